@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for hvapi. They are not part of installed package. Every ``bench_*`` module has ``run()``
+returning flat dict of metrics, ``python -m benchmarks`` runs all of them and compares results with baseline.
+"""
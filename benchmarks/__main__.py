@@ -0,0 +1,104 @@
+"""
+Runs all benchmarks and writes results as JSON, optionally compares them with results of other commit.
+
+  python -m benchmarks --output after.json --baseline before.json --threshold 0.25
+
+Results contain ``<name>_seconds`` timings(lower is better), ``<name>_round_trips`` WMI round trip counts,
+``<name>_bytes`` sizes and ``<name>_loaded_bindings`` counts of platform bindings loaded on import. Comparison
+fails(exit code 1) if any timing got slower than ``threshold`` relative to baseline, or if any of other metrics grew at
+all, they do not depend on machine the benchmark runs on.
+"""
+import argparse
+import importlib
+import json
+import pkgutil
+import platform
+import sys
+
+import benchmarks
+
+RESULTS_VERSION = 1
+
+# metrics compared with baseline and allowed relative growth, None means threshold given in command line
+COMPARED_METRICS = (
+  ("_seconds", None),
+  ("_round_trips", 0.0),
+  ("_bytes", 0.0),
+  ("_loaded_bindings", 0.0)
+)
+
+
+def benchmark_modules():
+  return sorted(name for _, name, _ in pkgutil.iter_modules(benchmarks.__path__) if name.startswith("bench_"))
+
+
+def run_benchmarks(names=None):
+  results = {}
+  for name in names or benchmark_modules():
+    module = importlib.import_module("benchmarks.%s" % name)
+    results[name] = module.run()
+  return {
+    "version": RESULTS_VERSION,
+    "environment": {
+      "python": platform.python_version(),
+      "implementation": platform.python_implementation(),
+      "platform": platform.platform(),
+      "machine": platform.machine()
+    },
+    "benchmarks": results
+  }
+
+
+def compare(baseline, current, threshold):
+  """
+  Compares results with baseline.
+
+  :return: list of (benchmark, metric, baseline value, current value, change, regression flag)
+  """
+  rows = []
+  for benchmark, metrics in sorted(current["benchmarks"].items()):
+    baseline_metrics = baseline["benchmarks"].get(benchmark, {})
+    for metric, value in sorted(metrics.items()):
+      allowed = None
+      for suffix, metric_threshold in COMPARED_METRICS:
+        if metric.endswith(suffix):
+          allowed = threshold if metric_threshold is None else metric_threshold
+          break
+      if allowed is None or metric not in baseline_metrics:
+        continue
+      baseline_value = baseline_metrics[metric]
+      change = (value - baseline_value) / baseline_value if baseline_value else (1.0 if value else 0.0)
+      rows.append((benchmark, metric, baseline_value, value, change, change > allowed))
+  return rows
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs hvapi benchmarks.")
+  parser.add_argument("names", nargs="*", help="benchmark modules to run, all by default")
+  parser.add_argument("--output", help="file to write results to, stdout by default")
+  parser.add_argument("--baseline", help="results to compare with")
+  parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown, default 0.25")
+  args = parser.parse_args(argv)
+
+  results = run_benchmarks(args.names)
+  text = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(text + "\n")
+  else:
+    print(text)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    rows = compare(baseline, results, args.threshold)
+    for benchmark, metric, baseline_value, value, change, regression in rows:
+      print("%-4s %s.%s: %.6g -> %.6g (%+.1f%%)" % (
+        "FAIL" if regression else "ok", benchmark, metric, baseline_value, value, change * 100), file=sys.stderr)
+    if any(row[-1] for row in rows):
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Cost of hvapi hot paths against ``HypervSimulator`` with injected WMI latency: listing, traversals, method invocation
+marshalling, code enum lookup, embedded instance parsing and VHD metadata parsing. Every WMI bound benchmark reports
+time per call and WMI round trips per call, round trips do not depend on machine and must not grow.
+
+Run with ``python -m benchmarks.bench_hot_paths``.
+"""
+import json
+import timeit
+
+from hvapi.backend.base import instance_to_xml
+from hvapi.backend.simulator import HypervSimulator, SimulatorBackend
+from hvapi.clr.base import ScopeHolder, MOHTransformers
+from hvapi.clr.classes_wrappers import VirtualSystemManagementService
+from hvapi.clr.types import ComputerSystem_EnabledState, ComputerSystem_RequestStateChange_ReturnCodes, \
+  VSMS_ModifyResourceSettings_ReturnCode, Msvm_ConcreteJob_JobState
+from hvapi.hyperv import HypervHost
+
+# WMI latency of each simulated round trip, seconds
+DEFAULT_LATENCY = 0.0005
+
+
+def create_host(machines=50, adapters=4, latency=DEFAULT_LATENCY):
+  """
+  Returns simulator, its backend and host with given number of machines, each with ``adapters`` network adapters
+  connected to one of two switches.
+  """
+  simulator = HypervSimulator()
+  switches = [simulator.add_switch("External"), simulator.add_switch("Internal")]
+  for index in range(machines):
+    simulator.add_machine(
+      "vm-%04d" % index,
+      state=ComputerSystem_EnabledState.Enabled if index % 2 else ComputerSystem_EnabledState.Disabled,
+      switches=[switches[adapter % 2] for adapter in range(adapters)],
+      machine_id="00000000-0000-0000-0000-%012d" % index
+    )
+  backend = SimulatorBackend(simulator, latency=latency)
+  return simulator, backend, HypervHost(ScopeHolder(backend=backend))
+
+
+def _measure(function, number, repeat=7):
+  return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def _round_trips(backend: SimulatorBackend, function):
+  backend.calls.clear()
+  function()
+  return sum(backend.calls.values())
+
+
+def _wmi_benchmark(results, name, backend, function, number):
+  results["%s_round_trips" % name] = _round_trips(backend, function)
+  results["%s_seconds" % name] = _measure(function, number)
+
+
+def bench_vhd_metadata(number):
+  """
+  Parses GET_VIRTUAL_DISK_INFO structures of all info versions to plain properties, as ``VHDDisk.properties`` does.
+  Returns ``None`` if virtdisk structures are not available on this platform.
+  """
+  try:
+    from hvapi.disk.internal import GET_VIRTUAL_DISK_INFO_PARAMETERS, GET_VIRTUAL_DISK_INFO_VERSION, \
+      parse_vdip_structure, VIRTUAL_STORAGE_TYPE_DEVICE_VHDX
+    from hvapi.disk.vhd import transform_property
+  except (ImportError, AttributeError, OSError):
+    return None
+
+  structures = []
+  for version in GET_VIRTUAL_DISK_INFO_VERSION.all_properties():
+    vdip = GET_VIRTUAL_DISK_INFO_PARAMETERS()
+    vdip.VERSION = version.int_value
+    if version == GET_VIRTUAL_DISK_INFO_VERSION.GET_VIRTUAL_DISK_INFO_SIZE:
+      vdip.VhdInfo.Size.VirtualSize = 127 * 1024 ** 3
+      vdip.VhdInfo.Size.PhysicalSize = 4 * 1024 ** 3
+      vdip.VhdInfo.Size.BlockSize = 32 * 1024 ** 2
+      vdip.VhdInfo.Size.SectorSize = 512
+    elif version == GET_VIRTUAL_DISK_INFO_VERSION.GET_VIRTUAL_DISK_INFO_PROVIDER_SUBTYPE:
+      vdip.VhdInfo.ProviderSubtype = 3
+    elif version == GET_VIRTUAL_DISK_INFO_VERSION.GET_VIRTUAL_DISK_INFO_VIRTUAL_STORAGE_TYPE:
+      vdip.VhdInfo.VirtualStorageType.DeviceId = VIRTUAL_STORAGE_TYPE_DEVICE_VHDX
+    structures.append((vdip, version))
+
+  def _parse():
+    result = {}
+    for vdip, version in structures:
+      member_name, value = parse_vdip_structure(vdip, version)
+      result[member_name] = transform_property(member_name, value)
+    return result
+
+  return _measure(_parse, number)
+
+
+def run(machines=50, adapters=4, latency=DEFAULT_LATENCY, number=20):
+  simulator, backend, host = create_host(machines, adapters, latency)
+  machine = host.machines_by_name("vm-0001")[0]
+  results = {
+    "machines": machines,
+    "adapters_per_machine": adapters,
+    "injected_latency": latency
+  }
+
+  # listing and traversals
+  _wmi_benchmark(results, "host_machines", backend, lambda: host.machines, number)
+  _wmi_benchmark(results, "network_adapters", backend, lambda: machine.network_adapters, number)
+  _wmi_benchmark(results, "com_ports", backend, lambda: machine.com_ports, number)
+  memory_path = machine.PATH_MAP["Msvm_MemorySettingData"]
+  _wmi_benchmark(results, "get_child", backend, lambda: machine.get_child(memory_path), number)
+
+  # invoke marshalling: embedded instance in, references out
+  management_service = VirtualSystemManagementService.from_moh(
+    host.scope.query_one("SELECT * FROM Msvm_VirtualSystemManagementService"))
+  memory_settings = machine.get_child(memory_path)
+  _wmi_benchmark(
+    results, "invoke_modify_resource_settings", backend,
+    lambda: management_service.invoke("ModifyResourceSettings", ResourceSettings=[memory_settings]), number)
+
+  # pure Python paths
+  codes = (0, 2, 7, 10, 4096, 32768, 32775, 65535)
+  enums = (ComputerSystem_RequestStateChange_ReturnCodes, VSMS_ModifyResourceSettings_ReturnCode,
+           Msvm_ConcreteJob_JobState)
+
+  def _from_code():
+    for enum in enums:
+      for code in codes:
+        enum.from_code(code)
+
+  results["ranged_code_enum_from_code_seconds"] = _measure(_from_code, number * 100) / (len(enums) * len(codes))
+
+  settings_xml = instance_to_xml(memory_settings.class_name, memory_settings.properties_dict)
+  results["moh_from_xml_seconds"] = _measure(lambda: MOHTransformers.from_xml(settings_xml, machine), number * 250)
+
+  vhd_metadata = bench_vhd_metadata(number * 250)
+  if vhd_metadata is not None:
+    results["vhd_metadata_seconds"] = vhd_metadata
+  return results
+
+
+if __name__ == "__main__":
+  print(json.dumps(run(), indent=2, sort_keys=True))
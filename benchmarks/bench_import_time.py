@@ -0,0 +1,59 @@
+"""
+Import time of hvapi modules, each measured in fresh interpreter. Also reports which platform bindings(pythonnet,
+.NET assemblies, virtdisk) got loaded by import, none of them should be loaded before first use.
+
+Run with ``python -m benchmarks.bench_import_time``.
+"""
+import json
+import subprocess
+import sys
+
+MODULES = (
+  "hvapi.types",
+  "hvapi.disk.types",
+  "hvapi.clr.types",
+  "hvapi.disk.vhd",
+  "hvapi.hyperv",
+  "hvapi.aio_hyperv"
+)
+
+BINDING_MODULES = ("clr", "System", "hvapi.backend.dotnet")
+
+_SCRIPT = """
+import sys, time, json
+started = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - started
+import hvapi.disk.internal as internal
+bindings = [name for name in %r if name in sys.modules]
+bindings.extend("windll." + name for name in internal._libraries)
+print(json.dumps([elapsed, bindings]))
+"""
+
+
+def measure_import(module, repeat=5):
+  """
+  Returns best import time of module in seconds and list of bindings loaded by import.
+  """
+  best = None
+  bindings = []
+  for _ in range(repeat):
+    output = subprocess.check_output([sys.executable, "-c", _SCRIPT % (module, BINDING_MODULES)])
+    elapsed, bindings = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    best = elapsed if best is None else min(best, elapsed)
+  return best, bindings
+
+
+def run(repeat=5):
+  results = {}
+  for module in MODULES:
+    elapsed, bindings = measure_import(module, repeat)
+    name = module.replace(".", "_")
+    results["%s_import_seconds" % name] = elapsed
+    results["%s_loaded_bindings" % name] = len(bindings)
+    results["%s_binding_names" % name] = bindings
+  return results
+
+
+if __name__ == "__main__":
+  print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,121 @@
+"""
+Round-trip speed and size of inventory export compared to JSON dump of the same objects.
+
+Full export must be smaller than zlib compressed JSON, dump and load faster than JSON with
+compression of the same objects, otherwise the benchmark fails.
+
+Run with ``python -m benchmarks.bench_inventory_export``.
+"""
+import json
+import random
+import timeit
+import uuid
+import zlib
+
+from hvapi.inventory_export import dump_inventory, load_inventory, InventorySnapshot
+
+HOST_PATH = r"\\HYPERV-HOST-01\root\virtualization\v2:"
+
+
+def generate_inventory(machines=400, switches=4, adapters_per_machine=2, seed=0):
+  """
+  Generates synthetic host inventory in ``HostInventory.objects`` shape.
+  """
+  rnd = random.Random(seed)
+  objects = {}
+  switch_ids = [str(uuid.UUID(int=rnd.getrandbits(128))).upper() for _ in range(switches)]
+  for switch_id in switch_ids:
+    path = HOST_PATH + 'Msvm_VirtualEthernetSwitch.CreationClassName="Msvm_VirtualEthernetSwitch",Name="%s"' % switch_id
+    objects[path] = ("Msvm_VirtualEthernetSwitch", {
+      "Name": switch_id, "ElementName": "switch-%s" % switch_id[:4], "EnabledState": 2, "HealthState": 5,
+      "Caption": "Virtual Switch", "MaxVMQOffloads": 0
+    })
+  for index in range(machines):
+    machine_id = str(uuid.UUID(int=rnd.getrandbits(128))).upper()
+    path = HOST_PATH + 'Msvm_ComputerSystem.CreationClassName="Msvm_ComputerSystem",Name="%s"' % machine_id
+    objects[path] = ("Msvm_ComputerSystem", {
+      "Name": machine_id, "ElementName": "vm-%04d" % index, "EnabledState": rnd.choice((2, 3, 6, 9)),
+      "HealthState": 5, "Caption": "Virtual Machine", "OnTimeInMilliseconds": rnd.getrandbits(32),
+      "OperationalStatus": (2,), "ProcessID": rnd.getrandbits(16), "InstallDate": "20170101000000.000000-000"
+    })
+    for adapter in range(adapters_per_machine):
+      adapter_id = str(uuid.UUID(int=rnd.getrandbits(128))).upper()
+      instance_id = "Microsoft:%s\\%s" % (machine_id, adapter_id)
+      objects[HOST_PATH + 'Msvm_SyntheticEthernetPortSettingData.InstanceID="%s"' % instance_id] = (
+        "Msvm_SyntheticEthernetPortSettingData", {
+          "InstanceID": instance_id, "ElementName": "Network Adapter", "Address": "00155D%06X" % rnd.getrandbits(24),
+          "StaticMacAddress": False, "ResourceType": 10, "ResourceSubType": "Microsoft:Hyper-V:Synthetic Ethernet Port",
+          "VirtualSystemIdentifiers": ("{%s}" % str(uuid.UUID(int=rnd.getrandbits(128))),)
+        })
+      switch_id = rnd.choice(switch_ids)
+      objects[HOST_PATH + 'Msvm_EthernetPortAllocationSettingData.InstanceID="%s\\C"' % instance_id] = (
+        "Msvm_EthernetPortAllocationSettingData", {
+          "InstanceID": instance_id + "\\C", "ElementName": "Dynamic Ethernet Switch Port", "ResourceType": 33,
+          "ResourceSubType": "Microsoft:Hyper-V:Ethernet Connection", "EnabledState": 2,
+          "HostResource": (HOST_PATH + 'Msvm_VirtualEthernetSwitch.CreationClassName="Msvm_VirtualEthernetSwitch",'
+                                       'Name="%s"' % switch_id,)
+        })
+  return objects
+
+
+def mutate_inventory(objects, changes=20, seed=1):
+  rnd = random.Random(seed)
+  result = dict(objects)
+  machines = [path for path, (cls, _) in objects.items() if cls == "Msvm_ComputerSystem"]
+  for path in rnd.sample(machines, changes):
+    class_name, properties = result[path]
+    properties = dict(properties)
+    properties["EnabledState"] = 3 if properties["EnabledState"] == 2 else 2
+    result[path] = (class_name, properties)
+  return result
+
+
+def _json_dump(objects):
+  return json.dumps({path: [cls, properties] for path, (cls, properties) in objects.items()}).encode("utf-8")
+
+
+def _json_zlib_dump(objects):
+  return zlib.compress(_json_dump(objects), 1)
+
+
+def _json_zlib_load(data):
+  return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def _measure(function, number):
+  return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def run(machines=400, number=10):
+  objects = generate_inventory(machines)
+  changed = mutate_inventory(objects)
+  full = dump_inventory(objects, class_names=None)
+  base = InventorySnapshot.from_objects(objects, full[6:22])
+  delta = dump_inventory(changed, base, class_names=None)
+  json_data = _json_dump(objects)
+  json_zlib_data = _json_zlib_dump(objects)
+  assert len(load_inventory(full)) == len(objects)
+  assert len(load_inventory(delta, base)) == len(changed)
+  results = {
+    "objects": len(objects),
+    "export_full_bytes": len(full),
+    "export_delta_bytes": len(delta),
+    "json_bytes": len(json_data),
+    "json_zlib_bytes": len(zlib.compress(json_data)),
+    "dump_full_seconds": _measure(lambda: dump_inventory(objects, class_names=None), number),
+    "dump_delta_seconds": _measure(lambda: dump_inventory(changed, base, class_names=None), number),
+    "load_full_seconds": _measure(lambda: load_inventory(full), number),
+    "load_delta_seconds": _measure(lambda: load_inventory(delta, base), number),
+    "json_dump_seconds": _measure(lambda: _json_dump(objects), number),
+    "json_load_seconds": _measure(lambda: json.loads(json_data.decode("utf-8")), number),
+    "json_zlib_dump_seconds": _measure(lambda: _json_zlib_dump(objects), number),
+    "json_zlib_load_seconds": _measure(lambda: _json_zlib_load(json_zlib_data), number),
+  }
+  assert results["export_full_bytes"] < results["json_zlib_bytes"], results
+  assert results["dump_full_seconds"] < results["json_zlib_dump_seconds"], results
+  assert results["load_full_seconds"] < results["json_zlib_load_seconds"], results
+  return results
+
+
+if __name__ == "__main__":
+  print(json.dumps(run(), indent=2))
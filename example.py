@@ -25,9 +25,8 @@ import asyncio
 import logging
 
 import sys
-from concurrent.futures import ThreadPoolExecutor
-
-from hvapi.aio_hyperv import HypervHost, AioHypervHost
+from hvapi.aio_executor import ScopeWorkerPool
+from hvapi.aio_hyperv import AioHypervHost
 
 if sys.platform == 'win32':
   loop = asyncio.ProactorEventLoop()
@@ -36,13 +35,14 @@ if sys.platform == 'win32':
 FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.DEBUG)
 
-executor = ThreadPoolExecutor(max_workers=1)
+# every worker owns its own WMI scope, so several workers can be used safely
+executor = ScopeWorkerPool(max_workers=4)
 
 
 loop = asyncio.get_event_loop()
 
 async def main_coro():
-  host = AioHypervHost(HypervHost(), executor, loop)
+  host = AioHypervHost(executor.create_host(), executor, loop)
   hello_machine = (await host.machines_by_name("hello"))[-1]
   com_ports = await hello_machine.get_com_ports()
   await com_ports[0].set_path("\\\\.\\pipe\\hello_com1")
@@ -0,0 +1,265 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import contextlib
+import ctypes
+import logging
+import queue
+import sys
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, List
+
+from hvapi.clr.base import ScopeHolder, ManagementObjectHolder
+from hvapi.hyperv import HypervHost
+
+COINIT_MULTITHREADED = 0
+_local = threading.local()
+
+
+def _com_initialize():
+  if sys.platform == 'win32':
+    ctypes.windll.ole32.CoInitializeEx(None, COINIT_MULTITHREADED)
+
+
+def _com_uninitialize():
+  if sys.platform == 'win32':
+    ctypes.windll.ole32.CoUninitialize()
+
+
+@contextlib.contextmanager
+def com_thread():
+  """
+  Initializes COM in multithreaded apartment for current thread while context is active, does nothing on platforms
+  other than Windows. Threads that use WMI objects outside of ``ScopeWorkerPool`` workers run in this context.
+  """
+  _com_initialize()
+  try:
+    yield
+  finally:
+    _com_uninitialize()
+
+
+def current_scope() -> ScopeHolder:
+  """
+  Returns ``ScopeHolder`` of current pool worker, ``None`` if called outside of ``ScopeWorkerPool`` worker.
+  """
+  worker = getattr(_local, 'worker', None)
+  if worker is not None:
+    return worker.scope
+
+
+class _Worker(object):
+  def __init__(self, pool: 'ScopeWorkerPool', index: int):
+    self.pool = pool
+    self.index = index
+    self.queue = queue.Queue()
+    self.pending = 0
+    self.alive = True
+    self.scope = None
+    self.ready = threading.Event()
+    self.thread = threading.Thread(target=self._run, name="%s-%s" % (pool.thread_name_prefix, index), daemon=True)
+
+  def _run(self):
+    _com_initialize()
+    _local.worker = self
+    try:
+      try:
+        self.scope = self.pool.scope_factory()
+      finally:
+        self.ready.set()
+      while True:
+        item = self.queue.get()
+        if item is None:
+          break
+        future, fn, args, kwargs = item
+        try:
+          if future.set_running_or_notify_cancel():
+            try:
+              result = self.pool.call_in_worker(self, fn, args, kwargs)
+            except BaseException as e:
+              future.set_exception(e)
+            else:
+              future.set_result(result)
+        finally:
+          with self.pool.lock:
+            self.pending -= 1
+    except BaseException:
+      self.pool.LOG.exception("Worker %s failed", self.index)
+    finally:
+      # pool routes nothing to dead worker, so work queued before that is all there is to fail
+      with self.pool.lock:
+        self.alive = False
+      self._fail_pending()
+      _local.worker = None
+      self.scope = None
+      _com_uninitialize()
+
+  def _fail_pending(self):
+    while True:
+      try:
+        item = self.queue.get_nowait()
+      except queue.Empty:
+        return
+      if item is not None:
+        with self.pool.lock:
+          self.pending -= 1
+        if item[0].set_running_or_notify_cancel():
+          item[0].set_exception(RuntimeError("Worker %s is not available" % self.index))
+
+
+class ScopeWorkerPool(Executor):
+  """
+  Executor for aio layer. Every worker thread initializes COM and owns its own ``ScopeHolder``, so WMI objects are
+  never shared between threads. Work is routed to worker that owns objects passed to it(bound method owner or first
+  ``ManagementObjectHolder`` argument), other work goes to least loaded worker. Objects that belong to other worker
+  are re-bound by their path to scope of worker that runs the call, ``HypervHost`` objects are re-created with
+  worker's scope. Worker which thread failed gets no more work, work routed to it goes to least loaded live worker.
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, max_workers=4, scope_factory: Callable[[], ScopeHolder] = ScopeHolder,
+               thread_name_prefix="hvapi-worker"):
+    if max_workers <= 0:
+      raise ValueError("max_workers must be greater than 0")
+    self.scope_factory = scope_factory
+    self.thread_name_prefix = thread_name_prefix
+    self.lock = threading.Lock()
+    self._shutdown = False
+    self.workers = [_Worker(self, index) for index in range(max_workers)]  # type: List[_Worker]
+    for worker in self.workers:
+      worker.thread.start()
+    for worker in self.workers:
+      worker.ready.wait()
+
+  def create_host(self) -> HypervHost:
+    """
+    Creates ``HypervHost`` bound to scope of first live worker, host calls can be executed by any worker.
+    """
+    with self.lock:
+      return HypervHost(self._live_workers()[0].scope)
+
+  def submit(self, fn, *args, **kwargs) -> Future:
+    return self.submit_to(self._route(fn, args, kwargs), fn, *args, **kwargs)
+
+  def submit_to(self, worker_index: int, fn, *args, **kwargs) -> Future:
+    future = Future()
+    with self.lock:
+      if self._shutdown:
+        raise RuntimeError("cannot schedule new futures after shutdown")
+      worker = self.workers[worker_index % len(self.workers)]
+      if not worker.alive:
+        worker = min(self._live_workers(), key=lambda live_worker: live_worker.pending)
+      worker.pending += 1
+      worker.queue.put((future, fn, args, kwargs))
+    return future
+
+  def shutdown(self, wait=True):
+    with self.lock:
+      self._shutdown = True
+      for worker in self.workers:
+        worker.queue.put(None)
+    if wait:
+      for worker in self.workers:
+        worker.thread.join()
+
+  def owner_of(self, obj) -> int:
+    """
+    Returns index of worker that owns given object, ``None`` if object is not owned by any worker.
+    """
+    scope = getattr(obj, 'scope_holder', None) or getattr(obj, 'scope', None)
+    if scope is not None:
+      for worker in self.workers:
+        if worker.alive and worker.scope is scope:
+          return worker.index
+
+  def call_in_worker(self, worker: _Worker, fn, args, kwargs):
+    owner = getattr(fn, '__self__', None)
+    if owner is not None and self._needs_rebind(owner, worker):
+      fn = getattr(self.rebind(owner, worker.scope), fn.__name__)
+    args = [self.rebind(arg, worker.scope) if self._needs_rebind(arg, worker) else arg for arg in args]
+    kwargs = {key: self.rebind(value, worker.scope) if self._needs_rebind(value, worker) else value
+              for key, value in kwargs.items()}
+    result = fn(*args, **kwargs)
+    self._remember_paths(result)
+    return result
+
+  @classmethod
+  def _remember_paths(cls, result):
+    """
+    Stores paths of objects returned by worker while still in worker thread, other workers read only stored paths.
+    """
+    if isinstance(result, ManagementObjectHolder):
+      result.remember_path()
+    elif isinstance(result, (list, tuple)):
+      for item in result:
+        cls._remember_paths(item)
+    elif isinstance(result, dict):
+      for item in result.values():
+        cls._remember_paths(item)
+
+  @staticmethod
+  def rebind(obj, scope: ScopeHolder):
+    """
+    Returns copy of given object bound to given scope. Object path is read from path stored by owning worker when it
+    returned the object, so backend object of other worker is not touched.
+    """
+    if isinstance(obj, HypervHost):
+      return HypervHost(scope)
+    if isinstance(obj, ManagementObjectHolder):
+      if not obj.key:
+        raise ValueError("Object '%s' is not stored in WMI and can not be passed to other worker" % obj)
+      holder = scope.get(obj.object_path, obj.lazy_properties)
+      if type(holder) is not type(obj):
+        holder = obj._create_cls_from_moh(type(obj), holder.class_name, holder)
+      return holder
+    return obj
+
+  @staticmethod
+  def _needs_rebind(obj, worker: _Worker):
+    if isinstance(obj, ManagementObjectHolder):
+      return obj.scope_holder is not worker.scope
+    if isinstance(obj, HypervHost):
+      return obj.scope is not worker.scope
+    return False
+
+  def _route(self, fn, args, kwargs) -> int:
+    candidates = [getattr(fn, '__self__', None)]
+    candidates.extend(args)
+    candidates.extend(kwargs.values())
+    for candidate in candidates:
+      if isinstance(candidate, ManagementObjectHolder):
+        owner = self.owner_of(candidate)
+        if owner is not None:
+          return owner
+    with self.lock:
+      return min(self._live_workers(), key=lambda worker: worker.pending).index
+
+  def _live_workers(self) -> List[_Worker]:
+    """
+    Returns workers which threads are running, must be called with ``lock`` held.
+    """
+    workers = [worker for worker in self.workers if worker.alive]
+    if not workers:
+      raise RuntimeError("All workers of pool have failed")
+    return workers
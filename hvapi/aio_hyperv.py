@@ -21,14 +21,80 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
+import asyncio
+import collections
+import logging
+import threading
 from asyncio import AbstractEventLoop
 from concurrent.futures import Executor
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Callable
 
+from hvapi.aio_executor import com_thread
+from hvapi.clr.base import JobException, ScopeHolder, EventWatcher
+from hvapi.clr.classes_wrappers import JobWrapper
+from hvapi.clr.types import ComputerSystem_EnabledState, ComputerSystem_RequestStateChange_RequestedState
 from hvapi.disk.vhd import VHDDisk
-from hvapi.hyperv import HypervHost, VirtualMachine, VirtualComPort, VirtualNetworkAdapter, VirtualSwitch
+from hvapi.events import HostEvent, HOST_EVENT_CLASSES, translate_event
+from hvapi.hyperv import HypervHost, VirtualMachine, VirtualComPort, VirtualNetworkAdapter, VirtualSwitch, \
+  DEFAULT_WAIT_OP_TIMEOUT
 from hvapi.types import VirtualMachineGeneration, VirtualMachineState, ComPort
 
+DEFAULT_STATE_POLL_INTERVAL = 1.0
+DEFAULT_JOB_POLL_INTERVAL = .1
+DEFAULT_EVENT_QUEUE_SIZE = 1000
+DEFAULT_EVENT_WAIT_TIMEOUT = 1.0
+
+# fields available for fetch methods, each one is evaluated in executor thread
+SWITCH_FIELDS = {
+  "name": lambda switch: switch.name,
+  "id": lambda switch: switch.id
+}  # type: Dict[str, Callable[[VirtualSwitch], Any]]
+NETWORK_ADAPTER_FIELDS = {
+  "address": lambda adapter: adapter.address,
+  "switch_id": lambda adapter: _switch_field(adapter.switch, "id"),
+  "switch_name": lambda adapter: _switch_field(adapter.switch, "name")
+}  # type: Dict[str, Callable[[VirtualNetworkAdapter], Any]]
+COM_PORT_FIELDS = {
+  "name": lambda com_port: com_port.name,
+  "path": lambda com_port: com_port.path
+}  # type: Dict[str, Callable[[VirtualComPort], Any]]
+MACHINE_FIELDS = {
+  "name": lambda machine: machine.name,
+  "id": lambda machine: machine.id,
+  # raw state, ``VirtualMachine.state`` would block executor thread while machine is in middle state
+  "state": lambda machine: machine.enabled_state.to_virtual_machine_state()
+}  # type: Dict[str, Callable[[VirtualMachine], Any]]
+DEFAULT_MACHINE_FIELDS = ("name", "id", "state")
+
+
+def _switch_field(switch, field):
+  if switch is not None:
+    return getattr(switch, field)
+
+
+def read_fields(obj, fields: Iterable[str], fields_map: Dict[str, Callable[[Any], Any]]) -> Dict[str, Any]:
+  """
+  Reads given fields of object, must be called in executor thread.
+
+  :param obj: object to read fields from
+  :param fields: field names
+  :param fields_map: available fields
+  :return: dict of field values
+  """
+  result = {}
+  for field in fields:
+    if field not in fields_map:
+      raise ValueError("Unknown field '%s', expected one of %s" % (field, ", ".join(sorted(fields_map))))
+    result[field] = fields_map[field](obj)
+  return result
+
+
+def list_fields(host: HypervHost, collection: str, fields: Iterable[str], fields_map: Dict[str, Callable[[Any], Any]]) -> List[Dict[str, Any]]:
+  """
+  Reads given fields of every object of host collection(e.g. 'machines'), must be called in executor thread.
+  """
+  return [read_fields(obj, fields, fields_map) for obj in getattr(host, collection)]
+
 
 class AioVirtualSwitch(object):
   def __init__(self, main_object: VirtualSwitch, executor: Executor, event_loop: AbstractEventLoop):
@@ -37,10 +103,13 @@ class AioVirtualSwitch(object):
     self.event_loop = event_loop
 
   async def get_name(self):
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.name)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'name')
 
   async def get_id(self):
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.id)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'id')
+
+  async def fetch(self, fields: Iterable[str] = tuple(SWITCH_FIELDS)) -> Dict[str, Any]:
+    return await self.event_loop.run_in_executor(self.executor, read_fields, self.main_object, tuple(fields), SWITCH_FIELDS)
 
 
 class AioVirtualNetworkAdapter(object):
@@ -50,14 +119,17 @@ class AioVirtualNetworkAdapter(object):
     self.event_loop = event_loop
 
   async def get_address(self) -> str:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.address)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'address')
 
   async def get_switch(self) -> 'AioVirtualSwitch':
-    return AioVirtualSwitch(await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.switch), self.executor, self.event_loop)
+    return AioVirtualSwitch(await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'switch'), self.executor, self.event_loop)
 
   async def connect(self, virtual_switch: 'AioVirtualSwitch'):
     await self.event_loop.run_in_executor(self.executor, self.main_object.connect, virtual_switch.main_object)
 
+  async def fetch(self, fields: Iterable[str] = tuple(NETWORK_ADAPTER_FIELDS)) -> Dict[str, Any]:
+    return await self.event_loop.run_in_executor(self.executor, read_fields, self.main_object, tuple(fields), NETWORK_ADAPTER_FIELDS)
+
 
 class AioVirtualComPort(object):
   def __init__(self, main_object: VirtualComPort, executor: Executor, event_loop: AbstractEventLoop):
@@ -66,20 +138,205 @@ class AioVirtualComPort(object):
     self.event_loop = event_loop
 
   async def get_name(self) -> str:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.name)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'name')
 
   async def get_path(self) -> str:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.path)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'path')
 
   async def set_path(self, value):
-    await self.event_loop.run_in_executor(self.executor, lambda: setattr(self.main_object, 'path', value))
+    await self.event_loop.run_in_executor(self.executor, setattr, self.main_object, 'path', value)
+
+  async def fetch(self, fields: Iterable[str] = tuple(COM_PORT_FIELDS)) -> Dict[str, Any]:
+    return await self.event_loop.run_in_executor(self.executor, read_fields, self.main_object, tuple(fields), COM_PORT_FIELDS)
+
+
+class AioStatePoller(object):
+  """
+  Shared waiter for machine state changes. While there are waiters, states of all host machines are read with one
+  query every ``interval`` seconds, waiting itself happens on event loop, so waiting machines do not occupy executor
+  threads. Waits can be cancelled and used with ``asyncio.wait_for``.
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, host: HypervHost, executor: Executor, event_loop: AbstractEventLoop,
+               interval=DEFAULT_STATE_POLL_INTERVAL):
+    self.host = host
+    self.executor = executor
+    self.event_loop = event_loop
+    self.interval = interval
+    self._waiters = []
+    self._task = None
+
+  async def wait_for_state(self, machine_id: str,
+                           predicate: Callable[[ComputerSystem_EnabledState], bool]) -> ComputerSystem_EnabledState:
+    """
+    Waits until state of given machine satisfies ``predicate``.
+
+    :param machine_id: machine id
+    :param predicate: callable that returns ``True`` for awaited state
+    :return: awaited state
+    """
+    waiter = (machine_id.upper(), predicate, self.event_loop.create_future())
+    self._waiters.append(waiter)
+    if self._task is None or self._task.done():
+      self._task = self.event_loop.create_task(self._poll())
+    try:
+      return await waiter[2]
+    finally:
+      if waiter in self._waiters:
+        self._waiters.remove(waiter)
+
+  async def _poll(self):
+    while self._waiters:
+      try:
+        states = await self.event_loop.run_in_executor(self.executor, self.host.machine_enabled_states)
+      except Exception as e:
+        for _, _, future in self._waiters:
+          if not future.done():
+            future.set_exception(e)
+        return
+      for machine_id, predicate, future in list(self._waiters):
+        state = states.get(machine_id)
+        if future.done():
+          continue
+        if state is None:
+          future.set_exception(Exception("Machine '%s' does not exist" % machine_id))
+        elif predicate(state):
+          future.set_result(state)
+      if self._waiters:
+        await asyncio.sleep(self.interval)
+
+
+class AioEventStream(object):
+  """
+  Asynchronous iterator of ``HostEvent`` objects. WMI events are awaited by dedicated thread, not by executor, they are
+  translated there and passed to event loop. Queue is bounded: if consumer is slower than host, oldest events are
+  dropped and ``EVENTS_DROPPED`` event with count of lost events is yielded before remaining ones. Stream can be used as
+  async context manager, watcher thread is stopped by ``close``.
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, watcher_factory: Callable[[], EventWatcher], event_loop: AbstractEventLoop,
+               queue_size=DEFAULT_EVENT_QUEUE_SIZE, wait_timeout=DEFAULT_EVENT_WAIT_TIMEOUT):
+    if queue_size <= 0:
+      raise ValueError("queue_size must be greater than 0")
+    self.watcher_factory = watcher_factory
+    self.event_loop = event_loop
+    self.queue_size = queue_size
+    self.wait_timeout = wait_timeout
+    self.dropped = 0
+    self._queue = collections.deque()
+    self._pending_dropped = 0
+    self._error = None
+    self._closed = False
+    self._waiter = None
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self):
+    if self._thread is None and not self._closed:
+      self._thread = threading.Thread(target=self._run, name="hvapi-events", daemon=True)
+      self._thread.start()
+
+  def close(self):
+    self._closed = True
+    self._stopped.set()
+    self._wake()
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self) -> HostEvent:
+    self.start()
+    while True:
+      if self._pending_dropped:
+        dropped, self._pending_dropped = self._pending_dropped, 0
+        return HostEvent.events_dropped(dropped)
+      if self._queue:
+        return self._queue.popleft()
+      if self._error is not None:
+        error, self._error = self._error, None
+        self.close()
+        raise error
+      if self._closed:
+        raise StopAsyncIteration
+      self._waiter = self.event_loop.create_future()
+      try:
+        await self._waiter
+      finally:
+        self._waiter = None
+
+  async def __aenter__(self) -> 'AioEventStream':
+    self.start()
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def _run(self):
+    with com_thread():
+      try:
+        watcher = self.watcher_factory()
+        try:
+          while not self._stopped.is_set():
+            event = watcher.next_event(self.wait_timeout)
+            if event is None:
+              continue
+            try:
+              events = translate_event(event)
+            except Exception:
+              self.LOG.exception("Failed to translate event %s", event)
+              continue
+            if events:
+              self._call_soon(self._put, events)
+        finally:
+          watcher.close()
+      except Exception as e:
+        if not self._stopped.is_set():
+          self.LOG.exception("Event watcher failed")
+          self._call_soon(self._fail, e)
+
+  def _call_soon(self, callback, *args):
+    try:
+      self.event_loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+      # event loop is closed, nobody will consume events
+      self._stopped.set()
+
+  def _put(self, events: List[HostEvent]):
+    if self._closed:
+      return
+    for event in events:
+      if len(self._queue) >= self.queue_size:
+        self._queue.popleft()
+        self._pending_dropped += 1
+        self.dropped += 1
+      self._queue.append(event)
+    self._wake()
+
+  def _fail(self, error: Exception):
+    self._error = error
+    self._wake()
+
+  def _wake(self):
+    if self._waiter is not None and not self._waiter.done():
+      self._waiter.set_result(None)
 
 
 class AioVirtualMachine(object):
-  def __init__(self, main_object: VirtualMachine, executor: Executor, event_loop: AbstractEventLoop):
+  """
+  Asynchronous wrapper of ``VirtualMachine``. State transitions only send requests in executor, waiting for job and
+  target state happens on event loop.
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, main_object: VirtualMachine, executor: Executor, event_loop: AbstractEventLoop,
+               state_poller: AioStatePoller = None):
     self.main_object = main_object
     self.executor = executor
     self.event_loop = event_loop
+    self.state_poller = state_poller or AioStatePoller(HypervHost(main_object.scope_holder), executor, event_loop)
+    self._id = None
 
   async def apply_properties(self, class_name: str, properties: Dict[str, Any]):
     await self.event_loop.run_in_executor(self.executor, self.main_object.apply_properties, class_name, properties)
@@ -88,28 +345,74 @@ class AioVirtualMachine(object):
     await self.event_loop.run_in_executor(self.executor, self.main_object.apply_properties_group, properties_group)
 
   async def get_name(self) -> str:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.name)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'name')
 
   async def get_id(self) -> str:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.id)
-
-  async def get_state(self) -> VirtualMachineState:
-    return await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.state)
-
-  async def start(self):
-    await self.event_loop.run_in_executor(self.executor, self.main_object.start)
-
-  async def stop(self, force=False, hard=False):
-    await self.event_loop.run_in_executor(self.executor, self.main_object.stop, force, hard)
-
-  async def kill(self):
-    await self.event_loop.run_in_executor(self.executor, self.main_object.kill)
-
-  async def save(self):
-    await self.event_loop.run_in_executor(self.executor, self.main_object.save)
-
-  async def pause(self):
-    await self.event_loop.run_in_executor(self.executor, self.main_object.pause)
+    return await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'id')
+
+  async def get_state(self, timeout=DEFAULT_WAIT_OP_TIMEOUT) -> VirtualMachineState:
+    """
+    Current machine state. If machine is in some middle state, waits up to ``timeout`` seconds for real state, same as
+    ``VirtualMachine.state`` does, but without occupying executor thread.
+
+    :return: virtual machine state
+    """
+    state = (await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'enabled_state')).to_virtual_machine_state()
+    if state != VirtualMachineState.UNDEFINED:
+      return state
+    try:
+      enabled_state = await asyncio.wait_for(self.state_poller.wait_for_state(
+        await self._machine_id(), lambda _state: _state.to_virtual_machine_state() != VirtualMachineState.UNDEFINED
+      ), timeout)
+    except asyncio.TimeoutError:
+      return VirtualMachineState.UNDEFINED
+    return enabled_state.to_virtual_machine_state()
+
+  async def fetch(self, fields: Iterable[str] = DEFAULT_MACHINE_FIELDS) -> Dict[str, Any]:
+    """
+    Reads several machine fields in one executor call.
+
+    :param fields: fields to read, keys of ``MACHINE_FIELDS``
+    :return: dict of field values
+    """
+    return await self.event_loop.run_in_executor(self.executor, read_fields, self.main_object, tuple(fields), MACHINE_FIELDS)
+
+  async def start(self, timeout=DEFAULT_WAIT_OP_TIMEOUT):
+    await self._change_state_if_needed(ComputerSystem_RequestStateChange_RequestedState.Running,
+                                       VirtualMachineState.RUNNING, timeout)
+
+  async def stop(self, force=False, hard=False, timeout=DEFAULT_WAIT_OP_TIMEOUT):
+    """
+    Try to stop virtual machine gracefully and wait for stopped state for ``timeout`` seconds, kill it otherwise.
+
+    :param force: indicates if we need to wait for user programs completion, ignored if *force* is *True*
+    :param hard: indicates if we need to perform turn off(power off)
+    :param timeout: seconds to wait for graceful shutdown
+    """
+    self.LOG.debug("Stopping machine '%s'", await self._machine_id())
+    if not hard:
+      initiated, job = await self.event_loop.run_in_executor(self.executor, self.main_object.request_shutdown, force)
+      if initiated:
+        try:
+          await asyncio.wait_for(self._wait_for_state(
+            job, ComputerSystem_RequestStateChange_RequestedState.Off.to_ComputerSystem_EnabledState()), timeout)
+          return
+        except (asyncio.TimeoutError, JobException):
+          self.LOG.debug("Failed to stop machine '%s' gracefully, killing...", self._id)
+      else:
+        self.LOG.debug("Graceful stop for machine '%s' not available, killing...", self._id)
+    await self.kill(timeout)
+
+  async def kill(self, timeout=DEFAULT_WAIT_OP_TIMEOUT):
+    await self._change_state(ComputerSystem_RequestStateChange_RequestedState.Off, timeout)
+
+  async def save(self, timeout=DEFAULT_WAIT_OP_TIMEOUT):
+    await self._change_state_if_needed(ComputerSystem_RequestStateChange_RequestedState.Saved,
+                                       VirtualMachineState.SAVED, timeout)
+
+  async def pause(self, timeout=DEFAULT_WAIT_OP_TIMEOUT):
+    await self._change_state_if_needed(ComputerSystem_RequestStateChange_RequestedState.Paused,
+                                       VirtualMachineState.PAUSED, timeout)
 
   async def add_adapter(self, static_mac=False, mac=None, adapter_name="Network Adapter") -> 'AioVirtualNetworkAdapter':
     return AioVirtualNetworkAdapter(await self.event_loop.run_in_executor(self.executor, self.main_object.add_adapter, static_mac, mac, adapter_name), self.executor, self.event_loop)
@@ -121,23 +424,65 @@ class AioVirtualMachine(object):
     await self.event_loop.run_in_executor(self.executor, self.main_object.add_vhd_disk, vhd_disk)
 
   async def get_network_adapters(self) -> List[AioVirtualNetworkAdapter]:
-    return [AioVirtualNetworkAdapter(va, self.executor, self.event_loop) for va in await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.network_adapters)]
+    return [AioVirtualNetworkAdapter(va, self.executor, self.event_loop) for va in await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'network_adapters')]
 
   async def get_com_ports(self) -> List[AioVirtualComPort]:
-    return [AioVirtualComPort(com, self.executor, self.event_loop) for com in await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.com_ports)]
+    return [AioVirtualComPort(com, self.executor, self.event_loop) for com in await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'com_ports')]
 
   async def get_com_port(self, port: ComPort):
     return AioVirtualComPort(await self.event_loop.run_in_executor(self.executor, self.main_object.get_com_port, port), self.executor, self.event_loop)
 
+  # internal methods
+  async def _machine_id(self) -> str:
+    if self._id is None:
+      self._id = await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'id')
+    return self._id
+
+  async def _change_state_if_needed(self, desired_state: ComputerSystem_RequestStateChange_RequestedState,
+                                    expected_state: VirtualMachineState, timeout):
+    if await self.get_state(timeout) == expected_state:
+      self.LOG.debug("Machine '%s' is already in state '%s'", await self._machine_id(), expected_state.name)
+      return
+    await self._change_state(desired_state, timeout)
+
+  async def _change_state(self, desired_state: ComputerSystem_RequestStateChange_RequestedState, timeout):
+    target_enabled_state = desired_state.to_ComputerSystem_EnabledState()
+    self.LOG.debug("Putting machine '%s' to '%s'", await self._machine_id(), target_enabled_state.name)
+    job = await self.event_loop.run_in_executor(self.executor, self.main_object.request_state_change, desired_state)
+    try:
+      await asyncio.wait_for(self._wait_for_state(job, target_enabled_state), timeout)
+    except asyncio.TimeoutError:
+      raise Exception("Failed to put machine to '%s' in %s seconds" % (target_enabled_state, timeout))
+
+  async def _wait_for_state(self, job: JobWrapper, target_enabled_state: ComputerSystem_EnabledState):
+    if job is not None:
+      while not await self.event_loop.run_in_executor(self.executor, job.poll):
+        await asyncio.sleep(DEFAULT_JOB_POLL_INTERVAL)
+    await self.state_poller.wait_for_state(await self._machine_id(), lambda state: state == target_enabled_state)
+
 
 class AioHypervHost(object):
-  def __init__(self, main_object: HypervHost, executor: Executor, event_loop: AbstractEventLoop):
+  def __init__(self, main_object: HypervHost, executor: Executor, event_loop: AbstractEventLoop,
+               state_poll_interval=DEFAULT_STATE_POLL_INTERVAL):
     self.main_object = main_object
     self.executor = executor
     self.event_loop = event_loop
+    self.state_poller = AioStatePoller(main_object, executor, event_loop, state_poll_interval)
+
+  def events(self, queue_size=DEFAULT_EVENT_QUEUE_SIZE, within=2) -> AioEventStream:
+    """
+    Returns asynchronous iterator of machine state, creation, deletion, settings and adapter connection events.
+
+    :param queue_size: max count of events buffered for slow consumer, oldest events are dropped above it
+    :param within: polling interval in seconds used by WMI for intrinsic events
+    :return: event stream, use it with ``async for`` and close it when it is not needed anymore
+    """
+    namespace, backend = self.main_object.scope.namespace, self.main_object.scope.backend
+    return AioEventStream(lambda: ScopeHolder(namespace, backend=backend).watch_instances(HOST_EVENT_CLASSES, within),
+                          self.event_loop, queue_size)
 
   async def get_switches(self) -> List[AioVirtualSwitch]:
-    return [AioVirtualSwitch(vs, self.executor, self.event_loop) for vs in await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.switches)]
+    return [AioVirtualSwitch(vs, self.executor, self.event_loop) for vs in await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'switches')]
 
   async def switches_by_name(self, name) -> AioVirtualSwitch:
     return [AioVirtualSwitch(vs, self.executor, self.event_loop) for vs in await self.event_loop.run_in_executor(self.executor, self.main_object.switches_by_name, name)]
@@ -145,14 +490,41 @@ class AioHypervHost(object):
   async def switch_by_id(self, switch_id) -> AioVirtualSwitch:
     return AioVirtualSwitch(await self.event_loop.run_in_executor(self.executor, self.main_object.switch_by_id, switch_id), self.executor, self.event_loop)
 
+  async def list_machines(self, fields: Iterable[str] = DEFAULT_MACHINE_FIELDS) -> List[Dict[str, Any]]:
+    """
+    Lists machines with given fields read in one executor call.
+
+    :param fields: fields to read, keys of ``MACHINE_FIELDS``
+    :return: list of dicts of field values
+    """
+    return await self.event_loop.run_in_executor(self.executor, list_fields, self.main_object, 'machines', tuple(fields), MACHINE_FIELDS)
+
+  async def list_switches(self, fields: Iterable[str] = tuple(SWITCH_FIELDS)) -> List[Dict[str, Any]]:
+    return await self.event_loop.run_in_executor(self.executor, list_fields, self.main_object, 'switches', tuple(fields), SWITCH_FIELDS)
+
+  async def start_machines(self, machines: Iterable[AioVirtualMachine], return_exceptions=True) -> List[Any]:
+    return await asyncio.gather(*(machine.start() for machine in machines), return_exceptions=return_exceptions)
+
+  async def stop_machines(self, machines: Iterable[AioVirtualMachine], force=False, hard=False, return_exceptions=True) -> List[Any]:
+    return await asyncio.gather(*(machine.stop(force, hard) for machine in machines), return_exceptions=return_exceptions)
+
+  async def kill_machines(self, machines: Iterable[AioVirtualMachine], return_exceptions=True) -> List[Any]:
+    return await asyncio.gather(*(machine.kill() for machine in machines), return_exceptions=return_exceptions)
+
+  async def save_machines(self, machines: Iterable[AioVirtualMachine], return_exceptions=True) -> List[Any]:
+    return await asyncio.gather(*(machine.save() for machine in machines), return_exceptions=return_exceptions)
+
+  async def pause_machines(self, machines: Iterable[AioVirtualMachine], return_exceptions=True) -> List[Any]:
+    return await asyncio.gather(*(machine.pause() for machine in machines), return_exceptions=return_exceptions)
+
   async def get_machines(self) -> List[AioVirtualMachine]:
-    return [AioVirtualMachine(vs, self.executor, self.event_loop) for vs in await self.event_loop.run_in_executor(self.executor, lambda: self.main_object.machines)]
+    return [AioVirtualMachine(vs, self.executor, self.event_loop, self.state_poller) for vs in await self.event_loop.run_in_executor(self.executor, getattr, self.main_object, 'machines')]
 
   async def machines_by_name(self, name) -> List[AioVirtualMachine]:
-    return [AioVirtualMachine(vs, self.executor, self.event_loop) for vs in await self.event_loop.run_in_executor(self.executor, self.main_object.machines_by_name, name)]
+    return [AioVirtualMachine(vs, self.executor, self.event_loop, self.state_poller) for vs in await self.event_loop.run_in_executor(self.executor, self.main_object.machines_by_name, name)]
 
   async def machine_by_id(self, machine_id) -> AioVirtualMachine:
-    return AioVirtualMachine(await self.event_loop.run_in_executor(self.executor, self.main_object.machine_by_id, machine_id), self.executor, self.event_loop)
+    return AioVirtualMachine(await self.event_loop.run_in_executor(self.executor, self.main_object.machine_by_id, machine_id), self.executor, self.event_loop, self.state_poller)
 
   async def create_machine(self, name, properties_group: Dict[str, Dict[str, Any]] = None, machine_generation: VirtualMachineGeneration = VirtualMachineGeneration.GEN1) -> AioVirtualMachine:
-    return AioVirtualMachine(await self.event_loop.run_in_executor(self.executor, self.main_object.create_machine, name, properties_group, machine_generation), self.executor, self.event_loop)
+    return AioVirtualMachine(await self.event_loop.run_in_executor(self.executor, self.main_object.create_machine, name, properties_group, machine_generation), self.executor, self.event_loop, self.state_poller)
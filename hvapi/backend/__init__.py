@@ -0,0 +1,46 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+from hvapi.backend.base import WmiBackend
+
+_default_backend = None
+
+
+def default_backend() -> WmiBackend:
+  """
+  Returns backend used by ``ScopeHolder`` objects created without explicit backend. Unless other backend is set, it
+  is pythonnet based ``DotNetBackend``, imported on first use, so library can be imported on any platform.
+  """
+  global _default_backend
+  if _default_backend is None:
+    from hvapi.backend.dotnet import DotNetBackend
+    _default_backend = DotNetBackend()
+  return _default_backend
+
+
+def set_default_backend(backend: WmiBackend):
+  """
+  Sets backend used by ``ScopeHolder`` objects created without explicit backend, e.g. ``SimulatorBackend``.
+  """
+  global _default_backend
+  _default_backend = backend
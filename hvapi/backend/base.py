@@ -0,0 +1,233 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import xml.etree.ElementTree as ET
+from enum import Enum
+from typing import Dict, Any, List, Tuple
+
+
+class WmiException(Exception):
+  pass
+
+
+class PropertyNotFound(WmiException):
+  pass
+
+
+class ObjectReference(str):
+  """
+  Path of WMI object returned as value of reference property or method output parameter.
+  """
+
+
+class WmiEventType(int, Enum):
+  CREATED = 0
+  MODIFIED = 1
+  DELETED = 2
+
+
+class WmiEvent(object):
+  """
+  Intrinsic WMI instance event transformed to plain python values. ``properties`` contains TargetInstance properties,
+  ``previous_properties`` contains PreviousInstance properties for modification events.
+  """
+
+  def __init__(self, event_type: WmiEventType, class_name: str, path: str, properties: Dict[str, Any],
+               previous_properties: Dict[str, Any] = None):
+    self.event_type = event_type
+    self.class_name = class_name
+    self.path = path
+    self.properties = properties
+    self.previous_properties = previous_properties
+
+  def __repr__(self):
+    return "WmiEvent(%s, %s, %s)" % (self.event_type.name, self.class_name, self.path)
+
+
+def instance_to_xml(class_name: str, properties: Dict[str, Any]) -> str:
+  """
+  Returns CIM-XML INSTANCE element for given plain properties, used as embedded instance representation by backends
+  that do not have real WMI objects.
+  """
+  root = ET.Element('INSTANCE', CLASSNAME=class_name)
+  for name, value in properties.items():
+    if isinstance(value, tuple):
+      element = ET.SubElement(root, 'PROPERTY.ARRAY', NAME=name, TYPE=_cim_type(value[0] if value else ''))
+      array = ET.SubElement(element, 'VALUE.ARRAY')
+      for item in value:
+        ET.SubElement(array, 'VALUE').text = _cim_text(item)
+    else:
+      element = ET.SubElement(root, 'PROPERTY', NAME=name, TYPE=_cim_type(value))
+      if value is not None:
+        ET.SubElement(element, 'VALUE').text = _cim_text(value)
+  return ET.tostring(root, encoding='unicode')
+
+
+def instance_from_xml(text: str) -> Tuple[str, Dict[str, Any]]:
+  root = ET.fromstring(text)
+  properties = {}
+  for element in root:
+    if element.tag == 'PROPERTY':
+      value_element = element.find('VALUE')
+      properties[element.attrib['NAME']] = _cim_value(
+        value_element.text if value_element is not None else None, element.attrib.get('TYPE'))
+    elif element.tag == 'PROPERTY.ARRAY':
+      properties[element.attrib['NAME']] = tuple(
+        _cim_value(item.text, element.attrib.get('TYPE')) for item in element.iter('VALUE'))
+  return root.attrib['CLASSNAME'], properties
+
+
+def _cim_type(value) -> str:
+  if isinstance(value, bool):
+    return 'boolean'
+  if isinstance(value, int):
+    return 'uint64'
+  return 'string'
+
+
+def _cim_text(value) -> str:
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  return str(value) if value is not None else ''
+
+
+def _cim_value(text, cim_type):
+  if text is None:
+    return None
+  if cim_type == 'boolean':
+    return text.lower() == 'true'
+  if cim_type and cim_type.startswith(('uint', 'sint')):
+    return int(text)
+  return text
+
+
+class WmiObject(object):
+  """
+  Backend object that represents one WMI object, stored instance or local instance that is not stored yet. Property
+  values are plain python values, arrays are tuples, references are paths. Object may be bound lazily, on first use.
+  """
+
+  @property
+  def path(self) -> str:
+    """
+    Full object path, empty string for objects that are not stored in WMI.
+    """
+    raise NotImplementedError()
+
+  @property
+  def class_name(self) -> str:
+    raise NotImplementedError()
+
+  def get_property(self, name):
+    """
+    Returns property value, raises ``PropertyNotFound`` if object has no such property.
+    """
+    raise NotImplementedError()
+
+  def set_property(self, name, value):
+    """
+    Sets property value of local copy of object. Value can be other ``WmiObject`` of same backend or list of them.
+    """
+    raise NotImplementedError()
+
+  def properties(self) -> Dict[str, Any]:
+    raise NotImplementedError()
+
+  def reload(self):
+    raise NotImplementedError()
+
+  def get_related(self, *args) -> List['WmiObject']:
+    """
+    Returns related objects, ``args`` are ManagementObject.GetRelated arguments.
+    """
+    raise NotImplementedError()
+
+  def get_relationships(self, *args) -> List['WmiObject']:
+    """
+    Returns association objects, ``args`` are ManagementObject.GetRelationships arguments.
+    """
+    raise NotImplementedError()
+
+  def invoke(self, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Invokes object method. Parameter values can be ``WmiObject`` of same backend(passed as reference or embedded
+    instance, depending on parameter type) or lists of them. Reference output parameters are ``ObjectReference``
+    values.
+
+    :param method_name: method name
+    :param parameters: input parameters, all method parameters must be given
+    :return: output parameters
+    """
+    raise NotImplementedError()
+
+  def clone(self) -> 'WmiObject':
+    raise NotImplementedError()
+
+  def get_text(self) -> str:
+    """
+    Returns object in CIM-XML representation.
+    """
+    raise NotImplementedError()
+
+
+class WmiWatcher(object):
+  def next_event(self, timeout: float = None) -> WmiEvent:
+    """
+    Waits for next event, returns ``None`` if no event arrived in ``timeout`` seconds.
+    """
+    raise NotImplementedError()
+
+  def close(self):
+    raise NotImplementedError()
+
+
+class WmiSession(object):
+  """
+  Connection of backend to one WMI namespace.
+  """
+
+  def __init__(self, namespace):
+    self.namespace = namespace
+
+  def query(self, query) -> List[WmiObject]:
+    raise NotImplementedError()
+
+  def get(self, path) -> WmiObject:
+    """
+    Returns object with given path, object is fetched on first use.
+    """
+    raise NotImplementedError()
+
+  def create_instance(self, class_name) -> WmiObject:
+    """
+    Creates local instance of given class, instance is not stored in WMI.
+    """
+    raise NotImplementedError()
+
+  def watch(self, query) -> WmiWatcher:
+    raise NotImplementedError()
+
+
+class WmiBackend(object):
+  def connect(self, namespace) -> WmiSession:
+    raise NotImplementedError()
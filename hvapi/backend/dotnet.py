@@ -0,0 +1,311 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import clr
+import collections.abc
+from typing import Dict, Any, List
+
+from hvapi.backend.base import WmiBackend, WmiSession, WmiObject, WmiWatcher, WmiEvent, WmiEventType, \
+  WmiException, PropertyNotFound, ObjectReference
+
+clr.AddReference("System.Management")
+from System.Management import ManagementScope, ObjectQuery, ManagementObjectSearcher, ManagementObject, CimType, \
+  ManagementException, ManagementClass, ManagementEventWatcher, WqlEventQuery, ManagementStatus
+from System import Array, String, TimeSpan
+
+_EVENT_CLASS_TYPES = {
+  "__InstanceCreationEvent": WmiEventType.CREATED,
+  "__InstanceModificationEvent": WmiEventType.MODIFIED,
+  "__InstanceDeletionEvent": WmiEventType.DELETED
+}
+
+
+def to_python_value(value):
+  """
+  Transforms property value of ManagementBaseObject to plain python value, arrays became tuples.
+
+  :param value: property value
+  :return: python value
+  """
+  if isinstance(value, Array):
+    return tuple(to_python_value(item) for item in value)
+  if isinstance(value, String):
+    return str(value)
+  return value
+
+
+def plain_properties(management_object) -> Dict[str, Any]:
+  """
+  Returns dict of plain python property values of given ManagementBaseObject.
+
+  :param management_object: ManagementBaseObject or ManagementObject
+  :return: dict of property values
+  """
+  return {_property.Name: to_python_value(_property.Value) for _property in management_object.Properties}
+
+
+class CimTypeTransformer(object):
+  """
+
+  """
+
+  @staticmethod
+  def target_class(value):
+    """
+    Returns target class in witch given CimType can/must be transformed.
+
+    :param value: System.Management.CimType enum item
+    :return: target class
+    """
+    if value == CimType.String:
+      return String
+    if value == CimType.Reference:
+      return ManagementObject
+    if value in (CimType.UInt32, CimType.UInt16):
+      return int
+    if value == CimType.DateTime:
+      return String
+    if value == CimType.Boolean:
+      return bool
+    raise Exception("unknown type")
+
+
+def _transform_object(obj, expected_type=None):
+  if obj is None:
+    return None
+
+  if isinstance(obj, DotNetObject):
+    obj = obj.management_object
+
+  if isinstance(obj, ManagementObject):
+    if expected_type == String:
+      return String(obj.GetText(2))
+    if expected_type == ManagementObject:
+      return obj
+    raise ValueError("Object '%s' can not be transformed to '%s'" % (obj, expected_type))
+
+  if isinstance(obj, (String, str)):
+    if expected_type == ManagementObject:
+      return String(obj)
+
+  if isinstance(obj, int):
+    if expected_type == int:
+      return obj
+
+  if isinstance(obj, bool):
+    if expected_type == bool:
+      return obj
+
+  if isinstance(obj, (str, String)):
+    if expected_type == String:
+      return String(obj)
+
+  raise Exception("Unknown object to transform: '%s'" % obj)
+
+
+def _transform_result(value, expected_type):
+  if expected_type == ManagementObject:
+    return ObjectReference(value)
+  return to_python_value(value)
+
+
+def _unwrap(value):
+  if isinstance(value, DotNetObject):
+    return value.management_object
+  if isinstance(value, (list, tuple)):
+    return [_unwrap(item) for item in value]
+  return value
+
+
+def _property_array(items: list, cim_type):
+  """
+  Converts list to value of array property. Objects in string arrays are stored as their paths, like
+  Msvm_EthernetPortAllocationSettingData.HostResource, arrays of other types are passed as is.
+  """
+  if not items:
+    return None
+  if cim_type != CimType.String:
+    return items
+  return Array[String]([String(item.Path.Path) if isinstance(item, ManagementObject) else String(str(item))
+                        for item in items])
+
+
+class DotNetObject(WmiObject):
+  """
+  ``WmiObject`` backed by System.Management.ManagementObject. Object created by path is bound on first use.
+  """
+
+  def __init__(self, management_object=None, reference=None):
+    self._management_object = management_object
+    self._reference = reference
+
+  @property
+  def management_object(self):
+    if self._management_object is None:
+      self._management_object = ManagementObject(self._reference)
+    return self._management_object
+
+  @property
+  def path(self) -> str:
+    return str(self.management_object.Path.Path)
+
+  @property
+  def class_name(self) -> str:
+    return str(self.management_object.ClassPath.ClassName)
+
+  def get_property(self, name):
+    try:
+      return to_python_value(self.management_object.Properties[name].Value)
+    except ManagementException as e:
+      if e.ErrorCode == ManagementStatus.NotFound:
+        raise PropertyNotFound(name)
+      raise WmiException(str(e))
+
+  def set_property(self, name, value):
+    value = _unwrap(value)
+    try:
+      _property = self.management_object.Properties[name]
+      if _property.IsArray and isinstance(value, list):
+        value = _property_array(value, _property.Type)
+      _property.Value = value
+    except ManagementException as e:
+      if e.ErrorCode == ManagementStatus.NotFound:
+        raise PropertyNotFound(name)
+      raise WmiException(str(e))
+
+  def properties(self) -> Dict[str, Any]:
+    return plain_properties(self.management_object)
+
+  def reload(self):
+    self.management_object.Get()
+
+  def get_related(self, *args) -> List[WmiObject]:
+    return [DotNetObject(item) for item in self.management_object.GetRelated(*args)]
+
+  def get_relationships(self, *args) -> List[WmiObject]:
+    return [DotNetObject(item) for item in self.management_object.GetRelationships(*args)]
+
+  def invoke(self, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    in_parameters = self.management_object.GetMethodParameters(method_name)
+    for parameter in in_parameters.Properties:
+      parameter_name = parameter.Name
+      parameter_type = CimTypeTransformer.target_class(parameter.Type)
+
+      if parameter_name not in parameters:
+        raise ValueError("Parameter '%s' not provided" % parameter_name)
+
+      if parameter.IsArray:
+        if not isinstance(parameters[parameter_name], collections.abc.Iterable):
+          raise ValueError("Parameter '%s' must be iterable" % parameter_name)
+        array_items = [_transform_object(item, parameter_type) for item in parameters[parameter_name]]
+        if array_items:
+          parameter_value = Array[parameter_type](array_items)
+        else:
+          parameter_value = None
+      else:
+        parameter_value = _transform_object(parameters[parameter_name], parameter_type)
+
+      in_parameters.Properties[parameter_name].Value = parameter_value
+
+    invocation_result = self.management_object.InvokeMethod(method_name, in_parameters, None)
+    result = {}
+    for _property in invocation_result.Properties:
+      _property_type = CimTypeTransformer.target_class(_property.Type)
+      _property_value = None
+      if _property.Value is not None:
+        if _property.IsArray:
+          _property_value = [_transform_result(item, _property_type) for item in _property.Value]
+        else:
+          _property_value = _transform_result(_property.Value, _property_type)
+      result[_property.Name] = _property_value
+    return result
+
+  def clone(self) -> WmiObject:
+    return DotNetObject(self.management_object.Clone())
+
+  def get_text(self) -> str:
+    return str(self.management_object.GetText(2))
+
+  def __str__(self):
+    return str(self.management_object)
+
+
+class DotNetWatcher(WmiWatcher):
+  def __init__(self, scope, query: str):
+    self.watcher = ManagementEventWatcher(scope, WqlEventQuery(query))
+
+  def next_event(self, timeout: float = None) -> WmiEvent:
+    if timeout is not None:
+      self.watcher.Options.Timeout = TimeSpan.FromSeconds(timeout)
+    try:
+      event = self.watcher.WaitForNextEvent()
+    except ManagementException as e:
+      if e.ErrorCode == ManagementStatus.Timedout:
+        return None
+      raise
+    event_type = _EVENT_CLASS_TYPES[str(event.GetPropertyValue("__CLASS"))]
+    target_instance = event.GetPropertyValue("TargetInstance")
+    previous_properties = None
+    if event_type == WmiEventType.MODIFIED:
+      previous_properties = plain_properties(event.GetPropertyValue("PreviousInstance"))
+    path = target_instance.GetPropertyValue("__PATH") or target_instance.GetPropertyValue("__RELPATH")
+    return WmiEvent(
+      event_type,
+      str(target_instance.GetPropertyValue("__CLASS")),
+      str(path),
+      plain_properties(target_instance),
+      previous_properties
+    )
+
+  def close(self):
+    self.watcher.Stop()
+    self.watcher.Dispose()
+
+
+class DotNetSession(WmiSession):
+  def __init__(self, namespace):
+    super().__init__(namespace)
+    self.scope = ManagementScope(namespace)
+
+  def query(self, query) -> List[WmiObject]:
+    searcher = ManagementObjectSearcher(self.scope, ObjectQuery(query))
+    return [DotNetObject(item) for item in searcher.Get()]
+
+  def get(self, path) -> WmiObject:
+    return DotNetObject(reference=path)
+
+  def create_instance(self, class_name) -> WmiObject:
+    cls = ManagementClass(str(self.scope.Path) + ":" + class_name)
+    return DotNetObject(cls.CreateInstance())
+
+  def watch(self, query) -> WmiWatcher:
+    return DotNetWatcher(self.scope, query)
+
+
+class DotNetBackend(WmiBackend):
+  """
+  Backend that talks to WMI through pythonnet and System.Management, works only on Windows.
+  """
+
+  def connect(self, namespace) -> WmiSession:
+    return DotNetSession(namespace)
@@ -0,0 +1,959 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import collections
+import heapq
+import itertools
+import queue
+import re
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Iterable, Callable, Tuple, Union
+
+from hvapi.backend.base import WmiBackend, WmiSession, WmiObject, WmiWatcher, WmiEvent, WmiEventType, \
+  WmiException, PropertyNotFound, ObjectReference, instance_to_xml, instance_from_xml
+from hvapi.clr.base import normalize_path
+from hvapi.clr.types import ComputerSystem_EnabledState, ComputerSystem_RequestStateChange_RequestedState, \
+  Msvm_ConcreteJob_JobState, ShutdownComponent_OperationalStatus
+from hvapi.types import VirtualMachineGeneration
+
+SIMULATOR_OPERATIONS = ("query", "get", "reload", "get_related", "get_relationships", "invoke")
+
+# simulator association between resource allocation setting data and its Parent
+DEPENDENCY_ASSOCIATION = "Msvm_SettingDataDependency"
+
+SUPERCLASSES = {
+  "Msvm_ComputerSystem": "CIM_ComputerSystem",
+  "Msvm_VirtualEthernetSwitch": "CIM_VirtualEthernetSwitch",
+  "CIM_VirtualEthernetSwitch": "CIM_ComputerSystem",
+  "Msvm_VirtualSystemManagementService": "CIM_VirtualSystemManagementService",
+  "Msvm_ShutdownComponent": "CIM_LogicalDevice",
+  "Msvm_ConcreteJob": "CIM_ConcreteJob",
+  "Msvm_VirtualSystemSettingData": "CIM_VirtualSystemSettingData",
+  "Msvm_ResourceAllocationSettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_SerialPortSettingData": "Msvm_ResourceAllocationSettingData",
+  "Msvm_ProcessorSettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_MemorySettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_SyntheticEthernetPortSettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_EthernetPortAllocationSettingData": "CIM_EthernetPortAllocationSettingData",
+  "CIM_EthernetPortAllocationSettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_StorageAllocationSettingData": "CIM_StorageAllocationSettingData",
+  "CIM_StorageAllocationSettingData": "CIM_ResourceAllocationSettingData",
+  "Msvm_ResourcePool": "CIM_ResourcePool",
+  "Msvm_AllocationCapabilities": "CIM_AllocationCapabilities",
+  "Msvm_SettingsDefineState": "CIM_SettingsDefineState",
+  "Msvm_VirtualSystemSettingDataComponent": "CIM_VirtualSystemSettingDataComponent",
+  "Msvm_SystemDevice": "CIM_SystemDevice",
+  "Msvm_ElementCapabilities": "CIM_ElementCapabilities",
+  "Msvm_SettingsDefineCapabilities": "CIM_SettingsDefineCapabilities",
+  DEPENDENCY_ASSOCIATION: "CIM_Dependency"
+}
+
+KEY_PROPERTIES = {
+  "Msvm_ComputerSystem": ("CreationClassName", "Name"),
+  "Msvm_VirtualEthernetSwitch": ("CreationClassName", "Name"),
+  "Msvm_VirtualSystemManagementService": ("CreationClassName", "Name", "SystemCreationClassName", "SystemName"),
+  "Msvm_ShutdownComponent": ("CreationClassName", "DeviceID", "SystemCreationClassName", "SystemName")
+}
+
+# association class -> reference properties, they are also association keys
+ASSOCIATION_ROLES = {
+  "Msvm_SettingsDefineState": ("ManagedElement", "SettingData"),
+  "Msvm_VirtualSystemSettingDataComponent": ("GroupComponent", "PartComponent"),
+  "Msvm_SystemDevice": ("GroupComponent", "PartComponent"),
+  "Msvm_ElementCapabilities": ("Capabilities", "ManagedElement"),
+  "Msvm_SettingsDefineCapabilities": ("GroupComponent", "PartComponent"),
+  DEPENDENCY_ASSOCIATION: ("Antecedent", "Dependent")
+}
+
+# properties of instances created with WmiSession.create_instance
+CLASS_DEFAULTS = {
+  "Msvm_VirtualSystemSettingData": {
+    "InstanceID": None, "ElementName": None, "VirtualSystemIdentifier": None,
+    "VirtualSystemSubType": VirtualMachineGeneration.GEN1.value,
+    "VirtualSystemType": "Microsoft:Hyper-V:System:Realized", "Notes": None, "Caption": "Virtual Machine Settings"
+  }
+}
+
+# resource pools: ResourceSubType -> (class of default setting data, ResourceType)
+RESOURCE_POOLS = {
+  "Microsoft:Hyper-V:Processor": ("Msvm_ProcessorSettingData", 3),
+  "Microsoft:Hyper-V:Memory": ("Msvm_MemorySettingData", 4),
+  "Microsoft:Hyper-V:Emulated IDE Controller": ("Msvm_ResourceAllocationSettingData", 5),
+  "Microsoft:Hyper-V:Synthetic Ethernet Port": ("Msvm_SyntheticEthernetPortSettingData", 10),
+  "Microsoft:Hyper-V:Synthetic Disk Drive": ("Msvm_ResourceAllocationSettingData", 17),
+  "Microsoft:Hyper-V:Virtual Hard Disk": ("Msvm_StorageAllocationSettingData", 31),
+  "Microsoft:Hyper-V:Ethernet Connection": ("Msvm_EthernetPortAllocationSettingData", 33)
+}
+
+# method -> parameters that must be provided
+METHOD_PARAMETERS = {
+  ("Msvm_ComputerSystem", "RequestStateChange"): ("RequestedState", "TimeoutPeriod"),
+  ("Msvm_ShutdownComponent", "InitiateShutdown"): ("Force", "Reason"),
+  ("Msvm_VirtualSystemManagementService", "DefineSystem"): (
+    "SystemSettings", "ResourceSettings", "ReferenceConfiguration"),
+  ("Msvm_VirtualSystemManagementService", "DestroySystem"): ("AffectedSystem",),
+  ("Msvm_VirtualSystemManagementService", "ModifySystemSettings"): ("SystemSettings",),
+  ("Msvm_VirtualSystemManagementService", "ModifyResourceSettings"): ("ResourceSettings",),
+  ("Msvm_VirtualSystemManagementService", "AddResourceSettings"): ("AffectedConfiguration", "ResourceSettings")
+}
+
+JOB_STARTED = 4096
+INVALID_STATE = 32775
+
+_EVENT_QUERY_TYPES = {
+  "__instancecreationevent": (WmiEventType.CREATED,),
+  "__instancemodificationevent": (WmiEventType.MODIFIED,),
+  "__instancedeletionevent": (WmiEventType.DELETED,),
+  "__instanceoperationevent": (WmiEventType.CREATED, WmiEventType.MODIFIED, WmiEventType.DELETED)
+}
+
+
+def is_subclass(class_name: str, base_name: str) -> bool:
+  """
+  Checks if ``class_name`` is ``base_name`` or its subclass in simulated class hierarchy, names are case-insensitive.
+  """
+  base_name = base_name.lower()
+  while class_name:
+    if class_name.lower() == base_name:
+      return True
+    class_name = SUPERCLASSES.get(class_name)
+  return False
+
+
+def _lookup(properties: Dict[str, Any], name: str):
+  """
+  Case-insensitive property name lookup, returns real property name or ``None``.
+  """
+  if name in properties:
+    return name
+  lower_name = name.lower()
+  for property_name in properties:
+    if property_name.lower() == lower_name:
+      return property_name
+
+
+def _freeze(value):
+  if isinstance(value, SimulatorObject):
+    return value.path
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(item) for item in value)
+  return value
+
+
+# WQL
+
+_TOKEN_RE = re.compile(r"""\s*(?:(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(?P<number>-?\d+(?:\.\d+)?)|"""
+                       r"""(?P<op><=|>=|<>|!=|=|<|>|\(|\)|,|\*)|(?P<name>[A-Za-z_][A-Za-z0-9_.]*))""")
+
+
+def _tokenize(query: str) -> List[Tuple[str, Any]]:
+  tokens = []
+  position = 0
+  query = query.strip()
+  while position < len(query):
+    match = _TOKEN_RE.match(query, position)
+    if not match or match.end() == position:
+      raise WmiException("Invalid query '%s'" % query)
+    position = match.end()
+    if match.group('string') is not None:
+      tokens.append(('value', re.sub(r'\\(.)', r'\1', match.group('string')[1:-1])))
+    elif match.group('number') is not None:
+      number = match.group('number')
+      tokens.append(('value', float(number) if '.' in number else int(number)))
+    elif match.group('op') is not None:
+      tokens.append(('op', match.group('op')))
+    else:
+      name = match.group('name')
+      if name.lower() in ('true', 'false'):
+        tokens.append(('value', name.lower() == 'true'))
+      elif name.lower() == 'null':
+        tokens.append(('value', None))
+      else:
+        tokens.append(('name', name))
+  return tokens
+
+
+def _compare(value, op, literal) -> bool:
+  if op in ('<>', '!='):
+    return not _compare(value, '=', literal)
+  if value is None or literal is None:
+    return op == '=' and value is None and literal is None
+  if isinstance(value, str) or isinstance(literal, str):
+    value, literal = str(value).lower(), str(literal).lower()
+  if op == '=':
+    return value == literal
+  if op == '<':
+    return value < literal
+  if op == '>':
+    return value > literal
+  if op == '<=':
+    return value <= literal
+  if op == '>=':
+    return value >= literal
+  raise WmiException("Unknown operator '%s'" % op)
+
+
+class _ConditionParser(object):
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.position = 0
+
+  def peek(self, kind=None, value=None):
+    if self.position < len(self.tokens):
+      token = self.tokens[self.position]
+      if (kind is None or token[0] == kind) and (value is None or str(token[1]).upper() == value):
+        return token
+
+  def take(self, kind=None, value=None):
+    token = self.peek(kind, value)
+    if token is None:
+      raise WmiException("Unexpected token in query: %s" % (self.tokens[self.position:],))
+    self.position += 1
+    return token
+
+  def parse(self) -> Callable[[Dict[str, Any]], bool]:
+    condition = self.parse_or()
+    if self.position != len(self.tokens):
+      raise WmiException("Unexpected token in query: %s" % (self.tokens[self.position:],))
+    return condition
+
+  def parse_or(self):
+    conditions = [self.parse_and()]
+    while self.peek('name', 'OR'):
+      self.take()
+      conditions.append(self.parse_and())
+    if len(conditions) == 1:
+      return conditions[0]
+    return lambda properties: any(condition(properties) for condition in conditions)
+
+  def parse_and(self):
+    conditions = [self.parse_not()]
+    while self.peek('name', 'AND'):
+      self.take()
+      conditions.append(self.parse_not())
+    if len(conditions) == 1:
+      return conditions[0]
+    return lambda properties: all(condition(properties) for condition in conditions)
+
+  def parse_not(self):
+    if self.peek('name', 'NOT'):
+      self.take()
+      condition = self.parse_not()
+      return lambda properties: not condition(properties)
+    if self.peek('op', '('):
+      self.take()
+      condition = self.parse_or()
+      self.take('op', ')')
+      return condition
+    name = self.take('name')[1]
+    if self.peek('name', 'IS'):
+      self.take()
+      negate = bool(self.peek('name', 'NOT'))
+      if negate:
+        self.take()
+      self.take('value')
+      return lambda properties: (_get(properties, name) is None) != negate
+    op = self.take('op')[1]
+    literal = self.take('value')[1]
+    return lambda properties: _compare(_get(properties, name), op, literal)
+
+
+def _get(properties, name):
+  property_name = _lookup(properties, name)
+  if property_name is not None:
+    return properties[property_name]
+
+
+class SelectQuery(object):
+  """
+  Parsed WQL data query: SELECT <properties> FROM <class> [WHERE <condition>].
+  """
+
+  def __init__(self, query: str):
+    tokens = _tokenize(query)
+    parser = _ConditionParser(tokens)
+    parser.take('name', 'SELECT')
+    self.properties = []
+    while True:
+      token = parser.take()
+      if token != ('op', '*'):
+        self.properties.append(token[1])
+      if not parser.peek('op', ','):
+        break
+      parser.take()
+    parser.take('name', 'FROM')
+    self.class_name = parser.take('name')[1]
+    self.condition = None
+    if parser.peek('name', 'WHERE'):
+      parser.take()
+      self.condition = parser.parse()
+    elif parser.position != len(tokens):
+      raise WmiException("Invalid query '%s'" % query)
+
+  def matches(self, class_name: str, properties: Dict[str, Any]) -> bool:
+    if not is_subclass(class_name, self.class_name):
+      return False
+    return self.condition is None or self.condition(properties)
+
+  def project(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+    if not self.properties:
+      return dict(properties)
+    result = {}
+    for name in self.properties:
+      property_name = _lookup(properties, name)
+      if property_name is not None:
+        result[property_name] = properties[property_name]
+    return result
+
+
+class _Instance(object):
+  __slots__ = ('class_name', 'properties', 'path', 'key')
+
+  def __init__(self, class_name, properties, path):
+    self.class_name = class_name
+    self.properties = properties
+    self.path = path
+    self.key = normalize_path(path)
+
+
+class HypervSimulator(object):
+  """
+  In-memory model of Hyper-V WMI provider: machines with their settings, switches, resource pools with default
+  settings, shutdown components and jobs. Covers Msvm classes, associations and methods used by hvapi.
+
+  State transitions and jobs take ``transition_duration`` and ``job_duration`` seconds of ``clock`` time, methods that
+  start jobs return 4096 like real provider does, so job waiting is exercised even with zero durations. Instance events
+  are delivered to watchers created by ``SimulatorSession.watch``. Simulator is thread safe.
+  """
+
+  def __init__(self, host_name="SIMHOST", namespace=r"root\virtualization\v2", job_duration=0.0,
+               transition_duration=0.0, clock: Callable[[], float] = time.monotonic):
+    self.host_name = host_name
+    self.namespace = namespace
+    self.job_duration = job_duration
+    self.transition_duration = transition_duration
+    self.clock = clock
+    self.lock = threading.RLock()
+    self._instances = collections.OrderedDict()  # type: Dict[str, _Instance]
+    self._links = collections.defaultdict(list)  # type: Dict[str, List[str]]
+    self._scheduled = []
+    self._sequence = itertools.count()
+    self._watchers = []
+    self._job_failures = {}
+    self._mac_counter = itertools.count(1)
+    self._create_host()
+
+  # public helpers to populate simulator
+
+  def add_switch(self, name, switch_id=None) -> str:
+    """
+    Adds virtual switch.
+
+    :return: switch path
+    """
+    with self.lock:
+      return self._create("Msvm_VirtualEthernetSwitch", {
+        "CreationClassName": "Msvm_VirtualEthernetSwitch", "Name": switch_id or str(uuid.uuid4()).upper(),
+        "ElementName": name, "Caption": "Virtual Switch", "EnabledState": 2, "HealthState": 5
+      }).path
+
+  def add_machine(self, name, state: ComputerSystem_EnabledState = ComputerSystem_EnabledState.Disabled, memory=1024,
+                  cpu_count=1, generation: VirtualMachineGeneration = VirtualMachineGeneration.GEN1,
+                  switches: Iterable[str] = (), com_ports=2, machine_id=None) -> str:
+    """
+    Adds virtual machine with processor, memory, controllers, com ports and network adapters connected to given
+    switches.
+
+    :param switches: paths of switches, one adapter is created for every switch
+    :return: machine id
+    """
+    with self.lock:
+      vssd = self._define_machine(name, generation.value, state, memory, cpu_count, com_ports, machine_id)
+      machine_id = vssd.properties["VirtualSystemIdentifier"]
+      for switch_path in switches:
+        port = self._add_resource(vssd, "Msvm_SyntheticEthernetPortSettingData", self._port_properties())
+        self._add_resource(vssd, "Msvm_EthernetPortAllocationSettingData", {
+          "ElementName": "Dynamic Ethernet Switch Port", "ResourceType": 33,
+          "ResourceSubType": "Microsoft:Hyper-V:Ethernet Connection", "Parent": port.path,
+          "HostResource": (switch_path,), "EnabledState": 2
+        })
+      return machine_id
+
+  def remove_machine(self, machine_id):
+    with self.lock:
+      self._destroy_machine(machine_id)
+
+  def inject_job_failure(self, method_name, error_code=32768, description="Simulated failure"):
+    """
+    Makes next job started by given method to fail.
+    """
+    with self.lock:
+      self._job_failures[method_name] = (error_code, description)
+
+  def machine_path(self, machine_id) -> str:
+    return self._machine(machine_id).path
+
+  def instances_of(self, class_name) -> List[Tuple[str, Dict[str, Any]]]:
+    with self.lock:
+      self.advance()
+      return [(instance.path, dict(instance.properties)) for instance in self._instances.values()
+              if is_subclass(instance.class_name, class_name)]
+
+  # provider operations, used by SimulatorSession and SimulatorObject
+
+  def advance(self):
+    """
+    Applies state transitions and job completions that are due.
+    """
+    with self.lock:
+      now = self.clock()
+      while self._scheduled and self._scheduled[0][0] <= now:
+        _, _, callback = heapq.heappop(self._scheduled)
+        callback()
+
+  def query(self, query: str) -> List[Tuple[str, str, Dict[str, Any]]]:
+    select = SelectQuery(query)
+    with self.lock:
+      self.advance()
+      return [(instance.class_name, instance.path, select.project(instance.properties))
+              for instance in self._instances.values() if select.matches(instance.class_name, instance.properties)]
+
+  def get(self, path) -> Tuple[str, str, Dict[str, Any]]:
+    with self.lock:
+      self.advance()
+      instance = self._instances.get(normalize_path(path))
+      if instance is None:
+        raise WmiException("Not found: '%s'" % path)
+      return instance.class_name, instance.path, dict(instance.properties)
+
+  def related(self, path, related_class=None, relationship_class=None, relationship_qualifier=None,
+              related_qualifier=None, related_role=None, this_role=None, *args) -> List[Tuple[str, str, Dict]]:
+    with self.lock:
+      self.advance()
+      key = normalize_path(path)
+      result = collections.OrderedDict()
+      for association in self._associations(key, relationship_class):
+        roles = ASSOCIATION_ROLES[association.class_name]
+        this_roles = [role for role in roles if normalize_path(association.properties[role]) == key
+                      and (not this_role or role.lower() == this_role.lower())]
+        if not this_roles:
+          continue
+        for role in roles:
+          if role in this_roles or (related_role and role.lower() != related_role.lower()):
+            continue
+          other = self._instances.get(normalize_path(association.properties[role]))
+          if other is not None and (not related_class or is_subclass(other.class_name, related_class)):
+            result[other.key] = (other.class_name, other.path, dict(other.properties))
+      return list(result.values())
+
+  def relationships(self, path, relationship_class=None, *args) -> List[Tuple[str, str, Dict]]:
+    with self.lock:
+      self.advance()
+      return [(association.class_name, association.path, dict(association.properties))
+              for association in self._associations(normalize_path(path), relationship_class)]
+
+  def invoke(self, class_name, path, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    for parameter_name in METHOD_PARAMETERS.get((class_name, method_name), ()):
+      if parameter_name not in parameters:
+        raise ValueError("Parameter '%s' not provided" % parameter_name)
+    handler = getattr(self, "_%s_%s" % (class_name, method_name), None)
+    if handler is None:
+      raise WmiException("Method '%s.%s' is not supported" % (class_name, method_name))
+    with self.lock:
+      self.advance()
+      return handler(self._instances[normalize_path(path)], **parameters)
+
+  def watch(self, watcher: 'SimulatorWatcher'):
+    with self.lock:
+      self._watchers.append(watcher)
+
+  def unwatch(self, watcher: 'SimulatorWatcher'):
+    with self.lock:
+      if watcher in self._watchers:
+        self._watchers.remove(watcher)
+
+  # instance store
+
+  def _make_path(self, class_name, properties) -> str:
+    keys = []
+    key_names = KEY_PROPERTIES.get(class_name) or ASSOCIATION_ROLES.get(class_name) or ("InstanceID",)
+    for key_name in sorted(key_names):
+      value = properties[key_name]
+      if isinstance(value, int) and not isinstance(value, bool):
+        keys.append('%s=%s' % (key_name, value))
+      else:
+        keys.append('%s="%s"' % (key_name, str(value).replace('\\', '\\\\').replace('"', '\\"')))
+    return "\\\\%s\\%s:%s.%s" % (self.host_name, self.namespace, class_name, ",".join(keys))
+
+  def _create(self, class_name, properties) -> _Instance:
+    instance = _Instance(class_name, properties, self._make_path(class_name, properties))
+    self._instances[instance.key] = instance
+    for role in ASSOCIATION_ROLES.get(class_name, ()):
+      self._links[normalize_path(properties[role])].append(instance.key)
+    self._emit(WmiEventType.CREATED, instance)
+    return instance
+
+  def _associate(self, class_name, **roles) -> _Instance:
+    properties = {role: value.path for role, value in roles.items() if isinstance(value, _Instance)}
+    properties.update({role: value for role, value in roles.items() if not isinstance(value, _Instance)})
+    return self._create(class_name, properties)
+
+  def _modify(self, instance: _Instance, changes: Dict[str, Any]):
+    previous = dict(instance.properties)
+    for name, value in changes.items():
+      property_name = _lookup(instance.properties, name) or name
+      instance.properties[property_name] = _freeze(value)
+    if previous != instance.properties:
+      self._emit(WmiEventType.MODIFIED, instance, previous)
+
+  def _delete(self, instance: _Instance):
+    if self._instances.pop(instance.key, None) is None:
+      return
+    for association_key in self._links.pop(instance.key, []):
+      association = self._instances.get(association_key)
+      if association is not None:
+        self._delete(association)
+    self._emit(WmiEventType.DELETED, instance)
+
+  def _associations(self, key, relationship_class=None) -> List[_Instance]:
+    result = []
+    for association_key in self._links.get(key, ()):
+      association = self._instances.get(association_key)
+      if association is not None and (not relationship_class or is_subclass(association.class_name,
+                                                                              relationship_class)):
+        result.append(association)
+    return result
+
+  def _related(self, instance: _Instance, related_class) -> List[_Instance]:
+    return [self._instances[normalize_path(path)] for _, path, _ in self.related(instance.path, related_class)]
+
+  def _emit(self, event_type: WmiEventType, instance: _Instance, previous=None):
+    if not self._watchers:
+      return
+    event = WmiEvent(event_type, instance.class_name, instance.path, dict(instance.properties), previous)
+    for watcher in self._watchers:
+      watcher.deliver(event)
+
+  def _schedule(self, delay, callback):
+    if delay <= 0:
+      callback()
+    else:
+      heapq.heappush(self._scheduled, (self.clock() + delay, next(self._sequence), callback))
+
+  # model
+
+  def _create_host(self):
+    self._host = self._create("Msvm_ComputerSystem", {
+      "CreationClassName": "Msvm_ComputerSystem", "Name": self.host_name, "ElementName": self.host_name,
+      "Caption": "Hosting Computer System", "EnabledState": 2
+    })
+    self._create("Msvm_VirtualSystemManagementService", {
+      "CreationClassName": "Msvm_VirtualSystemManagementService", "Name": "vmms",
+      "SystemCreationClassName": "Msvm_ComputerSystem", "SystemName": self.host_name,
+      "ElementName": "Virtual Machine Management Service"
+    })
+    for subtype, (class_name, resource_type) in sorted(RESOURCE_POOLS.items()):
+      pool_id = str(uuid.uuid4()).upper()
+      pool = self._create("Msvm_ResourcePool", {
+        "InstanceID": "Microsoft:%s" % pool_id, "PoolID": "", "ResourceType": resource_type,
+        "ResourceSubType": subtype, "Primordial": True, "ElementName": subtype
+      })
+      capabilities = self._create("Msvm_AllocationCapabilities", {
+        "InstanceID": "Microsoft:%s" % pool_id, "ResourceType": resource_type, "ResourceSubType": subtype
+      })
+      self._associate("Msvm_ElementCapabilities", ManagedElement=pool, Capabilities=capabilities)
+      for value_role, role_name in enumerate(("Default", "Minimum", "Maximum", "Increment")):
+        setting = self._create(class_name, self._default_properties(
+          "Microsoft:Definition\\%s\\%s" % (pool_id, role_name), class_name, resource_type, subtype))
+        self._associate("Msvm_SettingsDefineCapabilities", GroupComponent=capabilities, PartComponent=setting,
+                        ValueRole=value_role, ValueRange=0 if value_role == 0 else 1)
+
+  def _default_properties(self, instance_id, class_name, resource_type, subtype) -> Dict[str, Any]:
+    properties = {
+      "InstanceID": instance_id, "ResourceType": resource_type, "ResourceSubType": subtype, "ElementName": subtype,
+      "Parent": None, "Address": None, "AddressOnParent": None, "HostResource": (), "Connection": (),
+      "VirtualQuantity": 1, "Reservation": 0, "Limit": 0, "Weight": 0
+    }
+    if class_name == "Msvm_SyntheticEthernetPortSettingData":
+      properties.update({"StaticMacAddress": False, "VirtualSystemIdentifiers": ()})
+    if class_name == "Msvm_MemorySettingData":
+      properties.update({"DynamicMemoryEnabled": False})
+    if class_name == "Msvm_EthernetPortAllocationSettingData":
+      properties.update({"EnabledState": 2})
+    return properties
+
+  def _port_properties(self) -> Dict[str, Any]:
+    return {
+      "ElementName": "Network Adapter", "ResourceType": 10, "ResourceSubType": "Microsoft:Hyper-V:Synthetic Ethernet Port",
+      "Address": "00155D%06X" % next(self._mac_counter), "StaticMacAddress": False,
+      "VirtualSystemIdentifiers": ("{%s}" % uuid.uuid4(),)
+    }
+
+  def _define_machine(self, name, subtype, state, memory, cpu_count, com_ports, machine_id=None) -> _Instance:
+    machine_id = (machine_id or str(uuid.uuid4())).upper()
+    state = ComputerSystem_EnabledState(state).value
+    machine = self._create("Msvm_ComputerSystem", {
+      "CreationClassName": "Msvm_ComputerSystem", "Name": machine_id, "ElementName": name,
+      "Caption": "Virtual Machine", "Description": "Microsoft Virtual Machine", "EnabledState": state,
+      "HealthState": 5, "OperationalStatus": (2,), "OnTimeInMilliseconds": 0
+    })
+    vssd = self._create("Msvm_VirtualSystemSettingData", {
+      "InstanceID": "Microsoft:%s" % machine_id, "ElementName": name, "VirtualSystemIdentifier": machine_id,
+      "VirtualSystemSubType": subtype, "VirtualSystemType": "Microsoft:Hyper-V:System:Realized",
+      "Caption": "Virtual Machine Settings", "Notes": None
+    })
+    self._associate("Msvm_SettingsDefineState", ManagedElement=machine, SettingData=vssd)
+    shutdown = self._create("Msvm_ShutdownComponent", {
+      "CreationClassName": "Msvm_ShutdownComponent", "DeviceID": "Microsoft:%s\\ShutdownComponent" % machine_id,
+      "SystemCreationClassName": "Msvm_ComputerSystem", "SystemName": machine_id,
+      "ElementName": "Shutdown", "OperationalStatus": self._shutdown_status(state)
+    })
+    self._associate("Msvm_SystemDevice", GroupComponent=machine, PartComponent=shutdown)
+    self._add_resource(vssd, "Msvm_ProcessorSettingData", {
+      "ElementName": "Processor", "ResourceType": 3, "ResourceSubType": "Microsoft:Hyper-V:Processor",
+      "VirtualQuantity": cpu_count, "Reservation": 0, "Limit": 100000, "Weight": 100
+    })
+    self._add_resource(vssd, "Msvm_MemorySettingData", {
+      "ElementName": "Memory", "ResourceType": 4, "ResourceSubType": "Microsoft:Hyper-V:Memory",
+      "VirtualQuantity": memory, "Reservation": memory, "Limit": memory, "DynamicMemoryEnabled": False
+    })
+    if subtype == VirtualMachineGeneration.GEN1.value:
+      for address in ("0", "1"):
+        self._add_resource(vssd, "Msvm_ResourceAllocationSettingData", {
+          "ElementName": "IDE Controller %s" % address, "ResourceType": 5,
+          "ResourceSubType": "Microsoft:Hyper-V:Emulated IDE Controller", "Address": address
+        })
+    else:
+      self._add_resource(vssd, "Msvm_ResourceAllocationSettingData", {
+        "ElementName": "SCSI Controller", "ResourceType": 6,
+        "ResourceSubType": "Microsoft:Hyper-V:Synthetic SCSI Controller", "Address": None
+      })
+    serial_controller = self._add_resource(vssd, "Msvm_ResourceAllocationSettingData", {
+      "ElementName": "Serial Controller", "ResourceType": 1, "ResourceSubType": "Microsoft:Hyper-V:Serial Controller",
+      "Address": None
+    })
+    for port in range(com_ports):
+      self._add_resource(vssd, "Msvm_SerialPortSettingData", {
+        "ElementName": "COM %s" % (port + 1), "ResourceType": 21, "ResourceSubType": "Microsoft:Hyper-V:Serial Port",
+        "Parent": serial_controller.path, "AddressOnParent": str(port), "Connection": ("",)
+      })
+    return vssd
+
+  def _add_resource(self, vssd: _Instance, class_name, properties) -> _Instance:
+    properties = dict(properties)
+    properties["InstanceID"] = "Microsoft:%s\\%s" % (vssd.properties["VirtualSystemIdentifier"],
+                                                    str(uuid.uuid4()).upper())
+    for name in ("Parent", "HostResource", "Connection", "Address", "AddressOnParent"):
+      properties.setdefault(name, () if name in ("HostResource", "Connection") else None)
+    resource = self._create(class_name, properties)
+    self._associate("Msvm_VirtualSystemSettingDataComponent", GroupComponent=vssd, PartComponent=resource)
+    parent = self._instances.get(normalize_path(properties["Parent"])) if properties.get("Parent") else None
+    if parent is not None:
+      self._associate(DEPENDENCY_ASSOCIATION, Antecedent=parent, Dependent=resource)
+    return resource
+
+  def _machine(self, machine_id) -> _Instance:
+    instance = self._instances.get(normalize_path(self._make_path(
+      "Msvm_ComputerSystem", {"CreationClassName": "Msvm_ComputerSystem", "Name": str(machine_id).upper()})))
+    if instance is None:
+      raise WmiException("Machine '%s' does not exist" % machine_id)
+    return instance
+
+  def _destroy_machine(self, machine_id):
+    machine = self._machine(machine_id)
+    prefix = "MICROSOFT:%s" % machine.properties["Name"].upper()
+    owned = [instance for instance in self._instances.values()
+             if str(instance.properties.get("InstanceID") or "").upper().startswith(prefix)
+             or (instance.class_name == "Msvm_ShutdownComponent" and instance.properties["SystemName"] == machine_id)]
+    for instance in owned:
+      self._delete(instance)
+    self._delete(machine)
+
+  @staticmethod
+  def _shutdown_status(state) -> tuple:
+    if state == ComputerSystem_EnabledState.Enabled.value:
+      return ShutdownComponent_OperationalStatus.OK.value,
+    return ShutdownComponent_OperationalStatus.NoContact.value,
+
+  def _set_machine_state(self, machine: _Instance, state: int):
+    self._modify(machine, {"EnabledState": state})
+    for shutdown in self._related(machine, "Msvm_ShutdownComponent"):
+      self._modify(shutdown, {"OperationalStatus": self._shutdown_status(state)})
+
+  def _start_job(self, method_name, on_complete: Callable[[], None] = None, duration=None) -> Dict[str, Any]:
+    failure = self._job_failures.pop(method_name, None)
+    job = self._create("Msvm_ConcreteJob", {
+      "InstanceID": str(uuid.uuid4()).upper(), "ElementName": method_name, "Caption": method_name,
+      "JobState": Msvm_ConcreteJob_JobState.Running.value, "PercentComplete": 0, "ErrorCode": 0,
+      "ErrorDescription": None, "JobStatus": "Job is running"
+    })
+
+    def _complete():
+      if failure:
+        self._modify(job, {"JobState": Msvm_ConcreteJob_JobState.Exception.value, "ErrorCode": failure[0],
+                           "ErrorDescription": failure[1], "JobStatus": "Job failed"})
+        return
+      if on_complete:
+        on_complete()
+      self._modify(job, {"JobState": Msvm_ConcreteJob_JobState.Completed.value, "PercentComplete": 100,
+                         "JobStatus": "Job completed successfully"})
+
+    self._schedule(self.job_duration if duration is None else duration, _complete)
+    return {"ReturnValue": JOB_STARTED, "Job": ObjectReference(job.path)}
+
+  def _embedded(self, value) -> Tuple[str, Dict[str, Any]]:
+    if isinstance(value, SimulatorObject):
+      return value.class_name, {name: _freeze(item) for name, item in value.properties().items()}
+    return instance_from_xml(str(value))
+
+  def _instance_of(self, value) -> _Instance:
+    path = value.path if isinstance(value, SimulatorObject) else str(value)
+    instance = self._instances.get(normalize_path(path))
+    if instance is None:
+      raise WmiException("Not found: '%s'" % path)
+    return instance
+
+  def _apply_settings(self, value) -> _Instance:
+    class_name, properties = self._embedded(value)
+    instance = self._instances.get(normalize_path(self._make_path(class_name, properties)))
+    if instance is None:
+      raise WmiException("Not found: '%s'" % properties.get("InstanceID"))
+    self._modify(instance, properties)
+    return instance
+
+  # methods, named _<class>_<method>
+
+  def _Msvm_ComputerSystem_RequestStateChange(self, machine: _Instance, RequestedState, TimeoutPeriod=None):
+    requested = ComputerSystem_RequestStateChange_RequestedState.from_code(RequestedState)
+    target = requested.to_ComputerSystem_EnabledState().value
+    current = machine.properties["EnabledState"]
+    if current == target and requested != ComputerSystem_RequestStateChange_RequestedState.Reset:
+      return {"ReturnValue": INVALID_STATE, "Job": None}
+    if self.transition_duration > 0:
+      if target == ComputerSystem_EnabledState.Enabled.value:
+        self._set_machine_state(machine, ComputerSystem_EnabledState.Starting.value)
+      elif target == ComputerSystem_EnabledState.Disabled.value:
+        self._set_machine_state(machine, ComputerSystem_EnabledState.ShuttingDown.value)
+    return self._start_job("RequestStateChange", lambda: self._set_machine_state(machine, target),
+                           max(self.job_duration, self.transition_duration))
+
+  def _Msvm_ShutdownComponent_InitiateShutdown(self, component: _Instance, Force, Reason):
+    machine = self._machine(component.properties["SystemName"])
+    if machine.properties["EnabledState"] != ComputerSystem_EnabledState.Enabled.value:
+      return {"ReturnValue": INVALID_STATE, "Job": None}
+    if self.transition_duration > 0:
+      self._set_machine_state(machine, ComputerSystem_EnabledState.ShuttingDown.value)
+    return self._start_job(
+      "InitiateShutdown", lambda: self._set_machine_state(machine, ComputerSystem_EnabledState.Disabled.value),
+      max(self.job_duration, self.transition_duration))
+
+  def _Msvm_VirtualSystemManagementService_DefineSystem(self, service, SystemSettings, ResourceSettings=(),
+                                                        ReferenceConfiguration=None):
+    _, settings = self._embedded(SystemSettings)
+    vssd = self._define_machine(settings.get("ElementName") or "New Virtual Machine",
+                                settings.get("VirtualSystemSubType") or VirtualMachineGeneration.GEN1.value,
+                                ComputerSystem_EnabledState.Disabled, 1024, 1, 2)
+    for resource in ResourceSettings or ():
+      class_name, properties = self._embedded(resource)
+      self._add_resource(vssd, class_name, properties)
+    result = self._start_job("DefineSystem")
+    result["ResultingSystem"] = ObjectReference(self._machine(vssd.properties["VirtualSystemIdentifier"]).path)
+    return result
+
+  def _Msvm_VirtualSystemManagementService_DestroySystem(self, service, AffectedSystem):
+    machine_id = self._instance_of(AffectedSystem).properties["Name"]
+    return self._start_job("DestroySystem", lambda: self._destroy_machine(machine_id))
+
+  def _Msvm_VirtualSystemManagementService_ModifySystemSettings(self, service, SystemSettings):
+    vssd = self._apply_settings(SystemSettings)
+    machine = self._machine(vssd.properties["VirtualSystemIdentifier"])
+    self._modify(machine, {"ElementName": vssd.properties["ElementName"]})
+    return self._start_job("ModifySystemSettings")
+
+  def _Msvm_VirtualSystemManagementService_ModifyResourceSettings(self, service, ResourceSettings):
+    resources = [self._apply_settings(value) for value in ResourceSettings or ()]
+    result = self._start_job("ModifyResourceSettings")
+    result["ResultingResourceSettings"] = [ObjectReference(resource.path) for resource in resources]
+    return result
+
+  def _Msvm_VirtualSystemManagementService_AddResourceSettings(self, service, AffectedConfiguration,
+                                                               ResourceSettings):
+    vssd = self._instance_of(AffectedConfiguration)
+    resources = []
+    for value in ResourceSettings or ():
+      class_name, properties = self._embedded(value)
+      properties.pop("InstanceID", None)
+      resources.append(self._add_resource(vssd, class_name, properties))
+    result = self._start_job("AddResourceSettings")
+    result["ResultingResourceSettings"] = [ObjectReference(resource.path) for resource in resources]
+    return result
+
+
+class SimulatorObject(WmiObject):
+  """
+  Client side copy of simulated object. Like ManagementObject, it is bound on first use, local modifications are
+  applied only when object is passed to provider method.
+  """
+
+  def __init__(self, session: 'SimulatorSession', path='', class_name=None, properties: Dict[str, Any] = None):
+    self.session = session
+    self._path = path
+    self._class_name = class_name
+    self._properties = properties
+
+  def _bind(self) -> Dict[str, Any]:
+    if self._properties is None:
+      self.session.backend.call("get")
+      self._class_name, self._path, self._properties = self.session.backend.simulator.get(self._path)
+    return self._properties
+
+  @property
+  def path(self) -> str:
+    return self._path
+
+  @property
+  def class_name(self) -> str:
+    if self._class_name is None:
+      self._bind()
+    return self._class_name
+
+  def get_property(self, name):
+    properties = self._bind()
+    property_name = _lookup(properties, name)
+    if property_name is None:
+      raise PropertyNotFound(name)
+    return properties[property_name]
+
+  def set_property(self, name, value):
+    properties = self._bind()
+    properties[_lookup(properties, name) or name] = _freeze(value)
+
+  def properties(self) -> Dict[str, Any]:
+    return dict(self._bind())
+
+  def reload(self):
+    self.session.backend.call("reload")
+    self._class_name, self._path, self._properties = self.session.backend.simulator.get(self._path)
+
+  def get_related(self, *args) -> List[WmiObject]:
+    self.session.backend.call("get_related")
+    return [SimulatorObject(self.session, path, class_name, properties)
+            for class_name, path, properties in self.session.backend.simulator.related(self._path, *args)]
+
+  def get_relationships(self, *args) -> List[WmiObject]:
+    self.session.backend.call("get_relationships")
+    return [SimulatorObject(self.session, path, class_name, properties)
+            for class_name, path, properties in self.session.backend.simulator.relationships(self._path, *args)]
+
+  def invoke(self, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    class_name = self.class_name
+    self.session.backend.call("invoke")
+    return self.session.backend.simulator.invoke(class_name, self._path, method_name, parameters)
+
+  def clone(self) -> WmiObject:
+    return SimulatorObject(self.session, self._path, self.class_name, dict(self._bind()))
+
+  def get_text(self) -> str:
+    return instance_to_xml(self.class_name, self._bind())
+
+  def __str__(self):
+    return self._path or self.class_name
+
+
+class SimulatorWatcher(WmiWatcher):
+  def __init__(self, simulator: HypervSimulator, query: str):
+    self.simulator = simulator
+    from_match = re.search(r'\bFROM\s+(\w+)', query, re.IGNORECASE)
+    self.event_types = _EVENT_QUERY_TYPES.get(from_match.group(1).lower() if from_match else '', ())
+    self.class_names = re.findall(r"\bISA\s+['\"]([^'\"]+)['\"]", query, re.IGNORECASE)
+    self.events = queue.Queue()
+    simulator.watch(self)
+
+  def deliver(self, event: WmiEvent):
+    if event.event_type in self.event_types and any(
+        is_subclass(event.class_name, class_name) for class_name in self.class_names):
+      self.events.put(event)
+
+  def next_event(self, timeout: float = None) -> WmiEvent:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      self.simulator.advance()
+      wait = .05 if deadline is None else min(.05, deadline - time.monotonic())
+      try:
+        return self.events.get(timeout=max(wait, 0))
+      except queue.Empty:
+        if deadline is not None and time.monotonic() >= deadline:
+          return None
+
+  def close(self):
+    self.simulator.unwatch(self)
+
+
+class SimulatorSession(WmiSession):
+  def __init__(self, backend: 'SimulatorBackend', namespace):
+    super().__init__(namespace)
+    self.backend = backend
+
+  def query(self, query) -> List[WmiObject]:
+    self.backend.call("query")
+    return [SimulatorObject(self, path, class_name, properties)
+            for class_name, path, properties in self.backend.simulator.query(query)]
+
+  def get(self, path) -> WmiObject:
+    return SimulatorObject(self, str(path))
+
+  def create_instance(self, class_name) -> WmiObject:
+    return SimulatorObject(self, '', class_name, dict(CLASS_DEFAULTS.get(class_name, {})))
+
+  def watch(self, query) -> WmiWatcher:
+    return SimulatorWatcher(self.backend.simulator, query)
+
+
+class SimulatorBackend(WmiBackend):
+  """
+  Backend that serves ``HypervSimulator``, works on any platform. Every round trip to provider(see
+  ``SIMULATOR_OPERATIONS``) sleeps for configured latency: number of seconds for all operations, dict of operation
+  name to seconds, or callable that gets operation name and returns seconds. Round trips are counted in ``calls``.
+  """
+
+  def __init__(self, simulator: HypervSimulator = None,
+               latency: Union[float, Dict[str, float], Callable[[str], float]] = 0.0):
+    self.simulator = simulator or HypervSimulator()
+    self.latency = latency
+    self.calls = collections.Counter()
+
+  def call(self, operation: str):
+    self.calls[operation] += 1
+    if callable(self.latency):
+      delay = self.latency(operation)
+    elif isinstance(self.latency, dict):
+      delay = self.latency.get(operation, 0)
+    else:
+      delay = self.latency
+    if delay:
+      time.sleep(delay)
+
+  def connect(self, namespace) -> WmiSession:
+    return SimulatorSession(self, namespace)
@@ -0,0 +1,535 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import collections
+import gzip
+import json
+import threading
+import time
+from typing import Dict, Any, List, Union, IO, Tuple
+
+from hvapi.backend.base import WmiBackend, WmiSession, WmiObject, WmiWatcher, WmiEvent, WmiEventType, \
+  WmiException, PropertyNotFound, ObjectReference, instance_to_xml
+from hvapi.clr.base import normalize_path, parse_object_path
+
+TRANSCRIPT_VERSION = 1
+
+_ERRORS = {
+  "PropertyNotFound": PropertyNotFound,
+  "ValueError": ValueError
+}
+
+
+class TranscriptMismatch(WmiException):
+  """
+  Replayed code made WMI call that is not in transcript.
+  """
+
+
+def _open(file: Union[str, IO], mode: str) -> IO:
+  if not isinstance(file, str):
+    return file
+  if file.endswith(".gz"):
+    return gzip.open(file, mode + "t", encoding="utf-8")
+  return open(file, mode, encoding="utf-8")
+
+
+def _encode_value(value, writer: 'TranscriptWriter' = None):
+  if isinstance(value, ObjectReference):
+    return {"$ref": str(value)}
+  if isinstance(value, WmiObject):
+    return {"$obj": writer.snapshot(value.class_name, value.path, value.properties())}
+  if isinstance(value, (list, tuple)):
+    return [_encode_value(item, writer) for item in value]
+  if value is None or isinstance(value, (str, int, float, bool)):
+    return value
+  return str(value)
+
+
+def _decode_property(value):
+  if isinstance(value, list):
+    return tuple(_decode_property(item) for item in value)
+  return value
+
+
+def _decode_output(value):
+  if isinstance(value, dict) and "$ref" in value:
+    return ObjectReference(value["$ref"])
+  if isinstance(value, list):
+    return [_decode_output(item) for item in value]
+  return value
+
+
+def _error_record(error: Exception) -> Dict[str, str]:
+  return {"type": type(error).__name__, "message": str(error)}
+
+
+def _raise_recorded(error: Dict[str, str]):
+  raise _ERRORS.get(error["type"], WmiException)(error["message"])
+
+
+# recording
+
+class TranscriptWriter(object):
+  """
+  Writes transcript as JSON lines, gzip compressed if file name ends with '.gz'. Object snapshots are written once and
+  referenced by id, so objects that are fetched many times take place once per distinct state.
+  """
+
+  def __init__(self, file: Union[str, IO]):
+    self.file = _open(file, "w")
+    self.lock = threading.Lock()
+    self.started = time.monotonic()
+    self._snapshots = {}
+    self._write({"transcript": TRANSCRIPT_VERSION})
+
+  def _write(self, record):
+    self.file.write(json.dumps(record, separators=(",", ":")))
+    self.file.write("\n")
+
+  def snapshot(self, class_name, path, properties: Dict[str, Any]) -> int:
+    encoded = {name: _encode_value(value) for name, value in properties.items()}
+    key = json.dumps((class_name, path, encoded), sort_keys=True, separators=(",", ":"))
+    with self.lock:
+      snapshot_id = self._snapshots.get(key)
+      if snapshot_id is None:
+        snapshot_id = self._snapshots[key] = len(self._snapshots)
+        self._write({"s": snapshot_id, "c": class_name, "p": path, "v": encoded})
+      return snapshot_id
+
+  def record(self, op, started, duration, result=None, error: Exception = None, **fields):
+    record = {"op": op, "at": round(started - self.started, 6), "t": round(duration, 6)}
+    record.update(fields)
+    if error is not None:
+      record["e"] = _error_record(error)
+    else:
+      record["r"] = result
+    with self.lock:
+      self._write(record)
+
+  def close(self):
+    with self.lock:
+      self.file.close()
+
+
+class _Call(object):
+  """
+  Measures one call to wrapped backend and writes its record.
+  """
+
+  def __init__(self, writer: TranscriptWriter, op, **fields):
+    self.writer = writer
+    self.op = op
+    self.fields = fields
+    self.result = None
+
+  def __enter__(self):
+    self.started = time.monotonic()
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    duration = time.monotonic() - self.started
+    error = exc_val if isinstance(exc_val, Exception) else None
+    if exc_type is None or error is not None:
+      self.writer.record(self.op, self.started, duration, self.result, error, **self.fields)
+
+
+class RecordingObject(WmiObject):
+  def __init__(self, inner: WmiObject, session: 'RecordingSession', bound=True):
+    self.inner = inner
+    self.session = session
+    self._bound = bound
+
+  def _bind(self):
+    if not self._bound:
+      self._bound = True
+      with _Call(self.session.writer, "get", p=self.inner.path) as call:
+        call.result = self.session.writer.snapshot(self.inner.class_name, self.inner.path, self.inner.properties())
+
+  def _wrap(self, objects, call: _Call) -> List[WmiObject]:
+    call.result = [self.session.writer.snapshot(item.class_name, item.path, item.properties()) for item in objects]
+    return [RecordingObject(item, self.session) for item in objects]
+
+  @property
+  def path(self) -> str:
+    return self.inner.path
+
+  @property
+  def class_name(self) -> str:
+    return self.inner.class_name
+
+  def get_property(self, name):
+    self._bind()
+    return self.inner.get_property(name)
+
+  def set_property(self, name, value):
+    self._bind()
+    if isinstance(value, RecordingObject):
+      value = value.inner
+    elif isinstance(value, (list, tuple)):
+      value = [item.inner if isinstance(item, RecordingObject) else item for item in value]
+    self.inner.set_property(name, value)
+
+  def properties(self) -> Dict[str, Any]:
+    self._bind()
+    return self.inner.properties()
+
+  def reload(self):
+    with _Call(self.session.writer, "reload", p=self.inner.path) as call:
+      self.inner.reload()
+      call.result = self.session.writer.snapshot(self.inner.class_name, self.inner.path, self.inner.properties())
+    self._bound = True
+
+  def get_related(self, *args) -> List[WmiObject]:
+    with _Call(self.session.writer, "get_related", p=self.inner.path, a=list(args)) as call:
+      return self._wrap(self.inner.get_related(*args), call)
+
+  def get_relationships(self, *args) -> List[WmiObject]:
+    with _Call(self.session.writer, "get_relationships", p=self.inner.path, a=list(args)) as call:
+      return self._wrap(self.inner.get_relationships(*args), call)
+
+  def invoke(self, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    inner_parameters = {name: self._unwrap(value) for name, value in parameters.items()}
+    inputs = {name: _encode_value(value, self.session.writer) for name, value in parameters.items()}
+    with _Call(self.session.writer, "invoke", p=self.inner.path, m=method_name, i=inputs) as call:
+      result = self.inner.invoke(method_name, inner_parameters)
+      call.result = {name: _encode_value(value) for name, value in result.items()}
+    return result
+
+  @classmethod
+  def _unwrap(cls, value):
+    if isinstance(value, RecordingObject):
+      return value.inner
+    if isinstance(value, (list, tuple)):
+      return [cls._unwrap(item) for item in value]
+    return value
+
+  def clone(self) -> WmiObject:
+    self._bind()
+    return RecordingObject(self.inner.clone(), self.session)
+
+  def get_text(self) -> str:
+    self._bind()
+    return self.inner.get_text()
+
+  def __str__(self):
+    return str(self.inner)
+
+
+class RecordingWatcher(WmiWatcher):
+  def __init__(self, inner: WmiWatcher, writer: TranscriptWriter, query: str):
+    self.inner = inner
+    self.writer = writer
+    self.query = query
+
+  def next_event(self, timeout: float = None) -> WmiEvent:
+    with _Call(self.writer, "next_event", q=self.query) as call:
+      event = self.inner.next_event(timeout)
+      if event is not None:
+        call.result = {
+          "e": event.event_type.value,
+          "s": self.writer.snapshot(event.class_name, event.path, event.properties),
+          "prev": {name: _encode_value(value) for name, value in event.previous_properties.items()}
+          if event.previous_properties is not None else None
+        }
+    return event
+
+  def close(self):
+    self.inner.close()
+
+
+class RecordingSession(WmiSession):
+  def __init__(self, inner: WmiSession, writer: TranscriptWriter):
+    super().__init__(inner.namespace)
+    self.inner = inner
+    self.writer = writer
+
+  def query(self, query) -> List[WmiObject]:
+    with _Call(self.writer, "query", q=query) as call:
+      objects = self.inner.query(query)
+      call.result = [self.writer.snapshot(item.class_name, item.path, item.properties()) for item in objects]
+    return [RecordingObject(item, self) for item in objects]
+
+  def get(self, path) -> WmiObject:
+    return RecordingObject(self.inner.get(path), self, bound=False)
+
+  def create_instance(self, class_name) -> WmiObject:
+    with _Call(self.writer, "create_instance", c=class_name) as call:
+      instance = self.inner.create_instance(class_name)
+      call.result = self.writer.snapshot(instance.class_name, instance.path, instance.properties())
+    return RecordingObject(instance, self)
+
+  def watch(self, query) -> WmiWatcher:
+    return RecordingWatcher(self.inner.watch(query), self.writer, query)
+
+
+class RecordingBackend(WmiBackend):
+  """
+  Backend that passes all calls to ``inner`` backend and writes them to transcript: queries, object fetches and
+  reloads, GetRelated/GetRelationships arguments, method inputs and outputs, events, object snapshots and timing of
+  every call. Transcript can be served back by ``ReplayBackend`` on any platform. ``close`` must be called when
+  recording is finished.
+  """
+
+  def __init__(self, inner: WmiBackend, file: Union[str, IO]):
+    self.inner = inner
+    self.writer = TranscriptWriter(file)
+
+  def connect(self, namespace) -> WmiSession:
+    return RecordingSession(self.inner.connect(namespace), self.writer)
+
+  def close(self):
+    self.writer.close()
+
+
+# replay
+
+def _request_key(record) -> Tuple:
+  op = record["op"]
+  if op in ("query", "next_event"):
+    return op, record["q"]
+  if op in ("get", "reload"):
+    # both fetch object state, one queue keeps states of object in recorded order
+    return "fetch", normalize_path(record["p"])
+  if op in ("get_related", "get_relationships"):
+    return op, normalize_path(record["p"]), json.dumps(record["a"])
+  if op == "invoke":
+    return op, normalize_path(record["p"]), record["m"]
+  if op == "create_instance":
+    return op, record["c"]
+  raise ValueError("Unknown transcript operation '%s'" % op)
+
+
+class Transcript(object):
+  """
+  Loaded transcript. Records are grouped by request(operation and its arguments), every group is replayed in
+  recorded order.
+  """
+
+  def __init__(self, snapshots: Dict[int, Tuple[str, str, Dict[str, Any]]], records: List[Dict[str, Any]]):
+    self.snapshots = snapshots
+    self.records = records
+
+  @classmethod
+  def load(cls, file: Union[str, IO]) -> 'Transcript':
+    snapshots = {}
+    records = []
+    stream = _open(file, "r")
+    try:
+      header = json.loads(stream.readline())
+      if header.get("transcript") != TRANSCRIPT_VERSION:
+        raise ValueError("Unsupported transcript version '%s'" % header.get("transcript"))
+      for line in stream:
+        record = json.loads(line)
+        if "s" in record and "op" not in record:
+          snapshots[record["s"]] = (record["c"], record["p"],
+                                    {name: _decode_property(value) for name, value in record["v"].items()})
+        else:
+          records.append(record)
+    finally:
+      if stream is not file:
+        stream.close()
+    return cls(snapshots, records)
+
+  def requests(self) -> Dict[Tuple, List[Dict[str, Any]]]:
+    result = collections.OrderedDict()
+    for record in self.records:
+      result.setdefault(_request_key(record), []).append(record)
+    return result
+
+  def stats(self) -> Dict[str, Dict[str, float]]:
+    """
+    Returns count and total recorded time of calls per operation.
+    """
+    result = collections.OrderedDict()
+    for record in self.records:
+      op_stats = result.setdefault(record["op"], {"calls": 0, "time": 0.0})
+      op_stats["calls"] += 1
+      op_stats["time"] += record["t"]
+    return result
+
+
+class ReplayObject(WmiObject):
+  def __init__(self, session: 'ReplaySession', path='', class_name=None, properties: Dict[str, Any] = None):
+    self.session = session
+    self._path = path
+    self._class_name = class_name
+    self._properties = properties
+
+  def _bind(self) -> Dict[str, Any]:
+    if self._properties is None:
+      self._class_name, self._path, self._properties = self.session.backend.fetch(self._path)
+    return self._properties
+
+  @property
+  def path(self) -> str:
+    return self._path
+
+  @property
+  def class_name(self) -> str:
+    if self._class_name is None:
+      self._class_name = parse_object_path(self._path)[0]
+    return self._class_name
+
+  def get_property(self, name):
+    properties = self._bind()
+    if name not in properties:
+      for property_name in properties:
+        if property_name.lower() == name.lower():
+          return properties[property_name]
+      raise PropertyNotFound(name)
+    return properties[name]
+
+  def set_property(self, name, value):
+    properties = self._bind()
+    if isinstance(value, WmiObject):
+      value = value.path
+    elif isinstance(value, (list, tuple)):
+      value = tuple(item.path if isinstance(item, WmiObject) else item for item in value)
+    properties[name] = value
+
+  def properties(self) -> Dict[str, Any]:
+    return dict(self._bind())
+
+  def reload(self):
+    self._class_name, self._path, self._properties = self.session.backend.fetch(self._path)
+
+  def get_related(self, *args) -> List[WmiObject]:
+    return self.session.objects(self.session.backend.serve(
+      ("get_related", normalize_path(self._path), json.dumps(list(args)))))
+
+  def get_relationships(self, *args) -> List[WmiObject]:
+    return self.session.objects(self.session.backend.serve(
+      ("get_relationships", normalize_path(self._path), json.dumps(list(args)))))
+
+  def invoke(self, method_name, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    result = self.session.backend.serve(("invoke", normalize_path(self._path), method_name), repeat=False)
+    return {name: _decode_output(value) for name, value in result.items()}
+
+  def clone(self) -> WmiObject:
+    return ReplayObject(self.session, self._path, self.class_name, dict(self._bind()))
+
+  def get_text(self) -> str:
+    return instance_to_xml(self.class_name, self._bind())
+
+  def __str__(self):
+    return self._path or self.class_name
+
+
+class ReplayWatcher(WmiWatcher):
+  def __init__(self, backend: 'ReplayBackend', query: str):
+    self.backend = backend
+    self.query = query
+
+  def next_event(self, timeout: float = None) -> WmiEvent:
+    try:
+      result = self.backend.serve(("next_event", self.query), repeat=False)
+    except TranscriptMismatch:
+      if timeout is None or self.backend.strict:
+        raise
+      time.sleep(timeout)
+      return None
+    if result is None:
+      return None
+    class_name, path, properties = self.backend.transcript.snapshots[result["s"]]
+    previous = None
+    if result["prev"] is not None:
+      previous = {name: _decode_property(value) for name, value in result["prev"].items()}
+    return WmiEvent(WmiEventType(result["e"]), class_name, path, dict(properties), previous)
+
+  def close(self):
+    pass
+
+
+class ReplaySession(WmiSession):
+  def __init__(self, backend: 'ReplayBackend', namespace):
+    super().__init__(namespace)
+    self.backend = backend
+
+  def objects(self, snapshot_ids) -> List[WmiObject]:
+    result = []
+    for snapshot_id in snapshot_ids:
+      class_name, path, properties = self.backend.transcript.snapshots[snapshot_id]
+      result.append(ReplayObject(self, path, class_name, dict(properties)))
+    return result
+
+  def query(self, query) -> List[WmiObject]:
+    return self.objects(self.backend.serve(("query", query)))
+
+  def get(self, path) -> WmiObject:
+    return ReplayObject(self, str(path))
+
+  def create_instance(self, class_name) -> WmiObject:
+    _, path, properties = self.backend.transcript.snapshots[self.backend.serve(("create_instance", class_name))]
+    return ReplayObject(self, path, class_name, dict(properties))
+
+  def watch(self, query) -> WmiWatcher:
+    return ReplayWatcher(self.backend, query)
+
+
+class ReplayBackend(WmiBackend):
+  """
+  Backend that serves recorded transcript. Every request(operation with its arguments) gets recorded responses in
+  recorded order, after they are exhausted last response is repeated, except method invocations and events. In
+  ``strict`` mode any request that is not in transcript or exhausted raises ``TranscriptMismatch``. Recorded latency
+  is reproduced multiplied by ``latency_scale``, 0 disables it.
+  """
+
+  def __init__(self, transcript: Union['Transcript', str, IO], latency_scale=1.0, strict=False):
+    self.transcript = transcript if isinstance(transcript, Transcript) else Transcript.load(transcript)
+    self.latency_scale = latency_scale
+    self.strict = strict
+    self.lock = threading.Lock()
+    self._requests = {key: collections.deque(records) for key, records in self.transcript.requests().items()}
+    self._last = {}
+
+  def serve(self, key: Tuple, repeat=True):
+    with self.lock:
+      records = self._requests.get(key)
+      if records:
+        record = records.popleft()
+        self._last[key] = record
+      elif repeat and not self.strict and key in self._last:
+        record = self._last[key]
+      else:
+        raise TranscriptMismatch("Request %s is not in transcript" % (key,))
+    if self.latency_scale:
+      time.sleep(record["t"] * self.latency_scale)
+    if "e" in record:
+      _raise_recorded(record["e"])
+    return record["r"]
+
+  def fetch(self, path) -> Tuple[str, str, Dict[str, Any]]:
+    class_name, path, properties = self.transcript.snapshots[self.serve(("fetch", normalize_path(path)))]
+    return class_name, path, dict(properties)
+
+  def pending(self) -> Dict[Tuple, int]:
+    """
+    Returns requests that still have not replayed responses, useful to check that replayed code made all recorded
+    calls.
+    """
+    with self.lock:
+      return {key: len(records) for key, records in self._requests.items() if records}
+
+  def connect(self, namespace) -> WmiSession:
+    return ReplaySession(self, namespace)
@@ -1,56 +1,137 @@
-import clr
-import collections
+import re
+import uuid
+import weakref
 import xml.etree.ElementTree as ET
 from enum import Enum
-from typing import Tuple, Callable, Iterable, Union, List, Any, Sized
+from typing import Tuple, Callable, Iterable, Union, List, Any, Sized, Dict
 
+from hvapi.backend import default_backend
+from hvapi.backend.base import WmiBackend, WmiObject, WmiWatcher, WmiEvent, WmiEventType, WmiException, \
+  ObjectReference
 from hvapi.common_types import RangedCodeEnum
+from hvapi.instrumentation import instrumented, measure, QUERY, RELOAD, INVOKE, GET_RELATED, GET_RELATIONSHIPS
 
-clr.AddReference("System.Management")
-from System.Management import ManagementScope, ObjectQuery, ManagementObjectSearcher, ManagementObject, CimType, \
-  ManagementException, ManagementClass
-from System import Array, String, Guid
+_QUERY_CLASS = re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE)
+_QUERY_ALL_PROPERTIES = re.compile(r"^\s*SELECT\s+\*\s+FROM\b", re.IGNORECASE)
 
-# WARNING, clr_Array accepts iterable, e.g. ig you will pass string - it will be array of its chars, not array of one
-# string. clr_Array[clr_String](["hello"]) equals to array with one "hello" string in it
-clr_Array = Array
-clr_String = String
+
+def __getattr__(name):
+  # .NET types formerly exported by this module, loaded only when used, so CLR is not required on import.
+  # WARNING, clr_Array accepts iterable, e.g. if you will pass string - it will be array of its chars, not array of one
+  # string. clr_Array[clr_String](["hello"]) equals to array with one "hello" string in it
+  if name in ("clr_Array", "clr_String"):
+    from hvapi.backend import dotnet
+    return dotnet.Array if name == "clr_Array" else dotnet.String
+  raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
 
 
 def generate_guid(fmt="B"):
-  return Guid.NewGuid().ToString(fmt)
+  """
+  Generates new guid formatted like System.Guid.ToString does, e.g. '{xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx}' for "B".
+  """
+  value = str(uuid.uuid4())
+  if fmt == "B":
+    return "{%s}" % value
+  if fmt == "P":
+    return "(%s)" % value
+  if fmt == "N":
+    return value.replace("-", "")
+  return value
 
 
-class CimTypeTransformer(object):
+def normalize_path(path) -> str:
   """
+  Normalizes WMI object path to be used as object identity: server and namespace are stripped, path is lower-cased
+  since WMI paths are case-insensitive.
 
+  :param path: full or relative object path
+  :return: normalized relative path
   """
+  path = str(path)
+  colon = path.find(':')
+  if colon != -1 and '=' not in path[:colon]:
+    path = path[colon + 1:]
+  return path.lower()
 
-  @staticmethod
-  def target_class(value):
-    """
-    Returns target class in witch given CimType can/must be transformed.
 
-    :param value: System.Management.CimType enum item
-    :return: target class
-    """
-    if value == CimType.String:
-      return String
-    if value == CimType.Reference:
-      return ManagementObject
-    if value in (CimType.UInt32, CimType.UInt16):
-      return int
-    if value == CimType.DateTime:
-      return String
-    if value == CimType.Boolean:
-      return bool
-    raise Exception("unknown type")
+def parse_object_path(path) -> Tuple[str, List[Tuple[str, str]]]:
+  """
+  Splits WMI object path to class name and key properties. Key values are returned as WQL literals, exactly as they
+  are written in path(quoted and escaped strings or numbers), so they can be used in WHERE clause as is.
+
+  :param path: full or relative object path, e.g. 'Msvm_VirtualEthernetSwitch.CreationClassName="...",Name="..."'
+  :return: (class name, list of (key name, key literal))
+  """
+  path = str(path)
+  colon = path.find(':')
+  if colon != -1 and '=' not in path[:colon]:
+    path = path[colon + 1:]
+  dot = path.find('.')
+  if dot == -1:
+    return path.split('=', 1)[0], []
+  class_name = path[:dot]
+  keys = []
+  position = dot + 1
+  while position < len(path):
+    equals = path.index('=', position)
+    key_name = path[position:equals]
+    position = equals + 1
+    if path[position] == '"':
+      end = position + 1
+      while path[end] != '"':
+        end += 2 if path[end] == '\\' else 1
+      end += 1
+    else:
+      end = path.find(',', position)
+      if end == -1:
+        end = len(path)
+    keys.append((key_name, path[position:end]))
+    position = end + 1
+  return class_name, keys
+
+
+def _query_class(query) -> str:
+  match = _QUERY_CLASS.search(query)
+  return match.group(1) if match else None
+
+
+def is_projected_query(query) -> bool:
+  """
+  Returns True if query selects only some properties, objects it returns are partial.
+  """
+  return not _QUERY_ALL_PROPERTIES.match(query)
+
+
+def plain_properties(management_object: WmiObject) -> Dict[str, Any]:
+  """
+  Returns dict of plain python property values of given backend object.
+
+  :param management_object: backend object
+  :return: dict of property values
+  """
+  return management_object.properties()
 
 
 class MOHTransformers(object):
   @staticmethod
   def from_reference(object_reference, parent: 'ManagementObjectHolder') -> 'ManagementObjectHolder':
-    return ManagementObjectHolder(ManagementObject(object_reference), parent.scope_holder)
+    return parent.scope_holder.get(object_reference)
+
+  @staticmethod
+  def partial_reference(*property_names: str) -> Callable[[Any, 'ManagementObjectHolder'], 'ManagementObjectHolder']:
+    """
+    Returns transformer that works like ``from_reference``, but first access to any of given properties fetches
+    only these properties, referenced object will be fetched completely only if something else is requested.
+
+    :param property_names: properties that are expected to be used
+    :return: transformer suitable for Node property data
+    """
+
+    def _transformer(object_reference, parent: 'ManagementObjectHolder') -> 'ManagementObjectHolder':
+      return parent.scope_holder.get(object_reference, property_names)
+
+    _transformer.description = "partial_reference(%s)" % ", ".join(property_names)
+    return _transformer
 
   @staticmethod
   def from_xml(object_xml, parent: 'ManagementObjectHolder') -> 'ManagementObjectHolder':
@@ -64,7 +145,7 @@ class MOHTransformers(object):
       value_element = property_element.find('VALUE')
       if value_element is not None:
         property_value = value_element.text
-      class_instance.management_object.Properties[property_name].Value = property_value
+      class_instance.management_object.set_property(property_name, property_value)
     return class_instance
 
 
@@ -128,6 +209,7 @@ def PropertySelector(property_name, expected_value):
   def _sel(obj):
     return obj.properties[property_name] == expected_value
 
+  _sel.description = "%s == %r" % (property_name, expected_value)
   return _sel
 
 
@@ -138,20 +220,81 @@ def ListPropertySelector(properties):
         return False
     return True
 
+  _sel.description = " AND ".join("str(%s) == %r" % (name, str(value)) for name, value in properties)
   return _sel
 
 
+class EventWatcher(object):
+  """
+  Synchronous watcher of WMI events. ``next_event`` returns ``None`` if no event arrived in ``timeout`` seconds.
+  """
+
+  def __init__(self, scope_holder: 'ScopeHolder', query: str):
+    self.query = query
+    self.watcher = scope_holder.session.watch(query)  # type: WmiWatcher
+
+  def next_event(self, timeout: float = None) -> 'WmiEvent':
+    return self.watcher.next_event(timeout)
+
+  def close(self):
+    self.watcher.close()
+
+  def __iter__(self):
+    while True:
+      event = self.next_event()
+      if event is not None:
+        yield event
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+
 class ScopeHolder(object):
-  def __init__(self, namespace=r"\\.\root\virtualization\v2"):
-    self.scope = ManagementScope(namespace)
+  """
+  Holds connection to WMI namespace. If ``identity_map`` is enabled, scope keeps weak references to all holders it
+  created, keyed by normalized object path, so same WMI object reached several times(by reference, query or
+  traversal) is represented by same holder and references to known objects are resolved without fetching them again.
+  WMI is accessed through ``backend``, default backend is used if it is not given.
+  """
+
+  def __init__(self, namespace=r"\\.\root\virtualization\v2", identity_map=False, backend: WmiBackend = None):
+    self.namespace = namespace
+    self.backend = backend or default_backend()
+    self.session = self.backend.connect(namespace)
+    self.identity_map = weakref.WeakValueDictionary() if identity_map else None
+
+  def watch(self, query) -> 'EventWatcher':
+    return EventWatcher(self, query)
+
+  def watch_instances(self, class_names: Iterable[str], within=2) -> 'EventWatcher':
+    """
+    Watch creation, modification and deletion of instances of given classes.
+
+    :param class_names: classes to watch, subclasses are also matched
+    :param within: polling interval in seconds used by WMI for intrinsic events
+    :return: event watcher
+    """
+    condition = " OR ".join("TargetInstance ISA '%s'" % class_name for class_name in class_names)
+    return self.watch("SELECT * FROM __InstanceOperationEvent WITHIN %s WHERE %s" % (within, condition))
 
   def query(self, query) -> List['ManagementObjectHolder']:
-    result = []
-    query_obj = ObjectQuery(query)
-    searcher = ManagementObjectSearcher(self.scope, query_obj)
-    for man_object in searcher.Get():
-      result.append(ManagementObjectHolder(man_object, self))
-    return result
+    """
+    Executes query and wraps results. Results of query that selects only some properties are partial objects, they
+    never replace objects of holders in identity map and are returned in holders of their own.
+    """
+    if is_projected_query(query):
+      return [ManagementObjectHolder(man_object, self) for man_object in self.query_objects(query)]
+    return [self.wrap(man_object) for man_object in self.query_objects(query)]
+
+  @instrumented(QUERY, lambda self, query: _query_class(query))
+  def query_objects(self, query) -> List[WmiObject]:
+    """
+    Executes query and returns raw backend objects, bypassing identity map.
+    """
+    return self.session.query(query)
 
   def query_one(self, query) -> 'ManagementObjectHolder':
     result = self.query(query)
@@ -160,9 +303,60 @@ class ScopeHolder(object):
     if result:
       return result[0]
 
+  def get(self, path, properties: Iterable[str] = None) -> 'ManagementObjectHolder':
+    """
+    Returns holder for object with given path. Object is not fetched until it is used, if ``properties`` are given,
+    access to any of them fetches only these properties(see ``ManagementObjectHolder.fetch``). If identity map is
+    enabled and object is already known, existing holder is returned.
+
+    :param path: object path
+    :param properties: properties that are expected to be used
+    :return: holder
+    """
+    key = normalize_path(path)
+    if self.identity_map is not None:
+      holder = self.identity_map.get(key)
+      if holder is not None:
+        if properties:
+          holder.lazy_properties = tuple(set(holder.lazy_properties).union(properties))
+        return holder
+    holder = ManagementObjectHolder(None, self, key, str(path), properties)
+    if self.identity_map is not None:
+      self.identity_map[key] = holder
+    return holder
+
+  def wrap(self, management_object: WmiObject, path=None) -> 'ManagementObjectHolder':
+    """
+    Wraps backend object to holder, consulting identity map if it is enabled. Existing holder is updated with given,
+    more recent, object, so only complete objects must be wrapped, see ``query``.
+
+    :param management_object: object to wrap
+    :param path: object path if known, saves one property read
+    :return: holder
+    """
+    if self.identity_map is None:
+      return ManagementObjectHolder(management_object, self)
+    key = normalize_path(path if path is not None else management_object.path)
+    if not key:
+      return ManagementObjectHolder(management_object, self)
+    holder = self.identity_map.get(key)
+    if holder is not None:
+      holder.management_object = management_object
+      return holder
+    holder = ManagementObjectHolder(management_object, self, key)
+    self.identity_map[key] = holder
+    return holder
+
+  def register(self, holder: 'ManagementObjectHolder'):
+    """
+    Makes given holder canonical holder for its object, used when holder is replaced by instance of more concrete
+    class.
+    """
+    if self.identity_map is not None and holder.key:
+      self.identity_map[holder.key] = holder
+
   def cls_instance(self, class_name):
-    cls = ManagementClass(str(self.scope.Path) + ":" + class_name)
-    return ManagementObjectHolder(cls.CreateInstance(), self)
+    return ManagementObjectHolder(self.session.create_instance(class_name), self)
 
 
 class JobException(Exception):
@@ -177,49 +371,161 @@ class InvocationException(Exception):
 
 
 class PropertiesHolder(object):
-  def __init__(self, management_object):
-    self.management_object = management_object
+  def __init__(self, holder: 'ManagementObjectHolder'):
+    self.holder = holder
 
   def __getattribute__(self, key):
-    if key != 'management_object':
+    if key != 'holder':
       try:
-        return self.management_object.Properties[key].Value
-      except ManagementException as e:
+        return self.holder.get_property(key)
+      except WmiException:
         pass
     return super().__getattribute__(key)
 
   def __setattr__(self, key, value):
-    if key != 'management_object':
+    if key != 'holder':
       try:
-        self.management_object.Properties[key].Value = value
-      except ManagementException:
+        self.holder.management_object.set_property(key, value)
+      except WmiException:
         pass
       except AttributeError:
         pass
     super().__setattr__(key, value)
 
   def __getitem__(self, item):
-    return self.management_object.Properties[item].Value
+    return self.holder.get_property(item)
 
 
 class ManagementObjectHolder(object):
-  def __init__(self, management_object, scope_holder: ScopeHolder):
+  """
+  Wraps backend object(``WmiObject``). Holder can be created unbound, with object ``reference`` only, in that case
+  backend object is created on first use, and ``lazy_properties`` can be read before that with narrow query.
+  """
+
+  def __init__(self, management_object, scope_holder: ScopeHolder, key=None, reference=None,
+               lazy_properties: Iterable[str] = None):
     self.scope_holder = scope_holder
-    self.management_object = management_object
+    self._management_object = management_object
+    self._reference = reference
+    self._key = key
+    self._partial = None
+    self.lazy_properties = tuple(lazy_properties) if lazy_properties else ()
 
+  @property
+  def management_object(self):
+    if self._management_object is None:
+      self._management_object = self.scope_holder.session.get(self._reference)
+      self._partial = None
+    return self._management_object
+
+  @management_object.setter
+  def management_object(self, value):
+    self._management_object = value
+    self._partial = None
+
+  @property
+  def is_bound(self) -> bool:
+    return self._management_object is not None
+
+  def get_property(self, name):
+    """
+    Returns property value. For unbound holder prefetched or lazy properties are served without fetching whole
+    object.
+
+    :param name: property name
+    :return: property value
+    """
+    if self._management_object is None:
+      if self._partial is None and name in self.lazy_properties:
+        self.fetch(*self.lazy_properties)
+      if self._partial is not None and name in self._partial:
+        return self._partial[name]
+    return self.management_object.get_property(name)
+
+  def fetch(self, *property_names: str):
+    """
+    Fetches only given properties of unbound object with query by object key, e.g.
+    'SELECT ElementName FROM Msvm_VirtualEthernetSwitch WHERE CreationClassName = "..." AND Name = "..."'. Does nothing
+    if object is already bound.
+
+    :param property_names: properties to fetch
+    """
+    if self._management_object is not None or not property_names:
+      return
+    class_name, keys = parse_object_path(self._reference)
+    if not keys:
+      return
+    query = "SELECT %s FROM %s WHERE %s" % (
+      ", ".join(property_names), class_name, " AND ".join("%s = %s" % key for key in keys))
+    for man_object in self.scope_holder.query_objects(query):
+      partial = self._partial or {}
+      for property_name in property_names:
+        partial[property_name] = man_object.get_property(property_name)
+      self._partial = partial
+      return
+
+  @instrumented(RELOAD, lambda self: self.class_name)
   def reload(self):
-    self.management_object.Get()
+    self.management_object.reload()
+
+  @property
+  def object_path(self) -> str:
+    if self._management_object is None or self._reference is not None:
+      return self._reference
+    return self.management_object.path
+
+  def remember_path(self):
+    """
+    Stores object path and key as plain strings, so they can be read later from thread that does not own backend
+    object, e.g. to bind object to scope of other thread. Objects that are not stored in WMI yet have no path.
+    """
+    if self._reference is None:
+      path = self.management_object.path
+      if not path:
+        return
+      self._reference = str(path)
+    if self._key is None:
+      self._key = normalize_path(self._reference)
+
+  @property
+  def class_name(self) -> str:
+    if self._management_object is None:
+      return parse_object_path(self._reference)[0]
+    return self._management_object.class_name
+
+  @property
+  def key(self) -> str:
+    """
+    Normalized object path, used as object identity. Empty for objects that are not stored in WMI yet, e.g. created
+    with ``ScopeHolder.cls_instance``.
+    """
+    if self._key is None:
+      self._key = normalize_path(self.object_path)
+    return self._key
+
+  def __eq__(self, other):
+    if not isinstance(other, ManagementObjectHolder):
+      return NotImplemented
+    if self is other:
+      return True
+    return bool(self.key) and self.key == other.key
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    if result is NotImplemented:
+      return result
+    return not result
+
+  def __hash__(self):
+    return hash(self.key) if self.key else id(self)
 
   @property
   def properties(self):
-    return PropertiesHolder(self.management_object)
+    return PropertiesHolder(self)
 
   @property
   def properties_dict(self):
-    result = {}
-    for _property in self.management_object.Properties:
-      result[_property.Name] = _property.Value
-    return result
+    return self.management_object.properties()
 
   def traverse(self, traverse_path: Iterable[Node]) -> List[List['ManagementObjectHolder']]:
     """
@@ -243,84 +549,39 @@ class ManagementObjectHolder(object):
       raise Exception("Found more that one child for given path")
     return traverse_result[-1][-1]
 
+  @instrumented(INVOKE, lambda self, method_name, **kwargs: method_name)
   def invoke(self, method_name, **kwargs):
-    parameters = self.management_object.GetMethodParameters(method_name)
-    for parameter in parameters.Properties:
-      parameter_name = parameter.Name
-      parameter_type = CimTypeTransformer.target_class(parameter.Type)
-
-      if parameter_name not in kwargs:
-        raise ValueError("Parameter '%s' not provided" % parameter_name)
-
-      if parameter.IsArray:
-        if not isinstance(kwargs[parameter_name], collections.Iterable):
-          raise ValueError("Parameter '%s' must be iterable" % parameter_name)
-        array_items = [self._transform_object(item, parameter_type) for item in kwargs[parameter_name]]
-        if array_items:
-          parameter_value = Array[parameter_type](array_items)
-        else:
-          parameter_value = None
-      else:
-        parameter_value = self._transform_object(kwargs[parameter_name], parameter_type)
-
-      parameters.Properties[parameter_name].Value = parameter_value
-
-    invocation_result = self.management_object.InvokeMethod(method_name, parameters, None)
-    transformed_result = {}
-    for _property in invocation_result.Properties:
-      _property_type = CimTypeTransformer.target_class(_property.Type)
-      _property_value = None
-      if _property.Value is not None:
-        if _property.IsArray:
-          _property_value = [self._transform_object(item, _property_type) for item in _property.Value]
-        else:
-          _property_value = self._transform_object(_property.Value, _property_type)
-      transformed_result[_property.Name] = _property_value
-    return transformed_result
+    parameters = {name: self._unwrap_object(value) for name, value in kwargs.items()}
+    invocation_result = self.management_object.invoke(method_name, parameters)
+    return {name: self._wrap_result(value) for name, value in invocation_result.items()}
 
   def clone(self):
-    return ManagementObjectHolder(self.management_object.Clone(), self.scope_holder)
+    # clone is detached copy, it must not be equal to original object
+    return ManagementObjectHolder(self.management_object.clone(), self.scope_holder, '')
 
   def __str__(self):
     return str(self.management_object)
 
-  def _transform_object(self, obj, expected_type=None):
-    if obj is None:
-      return None
-
+  @classmethod
+  def _unwrap_object(cls, obj):
     if isinstance(obj, ManagementObjectHolder):
-      obj = obj.management_object
-
-    if isinstance(obj, ManagementObject):
-      if expected_type == String:
-        return String(obj.GetText(2))
-      if expected_type == ManagementObject:
-        return obj
-      raise ValueError("Object '%s' can not be transformed to '%s'" % (obj, expected_type))
-
-    if isinstance(obj, (String, str)):
-      if expected_type == ManagementObject:
-        return MOHTransformers.from_reference(obj, self)
-
-    if isinstance(obj, int):
-      if expected_type == int:
-        return obj
-
-    if isinstance(obj, bool):
-      if expected_type == bool:
-        return obj
-
-    if isinstance(obj, (str, String)):
-      if expected_type == String:
-        return String(obj)
-
-    raise Exception("Unknown object to transform: '%s'" % obj)
+      return obj.management_object
+    if isinstance(obj, (list, tuple)):
+      return [cls._unwrap_object(item) for item in obj]
+    return obj
+
+  def _wrap_result(self, value):
+    if isinstance(value, ObjectReference):
+      return MOHTransformers.from_reference(value, self)
+    if isinstance(value, list):
+      return [self._wrap_result(item) for item in value]
+    return value
 
   @staticmethod
   def _get_node_objects(parent_object: 'ManagementObjectHolder', node: 'Node'):
     results = []
     if node.relation_type == Relation.PROPERTY:
-      val = parent_object.management_object.Properties[node.path_args[0]].Value
+      val = parent_object.get_property(node.path_args[0])
       if node.property_type == Property.SINGLE:
         _result = node.property_transformer(val, parent_object)
         if node.selector:
@@ -340,9 +601,11 @@ class ManagementObjectHolder(object):
         raise Exception("Unknown property type")
       return results
     elif node.relation_type == Relation.RELATED:
-      for rel_object in parent_object.management_object.GetRelated(*node.path_args):
-        if not parent_object.management_object == rel_object:
-          _result = ManagementObjectHolder(rel_object, parent_object.scope_holder)
+      with measure(GET_RELATED, node.path_args[0] if node.path_args else None):
+        rel_objects = parent_object.management_object.get_related(*node.path_args)
+      for rel_object in rel_objects:
+        if normalize_path(rel_object.path) != parent_object.key:
+          _result = parent_object.scope_holder.wrap(rel_object)
           if node.selector:
             if node.selector(_result):
               results.append(_result)
@@ -350,9 +613,11 @@ class ManagementObjectHolder(object):
             results.append(_result)
       return results
     elif node.relation_type == Relation.RELATIONSHIP:
-      for rel_object in parent_object.management_object.GetRelationships(*node.path_args):
-        if not parent_object.management_object == rel_object:
-          _result = ManagementObjectHolder(rel_object, parent_object.scope_holder)
+      with measure(GET_RELATIONSHIPS, node.path_args[0] if node.path_args else None):
+        rel_objects = parent_object.management_object.get_relationships(*node.path_args)
+      for rel_object in rel_objects:
+        if normalize_path(rel_object.path) != parent_object.key:
+          _result = parent_object.scope_holder.wrap(rel_object)
           if node.selector:
             if node.selector(_result):
               results.append(_result)
@@ -378,11 +643,14 @@ class ManagementObjectHolder(object):
       return results
 
   @staticmethod
-  def _evaluate_invocation_result(result, codes_enum: RangedCodeEnum, ok_value, job_value):
+  def _evaluate_invocation_result(result, codes_enum: RangedCodeEnum, ok_value, job_value, wait_job=True):
     return_value = codes_enum.from_code(result['ReturnValue'])
     if return_value == job_value:
       from hvapi.clr.classes_wrappers import JobWrapper
-      JobWrapper.from_moh(result['Job']).wait()
+      job = JobWrapper.from_moh(result['Job'])
+      result['Job'] = job
+      if wait_job:
+        job.wait()
       return result
     if return_value != ok_value:
       raise InvocationException("Failed execute method with return value '%s'" % return_value.name)
@@ -390,6 +658,11 @@ class ManagementObjectHolder(object):
 
   @staticmethod
   def _create_cls_from_moh(cls, cls_name, moh):
-    if moh.management_object.ClassPath.ClassName not in cls_name:
+    if isinstance(moh, cls):
+      return moh
+    if moh.class_name not in cls_name:
       raise ValueError('Given ManagementObject is not %s' % cls_name)
-    return cls(moh.management_object, moh.scope_holder)
+    result = cls(moh._management_object, moh.scope_holder, moh._key, moh._reference, moh.lazy_properties)
+    result._partial = moh._partial
+    moh.scope_holder.register(result)
+    return result
@@ -4,9 +4,11 @@ from hvapi.clr.types import Msvm_ConcreteJob_JobState, VSMS_ModifyResourceSettin
   VSMS_ModifySystemSettings_ReturnCode, VSMS_AddResourceSettings_ReturnCode, \
   MIMS_GetVirtualHardDiskSettingData_ReturnCode
 from hvapi.clr.base import ManagementObjectHolder, JobException
+from hvapi.instrumentation import instrumented, JOB_WAIT
 
 
 class JobWrapper(ManagementObjectHolder):
+  @instrumented(JOB_WAIT)
   def wait(self):
     job_state = Msvm_ConcreteJob_JobState.from_code(self.properties['JobState'])
     while job_state not in [Msvm_ConcreteJob_JobState.Completed, Msvm_ConcreteJob_JobState.Terminated,
@@ -17,6 +19,21 @@ class JobWrapper(ManagementObjectHolder):
     if job_state != Msvm_ConcreteJob_JobState.Completed:
       raise JobException(self)
 
+  def poll(self) -> bool:
+    """
+    Reloads job once and checks its state.
+
+    :return: ``True`` if job is completed, ``False`` if it is still running
+    """
+    self.reload()
+    job_state = Msvm_ConcreteJob_JobState.from_code(self.properties['JobState'])
+    if job_state == Msvm_ConcreteJob_JobState.Completed:
+      return True
+    if job_state in (Msvm_ConcreteJob_JobState.Terminated, Msvm_ConcreteJob_JobState.Killed,
+                     Msvm_ConcreteJob_JobState.Exception):
+      raise JobException(self)
+    return False
+
   @classmethod
   def from_moh(cls, moh: 'ManagementObjectHolder') -> 'JobWrapper':
     return cls._create_cls_from_moh(cls, ('Msvm_ConcreteJob', 'Msvm_StorageJob'), moh)
@@ -0,0 +1,288 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import copy
+from typing import Iterable, List, Tuple, Dict, Any
+
+from hvapi.clr.base import Node, Relation, Property, ManagementObjectHolder
+
+# argument names of ManagementObject.GetRelated and ManagementObject.GetRelationships overloads
+GET_RELATED_ARGUMENTS = ("relatedClass", "relationshipClass", "relationshipQualifier", "relatedQualifier",
+                         "relatedRole", "thisRole", "classDefinitionsOnly", "options")
+GET_RELATIONSHIPS_ARGUMENTS = ("relationshipClass", "relationshipQualifier", "thisRole", "classDefinitionsOnly",
+                               "options")
+
+# WQL clauses of ASSOCIATORS OF and REFERENCES OF queries for method arguments
+_ASSOCIATORS_CLAUSES = {
+  "relatedClass": "ResultClass",
+  "relationshipClass": "AssocClass",
+  "relationshipQualifier": "RequiredAssocQualifier",
+  "relatedQualifier": "RequiredQualifier",
+  "relatedRole": "ResultRole",
+  "thisRole": "Role"
+}
+_REFERENCES_CLAUSES = {
+  "relationshipClass": "ResultClass",
+  "relationshipQualifier": "RequiredQualifier",
+  "thisRole": "Role"
+}
+
+
+def _describe(func) -> str:
+  if func is None:
+    return None
+  description = getattr(func, "description", None)
+  if description is not None:
+    return description
+  return getattr(func, "__qualname__", repr(func))
+
+
+class LevelStats(object):
+  """
+  What one traversal level did in real run.
+
+  :ivar parents: objects this level started from
+  :ivar candidates: objects returned by relation call or property, before selector
+  :ivar selected: objects that passed selector, fan-out of level is ``selected / parents``
+  :ivar relation_calls: GetRelated/GetRelationships calls
+  :ivar fetches: referenced objects of this level whose properties were read during traversal, by selector, by next
+                 property node or by partial fetch
+  :ivar deferred: referenced objects of this level that were not used yet, they will be fetched on first use
+  """
+
+  def __init__(self, parents=0):
+    self.parents = parents
+    self.candidates = 0
+    self.selected = 0
+    self.relation_calls = 0
+    self.fetches = 0
+    self.deferred = 0
+
+  @property
+  def fan_out(self) -> float:
+    return self.selected / self.parents if self.parents else 0.0
+
+  @property
+  def round_trips(self) -> int:
+    return self.relation_calls + self.fetches
+
+  def as_dict(self) -> Dict[str, Any]:
+    return {
+      "parents": self.parents,
+      "candidates": self.candidates,
+      "selected": self.selected,
+      "fan_out": self.fan_out,
+      "relation_calls": self.relation_calls,
+      "fetches": self.fetches,
+      "deferred": self.deferred,
+      "round_trips": self.round_trips
+    }
+
+
+class NodePlan(object):
+  """
+  How one ``Node`` is evaluated for every parent object.
+
+  :ivar relation_type: type of relation
+  :ivar method: WMI method that is called, ``None`` for property nodes, they read parent property
+  :ivar arguments: method arguments by name, or property name for property nodes
+  :ivar wql: equivalent WQL query that is executed by WMI for relation nodes
+  :ivar server_filters: conditions evaluated by WMI
+  :ivar python_filters: conditions evaluated in Python on every returned object
+  :ivar transformer: how property value is turned into objects, for property nodes
+  :ivar stats: ``LevelStats`` of real run, ``None`` if path was not executed
+  """
+
+  def __init__(self, index: int, node: Node, parent_path: str = None):
+    self.index = index
+    self.relation_type = node.relation_type
+    self.method = None
+    self.arguments = {}
+    self.wql = None
+    self.server_filters = []
+    self.python_filters = []
+    self.transformer = None
+    self.stats = None  # type: LevelStats
+
+    if node.relation_type in (Relation.RELATED, Relation.RELATIONSHIP):
+      if node.relation_type == Relation.RELATED:
+        self.method = "GetRelated"
+        names, clauses, statement = GET_RELATED_ARGUMENTS, _ASSOCIATORS_CLAUSES, "ASSOCIATORS OF"
+      else:
+        self.method = "GetRelationships"
+        names, clauses, statement = GET_RELATIONSHIPS_ARGUMENTS, _REFERENCES_CLAUSES, "REFERENCES OF"
+      self.arguments = {name: value for name, value in zip(names, node.path_args) if value is not None}
+      where = []
+      for name, value in self.arguments.items():
+        if name in clauses:
+          where.append("%s = %s" % (clauses[name], value))
+      if self.arguments.get("classDefinitionsOnly"):
+        where.append("ClassDefsOnly")
+      self.server_filters = where
+      self.wql = "%s {%s}%s" % (statement, parent_path or "<parent>", " WHERE " + " ".join(where) if where else "")
+      self.python_filters.append("exclude parent object")
+    else:
+      self.arguments = {"property": node.path_args[0]}
+      self.transformer = "%s %s" % (
+        "each item of" if node.property_type == Property.ARRAY else "value of",
+        "identity" if node.property_transformer.__qualname__.startswith("Node.") else
+        _describe(node.property_transformer))
+
+    if node.selector is not None:
+      self.python_filters.append(_describe(node.selector))
+
+  @property
+  def call(self) -> str:
+    """
+    Method call in C# notation, e.g. "GetRelated(relatedClass: 'Msvm_ShutdownComponent')".
+    """
+    if self.method is None:
+      return "property %s" % self.arguments["property"]
+    return "%s(%s)" % (self.method, ", ".join("%s: %r" % item for item in self.arguments.items()))
+
+  def __str__(self):
+    lines = ["#%d %s %s" % (self.index, self.relation_type.name, self.call)]
+    if self.wql:
+      lines.append("   wql:     %s" % self.wql)
+    if self.transformer:
+      lines.append("   objects: %s" % self.transformer)
+    lines.append("   server:  %s" % (", ".join(self.server_filters) or "-"))
+    lines.append("   python:  %s" % (", ".join(self.python_filters) or "-"))
+    if self.stats is not None:
+      lines.append("   run:     parents=%d candidates=%d selected=%d fan-out=%.2f round-trips=%d deferred=%d" % (
+        self.stats.parents, self.stats.candidates, self.stats.selected, self.stats.fan_out, self.stats.round_trips,
+        self.stats.deferred))
+    return "\n".join(lines)
+
+
+class TraversalPlan(object):
+  """
+  Result of ``explain``. For executed plans ``round_trips`` is number of WMI calls made by traversal, it can be used as
+  round trip budget in tests.
+  """
+
+  def __init__(self, root: str, nodes: List[NodePlan], results: List[List[ManagementObjectHolder]] = None):
+    self.root = root
+    self.nodes = nodes
+    self.results = results
+
+  @property
+  def executed(self) -> bool:
+    return self.results is not None
+
+  @property
+  def round_trips(self) -> int:
+    if not self.executed:
+      return None
+    return sum(node.stats.round_trips for node in self.nodes)
+
+  @property
+  def relation_calls_per_parent(self) -> int:
+    """
+    Static estimate, relation calls made for every chain of objects, without fan-out and reference fetches.
+    """
+    return sum(1 for node in self.nodes if node.method is not None)
+
+  def __str__(self):
+    lines = ["traversal from %s" % (self.root or "<root>")]
+    lines.extend(str(node) for node in self.nodes)
+    if self.executed:
+      lines.append("total: %d path(s), %d round trip(s)" % (len(self.results), self.round_trips))
+    return "\n".join(lines)
+
+
+class _ObservedNode(Node):
+  """
+  Copy of node that counts candidates and remembers objects created by property transformer.
+  """
+
+  def __init__(self, node: Node, stats: LevelStats, created: List[Tuple[ManagementObjectHolder, bool]]):
+    self.__dict__.update(copy.copy(node.__dict__))
+    transformer = node.property_transformer
+    selector = node.selector
+
+    def _transformer(value, parent):
+      result = transformer(value, parent)
+      if isinstance(result, ManagementObjectHolder):
+        created.append((result, _is_fetched(result)))
+      return result
+
+    def _selector(obj):
+      stats.candidates += 1
+      return selector(obj) if selector is not None else True
+
+    self.property_transformer = _transformer
+    self.selector = _selector
+
+
+def _is_fetched(holder: ManagementObjectHolder) -> bool:
+  return holder.is_bound or holder._partial is not None
+
+
+def explain(traverse_path: Iterable[Node], root: ManagementObjectHolder = None, execute=False) -> TraversalPlan:
+  """
+  Explains how given traversal path is evaluated: relation type of every node, WMI method and arguments it uses,
+  which filters are evaluated by WMI and which in Python. If ``execute`` is set, path is traversed from ``root``, same
+  way ``ManagementObjectHolder.traverse`` does, and every node gets ``LevelStats``: fan-out and round trips of level.
+
+  :param traverse_path: nodes
+  :param root: object traversal starts from, optional if path is not executed
+  :param execute: traverse path
+  :return: plan
+  """
+  traverse_path = list(traverse_path)
+  root_path = root.object_path if root is not None else None
+  nodes = [NodePlan(index, node, root_path if index == 0 else None) for index, node in enumerate(traverse_path)]
+  if not execute:
+    return TraversalPlan(root_path, nodes)
+  if root is None:
+    raise ValueError("root is required to execute traversal")
+
+  chains = [[root]]
+  created_by_level = []
+  for node, node_plan in zip(traverse_path, nodes):
+    stats = node_plan.stats = LevelStats(len(chains))
+    created = []
+    observed = _ObservedNode(node, stats, created)
+    next_chains = []
+    for chain in chains:
+      if node.relation_type != Relation.PROPERTY:
+        stats.relation_calls += 1
+      for obj in ManagementObjectHolder._get_node_objects(chain[-1], observed):
+        next_chains.append(chain + [obj])
+    stats.selected = len(next_chains)
+    created_by_level.append(created)
+    chains = next_chains
+
+  for index, (node, node_plan, created) in enumerate(zip(traverse_path, nodes, created_by_level)):
+    # relation call on object does not fetch it, reading its property does
+    properties_read = node.selector is not None or (
+      index + 1 < len(traverse_path) and traverse_path[index + 1].relation_type == Relation.PROPERTY)
+    for holder, fetched_at_creation in created:
+      if fetched_at_creation:
+        continue
+      if holder._partial is not None or (holder.is_bound and properties_read):
+        node_plan.stats.fetches += 1
+      elif not holder.is_bound:
+        node_plan.stats.deferred += 1
+  return TraversalPlan(root_path, nodes, [chain[1:] for chain in chains])
@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 from enum import Enum
 
 
@@ -7,7 +7,7 @@ class RangedCodeEnum(Enum):
   def from_code(cls, value):
     for enum_item in list(cls):
       enum_val = enum_item.value
-      if isinstance(enum_val, collections.Iterable):
+      if isinstance(enum_val, collections.abc.Iterable):
         if len(enum_val) == 1:
           if enum_val[0] == value:
             return enum_item
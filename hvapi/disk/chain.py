@@ -0,0 +1,402 @@
+"""
+Differencing disk chains. Parents are found through locators stored in children, validated by identifiers and shared
+between chains through parent cache, so thousands of children of one golden image parse it once.
+"""
+import array
+import collections
+import logging
+import os
+import threading
+from typing import List, Tuple, Optional
+
+from hvapi.disk.formats import open_image
+from hvapi.disk.image import DiskImage, DEFAULT_BAT_CACHE_PAGES, BLOCK_ABSENT, BLOCK_ZERO, BLOCK_PRESENT, \
+  BLOCK_PARTIAL
+from hvapi.disk.types import VHDChainError, VirtualStorageType
+
+# source map values that are not layer indexes
+SOURCE_ZERO = -1  # block reads as zeros
+SOURCE_MIXED = -2  # block is assembled from several layers by sector bitmaps
+
+_ZERO_BYTES = bytes(1024 * 1024)
+_ZEROS = memoryview(_ZERO_BYTES)
+
+# VHD timestamps count seconds from 2000-01-01 00:00:00 UTC
+VHD_EPOCH = 946684800
+
+
+def fill_zeros(view: memoryview):
+  """
+  Fills writable byte view with zeros without allocating buffer of its size.
+  """
+  for start in range(0, len(view), len(_ZEROS)):
+    chunk = min(len(_ZEROS), len(view) - start)
+    view[start:start + chunk] = _ZEROS[:chunk]
+
+
+def is_zero(view: memoryview) -> bool:
+  # bytes comparison uses memcmp, memoryview comparison goes element by element
+  for start in range(0, len(view), len(_ZERO_BYTES)):
+    chunk = min(len(_ZERO_BYTES), len(view) - start)
+    if view[start:start + chunk].tobytes() != (_ZERO_BYTES if chunk == len(_ZERO_BYTES) else bytes(chunk)):
+      return False
+  return True
+
+
+class ParentCache(object):
+  """
+  Thread safe cache of opened parent images, keyed by real path. Cached image is reopened if file was modified.
+  Images are reference counted, every ``open`` must be paired with ``release``, chains release their parents when
+  closed. Image replaced after modification is closed once its last user releases it, at most ``max_idle`` images
+  that are not in use are kept open, least recently used ones are closed first.
+
+  :param bat_cache_pages: number of decoded BAT pages to keep in memory for every image
+  :param max_idle: number of images kept open while not in use
+  """
+
+  def __init__(self, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES, max_idle=16):
+    self.bat_cache_pages = bat_cache_pages
+    self.max_idle = max_idle
+    self.hits = 0
+    self.misses = 0
+    self._images = collections.OrderedDict()  # real path to (version, image), least recently used first
+    self._references = {}  # id of image in use to [image, number of users]
+    self._lock = threading.Lock()
+
+  def open(self, path) -> DiskImage:
+    key = os.path.realpath(path)
+    stat = os.stat(key)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with self._lock:
+      cached = self._images.get(key)
+      if cached is not None and cached[0] == version:
+        self.hits += 1
+        self._images.move_to_end(key)
+        image = cached[1]
+      else:
+        self.misses += 1
+        image = open_image(key, self.bat_cache_pages)
+        if cached is not None:
+          del self._images[key]
+          # replaced image stays open while chains built before modification use it
+          self._close_unused(cached[1])
+        self._images[key] = (version, image)
+      self._references.setdefault(id(image), [image, 0])[1] += 1
+      self._evict()
+      return image
+
+  def release(self, image: DiskImage):
+    """
+    Releases image returned by ``open``.
+    """
+    with self._lock:
+      reference = self._references[id(image)]
+      reference[1] -= 1
+      if reference[1]:
+        return
+      del self._references[id(image)]
+      cached = self._images.get(os.path.realpath(image.path))
+      if cached is None or cached[1] is not image:
+        image.close()
+      else:
+        self._evict()
+
+  def __len__(self):
+    return len(self._images)
+
+  def clear(self):
+    """
+    Closes all images that are not in use, images in use are closed when released.
+    """
+    with self._lock:
+      for _, image in self._images.values():
+        self._close_unused(image)
+      self._images.clear()
+
+  def _close_unused(self, image):
+    if id(image) not in self._references:
+      image.close()
+
+  def _evict(self):
+    idle = [key for key, (_, image) in self._images.items() if id(image) not in self._references]
+    for key in idle[:max(0, len(idle) - self.max_idle)]:
+      _, image = self._images.pop(key)
+      image.close()
+
+
+# shared cache for callers that resolve many children of the same parents, used only when passed explicitly
+parent_cache = ParentCache()
+
+
+class DiskChain(object):
+  """
+  Differencing chain, from the disk itself to its base disk.
+
+  :param layers: images, child first
+  :param owned: number of first layers owned by chain and closed with it, other layers are released to ``cache``
+  :param cache: parent cache other layers were opened from
+  """
+
+  def __init__(self, layers: List[DiskImage], owned=1, cache: Optional[ParentCache] = None):
+    self.layers = layers
+    self.owned = owned
+    self.cache = cache
+    self.virtual_size = layers[0].virtual_size
+    # source map granularity, smallest block of all layers, so each unit belongs to one block of every layer
+    self.unit_size = min(layer.block_size for layer in layers)
+    self._source_map = None
+    self._lock = threading.Lock()
+
+  @property
+  def top(self) -> DiskImage:
+    return self.layers[0]
+
+  @property
+  def base(self) -> DiskImage:
+    return self.layers[-1]
+
+  @property
+  def unit_count(self) -> int:
+    return (self.virtual_size + self.unit_size - 1) // self.unit_size
+
+  @property
+  def source_map(self) -> array.array:
+    """
+    For each unit of ``unit_size`` bytes, index of layer that stores whole unit, ``SOURCE_ZERO`` for units that read
+    as zeros and ``SOURCE_MIXED`` for units assembled by sector bitmaps. Built on first use by sequential scan of BAT
+    of every layer.
+    """
+    if self._source_map is None:
+      with self._lock:
+        if self._source_map is None:
+          self._source_map = self._build_source_map()
+    return self._source_map
+
+  def _build_source_map(self) -> array.array:
+    unset = len(self.layers)
+    sources = array.array("h", [unset]) * self.unit_count
+    remaining = self.unit_count
+    for layer_index, layer in enumerate(self.layers):
+      if not remaining:
+        break
+      units_per_block = layer.block_size // self.unit_size
+      for index, kind, _ in layer.blocks():
+        if kind == BLOCK_ABSENT:
+          continue
+        source = layer_index if kind == BLOCK_PRESENT else SOURCE_MIXED if kind == BLOCK_PARTIAL else SOURCE_ZERO
+        for unit in range(index * units_per_block, min((index + 1) * units_per_block, self.unit_count)):
+          if sources[unit] == unset:
+            sources[unit] = source
+            remaining -= 1
+    for unit in range(self.unit_count):
+      if sources[unit] == unset:
+        sources[unit] = SOURCE_ZERO
+    return sources
+
+  def source_extents(self) -> List[Tuple[int, int, int]]:
+    """
+    Source map merged to extents.
+
+    :return: list of (offset, length, source)
+    """
+    extents = []
+    sources = self.source_map
+    start = 0
+    for unit in range(1, len(sources) + 1):
+      if unit == len(sources) or sources[unit] != sources[start]:
+        end = min(unit * self.unit_size, self.virtual_size)
+        extents.append((start * self.unit_size, end - start * self.unit_size, sources[start]))
+        start = unit
+    return extents
+
+  def locate(self, offset: int, layer_index=0) -> Tuple[int, int, int]:
+    """
+    Finds where virtual disk byte is stored, starting from given layer.
+
+    :return: (layer index or SOURCE_ZERO, file offset, number of following bytes stored the same way)
+    """
+    for index in range(layer_index, len(self.layers)):
+      layer = self.layers[index]
+      block_index, in_block = divmod(offset, layer.block_size)
+      if block_index >= layer.block_count:
+        break
+      kind, data_offset = layer.block(block_index)
+      block_length = min(layer.block_size, layer.virtual_size - block_index * layer.block_size)
+      if kind == BLOCK_PRESENT:
+        return index, data_offset + in_block, block_length - in_block
+      if kind == BLOCK_ZERO:
+        return SOURCE_ZERO, 0, block_length - in_block
+      if kind == BLOCK_PARTIAL:
+        for run_offset, run_length, present in layer.present_runs(block_index):
+          if run_offset <= in_block < run_offset + run_length:
+            if present:
+              return index, data_offset + in_block, run_offset + run_length - in_block
+            source, file_offset, length = self.locate(offset, index + 1)
+            return source, file_offset, min(length, run_offset + run_length - in_block)
+    return SOURCE_ZERO, 0, self.virtual_size - offset
+
+  def readinto_at(self, offset: int, buffer) -> int:
+    """
+    Reads virtual disk bytes at given offset into buffer. Reads go straight to the layer that owns data according to
+    source map, units that have no data read as zeros without touching any file. Safe to call from several threads.
+
+    :return: number of bytes read, less than buffer size only at the end of disk
+    """
+    view = memoryview(buffer).cast("B")
+    length = max(0, min(len(view), self.virtual_size - offset))
+    unit_size = self.unit_size
+    sources = self.source_map
+    done = 0
+    while done < length:
+      position = offset + done
+      unit, in_unit = divmod(position, unit_size)
+      source = sources[unit]
+      chunk = min(length - done, unit_size - in_unit)
+      if source == SOURCE_ZERO:
+        # runs of zero units are filled at once
+        while done + chunk < length and sources[unit + 1] == SOURCE_ZERO:
+          unit += 1
+          chunk = min(length - done, chunk + unit_size)
+        fill_zeros(view[done:done + chunk])
+      elif source == SOURCE_MIXED:
+        self._read_mixed(position, view[done:done + chunk])
+      else:
+        layer = self.layers[source]
+        _, data_offset = layer.block(position // layer.block_size)
+        layer.readinto_at(data_offset + position % layer.block_size, view[done:done + chunk])
+      done += chunk
+    return length
+
+  def _read_mixed(self, offset, view):
+    done = 0
+    while done < len(view):
+      source, file_offset, length = self.locate(offset + done)
+      length = min(length, len(view) - done)
+      if source == SOURCE_ZERO:
+        fill_zeros(view[done:done + length])
+      else:
+        self.layers[source].readinto_at(file_offset, view[done:done + length])
+      done += length
+
+  def close(self):
+    for layer in self.layers[:self.owned]:
+      layer.close()
+    for layer in self.layers[self.owned:]:
+      self.cache.release(layer)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def __repr__(self):
+    return "DiskChain(%s)" % " -> ".join(layer.path for layer in self.layers)
+
+
+class ChainResolver(object):
+  """
+  Builds chains by following parent locators. Every candidate parent location is checked, the first image which
+  identifier matches one stored in child is used.
+
+  :param cache: parent cache, parents are opened for every chain and closed with it if omitted
+  :param strict_timestamps: fail if VHD parent timestamp does not match instead of logging warning
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, cache: Optional[ParentCache] = None, strict_timestamps=False,
+               bat_cache_pages=DEFAULT_BAT_CACHE_PAGES):
+    self.cache = cache
+    self.strict_timestamps = strict_timestamps
+    self.bat_cache_pages = bat_cache_pages
+
+  def resolve(self, path) -> DiskChain:
+    """
+    Opens disk and all its parents.
+
+    :param path: path to disk
+    :return: DiskChain, must be closed by caller
+    """
+    top = open_image(path, self.bat_cache_pages)
+    try:
+      layers = self.resolve_parents(top)
+    except Exception:
+      top.close()
+      raise
+    if self.cache is None:
+      return DiskChain(layers, owned=len(layers))
+    return DiskChain(layers, cache=self.cache)
+
+  def resolve_parents(self, image: DiskImage) -> List[DiskImage]:
+    """
+    Opens all parents of image, they must be released with ``release`` by caller.
+
+    :return: given image followed by its parents
+    """
+    layers = [image]
+    seen = {os.path.realpath(image.path)}
+    try:
+      while image.has_parent:
+        parent = self.find_parent(image)
+        layers.append(parent)
+        real_path = os.path.realpath(parent.path)
+        if real_path in seen:
+          raise VHDChainError("Differencing chain of '%s' has loop at '%s'" % (layers[0].path, parent.path))
+        seen.add(real_path)
+        image = parent
+    except Exception:
+      self.release(layers[1:])
+      raise
+    return layers
+
+  def release(self, parents: List[DiskImage]):
+    """
+    Releases parents opened by ``resolve_parents`` or ``find_parent``.
+    """
+    for parent in parents:
+      if self.cache is None:
+        parent.close()
+      else:
+        self.cache.release(parent)
+
+  def find_parent(self, image: DiskImage) -> DiskImage:
+    rejected = []
+    for location in image.parent_locations():
+      if not os.path.isfile(location):
+        continue
+      candidate = self.cache.open(location) if self.cache is not None else open_image(location, self.bat_cache_pages)
+      if candidate.linkage_id not in image.parent_ids:
+        rejected.append("%s(id %s)" % (location, candidate.linkage_id))
+        self.release((candidate,))
+        continue
+      try:
+        self._check_timestamp(image, candidate)
+      except Exception:
+        self.release((candidate,))
+        raise
+      if candidate.virtual_size < image.virtual_size:
+        self.LOG.debug("Parent '%s' is smaller than child '%s', missing part reads as zeros", candidate.path,
+                       image.path)
+      return candidate
+    if rejected:
+      raise VHDChainError("Parent of '%s' expected with id %s, found only %s" % (
+        image.path, " or ".join(str(parent_id) for parent_id in image.parent_ids), ", ".join(rejected)))
+    raise VHDChainError("Parent of '%s' was not found, tried: %s" % (image.path, ", ".join(image.parent_locations())))
+
+  def _check_timestamp(self, image: DiskImage, parent: DiskImage):
+    if image.storage_type != VirtualStorageType.VHD or not image.parent_timestamp:
+      return
+    # writers store either footer timestamp or file modification time of parent
+    modified = int(os.stat(parent.path).st_mtime) - VHD_EPOCH
+    if image.parent_timestamp in (parent.timestamp, modified):
+      return
+    message = "Parent timestamp %d of '%s' does not match '%s'(%d)" % (
+      image.parent_timestamp, image.path, parent.path, parent.timestamp)
+    if self.strict_timestamps:
+      raise VHDChainError(message)
+    self.LOG.warning(message)
+
+
+def resolve_chain(path, cache: Optional[ParentCache] = None, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES) -> DiskChain:
+  return ChainResolver(cache, bat_cache_pages=bat_cache_pages).resolve(path)
+
@@ -0,0 +1,94 @@
+"""
+CRC-32C(Castagnoli) used by VHDX headers and region tables. Accelerated 'crc32c' or 'google-crc32c' package is used
+if installed, otherwise pure Python implementation, which processes trailing zero bytes(VHDX structures are mostly
+zero padding) with precomputed GF(2) operators instead of byte loop.
+"""
+
+_POLYNOMIAL = 0x82F63B78
+
+_TABLE = []
+for _byte in range(256):
+  _crc = _byte
+  for _ in range(8):
+    _crc = (_crc >> 1) ^ _POLYNOMIAL if _crc & 1 else _crc >> 1
+  _TABLE.append(_crc)
+del _byte, _crc
+
+
+def _matrix_times(matrix, vector):
+  result = 0
+  index = 0
+  while vector:
+    if vector & 1:
+      result ^= matrix[index]
+    vector >>= 1
+    index += 1
+  return result
+
+
+def _matrix_square(matrix):
+  return [_matrix_times(matrix, column) for column in matrix]
+
+
+def _zero_operators(count=40):
+  # operator[k] advances raw CRC register over 2**k zero bytes
+  # register bit 'bit' after one zero byte: table[reg & 0xFF] ^ (reg >> 8)
+  one_byte = [(_TABLE[(1 << bit) & 0xFF] ^ ((1 << bit) >> 8)) for bit in range(32)]
+  operators = [one_byte]
+  for _ in range(count - 1):
+    operators.append(_matrix_square(operators[-1]))
+  return operators
+
+
+_ZERO_OPERATORS = _zero_operators()
+
+
+def _extend_zeros(register, count):
+  index = 0
+  while count:
+    if count & 1:
+      register = _matrix_times(_ZERO_OPERATORS[index], register)
+    count >>= 1
+    index += 1
+  return register
+
+
+def _python_crc32c(data, crc=0) -> int:
+  data = bytes(data)
+  stripped = data.rstrip(b"\0")
+  register = crc ^ 0xFFFFFFFF
+  table = _TABLE
+  for byte in stripped:
+    register = table[(register ^ byte) & 0xFF] ^ (register >> 8)
+  register = _extend_zeros(register, len(data) - len(stripped))
+  return register ^ 0xFFFFFFFF
+
+
+try:
+  import crc32c as _crc32c_module
+
+
+  def crc32c(data, crc=0) -> int:
+    """
+    Returns CRC-32C of data, ``crc`` is CRC of preceding data.
+    """
+    return _crc32c_module.crc32c(bytes(data), crc)
+
+
+  IMPLEMENTATION = "crc32c"
+except ImportError:
+  try:
+    import google_crc32c as _crc32c_module
+
+
+    def crc32c(data, crc=0) -> int:
+      """
+      Returns CRC-32C of data, ``crc`` is CRC of preceding data.
+      """
+      return _crc32c_module.extend(crc, bytes(data))
+
+
+    IMPLEMENTATION = "google-crc32c"
+  except ImportError:
+    crc32c = _python_crc32c
+    IMPLEMENTATION = "python"
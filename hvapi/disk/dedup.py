@@ -0,0 +1,319 @@
+"""
+Content hash index of blocks of image library. Allocated data of every image is hashed in fixed size chunks by several
+threads, records are stored sorted by digest in compact table of fixed width records, which is mapped with mmap, so
+lookups and library wide queries do not load whole index into memory.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Iterator, Optional, Callable
+
+from hvapi.disk.chain import is_zero
+from hvapi.disk.export import DEFAULT_EXPORT_WORKERS
+from hvapi.disk.formats import open_image
+from hvapi.disk.image import BLOCK_PRESENT, BLOCK_PARTIAL
+from hvapi.disk.types import VHDException, VHDFormatError
+
+DEFAULT_INDEX_CHUNK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+DIGEST_ALGORITHM = "blake2b" if hasattr(hashlib, "blake2b") else "sha256"
+
+INDEX_MAGIC = b"HVDEDUP1"
+INDEX_HEADER_FORMAT = struct.Struct("<8sIIQQQ")
+# digest, image number, chunk number
+RECORD_FORMAT = struct.Struct("<%dsII" % DIGEST_SIZE)
+
+
+def chunk_digest(data) -> bytes:
+  if DIGEST_ALGORITHM == "blake2b":
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+  return hashlib.new(DIGEST_ALGORITHM, data).digest()[:DIGEST_SIZE]
+
+
+class IndexedImage(object):
+  """
+  Image entry of index.
+
+  :ivar path: image path
+  :ivar virtual_size: virtual size of image
+  :ivar chunks: number of hashed chunks, allocated in image file and not zero
+  :ivar zero_chunks: allocated chunks that contain only zeros, they are not indexed
+  """
+
+  def __init__(self, path, virtual_size=0, chunks=0, zero_chunks=0):
+    self.path = path
+    self.virtual_size = virtual_size
+    self.chunks = chunks
+    self.zero_chunks = zero_chunks
+
+  def to_dict(self):
+    return {"path": self.path, "virtual_size": self.virtual_size, "chunks": self.chunks,
+            "zero_chunks": self.zero_chunks}
+
+  def __repr__(self):
+    return "IndexedImage(%r, chunks=%d)" % (self.path, self.chunks)
+
+
+class BlockIndexBuilder(object):
+  """
+  Hashes allocated chunks of images and writes index. Only data stored in each image file is hashed, data of parents
+  belongs to parents, so parents should be added too.
+
+  :param chunk_size: size of hashed chunk, divides block sizes of images, 1MB by default
+  :param workers: number of hashing threads
+  :param progress: called with (hashed blocks, all blocks of image) for each image, from worker threads
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, chunk_size=DEFAULT_INDEX_CHUNK_SIZE, workers=DEFAULT_EXPORT_WORKERS,
+               progress: Optional[Callable[[int, int], None]] = None):
+    self.chunk_size = chunk_size
+    self.workers = max(1, workers)
+    self.progress = progress
+    self.images = []  # type: List[IndexedImage]
+    self._records = []  # type: List[bytes]
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def add(self, path) -> IndexedImage:
+    """
+    Hashes allocated chunks of image.
+    """
+    started = time.perf_counter()
+    number = len(self.images)
+    if any(image.path == os.path.abspath(getattr(path, "disk_path", path)) for image in self.images):
+      raise VHDException("Image '%s' is already indexed" % getattr(path, "disk_path", path))
+    with open_image(getattr(path, "disk_path", path)) as image:
+      if image.block_size % self.chunk_size:
+        raise VHDFormatError("Block size %d of '%s' is not multiple of chunk size %d" % (
+          image.block_size, image.path, self.chunk_size))
+      entry = IndexedImage(image.path, image.virtual_size)
+      blocks = list(image.allocated_blocks())
+      done = [0]
+
+      def hash_block(block):
+        records, zero = self._hash_block(image, number, block)
+        with self._lock:
+          self._records.extend(records)
+          entry.chunks += len(records)
+          entry.zero_chunks += zero
+          done[0] += 1
+          hashed = done[0]
+        if self.progress is not None:
+          self.progress(hashed, len(blocks))
+
+      with ThreadPoolExecutor(self.workers) as executor:
+        for future in [executor.submit(hash_block, block) for block in blocks]:
+          future.result()
+    self.images.append(entry)
+    self.LOG.debug("Indexed %d chunks of '%s' in %.3fs", entry.chunks, entry.path, time.perf_counter() - started)
+    return entry
+
+  def _hash_block(self, image, number, block) -> Tuple[List[bytes], int]:
+    index, kind, data_offset = block
+    buffer = getattr(self._local, "buffer", None)
+    if buffer is None:
+      buffer = self._local.buffer = bytearray(self.chunk_size)
+    block_length = min(image.block_size, image.virtual_size - index * image.block_size)
+    if kind == BLOCK_PRESENT:
+      present = [(0, block_length, True)]
+    else:
+      present = image.present_runs(index)
+    records = []
+    zero = 0
+    first_chunk = index * image.block_size // self.chunk_size
+    for run_offset, run_length, run_present in present:
+      if not run_present:
+        continue
+      # only chunks stored whole in this file are indexed, the last chunk of disk may be shorter than chunk size
+      start = (run_offset + self.chunk_size - 1) // self.chunk_size * self.chunk_size
+      while min(start + self.chunk_size, block_length) <= run_offset + run_length and start < block_length:
+        length = min(self.chunk_size, block_length - start)
+        view = memoryview(buffer)[:length]
+        image.readinto_at(data_offset + start, view)
+        if is_zero(view):
+          zero += 1
+        else:
+          records.append(RECORD_FORMAT.pack(chunk_digest(view), number, first_chunk + start // self.chunk_size))
+        start += self.chunk_size
+    return records, zero
+
+  def write(self, path) -> 'BlockIndex':
+    """
+    Writes index sorted by digest and opens it.
+    """
+    self._records.sort()
+    images = json.dumps({"digest": DIGEST_ALGORITHM, "images": [image.to_dict() for image in self.images]})
+    with open(path, "wb") as f:
+      f.write(INDEX_HEADER_FORMAT.pack(INDEX_MAGIC, DIGEST_SIZE, self.chunk_size, len(self.images),
+                                       len(self._records), INDEX_HEADER_FORMAT.size))
+      for record in self._records:
+        f.write(record)
+      f.write(images.encode("utf-8"))
+    return BlockIndex(path)
+
+
+class BlockIndex(object):
+  """
+  Index written by ``BlockIndexBuilder``, records are read through mmap.
+
+  :param path: index path
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._file = open(path, "rb")
+    self._map = None
+    try:
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, digest_size, self.chunk_size, image_count, self.record_count, self._records_offset = \
+        INDEX_HEADER_FORMAT.unpack_from(self._map)
+      if magic != INDEX_MAGIC or digest_size != DIGEST_SIZE:
+        raise VHDFormatError("File '%s' is not block index" % path)
+      tail = self._records_offset + self.record_count * RECORD_FORMAT.size
+      metadata = json.loads(self._map[tail:].decode("utf-8"))
+      if metadata["digest"] != DIGEST_ALGORITHM:
+        raise VHDFormatError("Index '%s' uses %s digests, %s is available" % (
+          path, metadata["digest"], DIGEST_ALGORITHM))
+      self.images = [IndexedImage(**image) for image in metadata["images"]]
+    except Exception:
+      self.close()
+      raise
+    self._numbers = {image.path: number for number, image in enumerate(self.images)}
+
+  def record(self, position: int) -> Tuple[bytes, int, int]:
+    return RECORD_FORMAT.unpack_from(self._map, self._records_offset + position * RECORD_FORMAT.size)
+
+  def records(self) -> Iterator[Tuple[bytes, int, int]]:
+    tail = self._records_offset + self.record_count * RECORD_FORMAT.size
+    return RECORD_FORMAT.iter_unpack(self._map[self._records_offset:tail])
+
+  def _digest_at(self, position: int) -> bytes:
+    offset = self._records_offset + position * RECORD_FORMAT.size
+    return self._map[offset:offset + DIGEST_SIZE]
+
+  def find(self, digest: bytes) -> List[Tuple[str, int]]:
+    """
+    Returns all chunks with given digest.
+
+    :return: list of (image path, chunk offset in virtual disk)
+    """
+    low, high = 0, self.record_count
+    while low < high:
+      middle = (low + high) // 2
+      if self._digest_at(middle) < digest:
+        low = middle + 1
+      else:
+        high = middle
+    result = []
+    while low < self.record_count and self._digest_at(low) == digest:
+      _, number, chunk = self.record(low)
+      result.append((self.images[number].path, chunk * self.chunk_size))
+      low += 1
+    return result
+
+  def images_sharing(self, path, offset: int) -> List[Tuple[str, int]]:
+    """
+    Answers which images store the same data as chunk of image at given virtual offset. Chunk is read from image.
+
+    :return: list of (image path, chunk offset), without the chunk itself
+    """
+    path = getattr(path, "disk_path", path)
+    with open_image(path) as image:
+      chunk_offset = offset // self.chunk_size * self.chunk_size
+      index, in_block = divmod(chunk_offset, image.block_size)
+      kind, data_offset = image.block(index)
+      if kind not in (BLOCK_PRESENT, BLOCK_PARTIAL):
+        return []
+      length = min(self.chunk_size, image.virtual_size - chunk_offset)
+      # like ``_hash_block``, only chunks stored whole in this file have data of their own
+      if kind == BLOCK_PARTIAL and not any(
+          present and run_offset <= in_block and in_block + length <= run_offset + run_length
+          for run_offset, run_length, present in image.present_runs(index)):
+        return []
+      data = image.read_at(data_offset + in_block, length)
+      source = image.path
+    return [(other, other_offset) for other, other_offset in self.find(chunk_digest(data))
+            if (other, other_offset) != (source, chunk_offset)]
+
+  def _groups(self) -> Iterator[List[Tuple[int, int]]]:
+    group = []
+    previous = None
+    for digest, number, chunk in self.records():
+      if digest != previous and group:
+        yield group
+        group = []
+      previous = digest
+      group.append((number, chunk))
+    if group:
+      yield group
+
+  def rebase_savings(self, path) -> Dict[str, int]:
+    """
+    Answers how much data of image would not have to be stored if it was rebased onto each other image as differencing
+    disk: size of chunks identical to chunks of candidate parent at the same offsets. Zero chunks are not counted.
+
+    :return: saved bytes by candidate parent path, best candidates first
+    """
+    path = os.path.abspath(getattr(path, "disk_path", path))
+    if path not in self._numbers:
+      raise VHDException("Image '%s' is not in index '%s'" % (path, self.path))
+    number = self._numbers[path]
+    savings = {}
+    for group in self._groups():
+      chunks = {chunk for group_number, chunk in group if group_number == number}
+      if not chunks:
+        continue
+      for other, chunk in {(other, chunk) for other, chunk in group if other != number and chunk in chunks}:
+        savings[other] = savings.get(other, 0) + self.chunk_size
+    return {self.images[other].path: saved for other, saved in
+            sorted(savings.items(), key=lambda item: item[1], reverse=True)}
+
+  def stats(self) -> Dict[str, int]:
+    """
+    Library wide totals: indexed bytes, bytes of unique chunks and bytes that deduplication would save.
+    """
+    unique = sum(1 for _ in self._groups())
+    return {
+      "images": len(self.images),
+      "indexed_bytes": self.record_count * self.chunk_size,
+      "unique_bytes": unique * self.chunk_size,
+      "duplicate_bytes": (self.record_count - unique) * self.chunk_size,
+      "zero_bytes": sum(image.zero_chunks for image in self.images) * self.chunk_size
+    }
+
+  def close(self):
+    if self._map is not None:
+      self._map.close()
+      self._map = None
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+
+def build_index(images, dest, chunk_size=DEFAULT_INDEX_CHUNK_SIZE, workers=DEFAULT_EXPORT_WORKERS) -> BlockIndex:
+  """
+  Builds block index of image library.
+
+  :param images: paths or VHDDisks of images
+  :param dest: path of index file
+  :param chunk_size: size of hashed chunk
+  :param workers: number of hashing threads
+  :return: opened BlockIndex
+  """
+  builder = BlockIndexBuilder(chunk_size, workers)
+  for image in images:
+    builder.add(image)
+  return builder.write(dest)
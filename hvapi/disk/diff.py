@@ -0,0 +1,296 @@
+"""
+Changed block diff between two virtual disks. Units stored at the same place of the same file(shared parents) or
+reading as zeros in both disks are skipped by BAT alone, only remaining units are read and compared in chunks, with
+numpy if it is installed.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Callable
+
+from hvapi.disk.chain import DiskChain, ChainResolver, ParentCache, SOURCE_ZERO, SOURCE_MIXED, is_zero
+from hvapi.disk.export import DEFAULT_EXPORT_WORKERS
+from hvapi.disk.types import VHDException, VHDFormatError
+from hvapi.disk.vhdx_writer import VHDXUpdater, create_vhdx
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+DEFAULT_DIFF_CHUNK_SIZE = 64 * 1024
+
+_DIFF_MAGIC = b"HVDIFF1\0"
+_DIFF_HEADER_FORMAT = struct.Struct("<8sQQ")
+_EXTENT_FORMAT = struct.Struct("<QQ")
+
+
+def changed_chunks(old: memoryview, new: memoryview, chunk_size: int) -> List[int]:
+  """
+  Returns indexes of chunks that differ between two buffers of the same length.
+  """
+  length = len(new)
+  if numpy is not None and not length % 8 and not chunk_size % 8:
+    different = numpy.frombuffer(old, dtype=numpy.uint64) != numpy.frombuffer(new, dtype=numpy.uint64)
+    words = chunk_size // 8
+    return numpy.flatnonzero(numpy.logical_or.reduceat(different, numpy.arange(0, len(different), words))).tolist()
+  # bytes comparison uses memcmp, so chunks are compared only if buffers differ at all
+  if old.tobytes() == new.tobytes():
+    return []
+  return [index for index, start in enumerate(range(0, length, chunk_size))
+          if old[start:start + chunk_size].tobytes() != new[start:start + chunk_size].tobytes()]
+
+
+def merge_extents(extents: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+  result = []
+  for offset, length in sorted(extents):
+    if result and result[-1][0] + result[-1][1] == offset:
+      result[-1] = (result[-1][0], result[-1][1] + length)
+    else:
+      result.append((offset, length))
+  return result
+
+
+class DiffResult(object):
+  """
+  Changed extents of new disk relative to old one.
+
+  :ivar virtual_size: size of new disk
+  :ivar extents: sorted and merged list of (offset, length) that differ
+  :ivar units: number of compared units
+  :ivar skipped_units: units proven equal by BAT without reading
+  :ivar read_bytes: bytes read from both disks to compare content
+  :ivar seconds: wall time of diff
+  """
+
+  def __init__(self, virtual_size, extents, units=0, skipped_units=0, read_bytes=0, seconds=0.0):
+    self.virtual_size = virtual_size
+    self.extents = extents
+    self.units = units
+    self.skipped_units = skipped_units
+    self.read_bytes = read_bytes
+    self.seconds = seconds
+
+  @property
+  def changed_bytes(self) -> int:
+    return sum(length for _, length in self.extents)
+
+  def save(self, path):
+    """
+    Saves extents in compact binary form: header and pairs of little endian 64 bit offset and length.
+    """
+    with open(path, "wb") as f:
+      f.write(_DIFF_HEADER_FORMAT.pack(_DIFF_MAGIC, self.virtual_size, len(self.extents)))
+      for offset, length in self.extents:
+        f.write(_EXTENT_FORMAT.pack(offset, length))
+
+  @classmethod
+  def load(cls, path) -> 'DiffResult':
+    with open(path, "rb") as f:
+      data = f.read()
+    magic, virtual_size, count = _DIFF_HEADER_FORMAT.unpack_from(data)
+    if magic != _DIFF_MAGIC or len(data) != _DIFF_HEADER_FORMAT.size + count * _EXTENT_FORMAT.size:
+      raise VHDFormatError("File '%s' is not diff extent list" % path)
+    extents = [_EXTENT_FORMAT.unpack_from(data, _DIFF_HEADER_FORMAT.size + index * _EXTENT_FORMAT.size)
+               for index in range(count)]
+    return cls(virtual_size, extents)
+
+  def __repr__(self):
+    return "DiffResult(%d extents, %d changed bytes, %d of %d units skipped by BAT)" % (
+      len(self.extents), self.changed_bytes, self.skipped_units, self.units)
+
+
+class ChainDiff(object):
+  """
+  Computes changed extents of ``new`` chain relative to ``old`` chain.
+
+  :param old: chain of old disk
+  :param new: chain of new disk
+  :param chunk_size: granularity of changed extents, multiple of sector size
+  :param workers: number of comparing threads
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, old: DiskChain, new: DiskChain, chunk_size=DEFAULT_DIFF_CHUNK_SIZE,
+               workers=DEFAULT_EXPORT_WORKERS):
+    self.old = old
+    self.new = new
+    self.unit_size = min(old.unit_size, new.unit_size)
+    self.chunk_size = min(chunk_size, self.unit_size)
+    self.workers = max(1, workers)
+    self._read = 0
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  @staticmethod
+  def _location(chain: DiskChain, offset: int):
+    """
+    Returns where unit starting at offset is stored: 0 for zeros, (path, file offset) for data of one layer, None if
+    unit is assembled from several layers and must be compared by content.
+    """
+    if offset >= chain.virtual_size:
+      return 0
+    source = chain.source_map[offset // chain.unit_size]
+    if source == SOURCE_ZERO:
+      return 0
+    if source == SOURCE_MIXED:
+      return None
+    layer = chain.layers[source]
+    _, data_offset = layer.block(offset // layer.block_size)
+    return layer.path, data_offset + offset % layer.block_size
+
+  def run(self) -> DiffResult:
+    started = time.perf_counter()
+    units = (self.new.virtual_size + self.unit_size - 1) // self.unit_size
+    candidates = []
+    for unit in range(units):
+      offset = unit * self.unit_size
+      old_location = self._location(self.old, offset)
+      if old_location is None or old_location != self._location(self.new, offset):
+        candidates.append(offset)
+    extents = []
+    with ThreadPoolExecutor(self.workers) as executor:
+      for future in [executor.submit(self._compare, offset) for offset in candidates]:
+        extents.extend(future.result())
+    result = DiffResult(self.new.virtual_size, merge_extents(extents), units, units - len(candidates), self._read,
+                        time.perf_counter() - started)
+    self.LOG.debug("Diff of '%s' and '%s': %s", self.old.top.path, self.new.top.path, result)
+    return result
+
+  def _buffers(self):
+    buffers = getattr(self._local, "buffers", None)
+    if buffers is None:
+      buffers = self._local.buffers = (bytearray(self.unit_size), bytearray(self.unit_size))
+    return buffers
+
+  def _compare(self, offset) -> List[Tuple[int, int]]:
+    old_buffer, new_buffer = self._buffers()
+    length = min(self.unit_size, self.new.virtual_size - offset)
+    old_view = memoryview(old_buffer)[:length]
+    new_view = memoryview(new_buffer)[:length]
+    read = self.old.readinto_at(offset, old_view)
+    if read < length:
+      # new disk is larger, missing part of old disk is zeros
+      old_view[read:] = bytes(length - read)
+    self.new.readinto_at(offset, new_view)
+    with self._lock:
+      self._read += read + length
+    return [(offset + index * self.chunk_size, min(self.chunk_size, length - index * self.chunk_size))
+            for index in changed_chunks(old_view, new_view, self.chunk_size)]
+
+
+def _disk_path(disk) -> str:
+  return getattr(disk, "disk_path", disk)
+
+
+def vhd_diff(old, new, chunk_size=DEFAULT_DIFF_CHUNK_SIZE, workers=DEFAULT_EXPORT_WORKERS) -> DiffResult:
+  """
+  Computes extents of ``new`` disk that differ from ``old`` disk. Works for unrelated disks and for disks sharing
+  parents, data of shared parents is never read.
+
+  :param old: path or VHDDisk of old disk
+  :param new: path or VHDDisk of new disk
+  :param chunk_size: granularity of changed extents
+  :param workers: number of comparing threads
+  :return: DiffResult
+  """
+  # parents shared by both disks are opened once
+  cache = ParentCache()
+  resolver = ChainResolver(cache)
+  try:
+    with resolver.resolve(_disk_path(old)) as old_chain, resolver.resolve(_disk_path(new)) as new_chain:
+      return ChainDiff(old_chain, new_chain, chunk_size, workers).run()
+  finally:
+    cache.clear()
+
+
+class DiffWriter(object):
+  """
+  Writes changed extents of disk chain to new differencing VHDX. Blocks changed as a whole are stored as full blocks,
+  or as zero blocks if they contain only zeros, blocks changed partly are stored as partial blocks, other sectors come
+  from parent.
+
+  :param chain: chain extents are read from
+  :param updater: updater of new differencing disk
+  :param extents: changed extents
+  :param workers: number of writing threads
+  :param progress: called with (written blocks, all blocks) after each block, from worker threads
+  """
+
+  def __init__(self, chain: DiskChain, updater: VHDXUpdater, extents: List[Tuple[int, int]],
+               workers=DEFAULT_EXPORT_WORKERS, progress: Optional[Callable[[int, int], None]] = None):
+    self.chain = chain
+    self.updater = updater
+    self.workers = max(1, workers)
+    self.progress = progress
+    self.blocks = {}
+    block_size = updater.block_size
+    for offset, length in extents:
+      end = offset + length
+      while offset < end:
+        index, in_block = divmod(offset, block_size)
+        run = min(end - offset, block_size - in_block)
+        self.blocks.setdefault(index, []).append((in_block, run))
+        offset += run
+    self._written = 0
+    self._lock = threading.Lock()
+
+  def run(self):
+    with ThreadPoolExecutor(self.workers) as executor:
+      for future in [executor.submit(self._write, index) for index in sorted(self.blocks)]:
+        future.result()
+    self.updater.commit()
+
+  def _write(self, index):
+    block_size = self.updater.block_size
+    runs = self.blocks[index]
+    block_length = min(block_size, self.chain.virtual_size - index * block_size)
+    view = memoryview(bytearray(block_length))
+    if runs == [(0, block_length)]:
+      self.chain.readinto_at(index * block_size, view)
+      if is_zero(view):
+        self.updater.zero_block(index)
+      else:
+        self.updater.write_block(index, view)
+    else:
+      for run_offset, run_length in runs:
+        self.chain.readinto_at(index * block_size + run_offset, view[run_offset:run_offset + run_length])
+      self.updater.write_partial_block(index, [(run_offset, view[run_offset:run_offset + run_length])
+                                               for run_offset, run_length in runs])
+    with self._lock:
+      self._written += 1
+      written = self._written
+    if self.progress is not None:
+      self.progress(written, len(self.blocks))
+
+
+def write_diff(diff: DiffResult, new, dest, base, workers=DEFAULT_EXPORT_WORKERS,
+               progress: Optional[Callable[[int, int], None]] = None) -> str:
+  """
+  Writes changed extents of ``new`` disk as differencing VHDX of ``base``, so it reads the same as ``new``.
+
+  :param diff: diff of new disk relative to base
+  :param new: path or VHDDisk of disk extents are read from
+  :param dest: path of new differencing disk, must not exist
+  :param base: path or VHDDisk of parent, must be VHDX of the same virtual size
+  :param workers: number of writing threads
+  :param progress: called with (written blocks, all blocks)
+  :return: path of created disk
+  """
+  with ChainResolver().resolve(_disk_path(new)) as chain:
+    if chain.virtual_size != diff.virtual_size:
+      raise VHDException("Diff was computed for disk of %d bytes, not %d" % (diff.virtual_size, chain.virtual_size))
+    create_vhdx(dest, parent_path=_disk_path(base))
+    try:
+      with VHDXUpdater(dest) as updater:
+        if updater.image.virtual_size != chain.virtual_size:
+          raise VHDException("Base has virtual size %d, diffed disk %d" % (updater.image.virtual_size,
+                                                                            chain.virtual_size))
+        DiffWriter(chain, updater, diff.extents, workers, progress).run()
+    except Exception:
+      os.remove(dest)
+      raise
+  return dest
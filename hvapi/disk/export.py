@@ -0,0 +1,182 @@
+"""
+Export of virtual disks to raw images. Only allocated data is copied, by several threads at once, regions without data
+are left as holes of sparse destination file.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, List, Tuple
+
+from hvapi.disk.chain import DiskChain, SOURCE_ZERO, SOURCE_MIXED, is_zero
+
+DEFAULT_EXPORT_WORKERS = 4
+# largest piece of data copied by one task
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ExportResult(object):
+  """
+  Statistics of finished export.
+
+  :ivar virtual_size: size of resulting raw image
+  :ivar copied_bytes: bytes actually written, holes are not counted
+  :ivar tasks: number of copied pieces
+  :ivar seconds: wall time of export
+  :ivar method: 'copy_file_range' if kernel copied data, 'pwrite' otherwise
+  """
+
+  def __init__(self, virtual_size, copied_bytes, tasks, seconds, method):
+    self.virtual_size = virtual_size
+    self.copied_bytes = copied_bytes
+    self.tasks = tasks
+    self.seconds = seconds
+    self.method = method
+
+  @property
+  def throughput(self) -> float:
+    """
+    Copied bytes per second.
+    """
+    return self.copied_bytes / self.seconds if self.seconds else 0.0
+
+  def __repr__(self):
+    return "ExportResult(copied=%d of %d bytes, %.1f MiB/s, %s)" % (
+      self.copied_bytes, self.virtual_size, self.throughput / (1024 * 1024), self.method)
+
+
+class RawExporter(object):
+  """
+  Copies content of disk chain to raw file.
+
+  :param chain: disk chain to export
+  :param workers: number of copying threads
+  :param chunk_size: largest piece of data copied by one task
+  :param progress: called with (copied bytes, bytes to copy) after each piece, from worker threads
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, chain: DiskChain, workers=DEFAULT_EXPORT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+               progress: Optional[Callable[[int, int], None]] = None):
+    self.chain = chain
+    self.workers = max(1, workers)
+    self.chunk_size = chunk_size
+    self.progress = progress
+    self._use_copy_file_range = hasattr(os, "copy_file_range")
+    self._copied = 0
+    self._total = 0
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def plan(self) -> List[Tuple[int, int, int]]:
+    """
+    Splits data of chain to pieces, each is stored in one block of one layer or assembled from several layers.
+
+    :return: list of (virtual offset, length, source)
+    """
+    tasks = []
+    for offset, length, source in self.chain.source_extents():
+      if source == SOURCE_ZERO:
+        continue
+      # pieces of one layer must not cross its blocks, they are not contiguous in file
+      block_size = None if source == SOURCE_MIXED else self.chain.layers[source].block_size
+      end = offset + length
+      while offset < end:
+        piece = min(end - offset, self.chunk_size - offset % self.chunk_size)
+        if block_size is not None:
+          piece = min(piece, block_size - offset % block_size)
+        tasks.append((offset, piece, source))
+        offset += piece
+    return tasks
+
+  def export(self, dest) -> ExportResult:
+    started = time.perf_counter()
+    tasks = self.plan()
+    self._total = sum(length for _, length, _ in tasks)
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+      # whole image is a hole at first, only data is written
+      os.ftruncate(fd, self.chain.virtual_size)
+      with ThreadPoolExecutor(self.workers) as executor:
+        for future in [executor.submit(self._copy, fd, task) for task in tasks]:
+          future.result()
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+    result = ExportResult(self.chain.virtual_size, self._copied, len(tasks), time.perf_counter() - started,
+                          "copy_file_range" if self._use_copy_file_range else "pwrite")
+    self.LOG.info("Exported '%s' to '%s': %s", self.chain.top.path, dest, result)
+    return result
+
+  def _copy(self, fd, task):
+    offset, length, source = task
+    copied = 0
+    if source != SOURCE_MIXED:
+      layer = self.chain.layers[source]
+      _, data_offset = layer.block(offset // layer.block_size)
+      file_offset = data_offset + offset % layer.block_size
+      if self._use_copy_file_range:
+        copied = self._copy_file_range(layer.fileno(), file_offset, fd, offset, length)
+      if copied < length:
+        buffer = self._buffer(length - copied)
+        layer.readinto_at(file_offset + copied, buffer)
+        write_at(fd, buffer, offset + copied)
+        copied = length
+    else:
+      buffer = self._buffer(length)
+      self.chain.readinto_at(offset, buffer)
+      # assembled data may still be zeros, these are left as holes
+      if not is_zero(buffer):
+        write_at(fd, buffer, offset)
+        copied = length
+    with self._lock:
+      self._copied += copied
+      copied_total = self._copied
+    if self.progress is not None:
+      self.progress(copied_total, self._total)
+
+  def _copy_file_range(self, src_fd, src_offset, dst_fd, dst_offset, length) -> int:
+    copied = 0
+    try:
+      while copied < length:
+        count = os.copy_file_range(src_fd, dst_fd, length - copied, src_offset + copied, dst_offset + copied)
+        if not count:
+          break
+        copied += count
+    except OSError as e:
+      # not supported by kernel or filesystem, other pieces are written with pwrite
+      self.LOG.debug("copy_file_range is not usable, falling back to pwrite: %s", e)
+      self._use_copy_file_range = False
+    return copied
+
+  def _buffer(self, length) -> memoryview:
+    buffer = getattr(self._local, "buffer", None)
+    if buffer is None or len(buffer) < self.chunk_size:
+      buffer = self._local.buffer = bytearray(self.chunk_size)
+    return memoryview(buffer)[:length]
+
+
+_seek_lock = threading.Lock()
+
+
+def write_at(fd, data, offset):
+  """
+  Writes all data at given file offset, with pwrite where available.
+  """
+  view = memoryview(data)
+  if hasattr(os, "pwrite"):
+    while len(view):
+      written = os.pwrite(fd, view, offset)
+      view = view[written:]
+      offset += written
+  else:
+    with _seek_lock:
+      os.lseek(fd, offset, os.SEEK_SET)
+      while len(view):
+        view = view[os.write(fd, view):]
+
+
+def export_raw(chain: DiskChain, dest, workers=DEFAULT_EXPORT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+               progress: Optional[Callable[[int, int], None]] = None) -> ExportResult:
+  return RawExporter(chain, workers, chunk_size, progress).export(dest)
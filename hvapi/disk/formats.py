@@ -0,0 +1,24 @@
+"""
+Native parsers of supported virtual disk formats.
+"""
+from hvapi.disk.image import DiskImage, DEFAULT_BAT_CACHE_PAGES
+from hvapi.disk.types import VHDFormatError
+from hvapi.disk.vhdfile import VHDFile, is_vhd
+from hvapi.disk.vhdx import VHDXFile, FILE_IDENTIFIER_SIGNATURE as VHDX_SIGNATURE
+
+
+def open_image(path, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES) -> DiskImage:
+  """
+  Opens virtual disk file with native parser chosen by file signature.
+
+  :param path: path to virtual disk file
+  :param bat_cache_pages: number of decoded BAT pages to keep in memory
+  :return: opened DiskImage, must be closed by caller
+  """
+  with open(path, "rb") as f:
+    signature = f.read(8)
+  if signature == VHDX_SIGNATURE:
+    return VHDXFile(path, bat_cache_pages)
+  if is_vhd(path):
+    return VHDFile(path, bat_cache_pages)
+  raise VHDFormatError("File '%s' has unknown virtual disk format" % path)
@@ -0,0 +1,352 @@
+"""
+Common part of native(pure Python) virtual disk file parsers. File is mapped with mmap, so only pages of structures
+that are actually read are loaded, BAT is decoded by pages kept in bounded LRU cache.
+"""
+import collections
+import mmap
+import os
+import threading
+import uuid
+from typing import Dict, Any, List, Tuple, Iterator, Callable
+
+from hvapi.disk.types import VirtualStorageType, ProviderSubtype, VHDFormatError
+
+# kinds of virtual disk blocks, as seen in one file
+BLOCK_ABSENT = 0  # not stored in file, reads as zeros or, for differencing disk, from parent
+BLOCK_ZERO = 1  # reads as zeros
+BLOCK_PRESENT = 2  # whole block is stored in file
+BLOCK_PARTIAL = 3  # sectors marked in sector bitmap are stored in file, others come from parent
+
+DEFAULT_BAT_CACHE_PAGES = 64
+# number of partial blocks which sector bitmap runs are kept decoded
+DEFAULT_RUNS_CACHE_BLOCKS = 64
+
+NULL_GUID = uuid.UUID(int=0)
+
+
+def format_guid(value: uuid.UUID) -> str:
+  """
+  Formats GUID the same way as virtdisk GUID structure is formatted by ``VHDDisk.properties``.
+  """
+  return str(value).upper() if value is not None else format_guid(NULL_GUID)
+
+
+class LRUCache(object):
+  """
+  Thread safe bounded cache, values are created by ``loader`` on miss, least recently used values are evicted.
+  """
+
+  def __init__(self, capacity: int, loader: Callable[[Any], Any]):
+    self.capacity = capacity
+    self.loader = loader
+    self.hits = 0
+    self.misses = 0
+    self._items = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value = self._items.get(key)
+      if value is not None:
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+      self.misses += 1
+      value = self.loader(key)
+      self._items[key] = value
+      if len(self._items) > self.capacity:
+        self._items.popitem(last=False)
+      return value
+
+  def clear(self):
+    with self._lock:
+      self._items.clear()
+
+
+def bitmap_runs(bitmap, sectors: int, sector_size: int, msb_first=False) -> List[Tuple[int, int, bool]]:
+  """
+  Converts sector bitmap to runs of sectors that are(``True``) or are not(``False``) stored in file.
+
+  :param bitmap: bytes-like bitmap, one bit per sector
+  :param sectors: number of sectors described by bitmap
+  :param sector_size: sector size in bytes
+  :param msb_first: bit order of bitmap bytes, VHD uses most significant bit for first sector, VHDX least significant
+  :return: list of (offset in block, length, present)
+  """
+  runs = []
+  run_start = 0
+  run_state = None
+  sector = 0
+  for byte in bytes(bitmap[:(sectors + 7) // 8]):
+    if byte in (0, 0xFF) and sector + 8 <= sectors:
+      state = byte == 0xFF
+      if state != run_state:
+        if run_state is not None:
+          runs.append((run_start * sector_size, (sector - run_start) * sector_size, run_state))
+        run_start, run_state = sector, state
+      sector += 8
+      continue
+    for bit in range(8):
+      if sector >= sectors:
+        break
+      state = bool(byte & (0x80 >> bit if msb_first else 1 << bit))
+      if state != run_state:
+        if run_state is not None:
+          runs.append((run_start * sector_size, (sector - run_start) * sector_size, run_state))
+        run_start, run_state = sector, state
+      sector += 1
+  if run_state is not None:
+    runs.append((run_start * sector_size, (sector - run_start) * sector_size, run_state))
+  return runs
+
+
+class DiskImage(object):
+  """
+  Virtual disk file opened for reading. Subclasses parse format metadata in ``_parse`` and provide block mapping, all
+  formats are described by the same attributes:
+
+  :ivar path: absolute file path
+  :ivar file_size: file size in bytes
+  :ivar virtual_size: size of virtual disk in bytes
+  :ivar block_size: size of block mapped by one BAT entry
+  :ivar logical_sector_size: logical sector size
+  :ivar physical_sector_size: physical sector size
+  :ivar unique_id: disk identifier(VHDX virtual disk id, VHD unique id)
+  :ivar provider_subtype: fixed, dynamic or differencing
+  :ivar parent_id: identifier of parent expected by differencing disk, ``None`` for other disks
+  :ivar parent_timestamp: parent timestamp expected by differencing disk(VHD only), 0 otherwise
+  :ivar timestamp: modification timestamp stored in file(VHD only), 0 otherwise
+  """
+
+  storage_type = VirtualStorageType.UNKNOWN
+  # BAT entries decoded at once and kept in cache as one page
+  bat_page_entries = 512
+
+  def __init__(self, path, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES):
+    self.path = os.path.abspath(path)
+    self._file = open(path, "rb")
+    self._map = None
+    try:
+      self.file_size = os.fstat(self._file.fileno()).st_size
+      if not self.file_size:
+        raise VHDFormatError("File '%s' is empty" % path)
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+      self.virtual_size = 0
+      self.block_size = 0
+      self.logical_sector_size = 512
+      self.physical_sector_size = 512
+      self.unique_id = NULL_GUID
+      self.provider_subtype = None
+      self.parent_id = None
+      self.parent_timestamp = 0
+      self.timestamp = 0
+      self._bat_cache = LRUCache(bat_cache_pages, self._read_bat_page)
+      self._runs_cache = LRUCache(DEFAULT_RUNS_CACHE_BLOCKS, self._present_runs)
+      self._parse()
+    except Exception:
+      self.close()
+      raise
+
+  def _parse(self):
+    raise NotImplementedError()
+
+  def _read_bat_page(self, page: int) -> Tuple:
+    """
+    Returns raw BAT entries of given page.
+    """
+    raise NotImplementedError()
+
+  def block(self, index: int) -> Tuple[int, int]:
+    """
+    Returns kind of block and offset of its data in file(0 for blocks without data).
+
+    :param index: block index, block covers virtual disk bytes [index * block_size, (index + 1) * block_size)
+    :return: (block kind, data offset)
+    """
+    raise NotImplementedError()
+
+  def sector_bitmap(self, index: int):
+    """
+    Returns sector bitmap of partial block as bytes-like object, bit order is given by ``bitmap_msb_first``.
+    """
+    raise NotImplementedError()
+
+  bitmap_msb_first = False
+
+  def parent_locations(self) -> List[str]:
+    """
+    Returns candidate parent paths stored in differencing disk, most reliable first, relative paths are resolved
+    against directory of this file. Empty list for disks without parent.
+    """
+    return []
+
+  @property
+  def linkage_id(self) -> uuid.UUID:
+    """
+    Identifier that differencing children of this disk store as their parent id.
+    """
+    return self.unique_id
+
+  @property
+  def parent_ids(self) -> List[uuid.UUID]:
+    """
+    Parent identifiers accepted by differencing disk.
+    """
+    return [self.parent_id] if self.parent_id is not None else []
+
+  @property
+  def has_parent(self) -> bool:
+    return self.provider_subtype == ProviderSubtype.DIFFERENCING
+
+  @property
+  def block_count(self) -> int:
+    return (self.virtual_size + self.block_size - 1) // self.block_size
+
+  def present_runs(self, index: int) -> List[Tuple[int, int, bool]]:
+    """
+    Returns runs of block bytes that are(``True``) or are not(``False``) stored in this file.
+    """
+    return self._runs_cache.get(index)
+
+  def _present_runs(self, index: int) -> List[Tuple[int, int, bool]]:
+    kind, _ = self.block(index)
+    length = min(self.block_size, self.virtual_size - index * self.block_size)
+    if kind == BLOCK_PARTIAL:
+      return bitmap_runs(self.sector_bitmap(index), length // self.logical_sector_size, self.logical_sector_size,
+                         self.bitmap_msb_first)
+    return [(0, length, kind == BLOCK_PRESENT)]
+
+  def blocks(self) -> Iterator[Tuple[int, int, int]]:
+    """
+    Iterates over all blocks, yields (index, kind, data offset).
+    """
+    for index in range(self.block_count):
+      kind, offset = self.block(index)
+      yield index, kind, offset
+
+  def allocated_blocks(self) -> Iterator[Tuple[int, int, int]]:
+    """
+    Iterates over blocks that have data in this file(present or partial), yields (index, kind, data offset).
+    """
+    for index, kind, offset in self.blocks():
+      if kind in (BLOCK_PRESENT, BLOCK_PARTIAL):
+        yield index, kind, offset
+
+  def read_at(self, offset: int, length: int) -> bytes:
+    """
+    Reads raw bytes of file through mapping.
+    """
+    return self._map[offset:offset + length]
+
+  def readinto_at(self, offset: int, buffer) -> int:
+    """
+    Reads raw bytes of file into given writable buffer, returns number of bytes read.
+    """
+    view = memoryview(buffer)
+    length = max(0, min(len(view), self.file_size - offset))
+    # views of mapping must be released before it can be closed
+    with memoryview(self._map) as source, source[offset:offset + length] as chunk:
+      view[:length] = chunk
+    return length
+
+  def fileno(self) -> int:
+    return self._file.fileno()
+
+  @property
+  def is_4k_aligned(self) -> bool:
+    return self.allocation_stats()[0]
+
+  @property
+  def block_stride(self) -> int:
+    """
+    Distance between data offsets of blocks stored one right after another in file.
+    """
+    return self.block_size
+
+  @property
+  def fragmentation_percentage(self) -> int:
+    """
+    Percentage of allocated blocks that are not stored right after previous virtual block.
+    """
+    return self.allocation_stats()[1]
+
+  def allocation_stats(self) -> Tuple[bool, int]:
+    """
+    Computes ``is_4k_aligned`` and ``fragmentation_percentage`` with one scan of BAT.
+
+    :return: (is_4k_aligned, fragmentation_percentage)
+    """
+    aligned = True
+    allocated = 0
+    fragmented = 0
+    expected = None
+    stride = self.block_stride
+    for _, _, offset in self.allocated_blocks():
+      if offset % 4096:
+        aligned = False
+      if expected is not None and offset != expected:
+        fragmented += 1
+      allocated += 1
+      expected = offset + stride
+    return aligned, fragmented * 100 // allocated if allocated else 0
+
+  def properties(self, scan_blocks=True) -> Dict[str, Any]:
+    """
+    Returns disk properties with the same names and value types as ``VHDDisk.properties`` gets from virtdisk.
+
+    :param scan_blocks: include ``Is4kAligned`` and ``FragmentationPercentage``, they need scan of whole BAT
+    """
+    parent_locations = self.parent_locations()
+    resolved = [location for location in parent_locations if os.path.isfile(location)]
+    result = {
+      'Size': {
+        'VirtualSize': self.virtual_size,
+        'PhysicalSize': self.file_size,
+        'BlockSize': self.block_size,
+        'SectorSize': self.logical_sector_size
+      },
+      'Identifier': format_guid(self.unique_id),
+      'ParentLocation': {
+        'ParentResolved': bool(resolved),
+        'ParentLocationBuffer': resolved[0] if resolved else "\0".join(parent_locations)
+      },
+      'ParentIdentifier': format_guid(self.parent_id),
+      'ParentTimestamp': self.parent_timestamp,
+      'VirtualStorageType': self.storage_type,
+      'ProviderSubtype': self.provider_subtype,
+      'PhysicalDisk': {
+        'LogicalSectorSize': self.logical_sector_size,
+        'PhysicalSectorSize': self.physical_sector_size,
+        'IsRemote': False
+      },
+      'VhdPhysicalSectorSize': self.physical_sector_size,
+      # virtual disk does not know partitions, whole disk is the smallest safe size
+      'SmallestSafeVirtualSize': self.virtual_size,
+      'IsLoaded': False,
+      'VirtualDiskId': format_guid(self.unique_id),
+      'ChangeTrackingState': {
+        'Enabled': False,
+        'NewerChanges': False,
+        'MostRecentId': ''
+      }
+    }
+    if scan_blocks:
+      result['Is4kAligned'], result['FragmentationPercentage'] = self.allocation_stats()
+    return result
+
+  def close(self):
+    if self._map is not None:
+      self._map.close()
+      self._map = None
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def __repr__(self):
+    return "%s(%r)" % (type(self).__name__, self.path)
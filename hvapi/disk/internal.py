@@ -4,8 +4,37 @@ from enum import Enum
 
 from hvapi.disk.types import VHDException
 
-kernel32 = ctypes.windll.kernel32
-virtdisk = ctypes.windll.virtdisk
+_libraries = {}
+
+
+def _library(name):
+  """
+  Returns windll library, loaded on first use, so module and its structures can be imported on any platform.
+
+  :param name: library name, e.g. 'virtdisk'
+  :return: loaded library
+  """
+  library = _libraries.get(name)
+  if library is None:
+    if not hasattr(ctypes, "windll"):
+      raise VHDException("Library '%s' is available only on Windows" % name)
+    library = _libraries[name] = getattr(ctypes.windll, name)
+  return library
+
+
+def virtdisk_available() -> bool:
+  """
+  Checks if virtdisk can be used on this platform, native parsers are used otherwise.
+  """
+  return hasattr(ctypes, "windll")
+
+
+def __getattr__(name):
+  # keeps module level 'kernel32' and 'virtdisk' names working without loading them on import
+  if name in ("kernel32", "virtdisk"):
+    return _library(name)
+  raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
 
 # CONSTANTS
 VIRTUAL_STORAGE_TYPE_DEVICE_UNKNOWN = 0
@@ -237,7 +266,7 @@ def close_handle(handle):
 
   :param handle:  handle to close
   """
-  kernel32.CloseHandle(handle)
+  _library("kernel32").CloseHandle(handle)
 
 
 VIRTUAL_DISK_ACCESS_ALL = 0x003f0000
@@ -249,12 +278,12 @@ def open_vhd(vhd_path, open_flag=OPEN_VIRTUAL_DISK_FLAG_NONE, open_access_mask=V
   vst = create_virtual_storage_type_structure(vhd_path)
   handle = wintypes.HANDLE()
 
-  ret_val = virtdisk.OpenVirtualDisk(ctypes.byref(vst),
-                                     ctypes.c_wchar_p(vhd_path),
-                                     open_access_mask,
-                                     open_flag,
-                                     open_params,
-                                     ctypes.byref(handle))
+  ret_val = _library("virtdisk").OpenVirtualDisk(ctypes.byref(vst),
+                                                 ctypes.c_wchar_p(vhd_path),
+                                                 open_access_mask,
+                                                 open_flag,
+                                                 open_params,
+                                                 ctypes.byref(handle))
   if ret_val:
     raise VHDException("Error calling OpenVirtualDisk: %s" % ret_val)
   return handle
@@ -284,7 +313,7 @@ def create_vhd(new_vhd_path, src_path=None, max_internal_size=0, parent_path=Non
   handle = wintypes.HANDLE()
   create_virtual_disk_flag = CREATE_VIRTUAL_DISK_FLAG_NONE
 
-  ret_val = virtdisk.CreateVirtualDisk(
+  ret_val = _library("virtdisk").CreateVirtualDisk(
     ctypes.byref(vst),
     ctypes.c_wchar_p(new_vhd_path),
     VIRTUAL_DISK_ACCESS_NONE,
@@ -320,8 +349,8 @@ def get_vhd_property(disk_handle, requested_property: GET_VIRTUAL_DISK_INFO_VERS
   vdip = GET_VIRTUAL_DISK_INFO_PARAMETERS()
   vdip.VERSION = ctypes.c_uint(requested_property.int_value)
   vdip_size = ctypes.sizeof(vdip)
-  virtdisk.GetVirtualDiskInformation.restype = wintypes.DWORD
-  ret_val = virtdisk.GetVirtualDiskInformation(
+  _library("virtdisk").GetVirtualDiskInformation.restype = wintypes.DWORD
+  ret_val = _library("virtdisk").GetVirtualDiskInformation(
     disk_handle,
     ctypes.byref(ctypes.c_ulong(vdip_size)),
     ctypes.byref(vdip),
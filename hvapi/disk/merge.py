@@ -0,0 +1,182 @@
+"""
+Merging of differencing chains. Content of blocks changed by merged layers is read through the chain and written as
+whole blocks to the target VHDX by several threads, then made visible in crash safe order by ``VHDXUpdater``.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Iterable, List
+
+from hvapi.disk.chain import DiskChain, SOURCE_ZERO, is_zero
+from hvapi.disk.export import DEFAULT_EXPORT_WORKERS
+from hvapi.disk.image import BLOCK_ABSENT
+from hvapi.disk.types import VHDException
+from hvapi.disk.vhdx import VHDXFile, MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
+from hvapi.disk.vhdx_writer import VHDXUpdater, create_vhdx, DEFAULT_BLOCK_SIZE
+
+
+class MergeResult(object):
+  """
+  Statistics of finished merge.
+
+  :ivar target: path of disk data was merged into
+  :ivar blocks: number of target blocks processed
+  :ivar written_blocks: blocks written with data
+  :ivar zero_blocks: blocks that turned out to contain only zeros, they got no data
+  :ivar copied_bytes: bytes of data written
+  :ivar seconds: wall time of merge
+  """
+
+  def __init__(self, target, blocks, written_blocks, zero_blocks, copied_bytes, seconds):
+    self.target = target
+    self.blocks = blocks
+    self.written_blocks = written_blocks
+    self.zero_blocks = zero_blocks
+    self.copied_bytes = copied_bytes
+    self.seconds = seconds
+
+  @property
+  def throughput(self) -> float:
+    return self.copied_bytes / self.seconds if self.seconds else 0.0
+
+  def __repr__(self):
+    return "MergeResult(%r, written=%d, zero=%d of %d blocks, %.1f MiB/s)" % (
+      self.target, self.written_blocks, self.zero_blocks, self.blocks, self.throughput / (1024 * 1024))
+
+
+class BlockMerger(object):
+  """
+  Copies content of given target blocks from chain to target VHDX.
+
+  :param chain: chain to read from
+  :param updater: target disk updater, block size of target defines blocks
+  :param blocks: indexes of target blocks to copy
+  :param zero_blocks_explicit: mark zero blocks as zero in target instead of leaving them unallocated, required when
+  target already has data or parent
+  :param workers: number of copying threads
+  :param progress: called with (processed blocks, all blocks) after each block, from worker threads
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, chain: DiskChain, updater: VHDXUpdater, blocks: Iterable[int], zero_blocks_explicit=True,
+               workers=DEFAULT_EXPORT_WORKERS, progress: Optional[Callable[[int, int], None]] = None):
+    self.chain = chain
+    self.updater = updater
+    self.blocks = sorted(blocks)
+    self.zero_blocks_explicit = zero_blocks_explicit
+    self.workers = max(1, workers)
+    self.progress = progress
+    self._processed = 0
+    self._written = 0
+    self._zero = 0
+    self._copied = 0
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def run(self) -> MergeResult:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(self.workers) as executor:
+      for future in [executor.submit(self._copy, index) for index in self.blocks]:
+        future.result()
+    self.updater.commit()
+    result = MergeResult(self.updater.image.path, len(self.blocks), self._written, self._zero, self._copied,
+                         time.perf_counter() - started)
+    self.LOG.info("Merged '%s' into '%s': %s", self.chain.top.path, self.updater.image.path, result)
+    return result
+
+  def _copy(self, index):
+    block_size = self.updater.block_size
+    buffer = getattr(self._local, "buffer", None)
+    if buffer is None:
+      buffer = self._local.buffer = bytearray(block_size)
+    view = memoryview(buffer)[:self.chain.readinto_at(index * block_size, buffer)]
+    if is_zero(view):
+      if self.zero_blocks_explicit:
+        self.updater.zero_block(index)
+      written = 0
+    else:
+      self.updater.write_block(index, view)
+      written = len(view)
+    with self._lock:
+      self._processed += 1
+      if written:
+        self._written += 1
+        self._copied += written
+      else:
+        self._zero += 1
+      processed = self._processed
+    if self.progress is not None:
+      self.progress(processed, len(self.blocks))
+
+
+def changed_blocks(layers, block_size: int) -> List[int]:
+  """
+  Returns indexes of blocks of given size that have data or zero marks in any of layers.
+  """
+  result = set()
+  for layer in layers:
+    for index, kind, _ in layer.blocks():
+      if kind == BLOCK_ABSENT:
+        continue
+      first = index * layer.block_size // block_size
+      last = ((index + 1) * layer.block_size - 1) // block_size
+      result.update(range(first, last + 1))
+  return sorted(result)
+
+
+def merge_into_parent(chain: DiskChain, depth=1, workers=DEFAULT_EXPORT_WORKERS,
+                      progress: Optional[Callable[[int, int], None]] = None) -> MergeResult:
+  """
+  Merges first ``depth`` layers of chain into layer ``depth``. Only blocks changed by merged layers are copied. Merged
+  layers no longer match target afterwards and should be deleted, as should other children of target.
+
+  :param chain: chain to merge
+  :param depth: number of layers to merge, 1 merges disk into its parent
+  :param workers: number of copying threads
+  :param progress: called with (processed blocks, all blocks)
+  :return: MergeResult
+  """
+  if not 1 <= depth < len(chain.layers):
+    raise VHDException("Merge depth must be from 1 to %d for '%s'" % (len(chain.layers) - 1, chain.top.path))
+  target = chain.layers[depth]
+  if not isinstance(target, VHDXFile):
+    raise VHDException("Only VHDX parent can be merged into, '%s' is not" % target.path)
+  with VHDXUpdater(target.path) as updater:
+    blocks = [index for index in changed_blocks(chain.layers[:depth], updater.block_size)
+              if index < updater.image.block_count]
+    return BlockMerger(chain, updater, blocks, True, workers, progress).run()
+
+
+def flatten(chain: DiskChain, dest, workers=DEFAULT_EXPORT_WORKERS,
+            progress: Optional[Callable[[int, int], None]] = None) -> MergeResult:
+  """
+  Writes content of whole chain to new dynamic VHDX. Blocks without data in any layer, or with only zeros, are left
+  unallocated.
+
+  :param chain: chain to flatten
+  :param dest: path of new disk, must not exist
+  :param workers: number of copying threads
+  :param progress: called with (processed blocks, all blocks)
+  :return: MergeResult
+  """
+  top = chain.top
+  block_size = top.block_size
+  if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE or block_size & (block_size - 1):
+    block_size = DEFAULT_BLOCK_SIZE
+  create_vhdx(dest, chain.virtual_size, block_size, top.logical_sector_size, top.physical_sector_size)
+  try:
+    with VHDXUpdater(dest) as updater:
+      # blocks consisting only of units without data are skipped without reading
+      sources = chain.source_map
+      blocks = []
+      for index in range(updater.image.block_count):
+        first = index * block_size // chain.unit_size
+        last = ((index + 1) * block_size - 1) // chain.unit_size
+        if any(source != SOURCE_ZERO for source in sources[first:last + 1]):
+          blocks.append(index)
+      return BlockMerger(chain, updater, blocks, False, workers, progress).run()
+  except Exception:
+    os.remove(dest)
+    raise
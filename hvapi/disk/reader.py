@@ -0,0 +1,70 @@
+"""
+Reader of guest visible content of virtual disk, works on top of native parsers, so disks can be read offline on any
+platform without mounting them.
+"""
+import io
+
+from hvapi.disk.chain import DiskChain
+
+
+class VirtualDiskReader(io.RawIOBase):
+  """
+  Seekable raw stream over virtual disk. Reads go straight to the layer of chain that owns the data according to
+  chain source map, units that have no data read as zeros without touching any file. Data is copied from file mapping
+  directly into caller buffers.
+
+  :param chain: disk chain, closed together with reader
+  """
+
+  def __init__(self, chain: DiskChain):
+    super().__init__()
+    self.chain = chain
+    self.size = chain.virtual_size
+    self._position = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self._position
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_SET:
+      position = offset
+    elif whence == io.SEEK_CUR:
+      position = self._position + offset
+    elif whence == io.SEEK_END:
+      position = self.size + offset
+    else:
+      raise ValueError("Invalid whence %r" % whence)
+    if position < 0:
+      raise ValueError("Negative seek position %d" % position)
+    self._position = position
+    return position
+
+  def readinto(self, buffer):
+    read = self.readinto_at(self._position, buffer)
+    self._position += read
+    return read
+
+  def readinto_at(self, offset: int, buffer) -> int:
+    """
+    Reads virtual disk bytes at given offset into buffer without moving stream position, so it can be used by
+    several threads at once.
+
+    :return: number of bytes read, less than buffer size only at the end of disk
+    """
+    if self.closed:
+      raise ValueError("I/O operation on closed reader")
+    return self.chain.readinto_at(offset, buffer)
+
+  def close(self):
+    if not self.closed:
+      self.chain.close()
+    super().close()
+
+  def __repr__(self):
+    return "VirtualDiskReader(%r)" % self.chain
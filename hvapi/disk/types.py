@@ -16,3 +16,15 @@ class VirtualStorageType(RangedCodeEnum):
   ISO = 1
   VHD = 2
   VHDX = 3
+
+
+class VHDFormatError(VHDException):
+  """
+  Virtual disk file is corrupted or has unsupported format.
+  """
+
+
+class VHDChainError(VHDException):
+  """
+  Parent of differencing disk can not be found or does not match child.
+  """
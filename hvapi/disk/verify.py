@@ -0,0 +1,516 @@
+"""
+Integrity verification of VHD and VHDX files. Problems are collected to report instead of raised, so one run shows
+everything that is wrong with file. Fast mode checks only headers, metadata and parent chain, full mode also checks
+every BAT entry and overlaps of allocated blocks, payload scan additionally reads all allocated data. BAT pages and
+payload blocks are checked by several threads with bounded number of tasks in flight.
+"""
+import collections
+import heapq
+import logging
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Iterable, Iterator, Callable, Dict, Any
+
+from hvapi.disk import vhdfile, vhdx
+from hvapi.disk.chain import ChainResolver
+from hvapi.disk.export import DEFAULT_EXPORT_WORKERS
+from hvapi.disk.formats import open_image
+from hvapi.disk.image import DiskImage, NULL_GUID, BLOCK_ABSENT, BLOCK_PRESENT, BLOCK_PARTIAL
+from hvapi.disk.types import VHDException
+from hvapi.disk.vhdx import MB
+
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+
+# names of checks, as used in report
+CHECK_STRUCTURE = "structure"
+CHECK_HEADERS = "headers"
+CHECK_REGION_TABLE = "region_table"
+CHECK_LOG = "log"
+CHECK_METADATA = "metadata"
+CHECK_PARENT_CHAIN = "parent_chain"
+CHECK_BAT = "bat"
+CHECK_OVERLAP = "overlap"
+CHECK_PAYLOAD = "payload"
+
+# further issues of the same check are only counted
+MAX_ISSUES_PER_CHECK = 64
+DEFAULT_SCAN_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class VerifyIssue(object):
+  """
+  Problem found by verification.
+
+  :ivar severity: 'error' if disk is corrupted, 'warning' if it is usable but something is suspicious
+  :ivar check: name of check that found problem
+  :ivar message: description
+  :ivar offset: file offset of damaged structure, if known
+  """
+
+  def __init__(self, severity, check, message, offset=None):
+    self.severity = severity
+    self.check = check
+    self.message = message
+    self.offset = offset
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {"severity": self.severity, "check": self.check, "message": self.message, "offset": self.offset}
+
+  def __repr__(self):
+    return "VerifyIssue(%s, %s, %r)" % (self.severity, self.check, self.message)
+
+
+class VerifyReport(object):
+  """
+  Result of verification.
+
+  :ivar path: verified file
+  :ivar checks: names of checks that were run
+  :ivar issues: found problems, at most ``MAX_ISSUES_PER_CHECK`` for one check
+  :ivar suppressed: numbers of problems not added to issues, by check
+  :ivar blocks: number of allocated blocks checked in BAT
+  :ivar scanned_bytes: bytes read by payload scan
+  :ivar seconds: wall time of verification
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.checks = []  # type: List[str]
+    self.issues = []  # type: List[VerifyIssue]
+    self.suppressed = {}  # type: Dict[str, int]
+    self.blocks = 0
+    self.scanned_bytes = 0
+    self.seconds = 0.0
+    self._counts = collections.Counter()
+
+  def add(self, severity, check, message, offset=None):
+    self._counts[check] += 1
+    if self._counts[check] > MAX_ISSUES_PER_CHECK:
+      self.suppressed[check] = self.suppressed.get(check, 0) + 1
+    else:
+      self.issues.append(VerifyIssue(severity, check, message, offset))
+
+  def error(self, check, message, offset=None):
+    self.add(SEVERITY_ERROR, check, message, offset)
+
+  def warning(self, check, message, offset=None):
+    self.add(SEVERITY_WARNING, check, message, offset)
+
+  @property
+  def errors(self) -> List[VerifyIssue]:
+    return [issue for issue in self.issues if issue.severity == SEVERITY_ERROR]
+
+  @property
+  def warnings(self) -> List[VerifyIssue]:
+    return [issue for issue in self.issues if issue.severity == SEVERITY_WARNING]
+
+  @property
+  def ok(self) -> bool:
+    """
+    No errors were found, warnings are allowed.
+    """
+    return not self.errors
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {"path": self.path, "ok": self.ok, "checks": self.checks, "issues": [i.to_dict() for i in self.issues],
+            "suppressed": self.suppressed, "blocks": self.blocks, "scanned_bytes": self.scanned_bytes,
+            "seconds": self.seconds}
+
+  def __repr__(self):
+    return "VerifyReport(%r, %s, %d errors, %d warnings, %.3fs)" % (
+      self.path, "ok" if self.ok else "corrupted", len(self.errors), len(self.warnings), self.seconds)
+
+
+class ImageVerifier(object):
+  """
+  Verifies one VHD or VHDX file.
+
+  :param path: file to verify
+  :param workers: number of threads checking BAT pages and reading payload
+  :param fast: check only headers, metadata and parent chain, without BAT
+  :param scan_payload: read all allocated blocks to find unreadable data, ignored in fast mode
+  :param check_chain: find and validate parents of differencing disk
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(self, path, workers=DEFAULT_EXPORT_WORKERS, fast=False, scan_payload=False, check_chain=True):
+    self.path = os.path.abspath(path)
+    self.workers = max(1, workers)
+    self.fast = fast
+    self.scan_payload = scan_payload and not fast
+    self.check_chain = check_chain
+    self._local = threading.local()
+    self._files = []
+    self._files_lock = threading.Lock()
+
+  def run(self) -> VerifyReport:
+    started = time.perf_counter()
+    report = VerifyReport(self.path)
+    report.checks.append(CHECK_STRUCTURE)
+    try:
+      if vhdx.is_vhdx(self.path):
+        self._check_vhdx_headers(report)
+      elif vhdfile.is_vhd(self.path):
+        self._check_vhd_footer(report)
+      else:
+        report.error(CHECK_STRUCTURE, "File is neither VHD nor VHDX")
+      image = open_image(self.path)
+    except (VHDException, OSError) as e:
+      # header and region table checks already reported why file can not be opened
+      if not report.errors:
+        report.error(CHECK_STRUCTURE, str(e))
+    else:
+      with image:
+        self._verify_image(image, report)
+    report.seconds = time.perf_counter() - started
+    self.LOG.debug("Verified '%s': %s", self.path, report)
+    return report
+
+  def _verify_image(self, image: DiskImage, report: VerifyReport):
+    report.checks.append(CHECK_METADATA)
+    if isinstance(image, vhdx.VHDXFile):
+      self._check_vhdx_metadata(image, report)
+    else:
+      self._check_vhd_metadata(image, report)
+    if self.check_chain and image.has_parent:
+      self._check_parent_chain(image, report)
+    if self.fast:
+      return
+    report.checks.extend((CHECK_BAT, CHECK_OVERLAP))
+    if isinstance(image, vhdx.VHDXFile):
+      reserved, extents = self._check_vhdx_bat(image, report)
+    else:
+      reserved, extents = self._check_vhd_bat(image, report)
+    self._check_overlaps(reserved, extents, report)
+    if self.scan_payload:
+      report.checks.append(CHECK_PAYLOAD)
+      self._scan(extents, report)
+
+  def _stream(self, function: Callable, items: Iterable) -> Iterator:
+    """
+    Runs function for items in worker threads, yields results in order. Only a few tasks are queued at once, so
+    memory does not grow with number of items.
+    """
+    with ThreadPoolExecutor(self.workers) as executor:
+      pending = collections.deque()
+      for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= self.workers * 2:
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+
+  # VHDX
+
+  def _check_vhdx_headers(self, report: VerifyReport):
+    report.checks.extend((CHECK_HEADERS, CHECK_REGION_TABLE, CHECK_LOG))
+    with open(self.path, "rb") as f:
+      data = f.read(MB)
+      file_size = os.fstat(f.fileno()).st_size
+    if len(data) < MB:
+      report.error(CHECK_HEADERS, "File is smaller than VHDX header section")
+      return
+    headers = [vhdx.VHDXHeader(offset, data[offset:offset + vhdx.HEADER_SIZE]) for offset in vhdx.HEADER_OFFSETS]
+    for header in headers:
+      if not header.signature_valid:
+        problem = "has no 'head' signature"
+      elif not header.checksum_valid:
+        problem = "CRC-32C does not match"
+      elif header.version != 1:
+        problem = "has unsupported version %d" % header.version
+      else:
+        continue
+      report.warning(CHECK_HEADERS, "Header at %d %s" % (header.offset, problem), header.offset)
+    valid = [header for header in headers if header.valid]
+    if not valid:
+      report.error(CHECK_HEADERS, "No valid header")
+    else:
+      if len(valid) == 2 and valid[0].sequence_number == valid[1].sequence_number:
+        report.warning(CHECK_HEADERS, "Both headers have sequence number %d" % valid[0].sequence_number)
+      header = max(valid, key=lambda item: item.sequence_number)
+      if header.log_offset % MB or header.log_length % MB or header.log_offset + header.log_length > file_size or \
+          (header.log_length and header.log_offset < MB):
+        report.error(CHECK_LOG, "Log at %d of %d bytes is misaligned or out of file bounds" % (
+          header.log_offset, header.log_length), header.offset)
+      if header.log_replay_required:
+        report.error(CHECK_LOG, "Log %s must be replayed, data written before last unclean shutdown is not "
+                                "visible until disk is attached by Hyper-V" % header.log_guid, header.log_offset)
+
+    tables = [vhdx.RegionTable(offset, data[offset:offset + vhdx.REGION_TABLE_SIZE])
+              for offset in vhdx.REGION_TABLE_OFFSETS]
+    for table in tables:
+      if not table.valid:
+        report.warning(CHECK_REGION_TABLE, "Region table at %d is %s" % (
+          table.offset, "corrupted" if table.signature_valid else "missing"), table.offset)
+    valid_tables = [table for table in tables if table.valid]
+    if not valid_tables:
+      report.error(CHECK_REGION_TABLE, "No valid region table")
+      return
+    if len(valid_tables) == 2 and [(e.guid, e.file_offset, e.length) for e in valid_tables[0].entries] != \
+        [(e.guid, e.file_offset, e.length) for e in valid_tables[1].entries]:
+      report.warning(CHECK_REGION_TABLE, "Region tables differ")
+    for entry in valid_tables[0].entries:
+      if entry.file_offset % MB or entry.length % MB or entry.file_offset < MB or \
+          entry.file_offset + entry.length > file_size:
+        report.error(CHECK_REGION_TABLE, "Region %s at %d of %d bytes is misaligned or out of file bounds" % (
+          entry.guid, entry.file_offset, entry.length), entry.file_offset)
+    for guid in (vhdx.BAT_REGION_GUID, vhdx.METADATA_REGION_GUID):
+      if valid_tables[0].find(guid) is None:
+        report.error(CHECK_REGION_TABLE, "Required region %s is missing" % guid)
+
+  def _check_vhdx_metadata(self, image: vhdx.VHDXFile, report: VerifyReport):
+    previous_end = vhdx.METADATA_TABLE_SIZE
+    previous = None
+    for entry in sorted(image.metadata_entries.values(), key=lambda item: item.offset):
+      if not entry.length:
+        continue
+      if entry.offset < vhdx.METADATA_TABLE_SIZE or entry.offset + entry.length > image.metadata_length:
+        report.error(CHECK_METADATA, "Metadata item %s is out of metadata region" % entry.item_id,
+                     image.metadata_offset + entry.offset)
+      elif previous is not None and entry.offset < previous_end:
+        report.error(CHECK_METADATA, "Metadata item %s overlaps item %s" % (entry.item_id, previous.item_id),
+                     image.metadata_offset + entry.offset)
+      if entry.offset + entry.length > previous_end:
+        previous_end = entry.offset + entry.length
+        previous = entry
+    if image.has_parent:
+      if image.parent_id is None:
+        report.error(CHECK_METADATA, "Differencing disk has no valid 'parent_linkage' in parent locator")
+      if not any(image.parent_locator.get(key) for key in vhdx.PARENT_PATH_KEYS):
+        report.error(CHECK_METADATA, "Parent locator has no parent path")
+    elif vhdx.PARENT_LOCATOR_GUID in image.metadata_entries:
+      report.warning(CHECK_METADATA, "Disk is not differencing, but has parent locator")
+    if image.unique_id == NULL_GUID:
+      report.warning(CHECK_METADATA, "Virtual disk id is empty")
+
+  def _check_vhdx_bat(self, image: vhdx.VHDXFile, report: VerifyReport):
+    reserved = [(0, MB, "header section"), (image.bat_offset, image.bat_length, "BAT region"),
+                (image.metadata_offset, image.metadata_length, "metadata region")]
+    if image.header.log_length:
+      reserved.append((image.header.log_offset, image.header.log_length, "log"))
+    payload = array("Q")
+    bitmaps = array("Q")
+    pages = range((image.bat_entries + image.bat_page_entries - 1) // image.bat_page_entries)
+    for issues, page_payload, page_bitmaps in self._stream(lambda page: self._vhdx_bat_page(image, page), pages):
+      for issue in issues:
+        report.error(CHECK_BAT, *issue)
+      payload.extend(page_payload)
+      bitmaps.extend(page_bitmaps)
+    report.blocks = len(payload)
+    return reserved, [(payload, image.block_size, "payload block"), (bitmaps, MB, "sector bitmap block")]
+
+  @staticmethod
+  def _vhdx_bat_page(image: vhdx.VHDXFile, page: int):
+    issues = []
+    payload = array("Q")
+    bitmaps = array("Q")
+    ratio = image.chunk_ratio
+    first = page * image.bat_page_entries
+    for position, entry in enumerate(image._read_bat_page(page)):
+      bat_index = first + position
+      entry_offset = image.bat_offset + bat_index * 8
+      state = entry & vhdx.BAT_ENTRY_STATE_MASK
+      offset = entry & vhdx.BAT_ENTRY_OFFSET_MASK
+      if (bat_index + 1) % (ratio + 1) == 0:
+        if state not in (vhdx.SB_BLOCK_NOT_PRESENT, vhdx.SB_BLOCK_PRESENT):
+          issues.append(("Sector bitmap entry %d has invalid state %d" % (bat_index, state), entry_offset))
+        elif state == vhdx.SB_BLOCK_PRESENT:
+          if not image.has_parent:
+            issues.append(("Sector bitmap block %d is present in disk without parent" % bat_index, entry_offset))
+          elif offset < MB or offset + MB > image.file_size:
+            issues.append(("Sector bitmap block %d at %d is out of file bounds" % (bat_index, offset), entry_offset))
+          else:
+            bitmaps.append(offset)
+        continue
+      index = bat_index - bat_index // (ratio + 1)
+      kind = vhdx._PAYLOAD_KINDS.get(state)
+      if kind is None:
+        issues.append(("BAT entry of block %d has invalid state %d" % (index, state), entry_offset))
+      elif index >= image.block_count:
+        if kind != BLOCK_ABSENT:
+          issues.append(("BAT entry %d is beyond virtual size, but not empty" % bat_index, entry_offset))
+      elif kind in (BLOCK_PRESENT, BLOCK_PARTIAL):
+        if offset < MB or offset + image.block_size > image.file_size:
+          issues.append(("Block %d at %d is out of file bounds" % (index, offset), entry_offset))
+          continue
+        payload.append(offset)
+        if kind == BLOCK_PARTIAL:
+          bitmap_state = image.bat_entry(vhdx.bitmap_bat_index(index, ratio)) & vhdx.BAT_ENTRY_STATE_MASK
+          if not image.has_parent:
+            issues.append(("Block %d is partially present in disk without parent" % index, entry_offset))
+          elif bitmap_state != vhdx.SB_BLOCK_PRESENT:
+            issues.append(("Block %d is partially present, but its sector bitmap is not" % index, entry_offset))
+    return issues, payload, bitmaps
+
+  # VHD
+
+  def _check_vhd_footer(self, report: VerifyReport):
+    report.checks.append(CHECK_HEADERS)
+    with open(self.path, "rb") as f:
+      file_size = os.fstat(f.fileno()).st_size
+      if file_size < vhdfile.FOOTER_SIZE:
+        report.error(CHECK_HEADERS, "File is smaller than VHD footer")
+        return
+      copy = vhdfile.VHDFooter(0, f.read(vhdfile.FOOTER_SIZE))
+      f.seek(file_size - vhdfile.FOOTER_SIZE)
+      footer = vhdfile.VHDFooter(file_size - vhdfile.FOOTER_SIZE, f.read(vhdfile.FOOTER_SIZE))
+    if not footer.valid:
+      report.add(SEVERITY_WARNING if copy.valid and copy.disk_type != vhdfile.DISK_TYPE_FIXED else SEVERITY_ERROR,
+                 CHECK_HEADERS, "Footer at the end of file is %s" % (
+                   "corrupted" if footer.cookie_valid else "missing"), footer.offset)
+    elif footer.disk_type != vhdfile.DISK_TYPE_FIXED:
+      if not copy.valid:
+        report.warning(CHECK_HEADERS, "Footer copy at the beginning of file is corrupted", 0)
+      elif (copy.unique_id, copy.current_size, copy.disk_type, copy.data_offset) != \
+          (footer.unique_id, footer.current_size, footer.disk_type, footer.data_offset):
+        report.warning(CHECK_HEADERS, "Footer copy at the beginning of file differs from footer", 0)
+
+  @staticmethod
+  def _check_vhd_metadata(image: vhdfile.VHDFile, report: VerifyReport):
+    if image.footer.disk_type == vhdfile.DISK_TYPE_FIXED:
+      if image.footer.offset != image.virtual_size:
+        report.warning(CHECK_METADATA, "Fixed disk data is %d bytes, virtual size is %d" % (
+          image.footer.offset, image.virtual_size))
+      return
+    if image.has_parent:
+      if image.parent_id is None or image.parent_id == NULL_GUID:
+        report.error(CHECK_METADATA, "Differencing disk has no parent unique id", image.footer.data_offset)
+      if not image.parent_locators and not image.parent_name:
+        report.error(CHECK_METADATA, "Differencing disk has no parent locators", image.footer.data_offset)
+    if image.unique_id == NULL_GUID:
+      report.warning(CHECK_METADATA, "Unique id is empty")
+
+  def _check_vhd_bat(self, image: vhdfile.VHDFile, report: VerifyReport):
+    data_end = image.file_size - vhdfile.FOOTER_SIZE
+    reserved = [(data_end, vhdfile.FOOTER_SIZE, "footer")]
+    payload = array("Q")
+    if image.footer.disk_type == vhdfile.DISK_TYPE_FIXED:
+      payload.extend(range(0, image.virtual_size, image.block_size))
+      report.blocks = len(payload)
+      return reserved, [(payload, image.block_size, "data")]
+    reserved.extend([
+      (0, vhdfile.FOOTER_SIZE, "footer copy"),
+      (image.footer.data_offset, vhdfile.DYNAMIC_HEADER_SIZE, "dynamic header"),
+      (image.table_offset, image.max_table_entries * 4, "BAT")
+    ])
+    reserved.extend((locator.data_offset, locator.data_length, "parent locator %s" % locator.platform_code.decode(
+      "latin-1")) for locator in image.parent_locators)
+    block_length = image.bitmap_size + image.block_size
+    pages = range((image.max_table_entries + image.bat_page_entries - 1) // image.bat_page_entries)
+
+    def check_page(page):
+      issues = []
+      offsets = array("Q")
+      first = page * image.bat_page_entries
+      for position, entry in enumerate(image._read_bat_page(page)):
+        index = first + position
+        entry_offset = image.table_offset + index * 4
+        if entry == vhdfile.UNALLOCATED:
+          continue
+        if index >= image.block_count:
+          issues.append(("BAT entry %d is beyond virtual size, but not empty" % index, entry_offset))
+        elif entry * vhdfile.SECTOR_SIZE + block_length > data_end:
+          issues.append(("Block %d at %d is out of file bounds" % (index, entry * vhdfile.SECTOR_SIZE),
+                         entry_offset))
+        else:
+          offsets.append(entry * vhdfile.SECTOR_SIZE)
+      return issues, offsets
+
+    for issues, offsets in self._stream(check_page, pages):
+      for issue in issues:
+        report.error(CHECK_BAT, *issue)
+      payload.extend(offsets)
+    report.blocks = len(payload)
+    return reserved, [(payload, block_length, "block")]
+
+  # common
+
+  def _check_parent_chain(self, image: DiskImage, report: VerifyReport):
+    report.checks.append(CHECK_PARENT_CHAIN)
+    resolver = ChainResolver(strict_timestamps=True)
+    try:
+      parents = resolver.resolve_parents(image)[1:]
+    except (VHDException, OSError) as e:
+      resolver = ChainResolver()
+      try:
+        # chain that is broken only by VHD parent timestamp is still usable
+        parents = resolver.resolve_parents(image)[1:]
+      except (VHDException, OSError):
+        report.error(CHECK_PARENT_CHAIN, str(e))
+        return
+      report.warning(CHECK_PARENT_CHAIN, str(e))
+    try:
+      for parent in parents:
+        if isinstance(parent, vhdx.VHDXFile) and parent.log_replay_required:
+          report.error(CHECK_PARENT_CHAIN, "Log of parent '%s' must be replayed" % parent.path)
+    finally:
+      resolver.release(parents)
+
+  @staticmethod
+  def _check_overlaps(reserved: List[Tuple[int, int, str]], extents: List[Tuple[array, int, str]],
+                      report: VerifyReport):
+    streams = [sorted((start, length, label) for start, length, label in reserved if length)]
+    streams.extend(_extent_stream(offsets, length, label) for offsets, length, label in extents)
+    previous_end = 0
+    previous = None
+    for start, length, label in heapq.merge(*streams):
+      if start < previous_end:
+        report.error(CHECK_OVERLAP, "%s at %d overlaps %s at %d" % (label, start, previous[1], previous[0]), start)
+      if start + length > previous_end:
+        previous_end = start + length
+        previous = (start, label)
+
+  def _scan(self, extents: List[Tuple[array, int, str]], report: VerifyReport):
+    def tasks():
+      for offsets, length, label in extents:
+        for offset in sorted(offsets):
+          yield offset, length, label
+
+    try:
+      for issue, scanned in self._stream(self._scan_extent, tasks()):
+        report.scanned_bytes += scanned
+        if issue is not None:
+          report.error(CHECK_PAYLOAD, *issue)
+    finally:
+      with self._files_lock:
+        for f in self._files:
+          f.close()
+        self._files = []
+
+  def _scan_extent(self, task):
+    offset, length, label = task
+    f = getattr(self._local, "file", None)
+    if f is None or f.closed:
+      f = self._local.file = open(self.path, "rb", buffering=0)
+      self._local.buffer = bytearray(DEFAULT_SCAN_CHUNK_SIZE)
+      with self._files_lock:
+        self._files.append(f)
+    buffer = memoryview(self._local.buffer)
+    scanned = 0
+    try:
+      f.seek(offset)
+      while scanned < length:
+        count = f.readinto(buffer[:min(len(buffer), length - scanned)])
+        if not count:
+          return ("%s at %d is truncated after %d bytes" % (label, offset, scanned), offset), scanned
+        scanned += count
+    except OSError as e:
+      return ("%s at %d can not be read: %s" % (label, offset + scanned, e), offset + scanned), scanned
+    return None, scanned
+
+
+def _extent_stream(offsets: array, length: int, label: str) -> Iterator[Tuple[int, int, str]]:
+  for offset in sorted(offsets):
+    yield offset, length, label
+
+
+def verify_image(path, workers=DEFAULT_EXPORT_WORKERS, fast=False, scan_payload=False,
+                 check_chain=True) -> VerifyReport:
+  """
+  Verifies VHD or VHDX file, see ``ImageVerifier``.
+  """
+  return ImageVerifier(path, workers, fast, scan_payload, check_chain).run()
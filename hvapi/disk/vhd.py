@@ -1,5 +1,14 @@
-from hvapi.disk.internal import open_vhd, get_vhd_info, GUID, create_vhd, close_handle
+from hvapi.disk.chain import ChainResolver, DiskChain, ParentCache
+from hvapi.disk.diff import vhd_diff, write_diff, DiffResult
+from hvapi.disk.export import export_raw, ExportResult, DEFAULT_EXPORT_WORKERS
+from hvapi.disk.formats import open_image
+from hvapi.disk.image import DiskImage, DEFAULT_BAT_CACHE_PAGES
+from hvapi.disk.internal import open_vhd, get_vhd_info, GUID, create_vhd, close_handle, virtdisk_available
+from hvapi.disk.merge import merge_into_parent, flatten, MergeResult
+from hvapi.disk.reader import VirtualDiskReader
 from hvapi.disk.types import ProviderSubtype, VirtualStorageType, VHDException
+from hvapi.disk.verify import verify_image, VerifyReport
+from hvapi.disk.vhdx_writer import create_vhdx
 
 
 def transform_property(member_name, value):
@@ -29,21 +38,143 @@ def transform_property(member_name, value):
 class VHDDisk(object):
   def __init__(self, disk_path):
     self.disk_path = disk_path
-    close_handle(open_vhd(self.disk_path))
+    if virtdisk_available():
+      close_handle(open_vhd(self.disk_path))
+    else:
+      open_image(self.disk_path).close()
+
+  def image(self, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES) -> DiskImage:
+    """
+    Opens disk file with native parser, works on any platform and does not lock file like virtdisk does.
+    """
+    return open_image(self.disk_path, bat_cache_pages)
+
+  def chain(self, cache: ParentCache = None, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES) -> DiskChain:
+    """
+    Opens disk with all its parents, validating parent identifiers.
+
+    :param cache: cache of opened parents, parents are opened for this chain only if omitted
+    :param bat_cache_pages: number of decoded BAT pages to keep in memory for disk
+    :return: DiskChain, must be closed by caller
+    """
+    return ChainResolver(cache, bat_cache_pages=bat_cache_pages).resolve(self.disk_path)
+
+  def open_reader(self, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES) -> VirtualDiskReader:
+    """
+    Opens seekable raw stream over guest visible content of disk, parents of differencing disk are resolved too.
+
+    :param bat_cache_pages: number of decoded BAT pages to keep in memory for disk
+    :return: VirtualDiskReader, must be closed by caller
+    """
+    return VirtualDiskReader(self.chain(bat_cache_pages=bat_cache_pages))
+
+  def export_raw(self, dest, workers=DEFAULT_EXPORT_WORKERS, progress=None) -> ExportResult:
+    """
+    Exports guest visible content of disk, with all its parents, to raw image. Only allocated data is copied, regions
+    without data are left as holes, so destination should be on filesystem supporting sparse files.
+
+    :param dest: path of raw image, overwritten if exists
+    :param workers: number of copying threads
+    :param progress: called with (copied bytes, bytes to copy) after each copied piece
+    :return: ExportResult with copied bytes and throughput
+    """
+    with self.chain() as chain:
+      return export_raw(chain, dest, workers, progress=progress)
+
+  def merge_into_parent(self, depth=1, workers=DEFAULT_EXPORT_WORKERS, progress=None) -> MergeResult:
+    """
+    Merges this differencing disk, and ``depth`` - 1 of its parents, into parent at given depth, which must be VHDX.
+    Only blocks changed by merged disks are copied, data is written to new space of target and made visible in crash
+    safe order: data, BAT, header. Merged disks and other children of target no longer match it afterwards.
+
+    :param depth: number of disks to merge, 1 merges this disk into its parent
+    :param workers: number of copying threads
+    :param progress: called with (processed blocks, all blocks) after each block
+    :return: MergeResult, its ``target`` is path of disk data was merged into
+    """
+    with self.chain() as chain:
+      return merge_into_parent(chain, depth, workers, progress)
+
+  def flatten(self, dest, workers=DEFAULT_EXPORT_WORKERS, progress=None) -> 'VHDDisk':
+    """
+    Writes content of this disk, with all its parents, to new dynamic VHDX without parent.
+
+    :param dest: path of new disk, must not exist
+    :param workers: number of copying threads
+    :param progress: called with (processed blocks, all blocks) after each block
+    :return: resulting VHDDisk
+    """
+    with self.chain() as chain:
+      flatten(chain, dest, workers, progress)
+    return VHDDisk(dest)
+
+  def diff(self, old: 'VHDDisk', workers=DEFAULT_EXPORT_WORKERS) -> DiffResult:
+    """
+    Computes extents of this disk that differ from ``old`` disk, for incremental backups. Native parser can not read
+    resilient change tracking data, so changes are found by BAT and content comparison.
+
+    :param old: disk to compare with, e.g. previous backup
+    :param workers: number of comparing threads
+    :return: DiffResult with changed extents
+    """
+    return vhd_diff(old, self, workers=workers)
+
+  def write_diff(self, diff: DiffResult, dest, base: 'VHDDisk', workers=DEFAULT_EXPORT_WORKERS) -> 'VHDDisk':
+    """
+    Writes extents of this disk listed in diff as differencing VHDX of ``base``.
+
+    :param diff: diff of this disk relative to base
+    :param dest: path of new differencing disk
+    :param base: parent of new disk, VHDX
+    :param workers: number of writing threads
+    :return: resulting VHDDisk
+    """
+    return VHDDisk(write_diff(diff, self, dest, base, workers))
+
+  def verify(self, workers=DEFAULT_EXPORT_WORKERS, fast=False, scan_payload=False) -> VerifyReport:
+    """
+    Checks integrity of disk file and its parent chain. Problems are returned in report, not raised.
+
+    :param workers: number of threads checking BAT and reading payload
+    :param fast: check only headers, metadata and parent chain, takes milliseconds
+    :param scan_payload: also read all allocated blocks to find unreadable data
+    :return: VerifyReport
+    """
+    return verify_image(self.disk_path, workers, fast, scan_payload)
 
   @property
   def properties(self):
+    if not virtdisk_available():
+      with self.image() as image:
+        return image.properties()
     return {name: transform_property(name, value) for name, value in get_vhd_info(self.disk_path).items()}
 
-  def clone(self, clone_path, differencing=True):
+  @property
+  def native_properties(self):
+    """
+    Disk properties read from file metadata by native parser, same names and value types as ``properties``, except
+    ``Is4kAligned`` and ``FragmentationPercentage`` that need scan of whole BAT, see ``DiskImage.allocation_stats``.
+    """
+    with self.image() as image:
+      return image.properties(scan_blocks=False)
+
+  def clone(self, clone_path, differencing=True, native=None):
     """
     Creates clone of current vhd disk.
 
     :param clone_path: path where cloned disk will be stored
     :param differencing: indicates if disk must be thin-copy
+    :param native: create differencing VHDX by writing file directly instead of virtdisk, used by default where
+    virtdisk is not available
     :return: resulting VHDDisk
     """
-    if differencing:
+    if native is None:
+      native = not virtdisk_available()
+    if native:
+      if not differencing:
+        raise VHDException("Only differencing clone can be created natively")
+      create_vhdx(clone_path, parent_path=self.disk_path)
+    elif differencing:
       close_handle(create_vhd(clone_path, parent_path=self.disk_path))
     else:
       close_handle(create_vhd(clone_path, src_path=self.disk_path))
@@ -0,0 +1,259 @@
+"""
+Native VHD(Virtual Hard Disk Image Format Specification v1.0) parser. Reads footer, dynamic disk header, parent
+locators and BAT through mmap, without virtdisk, so it works on any platform.
+"""
+import ntpath
+import os
+import struct
+import uuid
+from typing import List, Tuple, Dict, Any
+
+from hvapi.disk.image import DiskImage, BLOCK_ABSENT, BLOCK_PRESENT, BLOCK_PARTIAL, DEFAULT_BAT_CACHE_PAGES
+from hvapi.disk.types import VirtualStorageType, ProviderSubtype, VHDFormatError
+from hvapi.disk.vhdx import local_parent_path
+
+SECTOR_SIZE = 512
+FOOTER_SIZE = 512
+DYNAMIC_HEADER_SIZE = 1024
+
+FOOTER_COOKIE = b"conectix"
+DYNAMIC_HEADER_COOKIE = b"cxsparse"
+FILE_FORMAT_VERSION = 0x00010000
+NO_DATA_OFFSET = 0xFFFFFFFFFFFFFFFF
+UNALLOCATED = 0xFFFFFFFF
+
+DISK_TYPE_FIXED = 2
+DISK_TYPE_DYNAMIC = 3
+DISK_TYPE_DIFFERENCING = 4
+
+_PROVIDER_SUBTYPES = {
+  DISK_TYPE_FIXED: ProviderSubtype.FIXED,
+  DISK_TYPE_DYNAMIC: ProviderSubtype.DYNAMIC,
+  DISK_TYPE_DIFFERENCING: ProviderSubtype.DIFFERENCING
+}
+
+# fixed disks have no blocks, they are mapped in blocks of default size
+DEFAULT_BLOCK_SIZE = 2 * 1024 * 1024
+
+FOOTER_FORMAT = struct.Struct(">8sIIQI4sI4sQQHBBII16sB427s")
+FOOTER_CHECKSUM_OFFSET = 64
+DYNAMIC_HEADER_FORMAT = struct.Struct(">8sQQIIII16sII512s")
+DYNAMIC_HEADER_CHECKSUM_OFFSET = 36
+PARENT_LOCATOR_FORMAT = struct.Struct(">4sIIIQ")
+PARENT_LOCATOR_COUNT = 8
+
+# parent locator platform codes, in order they are tried to find parent, with path encodings
+PLATFORM_CODES = (
+  (b"W2ru", "utf-16-le"),
+  (b"W2ku", "utf-16-le"),
+  (b"Wi2r", "mbcs" if os.name == "nt" else "latin-1"),
+  (b"Wi2k", "mbcs" if os.name == "nt" else "latin-1"),
+)
+
+
+def checksum(data, checksum_offset: int) -> int:
+  """
+  Ones' complement of sum of all bytes, checksum field itself is skipped.
+  """
+  data = bytes(data)
+  return ~(sum(data[:checksum_offset]) + sum(data[checksum_offset + 4:])) & 0xFFFFFFFF
+
+
+class VHDFooter(object):
+  """
+  Hard disk footer, stored at the end of every VHD file and copied to its beginning for dynamic disks.
+  """
+
+  def __init__(self, offset, data):
+    (cookie, self.features, self.version, self.data_offset, self.timestamp, self.creator_application,
+     self.creator_version, self.creator_host_os, self.original_size, self.current_size, self.cylinders, self.heads,
+     self.sectors_per_track, self.disk_type, self.checksum, unique_id, self.saved_state,
+     _) = FOOTER_FORMAT.unpack_from(data)
+    self.offset = offset
+    self.cookie_valid = cookie == FOOTER_COOKIE
+    self.checksum_valid = self.cookie_valid and checksum(data[:FOOTER_SIZE], FOOTER_CHECKSUM_OFFSET) == self.checksum
+    self.unique_id = uuid.UUID(bytes_le=unique_id)
+
+  @property
+  def valid(self) -> bool:
+    return self.cookie_valid and self.checksum_valid and self.disk_type in _PROVIDER_SUBTYPES
+
+
+class ParentLocator(object):
+  def __init__(self, platform_code: bytes, data_space: int, data_length: int, data_offset: int):
+    self.platform_code = platform_code
+    self.data_space = data_space
+    self.data_length = data_length
+    self.data_offset = data_offset
+
+  def __repr__(self):
+    return "ParentLocator(%r, offset=%d, length=%d)" % (self.platform_code, self.data_offset, self.data_length)
+
+
+class VHDFile(DiskImage):
+  """
+  VHD file opened for reading.
+
+  :ivar footer: valid footer, one from the end of file if possible
+  :ivar table_offset: BAT offset, dynamic and differencing disks only
+  :ivar max_table_entries: number of BAT entries
+  :ivar parent_name: parent file name stored in dynamic header
+  :ivar parent_locators: parent locator entries in use
+  :ivar bitmap_size: size of sector bitmap preceding data of each block
+  """
+
+  storage_type = VirtualStorageType.VHD
+  bitmap_msb_first = True
+  bat_page_entries = 1024
+
+  def __init__(self, path, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES):
+    self._bat = None
+    super().__init__(path, bat_cache_pages)
+
+  def _parse(self):
+    if self.file_size < FOOTER_SIZE:
+      raise VHDFormatError("File '%s' is not VHD file" % self.path)
+    self.footer = VHDFooter(self.file_size - FOOTER_SIZE, self._map[self.file_size - FOOTER_SIZE:])
+    if not self.footer.valid:
+      # dynamic disks keep footer copy at the beginning of file
+      footer_copy = VHDFooter(0, self._map[:FOOTER_SIZE])
+      if not footer_copy.valid or footer_copy.disk_type == DISK_TYPE_FIXED:
+        raise VHDFormatError("File '%s' has no valid VHD footer" % self.path)
+      self.footer = footer_copy
+    self.virtual_size = self.footer.current_size
+    self.unique_id = self.footer.unique_id
+    self.timestamp = self.footer.timestamp
+    self.provider_subtype = _PROVIDER_SUBTYPES[self.footer.disk_type]
+    self.logical_sector_size = self.physical_sector_size = SECTOR_SIZE
+    self.parent_name = ""
+    self.parent_locators = []  # type: List[ParentLocator]
+
+    if self.footer.disk_type == DISK_TYPE_FIXED:
+      self.block_size = DEFAULT_BLOCK_SIZE
+      self.table_offset = 0
+      self.max_table_entries = 0
+      self.bitmap_size = 0
+      if self.virtual_size > self.footer.offset:
+        raise VHDFormatError("Fixed disk '%s' is smaller than its virtual size" % self.path)
+      return
+
+    header_offset = self.footer.data_offset
+    if header_offset == NO_DATA_OFFSET or header_offset + DYNAMIC_HEADER_SIZE > self.file_size:
+      raise VHDFormatError("Dynamic header of '%s' is out of file bounds" % self.path)
+    header = self._map[header_offset:header_offset + DYNAMIC_HEADER_SIZE]
+    (cookie, _, self.table_offset, _, self.max_table_entries, self.block_size, header_checksum, parent_id,
+     parent_timestamp, _, parent_name) = DYNAMIC_HEADER_FORMAT.unpack_from(header)
+    if cookie != DYNAMIC_HEADER_COOKIE:
+      raise VHDFormatError("File '%s' has invalid dynamic header" % self.path)
+    if checksum(header, DYNAMIC_HEADER_CHECKSUM_OFFSET) != header_checksum:
+      raise VHDFormatError("Dynamic header checksum of '%s' does not match" % self.path)
+    if not self.block_size or self.block_size % SECTOR_SIZE or self.block_size & (self.block_size - 1):
+      raise VHDFormatError("Invalid block size %d" % self.block_size)
+    if self.max_table_entries < self.block_count or \
+        self.table_offset + self.max_table_entries * 4 > self.file_size:
+      raise VHDFormatError("BAT of '%s' is too small or out of file bounds" % self.path)
+    bitmap_bytes = (self.block_size // SECTOR_SIZE + 7) // 8
+    self.bitmap_size = (bitmap_bytes + SECTOR_SIZE - 1) // SECTOR_SIZE * SECTOR_SIZE
+    # BAT is not copied, pages of it are decoded on demand from view of mapping
+    self._bat = memoryview(self._map)[self.table_offset:self.table_offset + self.max_table_entries * 4]
+
+    if self.footer.disk_type == DISK_TYPE_DIFFERENCING:
+      self.parent_id = uuid.UUID(bytes_le=parent_id)
+      self.parent_timestamp = parent_timestamp
+      self.parent_name = parent_name.decode("utf-16-be", "replace").split("\0", 1)[0]
+      for index in range(PARENT_LOCATOR_COUNT):
+        platform_code, data_space, data_length, _, data_offset = PARENT_LOCATOR_FORMAT.unpack_from(
+          header, DYNAMIC_HEADER_FORMAT.size + index * PARENT_LOCATOR_FORMAT.size)
+        if platform_code.strip(b"\0") and data_length:
+          if data_offset + data_length > self.file_size:
+            raise VHDFormatError("Parent locator %d of '%s' is out of file bounds" % (index, self.path))
+          self.parent_locators.append(ParentLocator(platform_code, data_space, data_length, data_offset))
+
+  def parent_locations(self) -> List[str]:
+    if not self.has_parent:
+      return []
+    base_directory = os.path.dirname(self.path)
+    values = []
+    for platform_code, encoding in PLATFORM_CODES:
+      for locator in self.parent_locators:
+        if locator.platform_code == platform_code:
+          data = self._map[locator.data_offset:locator.data_offset + locator.data_length]
+          values.append(data.decode(encoding, "replace").split("\0", 1)[0])
+    if self.parent_name:
+      values.append(self.parent_name)
+    result = []
+    for value in values:
+      # images are often moved together with parents, so look for parent file near child too
+      for path in (local_parent_path(value, base_directory), os.path.join(base_directory, ntpath.basename(value))):
+        if path not in result:
+          result.append(path)
+    return result
+
+  def _read_bat_page(self, page: int) -> Tuple:
+    first = page * self.bat_page_entries
+    count = min(self.bat_page_entries, self.max_table_entries - first)
+    return struct.unpack_from(">%dI" % count, self._bat, first * 4)
+
+  def _decode(self, entry: int) -> Tuple[int, int]:
+    if entry == UNALLOCATED:
+      return BLOCK_ABSENT, 0
+    offset = entry * SECTOR_SIZE + self.bitmap_size
+    if offset + self.block_size > self.file_size:
+      raise VHDFormatError("Block at sector %d is out of file bounds" % entry)
+    # sectors of dynamic disk block that are not marked in bitmap were never written, but read from file anyway
+    return BLOCK_PARTIAL if self.has_parent else BLOCK_PRESENT, offset
+
+  def block(self, index: int) -> Tuple[int, int]:
+    if not 0 <= index < self.block_count:
+      raise IndexError("Block index %d is out of range" % index)
+    if self._bat is None:
+      return BLOCK_PRESENT, index * self.block_size
+    page, position = divmod(index, self.bat_page_entries)
+    return self._decode(self._bat_cache.get(page)[position])
+
+  def blocks(self):
+    if self._bat is None:
+      yield from super().blocks()
+      return
+    # sequential scan reads BAT pages directly, so it does not evict pages used by random access
+    for page in range((self.block_count + self.bat_page_entries - 1) // self.bat_page_entries):
+      first = page * self.bat_page_entries
+      for position, entry in enumerate(self._read_bat_page(page)[:self.block_count - first]):
+        kind, offset = self._decode(entry)
+        yield first + position, kind, offset
+
+  @property
+  def block_stride(self) -> int:
+    # data of each block is preceded by its sector bitmap
+    return self.bitmap_size + self.block_size
+
+  def sector_bitmap(self, index: int):
+    kind, offset = self.block(index)
+    if kind == BLOCK_ABSENT:
+      return bytes(self.bitmap_size)
+    return self._map[offset - self.bitmap_size:offset]
+
+  def properties(self, scan_blocks=True) -> Dict[str, Any]:
+    result = super().properties(scan_blocks)
+    if self.footer.disk_type == DISK_TYPE_FIXED:
+      # virtdisk reports no block size for fixed VHD
+      result['Size']['BlockSize'] = 0
+    return result
+
+  def close(self):
+    if self._bat is not None:
+      self._bat.release()
+      self._bat = None
+    super().close()
+
+
+def is_vhd(path) -> bool:
+  with open(path, "rb") as f:
+    f.seek(0, os.SEEK_END)
+    if f.tell() < FOOTER_SIZE:
+      return False
+    f.seek(-FOOTER_SIZE, os.SEEK_END)
+    if f.read(8) == FOOTER_COOKIE:
+      return True
+    f.seek(0)
+    return f.read(8) == FOOTER_COOKIE
@@ -0,0 +1,442 @@
+"""
+Native VHDX parser(MS-VHDX v1.0). Reads file identifier, both headers, region table, metadata region and BAT through
+mmap, without virtdisk, so it works on any platform.
+"""
+import ntpath
+import os
+import struct
+import uuid
+from typing import Dict, List, Tuple, Optional
+
+from hvapi.disk.crc32c import crc32c
+from hvapi.disk.image import DiskImage, NULL_GUID, BLOCK_ABSENT, BLOCK_ZERO, BLOCK_PRESENT, BLOCK_PARTIAL, \
+  DEFAULT_BAT_CACHE_PAGES
+from hvapi.disk.types import VirtualStorageType, ProviderSubtype, VHDFormatError
+
+KB = 1024
+MB = 1024 * KB
+
+FILE_IDENTIFIER_SIGNATURE = b"vhdxfile"
+HEADER_SIGNATURE = b"head"
+REGION_TABLE_SIGNATURE = b"regi"
+METADATA_TABLE_SIGNATURE = b"metadata"
+
+FILE_IDENTIFIER_OFFSET = 0
+HEADER_OFFSETS = (64 * KB, 128 * KB)
+HEADER_SIZE = 4 * KB
+REGION_TABLE_OFFSETS = (192 * KB, 256 * KB)
+REGION_TABLE_SIZE = 64 * KB
+METADATA_TABLE_SIZE = 64 * KB
+
+# region and metadata item identifiers
+BAT_REGION_GUID = uuid.UUID("2DC27766-F623-4200-9D64-115E9BFD4A08")
+METADATA_REGION_GUID = uuid.UUID("8B7CA206-4790-4B9A-B8FE-575F050F886E")
+FILE_PARAMETERS_GUID = uuid.UUID("CAA16737-FA36-4D43-B3B6-33F0AA44E76B")
+VIRTUAL_DISK_SIZE_GUID = uuid.UUID("2FA54224-CD1B-4876-B211-5DBED83BF4B8")
+VIRTUAL_DISK_ID_GUID = uuid.UUID("BECA12AB-B2E6-4523-93EF-C309E000C746")
+LOGICAL_SECTOR_SIZE_GUID = uuid.UUID("8141BF1D-A96F-4709-BA47-F233A8FAAB5F")
+PHYSICAL_SECTOR_SIZE_GUID = uuid.UUID("CDA348C7-445D-4471-9CC9-E9885251C556")
+PARENT_LOCATOR_GUID = uuid.UUID("A8D35F2B-B30B-454D-ABF7-D3D84834AB0C")
+VHDX_PARENT_LOCATOR_TYPE_GUID = uuid.UUID("B04AEFB7-D19E-4A81-B789-25B8E9445913")
+
+KNOWN_METADATA_ITEMS = (FILE_PARAMETERS_GUID, VIRTUAL_DISK_SIZE_GUID, VIRTUAL_DISK_ID_GUID, LOGICAL_SECTOR_SIZE_GUID,
+                        PHYSICAL_SECTOR_SIZE_GUID, PARENT_LOCATOR_GUID)
+
+# BAT entry states
+PAYLOAD_BLOCK_NOT_PRESENT = 0
+PAYLOAD_BLOCK_UNDEFINED = 1
+PAYLOAD_BLOCK_ZERO = 2
+PAYLOAD_BLOCK_UNMAPPED = 3
+PAYLOAD_BLOCK_FULLY_PRESENT = 6
+PAYLOAD_BLOCK_PARTIALLY_PRESENT = 7
+SB_BLOCK_NOT_PRESENT = 0
+SB_BLOCK_PRESENT = 6
+
+_PAYLOAD_KINDS = {
+  PAYLOAD_BLOCK_NOT_PRESENT: BLOCK_ABSENT,
+  PAYLOAD_BLOCK_UNDEFINED: BLOCK_ZERO,
+  PAYLOAD_BLOCK_ZERO: BLOCK_ZERO,
+  PAYLOAD_BLOCK_UNMAPPED: BLOCK_ZERO,
+  PAYLOAD_BLOCK_FULLY_PRESENT: BLOCK_PRESENT,
+  PAYLOAD_BLOCK_PARTIALLY_PRESENT: BLOCK_PARTIAL
+}
+
+BAT_ENTRY_STATE_MASK = 0x7
+BAT_ENTRY_OFFSET_MASK = ~(MB - 1) & 0xFFFFFFFFFFFFFFFF
+
+# number of sectors described by one sector bitmap block
+SECTORS_PER_BITMAP_BLOCK = 2 ** 23
+
+HEADER_FORMAT = struct.Struct("<4sIQ16s16s16sHHIQ")
+REGION_TABLE_HEADER_FORMAT = struct.Struct("<4sIII")
+REGION_TABLE_ENTRY_FORMAT = struct.Struct("<16sQII")
+METADATA_TABLE_HEADER_FORMAT = struct.Struct("<8sHH20s")
+METADATA_TABLE_ENTRY_FORMAT = struct.Struct("<16sIIII")
+PARENT_LOCATOR_HEADER_FORMAT = struct.Struct("<16sHH")
+PARENT_LOCATOR_ENTRY_FORMAT = struct.Struct("<IIHH")
+
+MAX_REGION_TABLE_ENTRIES = 2047
+MAX_METADATA_TABLE_ENTRIES = 2047
+
+MIN_BLOCK_SIZE = 1 * MB
+MAX_BLOCK_SIZE = 256 * MB
+MAX_VIRTUAL_SIZE = 64 * 1024 ** 4
+SECTOR_SIZES = (512, 4096)
+
+# parent locator keys, in order they are tried to find parent
+PARENT_PATH_KEYS = ("relative_path", "volume_path", "absolute_win32_path")
+
+
+def guid_from_bytes(data) -> uuid.UUID:
+  return uuid.UUID(bytes_le=bytes(data))
+
+
+def chunk_ratio(block_size: int, logical_sector_size: int) -> int:
+  """
+  Number of payload blocks described by one sector bitmap block.
+  """
+  return SECTORS_PER_BITMAP_BLOCK * logical_sector_size // block_size
+
+
+def bat_entry_count(virtual_size: int, block_size: int, logical_sector_size: int, has_parent: bool) -> int:
+  ratio = chunk_ratio(block_size, logical_sector_size)
+  data_blocks = (virtual_size + block_size - 1) // block_size
+  if has_parent:
+    return (data_blocks + ratio - 1) // ratio * (ratio + 1)
+  return data_blocks + (data_blocks - 1) // ratio
+
+
+def payload_bat_index(index: int, ratio: int) -> int:
+  return index + index // ratio
+
+
+def bitmap_bat_index(index: int, ratio: int) -> int:
+  return index // ratio * (ratio + 1) + ratio
+
+
+class VHDXHeader(object):
+  """
+  One of two VHDX headers.
+
+  :ivar offset: header offset in file
+  :ivar signature_valid: header has 'head' signature
+  :ivar checksum_valid: stored CRC-32C matches header content
+  """
+
+  def __init__(self, offset, data):
+    (signature, self.checksum, self.sequence_number, file_write_guid, data_write_guid, log_guid, self.log_version,
+     self.version, self.log_length, self.log_offset) = HEADER_FORMAT.unpack_from(data)
+    self.offset = offset
+    self.signature_valid = signature == HEADER_SIGNATURE
+    self.file_write_guid = guid_from_bytes(file_write_guid)
+    self.data_write_guid = guid_from_bytes(data_write_guid)
+    self.log_guid = guid_from_bytes(log_guid)
+    self.checksum_valid = self.signature_valid and crc32c(data[:4] + b"\0\0\0\0" + data[8:HEADER_SIZE]) == \
+                          self.checksum
+
+  @property
+  def valid(self) -> bool:
+    return self.signature_valid and self.checksum_valid and self.version == 1
+
+  @property
+  def log_replay_required(self) -> bool:
+    return self.log_guid != NULL_GUID
+
+  def __repr__(self):
+    return "VHDXHeader(offset=%d, sequence_number=%d, valid=%s)" % (self.offset, self.sequence_number, self.valid)
+
+
+class RegionTableEntry(object):
+  def __init__(self, guid: uuid.UUID, file_offset: int, length: int, required: bool):
+    self.guid = guid
+    self.file_offset = file_offset
+    self.length = length
+    self.required = required
+
+  def __repr__(self):
+    return "RegionTableEntry(%s, offset=%d, length=%d)" % (self.guid, self.file_offset, self.length)
+
+
+class RegionTable(object):
+  """
+  One of two VHDX region tables.
+  """
+
+  def __init__(self, offset, data):
+    signature, self.checksum, entry_count, _ = REGION_TABLE_HEADER_FORMAT.unpack_from(data)
+    self.offset = offset
+    self.signature_valid = signature == REGION_TABLE_SIGNATURE
+    self.checksum_valid = self.signature_valid and crc32c(data[:4] + b"\0\0\0\0" + data[8:REGION_TABLE_SIZE]) == \
+                          self.checksum
+    self.entries = []  # type: List[RegionTableEntry]
+    if self.signature_valid and entry_count <= MAX_REGION_TABLE_ENTRIES:
+      for index in range(entry_count):
+        guid, file_offset, length, required = REGION_TABLE_ENTRY_FORMAT.unpack_from(
+          data, REGION_TABLE_HEADER_FORMAT.size + index * REGION_TABLE_ENTRY_FORMAT.size)
+        self.entries.append(RegionTableEntry(guid_from_bytes(guid), file_offset, length, bool(required & 1)))
+
+  @property
+  def valid(self) -> bool:
+    return self.signature_valid and self.checksum_valid
+
+  def find(self, guid: uuid.UUID) -> Optional[RegionTableEntry]:
+    for entry in self.entries:
+      if entry.guid == guid:
+        return entry
+    return None
+
+
+class MetadataEntry(object):
+  def __init__(self, item_id: uuid.UUID, offset: int, length: int, flags: int):
+    self.item_id = item_id
+    self.offset = offset
+    self.length = length
+    self.is_user = bool(flags & 1)
+    self.is_virtual_disk = bool(flags & 2)
+    self.is_required = bool(flags & 4)
+
+  def __repr__(self):
+    return "MetadataEntry(%s, offset=%d, length=%d)" % (self.item_id, self.offset, self.length)
+
+
+def parse_parent_locator(data) -> Tuple[uuid.UUID, Dict[str, str]]:
+  """
+  Parses parent locator metadata item.
+
+  :param data: item content
+  :return: (locator type, key-value entries)
+  """
+  locator_type, _, count = PARENT_LOCATOR_HEADER_FORMAT.unpack_from(data)
+  entries = {}
+  for index in range(count):
+    key_offset, value_offset, key_length, value_length = PARENT_LOCATOR_ENTRY_FORMAT.unpack_from(
+      data, PARENT_LOCATOR_HEADER_FORMAT.size + index * PARENT_LOCATOR_ENTRY_FORMAT.size)
+    if key_offset + key_length > len(data) or value_offset + value_length > len(data):
+      raise VHDFormatError("Parent locator entry %d is out of metadata item bounds" % index)
+    key = bytes(data[key_offset:key_offset + key_length]).decode("utf-16-le")
+    entries[key] = bytes(data[value_offset:value_offset + value_length]).decode("utf-16-le")
+  return guid_from_bytes(locator_type), entries
+
+
+def parse_linkage(value: str) -> Optional[uuid.UUID]:
+  try:
+    return uuid.UUID(value.strip("{}"))
+  except (ValueError, AttributeError):
+    return None
+
+
+def local_parent_path(value: str, base_directory: str) -> str:
+  """
+  Converts Windows path from parent locator to local path, relative paths are resolved against ``base_directory``.
+  """
+  if value.startswith("\\\\?\\"):
+    value = value[4:]
+  if os.sep == "\\":
+    return os.path.normpath(ntpath.join(base_directory, value))
+  if ntpath.isabs(value) or ntpath.splitdrive(value)[0]:
+    # absolute Windows path can be used as is only on Windows
+    return value
+  return os.path.normpath(os.path.join(base_directory, value.replace("\\", "/")))
+
+
+class VHDXFile(DiskImage):
+  """
+  VHDX file opened for reading.
+
+  :ivar creator: creator string of file identifier
+  :ivar headers: both headers, valid or not
+  :ivar header: current header, valid header with greater sequence number
+  :ivar region_table: first valid region table
+  :ivar metadata_entries: metadata table entries by item id
+  :ivar leave_blocks_allocated: file parameters flag, set for fixed disks
+  :ivar parent_locator: parent locator entries of differencing disk
+  :ivar bat_offset: BAT region offset
+  :ivar bat_length: BAT region length
+  :ivar bat_entries: number of BAT entries for virtual size and block size
+  :ivar chunk_ratio: payload blocks per sector bitmap block
+  """
+
+  storage_type = VirtualStorageType.VHDX
+  bat_page_entries = 512
+
+  def __init__(self, path, bat_cache_pages=DEFAULT_BAT_CACHE_PAGES):
+    super().__init__(path, bat_cache_pages)
+
+  def _parse(self):
+    if self.file_size < 1 * MB or self._map[:8] != FILE_IDENTIFIER_SIGNATURE:
+      raise VHDFormatError("File '%s' is not VHDX file" % self.path)
+    self.creator = bytes(self._map[8:8 + 512]).decode("utf-16-le", "replace").split("\0", 1)[0]
+
+    self.headers = [VHDXHeader(offset, self._map[offset:offset + HEADER_SIZE]) for offset in HEADER_OFFSETS]
+    valid_headers = [header for header in self.headers if header.valid]
+    if not valid_headers:
+      raise VHDFormatError("File '%s' has no valid VHDX header" % self.path)
+    self.header = max(valid_headers, key=lambda header: header.sequence_number)
+
+    self.region_tables = [RegionTable(offset, self._map[offset:offset + REGION_TABLE_SIZE])
+                          for offset in REGION_TABLE_OFFSETS]
+    valid_tables = [table for table in self.region_tables if table.valid]
+    if not valid_tables:
+      raise VHDFormatError("File '%s' has no valid region table" % self.path)
+    self.region_table = valid_tables[0]
+    for entry in self.region_table.entries:
+      if entry.required and entry.guid not in (BAT_REGION_GUID, METADATA_REGION_GUID):
+        raise VHDFormatError("Unknown required region %s" % entry.guid)
+    bat_region = self.region_table.find(BAT_REGION_GUID)
+    metadata_region = self.region_table.find(METADATA_REGION_GUID)
+    if bat_region is None or metadata_region is None:
+      raise VHDFormatError("File '%s' has no BAT or metadata region" % self.path)
+    self.bat_offset = bat_region.file_offset
+    self.bat_length = bat_region.length
+    self.metadata_offset = metadata_region.file_offset
+    self.metadata_length = metadata_region.length
+    self._parse_metadata()
+
+    self.chunk_ratio = chunk_ratio(self.block_size, self.logical_sector_size)
+    self.bat_entries = bat_entry_count(self.virtual_size, self.block_size, self.logical_sector_size,
+                                       self.has_parent)
+    if self.bat_entries * 8 > self.bat_length or self.bat_offset + self.bat_length > self.file_size:
+      raise VHDFormatError("BAT region of '%s' is too small or out of file bounds" % self.path)
+
+  def _parse_metadata(self):
+    table = self._map[self.metadata_offset:self.metadata_offset + METADATA_TABLE_SIZE]
+    signature, _, entry_count, _ = METADATA_TABLE_HEADER_FORMAT.unpack_from(table)
+    if signature != METADATA_TABLE_SIGNATURE or entry_count > MAX_METADATA_TABLE_ENTRIES:
+      raise VHDFormatError("File '%s' has invalid metadata table" % self.path)
+    self.metadata_entries = {}  # type: Dict[uuid.UUID, MetadataEntry]
+    for index in range(entry_count):
+      item_id, offset, length, flags, _ = METADATA_TABLE_ENTRY_FORMAT.unpack_from(
+        table, METADATA_TABLE_HEADER_FORMAT.size + index * METADATA_TABLE_ENTRY_FORMAT.size)
+      entry = MetadataEntry(guid_from_bytes(item_id), offset, length, flags)
+      if entry.is_required and entry.item_id not in KNOWN_METADATA_ITEMS:
+        raise VHDFormatError("Unknown required metadata item %s" % entry.item_id)
+      self.metadata_entries[entry.item_id] = entry
+
+    block_size, flags = struct.unpack("<II", self.metadata_item(FILE_PARAMETERS_GUID, 8))
+    self.block_size = block_size
+    self.leave_blocks_allocated = bool(flags & 1)
+    has_parent = bool(flags & 2)
+    self.virtual_size, = struct.unpack("<Q", self.metadata_item(VIRTUAL_DISK_SIZE_GUID, 8))
+    self.unique_id = guid_from_bytes(self.metadata_item(VIRTUAL_DISK_ID_GUID, 16))
+    self.logical_sector_size, = struct.unpack("<I", self.metadata_item(LOGICAL_SECTOR_SIZE_GUID, 4))
+    self.physical_sector_size, = struct.unpack("<I", self.metadata_item(PHYSICAL_SECTOR_SIZE_GUID, 4))
+
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE or block_size & (block_size - 1):
+      raise VHDFormatError("Invalid block size %d" % block_size)
+    if self.logical_sector_size not in SECTOR_SIZES or self.physical_sector_size not in SECTOR_SIZES:
+      raise VHDFormatError("Invalid sector size %d/%d" % (self.logical_sector_size, self.physical_sector_size))
+    if not self.virtual_size or self.virtual_size > MAX_VIRTUAL_SIZE or \
+        self.virtual_size % self.logical_sector_size:
+      raise VHDFormatError("Invalid virtual size %d" % self.virtual_size)
+
+    self.parent_locator = {}
+    self.alternate_parent_id = None
+    if has_parent:
+      self.provider_subtype = ProviderSubtype.DIFFERENCING
+      locator_type, self.parent_locator = parse_parent_locator(self.metadata_item(PARENT_LOCATOR_GUID))
+      if locator_type != VHDX_PARENT_LOCATOR_TYPE_GUID:
+        raise VHDFormatError("Unknown parent locator type %s" % locator_type)
+      self.parent_id = parse_linkage(self.parent_locator.get("parent_linkage"))
+      self.alternate_parent_id = parse_linkage(self.parent_locator.get("parent_linkage2"))
+    elif self.leave_blocks_allocated:
+      self.provider_subtype = ProviderSubtype.FIXED
+    else:
+      self.provider_subtype = ProviderSubtype.DYNAMIC
+
+  def metadata_item(self, item_id: uuid.UUID, expected_length: int = None) -> bytes:
+    """
+    Returns content of metadata item.
+    """
+    entry = self.metadata_entries.get(item_id)
+    if entry is None:
+      raise VHDFormatError("Metadata item %s is missing" % item_id)
+    if entry.offset + entry.length > self.metadata_length or \
+        (expected_length is not None and entry.length < expected_length):
+      raise VHDFormatError("Metadata item %s has invalid location" % item_id)
+    start = self.metadata_offset + entry.offset
+    return self._map[start:start + (expected_length or entry.length)]
+
+  @property
+  def file_write_guid(self) -> uuid.UUID:
+    return self.header.file_write_guid
+
+  @property
+  def data_write_guid(self) -> uuid.UUID:
+    """
+    Identifier of current disk data, differencing children store it as 'parent_linkage'.
+    """
+    return self.header.data_write_guid
+
+  @property
+  def log_replay_required(self) -> bool:
+    return self.header.log_replay_required
+
+  @property
+  def linkage_id(self) -> uuid.UUID:
+    return self.header.data_write_guid
+
+  @property
+  def parent_ids(self) -> List[uuid.UUID]:
+    # 'parent_linkage2' is set while parent is being modified in place, both identifiers are accepted then
+    return [parent_id for parent_id in (self.parent_id, self.alternate_parent_id) if parent_id is not None]
+
+  def parent_locations(self) -> List[str]:
+    base_directory = os.path.dirname(self.path)
+    result = []
+    for key in PARENT_PATH_KEYS:
+      value = self.parent_locator.get(key)
+      if value:
+        path = local_parent_path(value, base_directory)
+        if path not in result:
+          result.append(path)
+        # images are often moved together with parents, so look for parent file near child too
+        nearby = os.path.join(base_directory, ntpath.basename(value))
+        if nearby not in result:
+          result.append(nearby)
+    return result
+
+  def bat_entry(self, bat_index: int) -> int:
+    page, position = divmod(bat_index, self.bat_page_entries)
+    return self._bat_cache.get(page)[position]
+
+  def _read_bat_page(self, page: int) -> Tuple:
+    first = page * self.bat_page_entries
+    count = min(self.bat_page_entries, self.bat_entries - first)
+    return struct.unpack_from("<%dQ" % count, self._map, self.bat_offset + first * 8)
+
+  @staticmethod
+  def _decode(entry: int) -> Tuple[int, int]:
+    kind = _PAYLOAD_KINDS.get(entry & BAT_ENTRY_STATE_MASK)
+    if kind is None:
+      raise VHDFormatError("Invalid BAT entry state %d" % (entry & BAT_ENTRY_STATE_MASK))
+    return kind, entry & BAT_ENTRY_OFFSET_MASK if kind in (BLOCK_PRESENT, BLOCK_PARTIAL) else 0
+
+  def block(self, index: int) -> Tuple[int, int]:
+    if not 0 <= index < self.block_count:
+      raise IndexError("Block index %d is out of range" % index)
+    return self._decode(self.bat_entry(payload_bat_index(index, self.chunk_ratio)))
+
+  def blocks(self):
+    # sequential scan reads BAT pages directly, so it does not evict pages used by random access
+    page_number = -1
+    page = ()
+    for index in range(self.block_count):
+      bat_index = payload_bat_index(index, self.chunk_ratio)
+      if bat_index // self.bat_page_entries != page_number:
+        page_number = bat_index // self.bat_page_entries
+        page = self._read_bat_page(page_number)
+      kind, offset = self._decode(page[bat_index % self.bat_page_entries])
+      yield index, kind, offset
+
+  def sector_bitmap(self, index: int):
+    entry = self.bat_entry(bitmap_bat_index(index, self.chunk_ratio))
+    sectors_per_block = self.block_size // self.logical_sector_size
+    if entry & BAT_ENTRY_STATE_MASK != SB_BLOCK_PRESENT:
+      return bytes(sectors_per_block // 8)
+    start = (entry & BAT_ENTRY_OFFSET_MASK) + (index % self.chunk_ratio) * sectors_per_block // 8
+    return self._map[start:start + sectors_per_block // 8]
+
+
+def is_vhdx(path) -> bool:
+  with open(path, "rb") as f:
+    return f.read(8) == FILE_IDENTIFIER_SIGNATURE
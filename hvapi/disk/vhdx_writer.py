@@ -0,0 +1,370 @@
+"""
+Native VHDX creation. Only file identifier, headers, region tables and metadata are written, log and BAT regions are
+left as holes of sparse file, so creating disk costs about 80KB of writes.
+"""
+import os
+import struct
+import threading
+import uuid
+from typing import Dict, Optional
+
+from hvapi.disk.crc32c import crc32c
+from hvapi.disk.export import write_at
+from hvapi.disk.chain import ParentCache
+from hvapi.disk.formats import open_image
+from hvapi.disk.image import NULL_GUID
+from hvapi.disk.types import VHDException
+from hvapi.disk.vhdx import VHDXFile, MB, FILE_IDENTIFIER_SIGNATURE, HEADER_SIGNATURE, REGION_TABLE_SIGNATURE, \
+  METADATA_TABLE_SIGNATURE, HEADER_OFFSETS, HEADER_SIZE, REGION_TABLE_OFFSETS, BAT_REGION_GUID, \
+  METADATA_REGION_GUID, FILE_PARAMETERS_GUID, VIRTUAL_DISK_SIZE_GUID, VIRTUAL_DISK_ID_GUID, LOGICAL_SECTOR_SIZE_GUID, \
+  PHYSICAL_SECTOR_SIZE_GUID, PARENT_LOCATOR_GUID, VHDX_PARENT_LOCATOR_TYPE_GUID, HEADER_FORMAT, \
+  REGION_TABLE_HEADER_FORMAT, REGION_TABLE_ENTRY_FORMAT, METADATA_TABLE_HEADER_FORMAT, METADATA_TABLE_ENTRY_FORMAT, \
+  PARENT_LOCATOR_HEADER_FORMAT, PARENT_LOCATOR_ENTRY_FORMAT, MIN_BLOCK_SIZE, MAX_BLOCK_SIZE, MAX_VIRTUAL_SIZE, \
+  SECTOR_SIZES, PAYLOAD_BLOCK_ZERO, PAYLOAD_BLOCK_FULLY_PRESENT, PAYLOAD_BLOCK_PARTIALLY_PRESENT, SB_BLOCK_PRESENT, \
+  BAT_ENTRY_STATE_MASK, BAT_ENTRY_OFFSET_MASK, bat_entry_count, payload_bat_index, bitmap_bat_index
+
+DEFAULT_BLOCK_SIZE = 32 * MB
+DEFAULT_DIFFERENCING_BLOCK_SIZE = 2 * MB
+DEFAULT_CREATOR = "hvapi"
+
+# fixed layout of created files, everything is aligned to 1MB as specification requires
+LOG_OFFSET = 1 * MB
+LOG_LENGTH = 1 * MB
+METADATA_OFFSET = 2 * MB
+METADATA_LENGTH = 1 * MB
+BAT_OFFSET = 3 * MB
+# metadata items are stored after 64KB metadata table
+METADATA_ITEMS_OFFSET = 64 * 1024
+
+METADATA_FLAG_USER = 1
+METADATA_FLAG_VIRTUAL_DISK = 2
+METADATA_FLAG_REQUIRED = 4
+
+FILE_PARAMETERS_LEAVE_BLOCKS_ALLOCATED = 1
+FILE_PARAMETERS_HAS_PARENT = 2
+
+
+def round_up(value: int, alignment: int) -> int:
+  return (value + alignment - 1) // alignment * alignment
+
+
+def set_bits(bitmap: bytearray, first: int, count: int):
+  """
+  Sets ``count`` bits of LSB first bitmap starting from bit ``first``.
+  """
+  end = first + count
+  while first < end and first & 7:
+    bitmap[first >> 3] |= 1 << (first & 7)
+    first += 1
+  full_bytes = (end - first) >> 3
+  bitmap[first >> 3:(first >> 3) + full_bytes] = b"\xff" * full_bytes
+  first += full_bytes << 3
+  while first < end:
+    bitmap[first >> 3] |= 1 << (first & 7)
+    first += 1
+
+
+def format_linkage(value: uuid.UUID) -> str:
+  return "{%s}" % str(value).upper()
+
+
+def build_header(sequence_number: int, file_write_guid: uuid.UUID, data_write_guid: uuid.UUID,
+                 log_guid: uuid.UUID = NULL_GUID, log_length=LOG_LENGTH, log_offset=LOG_OFFSET) -> bytes:
+  header = bytearray(HEADER_SIZE)
+  HEADER_FORMAT.pack_into(header, 0, HEADER_SIGNATURE, 0, sequence_number, file_write_guid.bytes_le,
+                          data_write_guid.bytes_le, log_guid.bytes_le, 0, 1, log_length, log_offset)
+  struct.pack_into("<I", header, 4, crc32c(header))
+  return bytes(header)
+
+
+def build_region_table(bat_length: int) -> bytes:
+  """
+  Returns used part of region table, the rest of 64KB table is zeros and is covered by checksum as such.
+  """
+  table = bytearray(REGION_TABLE_HEADER_FORMAT.size + 2 * REGION_TABLE_ENTRY_FORMAT.size)
+  REGION_TABLE_HEADER_FORMAT.pack_into(table, 0, REGION_TABLE_SIGNATURE, 0, 2, 0)
+  REGION_TABLE_ENTRY_FORMAT.pack_into(table, REGION_TABLE_HEADER_FORMAT.size, BAT_REGION_GUID.bytes_le, BAT_OFFSET,
+                                      bat_length, 1)
+  REGION_TABLE_ENTRY_FORMAT.pack_into(table, REGION_TABLE_HEADER_FORMAT.size + REGION_TABLE_ENTRY_FORMAT.size,
+                                      METADATA_REGION_GUID.bytes_le, METADATA_OFFSET, METADATA_LENGTH, 1)
+  struct.pack_into("<I", table, 4, crc32c(bytes(table) + bytes(64 * 1024 - len(table))))
+  return bytes(table)
+
+
+def build_parent_locator(entries: Dict[str, str]) -> bytes:
+  keys_values = b""
+  table = PARENT_LOCATOR_HEADER_FORMAT.pack(VHDX_PARENT_LOCATOR_TYPE_GUID.bytes_le, 0, len(entries))
+  data_offset = PARENT_LOCATOR_HEADER_FORMAT.size + len(entries) * PARENT_LOCATOR_ENTRY_FORMAT.size
+  for key, value in entries.items():
+    key_data = key.encode("utf-16-le")
+    value_data = value.encode("utf-16-le")
+    key_offset = data_offset + len(keys_values)
+    table += PARENT_LOCATOR_ENTRY_FORMAT.pack(key_offset, key_offset + len(key_data), len(key_data), len(value_data))
+    keys_values += key_data + value_data
+  return table + keys_values
+
+
+def build_metadata(virtual_size: int, block_size: int, logical_sector_size: int, physical_sector_size: int,
+                   virtual_disk_id: uuid.UUID, parent_locator: Optional[Dict[str, str]] = None) -> bytes:
+  """
+  Returns used part of metadata region: metadata table followed by items.
+  """
+  flags = FILE_PARAMETERS_HAS_PARENT if parent_locator is not None else 0
+  items = [
+    (FILE_PARAMETERS_GUID, struct.pack("<II", block_size, flags), METADATA_FLAG_REQUIRED),
+    (VIRTUAL_DISK_SIZE_GUID, struct.pack("<Q", virtual_size), METADATA_FLAG_VIRTUAL_DISK | METADATA_FLAG_REQUIRED),
+    (VIRTUAL_DISK_ID_GUID, virtual_disk_id.bytes_le, METADATA_FLAG_VIRTUAL_DISK | METADATA_FLAG_REQUIRED),
+    (LOGICAL_SECTOR_SIZE_GUID, struct.pack("<I", logical_sector_size),
+     METADATA_FLAG_VIRTUAL_DISK | METADATA_FLAG_REQUIRED),
+    (PHYSICAL_SECTOR_SIZE_GUID, struct.pack("<I", physical_sector_size),
+     METADATA_FLAG_VIRTUAL_DISK | METADATA_FLAG_REQUIRED)
+  ]
+  if parent_locator is not None:
+    items.append((PARENT_LOCATOR_GUID, build_parent_locator(parent_locator), METADATA_FLAG_REQUIRED))
+  table = bytearray(METADATA_ITEMS_OFFSET)
+  METADATA_TABLE_HEADER_FORMAT.pack_into(table, 0, METADATA_TABLE_SIGNATURE, 0, len(items), bytes(20))
+  content = b""
+  for index, (item_id, value, item_flags) in enumerate(items):
+    METADATA_TABLE_ENTRY_FORMAT.pack_into(table, METADATA_TABLE_HEADER_FORMAT.size + index *
+                                          METADATA_TABLE_ENTRY_FORMAT.size, item_id.bytes_le,
+                                          METADATA_ITEMS_OFFSET + len(content), len(value), item_flags, 0)
+    # items are 8 byte aligned, so numeric fields are naturally aligned
+    content += value + bytes(round_up(len(value), 8) - len(value))
+  return bytes(table) + content
+
+
+def parent_locator_entries(path: str, parent: VHDXFile) -> Dict[str, str]:
+  """
+  Builds parent locator of child at ``path``: linkage to current parent data and its relative path, absolute path is
+  added only on Windows, where it is meaningful for Hyper-V.
+  """
+  entries = {
+    "parent_linkage": format_linkage(parent.data_write_guid),
+    "relative_path": os.path.relpath(parent.path, os.path.dirname(os.path.abspath(path))).replace(os.sep, "\\")
+  }
+  if os.name == "nt":
+    entries["absolute_win32_path"] = "\\\\?\\" + parent.path
+  return entries
+
+
+def create_vhdx(path, virtual_size: int = None, block_size: int = None, logical_sector_size=512,
+                physical_sector_size=4096, parent_path=None, creator=DEFAULT_CREATOR,
+                cache: Optional[ParentCache] = None) -> uuid.UUID:
+  """
+  Creates dynamic VHDX, or differencing VHDX if ``parent_path`` is given. Differencing disk takes virtual size and
+  sector sizes from parent.
+
+  :param path: path of new disk, must not exist
+  :param virtual_size: size of virtual disk in bytes, multiple of logical sector size
+  :param block_size: block size, power of two from 1MB to 256MB
+  :param logical_sector_size: 512 or 4096
+  :param physical_sector_size: 512 or 4096
+  :param parent_path: parent disk of differencing disk, must be VHDX
+  :param creator: creator string stored in file identifier
+  :param cache: parent cache, bulk clones of one golden image sharing it parse parent once
+  :return: virtual disk id of new disk
+  """
+  parent_locator = None
+  if parent_path is not None:
+    parent = cache.open(parent_path) if cache is not None else open_image(parent_path)
+    try:
+      if not isinstance(parent, VHDXFile):
+        raise VHDException("Parent of VHDX differencing disk must be VHDX, '%s' is not" % parent_path)
+      if virtual_size is not None and virtual_size != parent.virtual_size:
+        raise VHDException("Differencing disk must have virtual size of parent(%d)" % parent.virtual_size)
+      virtual_size = parent.virtual_size
+      logical_sector_size = parent.logical_sector_size
+      physical_sector_size = parent.physical_sector_size
+      block_size = block_size or DEFAULT_DIFFERENCING_BLOCK_SIZE
+      parent_locator = parent_locator_entries(path, parent)
+    finally:
+      if cache is not None:
+        cache.release(parent)
+      else:
+        parent.close()
+  block_size = block_size or DEFAULT_BLOCK_SIZE
+  if virtual_size is None:
+    raise VHDException("Virtual size of dynamic disk is required")
+  if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE or block_size & (block_size - 1):
+    raise VHDException("Invalid block size %d" % block_size)
+  if logical_sector_size not in SECTOR_SIZES or physical_sector_size not in SECTOR_SIZES:
+    raise VHDException("Invalid sector size %d/%d" % (logical_sector_size, physical_sector_size))
+  if not 0 < virtual_size <= MAX_VIRTUAL_SIZE or virtual_size % logical_sector_size:
+    raise VHDException("Invalid virtual size %d" % virtual_size)
+
+  bat_length = round_up(bat_entry_count(virtual_size, block_size, logical_sector_size, parent_locator is not None) * 8,
+                        MB)
+  virtual_disk_id = uuid.uuid4()
+  data_write_guid = uuid.uuid4()
+  identifier = FILE_IDENTIFIER_SIGNATURE + creator.encode("utf-16-le")[:512]
+  region_table = build_region_table(bat_length)
+  metadata = build_metadata(virtual_size, block_size, logical_sector_size, physical_sector_size, virtual_disk_id,
+                            parent_locator)
+  with open(path, "xb") as f:
+    f.write(identifier)
+    for sequence_number, offset in enumerate(HEADER_OFFSETS):
+      f.seek(offset)
+      f.write(build_header(sequence_number, uuid.uuid4(), data_write_guid))
+    for offset in REGION_TABLE_OFFSETS:
+      f.seek(offset)
+      f.write(region_table)
+    f.seek(METADATA_OFFSET)
+    f.write(metadata)
+    # log and BAT are zeros, they stay holes
+    f.truncate(BAT_OFFSET + bat_length)
+  return virtual_disk_id
+
+
+class VHDXUpdater(object):
+  """
+  Writes whole blocks to existing VHDX in crash safe order. Before the first write of each commit new header with new
+  file and data write identifiers is made durable, as specification requires, so children of the disk stop matching it
+  before any of its data changes. Block data is always written to newly allocated space at the end of file, so blocks
+  in use are never overwritten, ``commit`` then makes data durable and updates BAT entries. Sector bitmaps changed by
+  partial blocks are kept in memory and written to new space by ``commit`` too. Crash before BAT update leaves content
+  of disk unchanged, after it every block is either old or new. Space of replaced blocks is not reused.
+
+  :param path: path to VHDX file
+  """
+
+  def __init__(self, path):
+    self.image = VHDXFile(path)
+    try:
+      if self.image.log_replay_required:
+        raise VHDException("Log of '%s' must be replayed before it can be modified" % path)
+      self.fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    except Exception:
+      self.image.close()
+      raise
+    self.block_size = self.image.block_size
+    self._next_offset = round_up(self.image.file_size, MB)
+    # current header, mapping of image is not updated by commits, so it is tracked here
+    self._header_offset = self.image.header.offset
+    self._sequence_number = self.image.header.sequence_number
+    self._header_updated = False
+    self._entries = {}  # type: Dict[int, int]
+    # sector bitmap blocks by BAT index, once loaded they stay here, so BAT of image is never read for them again
+    self._bitmaps = {}  # type: Dict[int, bytearray]
+    self._dirty_bitmaps = set()
+    self._lock = threading.Lock()
+
+  def write_block(self, index: int, data):
+    """
+    Writes whole block to new space, block becomes visible after ``commit``.
+    """
+    if len(data) > self.block_size:
+      raise VHDException("Block data is larger than block size %d" % self.block_size)
+    with self._lock:
+      self._update_header()
+      offset = self._next_offset
+      self._next_offset += self.block_size
+    write_at(self.fd, data, offset)
+    with self._lock:
+      self._entries[payload_bat_index(index, self.image.chunk_ratio)] = offset | PAYLOAD_BLOCK_FULLY_PRESENT
+
+  def write_partial_block(self, index: int, runs):
+    """
+    Writes parts of block of differencing disk, sectors outside of given runs are read from parent. Block is replaced,
+    its previous data in this disk is not visible after ``commit``.
+
+    :param index: block index
+    :param runs: list of (offset in block, data), offsets and lengths are multiples of logical sector size
+    """
+    if not self.image.has_parent:
+      raise VHDException("Partial blocks are supported only by differencing disks")
+    sector_size = self.image.logical_sector_size
+    sectors_per_block = self.block_size // sector_size
+    bitmap = bytearray(sectors_per_block // 8)
+    for run_offset, data in runs:
+      if run_offset % sector_size or len(data) % sector_size or run_offset + len(data) > self.block_size:
+        raise VHDException("Run at %d of %d bytes is not aligned to sectors of block" % (run_offset, len(data)))
+    with self._lock:
+      self._update_header()
+      offset = self._next_offset
+      self._next_offset += self.block_size
+    for run_offset, data in runs:
+      write_at(self.fd, data, offset + run_offset)
+      set_bits(bitmap, run_offset // sector_size, len(data) // sector_size)
+    start = (index % self.image.chunk_ratio) * sectors_per_block // 8
+    with self._lock:
+      self._sector_bitmap(index)[start:start + len(bitmap)] = bitmap
+      self._entries[payload_bat_index(index, self.image.chunk_ratio)] = offset | PAYLOAD_BLOCK_PARTIALLY_PRESENT
+
+  def _update_header(self):
+    """
+    Makes new header with new write identifiers durable, once per commit, must be called with ``_lock`` held.
+    """
+    if self._header_updated:
+      return
+    # new header goes to the other slot, current one stays valid until new one is durable
+    offset = next(header_offset for header_offset in HEADER_OFFSETS if header_offset != self._header_offset)
+    write_at(self.fd, build_header(self._sequence_number + 1, uuid.uuid4(), uuid.uuid4(), NULL_GUID,
+                                   self.image.header.log_length, self.image.header.log_offset), offset)
+    os.fsync(self.fd)
+    self._header_offset = offset
+    self._sequence_number += 1
+    self._header_updated = True
+
+  def _sector_bitmap(self, index: int) -> bytearray:
+    """
+    Returns sector bitmap block of given block for modification, must be called with ``_lock`` held.
+    """
+    bat_index = bitmap_bat_index(index, self.image.chunk_ratio)
+    bitmap = self._bitmaps.get(bat_index)
+    if bitmap is None:
+      entry = self.image.bat_entry(bat_index)
+      if entry & BAT_ENTRY_STATE_MASK == SB_BLOCK_PRESENT:
+        bitmap = bytearray(self.image.read_at(entry & BAT_ENTRY_OFFSET_MASK, MB))
+      else:
+        bitmap = bytearray(MB)
+      self._bitmaps[bat_index] = bitmap
+    self._dirty_bitmaps.add(bat_index)
+    return bitmap
+
+  def zero_block(self, index: int):
+    """
+    Marks block as reading zeros, even if parent has data there.
+    """
+    with self._lock:
+      self._entries[payload_bat_index(index, self.image.chunk_ratio)] = PAYLOAD_BLOCK_ZERO
+
+  @property
+  def pending_blocks(self) -> int:
+    return len(self._entries)
+
+  def commit(self):
+    """
+    Makes written blocks visible: writes new header, which changes file and data write identifiers, unless writes
+    already did, flushes data, then writes BAT entries and flushes them. Children of this disk no longer match it.
+    """
+    if not self._entries:
+      return
+    with self._lock:
+      self._update_header()
+      # bitmaps in use are not overwritten, old payload blocks stay paired with old bitmaps until BAT is updated
+      for bat_index in sorted(self._dirty_bitmaps):
+        bitmap_offset = self._next_offset
+        self._next_offset += MB
+        write_at(self.fd, self._bitmaps[bat_index], bitmap_offset)
+        self._entries[bat_index] = bitmap_offset | SB_BLOCK_PRESENT
+      self._dirty_bitmaps.clear()
+    if self._next_offset > self.image.file_size:
+      # data of the last block of disk may be shorter than block, but its whole space must be in file
+      os.ftruncate(self.fd, max(self._next_offset, os.fstat(self.fd).st_size))
+    os.fsync(self.fd)
+    for bat_index, entry in sorted(self._entries.items()):
+      write_at(self.fd, struct.pack("<Q", entry), self.image.bat_offset + bat_index * 8)
+    os.fsync(self.fd)
+    with self._lock:
+      self._entries.clear()
+      self._header_updated = False
+
+  def close(self):
+    os.close(self.fd)
+    self.image.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
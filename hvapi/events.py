@@ -0,0 +1,156 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+from enum import Enum
+from typing import Dict, Any, List
+
+from hvapi.clr.base import WmiEvent, WmiEventType
+from hvapi.clr.types import ComputerSystem_EnabledState
+from hvapi.hyperv import machine_id_from_instance_id, switch_id_from_path
+from hvapi.types import VirtualMachineState
+
+HOST_EVENT_CLASSES = (
+  "Msvm_ComputerSystem",
+  "Msvm_VirtualSystemSettingData",
+  "Msvm_ProcessorSettingData",
+  "Msvm_MemorySettingData",
+  "Msvm_SyntheticEthernetPortSettingData",
+  "Msvm_EthernetPortAllocationSettingData",
+  "Msvm_StorageAllocationSettingData",
+  "Msvm_SerialPortSettingData"
+)
+
+
+class HostEventType(int, Enum):
+  MACHINE_CREATED = 0
+  MACHINE_DELETED = 1
+  MACHINE_STATE_CHANGED = 2
+  SETTINGS_MODIFIED = 3
+  ADAPTER_CONNECTED = 4
+  ADAPTER_DISCONNECTED = 5
+  EVENTS_DROPPED = 6
+
+
+class HostEvent(object):
+  """
+  Typed change of host machine. ``state`` is set for state changes, ``switch_id`` for adapter events, ``changed`` is
+  tuple of modified property names for modification events, ``dropped`` is count of events lost before this one for
+  ``EVENTS_DROPPED`` events.
+  """
+
+  def __init__(self, event_type: HostEventType, machine_id: str = None, class_name: str = None, path: str = None,
+               properties: Dict[str, Any] = None, changed: tuple = (), state: VirtualMachineState = None,
+               switch_id: str = None, dropped=0):
+    self.event_type = event_type
+    self.machine_id = machine_id
+    self.class_name = class_name
+    self.path = path
+    self.properties = properties
+    self.changed = changed
+    self.state = state
+    self.switch_id = switch_id
+    self.dropped = dropped
+
+  @classmethod
+  def events_dropped(cls, count) -> 'HostEvent':
+    return cls(HostEventType.EVENTS_DROPPED, dropped=count)
+
+  def __repr__(self):
+    if self.event_type == HostEventType.EVENTS_DROPPED:
+      return "HostEvent(%s, %s)" % (self.event_type.name, self.dropped)
+    return "HostEvent(%s, %s)" % (self.event_type.name, self.machine_id)
+
+
+def _changed_properties(event: WmiEvent) -> tuple:
+  previous = event.previous_properties or {}
+  return tuple(sorted(name for name, value in event.properties.items() if previous.get(name) != value))
+
+
+def _switch_ids(properties: Dict[str, Any]) -> List[str]:
+  switch_ids = []
+  for resource in (properties or {}).get('HostResource') or ():
+    switch_id = switch_id_from_path(resource)
+    if switch_id:
+      switch_ids.append(switch_id)
+  return switch_ids
+
+
+def _machine_events(event: WmiEvent) -> List[HostEvent]:
+  properties = event.properties
+  if properties.get('Caption') != "Virtual Machine":
+    return []
+  machine_id = str(properties['Name']).upper()
+  if event.event_type == WmiEventType.CREATED:
+    return [HostEvent(HostEventType.MACHINE_CREATED, machine_id, event.class_name, event.path, properties)]
+  if event.event_type == WmiEventType.DELETED:
+    return [HostEvent(HostEventType.MACHINE_DELETED, machine_id, event.class_name, event.path, properties)]
+  if 'EnabledState' not in _changed_properties(event):
+    return []
+  state = ComputerSystem_EnabledState.from_code(properties['EnabledState']).to_virtual_machine_state()
+  return [HostEvent(HostEventType.MACHINE_STATE_CHANGED, machine_id, event.class_name, event.path, properties,
+                    ('EnabledState',), state=state)]
+
+
+def _adapter_events(event: WmiEvent, machine_id: str) -> List[HostEvent]:
+  switches = _switch_ids(event.properties)
+  previous_switches = _switch_ids(event.previous_properties)
+  if event.event_type == WmiEventType.CREATED:
+    previous_switches = []
+  elif event.event_type == WmiEventType.DELETED:
+    previous_switches, switches = switches, []
+  result = [HostEvent(HostEventType.ADAPTER_DISCONNECTED, machine_id, event.class_name, event.path, event.properties,
+                      switch_id=switch_id) for switch_id in previous_switches if switch_id not in switches]
+  result.extend(HostEvent(HostEventType.ADAPTER_CONNECTED, machine_id, event.class_name, event.path, event.properties,
+                          switch_id=switch_id) for switch_id in switches if switch_id not in previous_switches)
+  return result
+
+
+def translate_event(event: WmiEvent) -> List[HostEvent]:
+  """
+  Translates WMI instance event of one of ``HOST_EVENT_CLASSES`` to typed host events. Events that do not change
+  anything visible(e.g. modification events without changed properties) are translated to empty list.
+
+  :param event: WMI event
+  :return: list of host events
+  """
+  if event.class_name == "Msvm_ComputerSystem":
+    return _machine_events(event)
+  machine_id = event.properties.get('VirtualSystemIdentifier') or \
+               machine_id_from_instance_id(event.properties.get('InstanceID'))
+  if not machine_id:
+    return []
+  machine_id = str(machine_id).upper()
+  if event.class_name == "Msvm_EthernetPortAllocationSettingData":
+    result = _adapter_events(event, machine_id)
+    if event.event_type == WmiEventType.MODIFIED:
+      changed = tuple(name for name in _changed_properties(event) if name != 'HostResource')
+      if changed:
+        result.append(HostEvent(HostEventType.SETTINGS_MODIFIED, machine_id, event.class_name, event.path,
+                                event.properties, changed))
+    return result
+  if event.event_type == WmiEventType.MODIFIED:
+    changed = _changed_properties(event)
+    if changed:
+      return [HostEvent(HostEventType.SETTINGS_MODIFIED, machine_id, event.class_name, event.path, event.properties,
+                        changed)]
+  return []
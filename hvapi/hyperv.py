@@ -23,16 +23,17 @@ THE SOFTWARE.
 """
 import logging
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 from hvapi.clr.types import ComputerSystem_RequestStateChange_RequestedState, \
   ComputerSystem_RequestStateChange_ReturnCodes, ComputerSystem_EnabledState, ShutdownComponent_OperationalStatus, \
   ShutdownComponent_ShutdownComponent_ReturnCodes
 from hvapi.clr.base import ScopeHolder, ManagementObjectHolder, Node, Relation, \
-  VirtualSystemSettingDataNode, Property, MOHTransformers, PropertySelector, generate_guid, clr_Array, clr_String, \
-  ListPropertySelector
-from hvapi.clr.classes_wrappers import VirtualSystemManagementService
+  VirtualSystemSettingDataNode, Property, MOHTransformers, PropertySelector, generate_guid, ListPropertySelector, \
+  parse_object_path
+from hvapi.clr.classes_wrappers import VirtualSystemManagementService, JobWrapper
 from hvapi.disk.vhd import VHDDisk
+from hvapi.instrumentation import api_call
 from hvapi.types import VirtualMachineGeneration, VirtualMachineState, ComPort
 
 _CLS_MAP_PRIORITY = {
@@ -41,19 +42,44 @@ _CLS_MAP_PRIORITY = {
 DEFAULT_WAIT_OP_TIMEOUT = 60
 
 
+def machine_id_from_instance_id(instance_id) -> str:
+  """
+  Extracts machine id from setting data InstanceID, e.g. 'Microsoft:<machine id>\\<device id>\\...'.
+
+  :param instance_id: InstanceID of setting data object
+  :return: upper-cased machine id or ``None``
+  """
+  if not instance_id or not str(instance_id).startswith("Microsoft:"):
+    return None
+  return str(instance_id)[len("Microsoft:"):].split("\\", 1)[0].upper()
+
+
+def switch_id_from_path(path) -> str:
+  """
+  Extracts switch id from Msvm_VirtualEthernetSwitch path, e.g. port HostResource value.
+
+  :param path: switch path
+  :return: upper-cased switch id or ``None``
+  """
+  class_name, keys = parse_object_path(path)
+  if class_name.lower() != "msvm_virtualethernetswitch":
+    return None
+  for key_name, key_value in keys:
+    if key_name.lower() == "name":
+      return key_value.strip('"').upper()
+
+
 class VirtualSwitch(ManagementObjectHolder):
   @property
+  @api_call
   def name(self):
     return self.properties['ElementName']
 
   @property
+  @api_call
   def id(self):
     return self.properties['Name']
 
-  def __eq__(self, other):
-    if other:
-      return self.id == other.id and self.name == other.name
-
   @classmethod
   def from_moh(cls, moh: ManagementObjectHolder) -> 'VirtualSwitch':
     return cls._create_cls_from_moh(cls, 'Msvm_VirtualEthernetSwitch', moh)
@@ -61,15 +87,17 @@ class VirtualSwitch(ManagementObjectHolder):
 
 class VirtualNetworkAdapter(ManagementObjectHolder):
   @property
+  @api_call
   def address(self) -> str:
     return self.properties['Address']
 
   @property
+  @api_call
   def switch(self) -> 'VirtualSwitch':
     result = []
     port_to_switch_path = (
       Node(Relation.RELATED, "Msvm_EthernetPortAllocationSettingData"),
-      Node(Relation.PROPERTY, "HostResource", (Property.ARRAY, MOHTransformers.from_reference))
+      Node(Relation.PROPERTY, "HostResource", (Property.ARRAY, MOHTransformers.partial_reference('ElementName', 'Name')))
     )
     for _, virtual_switch in self.traverse(port_to_switch_path):
       result.append(VirtualSwitch.from_moh(virtual_switch))
@@ -79,6 +107,7 @@ class VirtualNetworkAdapter(ManagementObjectHolder):
       return result[0]
     return None
 
+  @api_call
   def connect(self, virtual_switch: 'VirtualSwitch'):
     """
     Connect adapter to given virtual switch.
@@ -107,15 +136,18 @@ class VirtualNetworkAdapter(ManagementObjectHolder):
 
 class VirtualComPort(ManagementObjectHolder):
   @property
+  @api_call
   def name(self) -> str:
     return self.properties.ElementName
 
   @property
+  @api_call
   def path(self) -> str:
     if len(self.properties.Connection) > 0:
       return self.properties.Connection[0]
 
   @path.setter
+  @api_call
   def path(self, value):
     management_service = VirtualSystemManagementService.from_moh(
       self.scope_holder.query_one('SELECT * FROM Msvm_VirtualSystemManagementService')
@@ -129,13 +161,15 @@ class VirtualComPort(ManagementObjectHolder):
 
 
 class ShutdownComponent(ManagementObjectHolder):
-  def InitiateShutdown(self, Force, Reason):
+  @api_call
+  def InitiateShutdown(self, Force, Reason, wait_job=True):
     out_objects = self.invoke("InitiateShutdown", Force=Force, Reason=Reason)
     return self._evaluate_invocation_result(
       out_objects,
       ShutdownComponent_ShutdownComponent_ReturnCodes,
       ShutdownComponent_ShutdownComponent_ReturnCodes.Completed_with_No_Error,
-      ShutdownComponent_ShutdownComponent_ReturnCodes.Method_Parameters_Checked_JobStarted
+      ShutdownComponent_ShutdownComponent_ReturnCodes.Method_Parameters_Checked_JobStarted,
+      wait_job
     )
 
   @classmethod
@@ -165,6 +199,7 @@ class VirtualMachine(ManagementObjectHolder):
   RESOURCE_CLASSES = ("Msvm_ProcessorSettingData", "Msvm_MemorySettingData")
   SYSTEM_CLASSES = ("Msvm_VirtualSystemSettingData",)
 
+  @api_call
   def apply_properties(self, class_name: str, properties: Dict[str, Any]):
     """
     Apply ``properties`` for ``class_name`` that associated with virtual machine.
@@ -183,6 +218,7 @@ class VirtualMachine(ManagementObjectHolder):
     if class_name in self.SYSTEM_CLASSES:
       management_service.ModifySystemSettings(SystemSettings=class_instance)
 
+  @api_call
   def apply_properties_group(self, properties_group: Dict[str, Dict[str, Any]]):
     """
     Applies given properties to virtual machine.
@@ -193,6 +229,7 @@ class VirtualMachine(ManagementObjectHolder):
       self.apply_properties(cls, properties)
 
   @property
+  @api_call
   def name(self) -> str:
     """
     Virtual machine name that displayed everywhere in windows UI and other places.
@@ -202,6 +239,7 @@ class VirtualMachine(ManagementObjectHolder):
     return self.properties['ElementName']
 
   @property
+  @api_call
   def id(self) -> str:
     """
     Unique virtual machine identifier.
@@ -211,6 +249,7 @@ class VirtualMachine(ManagementObjectHolder):
     return self.properties['Name']
 
   @property
+  @api_call
   def state(self) -> VirtualMachineState:
     """
     Current virtual machine state. It will try to get actual real state(like running, stopped, etc) for
@@ -227,6 +266,43 @@ class VirtualMachine(ManagementObjectHolder):
       time.sleep(.1)
     return state
 
+  @property
+  @api_call
+  def enabled_state(self) -> ComputerSystem_EnabledState:
+    """
+    Current raw machine state, without waiting for middle states to finish.
+
+    :return: Msvm_ComputerSystem.EnabledState value
+    """
+    return self._enabled_state
+
+  @api_call
+  def request_state_change(self, desired_state: ComputerSystem_RequestStateChange_RequestedState) -> JobWrapper:
+    """
+    Requests state change without waiting for transition.
+
+    :param desired_state: requested state
+    :return: job that tracks transition, ``None`` if transition was completed synchronously
+    """
+    job = self.RequestStateChange(desired_state, wait_job=False).get('Job')
+    return job if isinstance(job, JobWrapper) else None
+
+  @api_call
+  def request_shutdown(self, force=False) -> Tuple[bool, JobWrapper]:
+    """
+    Initiates graceful shutdown without waiting for it.
+
+    :param force: indicates if we need to wait for user programs completion
+    :return: tuple of flag that indicates if shutdown was initiated(shutdown component is available) and job that
+      tracks it(``None`` if there is no job)
+    """
+    shutdown_component = self._get_shutdown_component()
+    if not shutdown_component:
+      return False, None
+    job = shutdown_component.InitiateShutdown(force, "hvapi shutdown", wait_job=False).get('Job')
+    return True, job if isinstance(job, JobWrapper) else None
+
+  @api_call
   def start(self):
     """
     Try to start virtual machine and wait for started state for ``timeout`` seconds.
@@ -242,6 +318,7 @@ class VirtualMachine(ManagementObjectHolder):
     else:
       self.LOG.debug("Machine '%s' is already started", self.id)
 
+  @api_call
   def stop(self, force=False, hard=False):
     """
     Try to stop virtual machine and wait for stopped state for ``timeout`` seconds.
@@ -266,6 +343,7 @@ class VirtualMachine(ManagementObjectHolder):
       self.kill()
     self.LOG.debug("Stopped machine '%s'", self.id)
 
+  @api_call
   def kill(self):
     """
     Hard-kill vm.
@@ -276,6 +354,7 @@ class VirtualMachine(ManagementObjectHolder):
     if not self._wait_for_enabled_state(target_enabled_state, timeout=DEFAULT_WAIT_OP_TIMEOUT):
       raise Exception("Failed to put machine to '%s' in %s seconds" % (target_enabled_state, DEFAULT_WAIT_OP_TIMEOUT))
 
+  @api_call
   def save(self):
     """
     Try to save virtual machine state and wait for saved state for ``timeout`` seconds.
@@ -291,6 +370,7 @@ class VirtualMachine(ManagementObjectHolder):
     else:
       self.LOG.debug("Machine '%s' is already saved", self.id)
 
+  @api_call
   def pause(self):
     if self.state != VirtualMachineState.PAUSED:
       self.LOG.debug("Pausing machine '%s'", self.id)
@@ -303,6 +383,7 @@ class VirtualMachine(ManagementObjectHolder):
     else:
       self.LOG.debug("Machine '%s' is already paused", self.id)
 
+  @api_call
   def add_adapter(self, static_mac=False, mac=None, adapter_name="Network Adapter") -> 'VirtualNetworkAdapter':
     """
     Add adapter to virtual machine.
@@ -326,7 +407,7 @@ class VirtualMachine(ManagementObjectHolder):
     )
     Msvm_VirtualSystemSettingData = self.traverse((VirtualSystemSettingDataNode,))[-1][-1]
     Msvm_SyntheticEthernetPortSettingData = Msvm_ResourcePool.traverse(Msvm_SyntheticEthernetPortSettingData_Path)[-1][-1]
-    Msvm_SyntheticEthernetPortSettingData.properties.VirtualSystemIdentifiers = clr_Array[clr_String]([generate_guid()])
+    Msvm_SyntheticEthernetPortSettingData.properties.VirtualSystemIdentifiers = [generate_guid()]
     Msvm_SyntheticEthernetPortSettingData.properties.ElementName = adapter_name
     Msvm_SyntheticEthernetPortSettingData.properties.StaticMacAddress = static_mac
     if mac:
@@ -337,6 +418,7 @@ class VirtualMachine(ManagementObjectHolder):
     )
     return VirtualNetworkAdapter.from_moh(result['ResultingResourceSettings'][-1])
 
+  @api_call
   def is_connected_to_switch(self, virtual_switch: 'VirtualSwitch'):
     """
     Returns ``True`` if machine is connected to given ``VirtualSwitch``.
@@ -348,6 +430,7 @@ class VirtualMachine(ManagementObjectHolder):
       if virtual_switch == adapter.switch:
         return True
 
+  @api_call
   def add_vhd_disk(self, vhd_disk: VHDDisk):
     """
     Adds given ``VHDDisk`` to virtual machine.
@@ -389,6 +472,7 @@ class VirtualMachine(ManagementObjectHolder):
     management_service.AddResourceSettings(Msvm_VirtualSystemSettingData, virtual_hard_disk_data)
 
   @property
+  @api_call
   def network_adapters(self) -> List[VirtualNetworkAdapter]:
     """
     Returns list of machines network adapters.
@@ -405,6 +489,7 @@ class VirtualMachine(ManagementObjectHolder):
     return result
 
   @property
+  @api_call
   def com_ports(self) -> List[VirtualComPort]:
     """
     Returns list of machine com-ports.
@@ -422,6 +507,7 @@ class VirtualMachine(ManagementObjectHolder):
       result.append(VirtualComPort.from_moh(com_port))
     return result
 
+  @api_call
   def get_com_port(self, port: ComPort):
     """
     Get concrete com-port
@@ -455,13 +541,16 @@ class VirtualMachine(ManagementObjectHolder):
     return ComputerSystem_EnabledState.from_code(self.properties['EnabledState'])
 
   # WMI object methods
-  def RequestStateChange(self, RequestedState: ComputerSystem_RequestStateChange_RequestedState, TimeoutPeriod=None):
+  @api_call
+  def RequestStateChange(self, RequestedState: ComputerSystem_RequestStateChange_RequestedState, TimeoutPeriod=None,
+                         wait_job=True):
     out_objects = self.invoke("RequestStateChange", RequestedState=RequestedState.value, TimeoutPeriod=TimeoutPeriod)
     return self._evaluate_invocation_result(
       out_objects,
       ComputerSystem_RequestStateChange_ReturnCodes,
       ComputerSystem_RequestStateChange_ReturnCodes.Completed_with_No_Error,
-      ComputerSystem_RequestStateChange_ReturnCodes.Method_Parameters_Checked_Transition_Started
+      ComputerSystem_RequestStateChange_ReturnCodes.Method_Parameters_Checked_Transition_Started,
+      wait_job
     )
 
   @classmethod
@@ -480,31 +569,53 @@ class HypervHost(object):
       self.scope = ScopeHolder()
 
   @property
+  @api_call
   def switches(self) -> List[VirtualSwitch]:
     machines = self.scope.query('SELECT * FROM Msvm_VirtualEthernetSwitch')
     return [VirtualSwitch.from_moh(_machine) for _machine in machines] if machines else []
 
+  @api_call
   def switches_by_name(self, name) -> VirtualSwitch:
     machines = self.scope.query('SELECT * FROM Msvm_VirtualEthernetSwitch WHERE ElementName = "%s"' % name)
     return [VirtualSwitch.from_moh(_machine) for _machine in machines] if machines else []
 
+  @api_call
   def switch_by_id(self, switch_id) -> VirtualSwitch:
     machines = self.scope.query('SELECT * FROM Msvm_VirtualEthernetSwitch WHERE Name = "%s"' % switch_id)
     return [VirtualSwitch.from_moh(_machine) for _machine in machines] if machines else []
 
   @property
+  @api_call
   def machines(self) -> List[VirtualMachine]:
     machines = self.scope.query('SELECT * FROM Msvm_ComputerSystem WHERE Caption = "Virtual Machine"')
     return [VirtualMachine.from_moh(_machine) for _machine in machines] if machines else []
 
+  @api_call
   def machines_by_name(self, name) -> List[VirtualMachine]:
     machines = self.scope.query('SELECT * FROM Msvm_ComputerSystem WHERE Caption = "Virtual Machine" AND ElementName = "%s"' % name)
     return [VirtualMachine.from_moh(_machine) for _machine in machines] if machines else []
 
+  @api_call
   def machine_by_id(self, machine_id) -> VirtualMachine:
     machines = self.scope.query('SELECT * FROM Msvm_ComputerSystem WHERE Caption = "Virtual Machine" AND Name = "%s"' % machine_id)
     return [VirtualMachine.from_moh(_machine) for _machine in machines] if machines else []
 
+  @api_call
+  def machine_enabled_states(self) -> Dict[str, ComputerSystem_EnabledState]:
+    """
+    Returns current raw states of all machines with one narrow query.
+
+    :return: dict of upper-cased machine id to Msvm_ComputerSystem.EnabledState value
+    """
+    result = {}
+    # raw objects, so partially selected objects do not get to identity map
+    for machine in self.scope.query_objects(
+        'SELECT CreationClassName, Name, EnabledState FROM Msvm_ComputerSystem WHERE Caption = "Virtual Machine"'):
+      result[str(machine.get_property('Name')).upper()] = ComputerSystem_EnabledState.from_code(
+        machine.get_property('EnabledState'))
+    return result
+
+  @api_call
   def create_machine(self, name, properties_group: Dict[str, Dict[str, Any]] = None, machine_generation: VirtualMachineGeneration = VirtualMachineGeneration.GEN1) -> VirtualMachine:
     management_service = VirtualSystemManagementService.from_moh(self.scope.query_one('SELECT * FROM Msvm_VirtualSystemManagementService'))
     Msvm_VirtualSystemSettingData = self.scope.cls_instance("Msvm_VirtualSystemSettingData")
@@ -512,5 +623,6 @@ class HypervHost(object):
     Msvm_VirtualSystemSettingData.properties.VirtualSystemSubType = machine_generation.value
     result = management_service.DefineSystem(SystemSettings=Msvm_VirtualSystemSettingData)
     vm = VirtualMachine.from_moh(result['ResultingSystem'])
-    vm.apply_properties_group(properties_group)
+    if properties_group:
+      vm.apply_properties_group(properties_group)
     return vm
@@ -0,0 +1,368 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Dict, Tuple, IO, Union
+
+# WMI round trips, recorded by hooks in hvapi.clr
+QUERY = "query"
+RELOAD = "reload"
+GET_RELATED = "get_related"
+GET_RELATIONSHIPS = "get_relationships"
+INVOKE = "invoke"
+JOB_WAIT = "job_wait"
+# public API call that encloses round trips
+API_CALL = "api_call"
+
+UNATTRIBUTED = "-"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = False
+_current_api = contextvars.ContextVar("hvapi_current_api", default=None)
+
+
+class Histogram(object):
+  """
+  Latency histogram with fixed upper bounds of buckets in seconds, last bucket is unbounded.
+  """
+
+  def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.count = 0
+    self.errors = 0
+    self.total = 0.0
+
+  def observe(self, duration: float, error=False):
+    self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+    self.count += 1
+    self.total += duration
+    if error:
+      self.errors += 1
+
+  def cumulative(self) -> List[Tuple[float, int]]:
+    """
+    Returns cumulative counts per bucket upper bound, last bound is ``float('inf')``.
+    """
+    result = []
+    running = 0
+    for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+      running += count
+      result.append((bound, running))
+    return result
+
+  def quantile(self, q: float) -> float:
+    """
+    Returns upper bound of bucket that contains given quantile.
+    """
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    for bound, count in self.cumulative():
+      if count >= rank:
+        return bound
+    return float("inf")
+
+  def copy(self) -> 'Histogram':
+    result = Histogram(self.buckets)
+    result.counts = list(self.counts)
+    result.count = self.count
+    result.errors = self.errors
+    result.total = self.total
+    return result
+
+
+class Metrics(object):
+  """
+  Thread safe registry of histograms keyed by (api, operation, detail), where ``api`` is name of enclosing public API
+  call, ``operation`` is one of round trip names and ``detail`` is method name for invocations, class name for queries
+  and relation arguments for traversals.
+  """
+
+  def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.lock = threading.Lock()
+    self.histograms = {}  # type: Dict[Tuple[str, str, str], Histogram]
+
+  def observe(self, api: str, operation: str, detail: str, duration: float, error=False):
+    key = (api or UNATTRIBUTED, operation, detail or "")
+    with self.lock:
+      histogram = self.histograms.get(key)
+      if histogram is None:
+        histogram = self.histograms[key] = Histogram(self.buckets)
+      histogram.observe(duration, error)
+
+  def snapshot(self) -> Dict[Tuple[str, str, str], Histogram]:
+    with self.lock:
+      return {key: histogram.copy() for key, histogram in self.histograms.items()}
+
+  def reset(self):
+    with self.lock:
+      self.histograms.clear()
+
+
+_metrics = Metrics()
+_sinks = []  # type: List[Sink]
+
+
+# sinks
+
+class Sink(object):
+  def export(self, snapshot: Dict[Tuple[str, str, str], Histogram]):
+    raise NotImplementedError()
+
+
+class LoggingSink(Sink):
+  """
+  Logs one line per (api, operation, detail) with call count, errors, total and p50/p99 latency.
+  """
+
+  def __init__(self, logger: logging.Logger = None, level=logging.INFO):
+    self.logger = logger or logging.getLogger(__name__)
+    self.level = level
+
+  def export(self, snapshot: Dict[Tuple[str, str, str], Histogram]):
+    for (api, operation, detail), histogram in sorted(snapshot.items()):
+      self.logger.log(
+        self.level, "%s %s%s calls=%d errors=%d total=%.6fs p50<=%ss p99<=%ss", api, operation,
+        "(%s)" % detail if detail else "", histogram.count, histogram.errors, histogram.total,
+        histogram.quantile(0.5), histogram.quantile(0.99)
+      )
+
+
+def _label(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text(snapshot: Dict[Tuple[str, str, str], Histogram], prefix="hvapi_wmi") -> str:
+  """
+  Renders snapshot in Prometheus text exposition format, as ``<prefix>_seconds`` histogram and ``<prefix>_errors_total``
+  counter labeled by api, operation and detail.
+  """
+  lines = [
+    "# HELP %s_seconds Latency of WMI round trips." % prefix,
+    "# TYPE %s_seconds histogram" % prefix
+  ]
+  errors = []
+  for (api, operation, detail), histogram in sorted(snapshot.items()):
+    labels = 'api="%s",operation="%s",detail="%s"' % (_label(api), _label(operation), _label(detail))
+    for bound, count in histogram.cumulative():
+      lines.append('%s_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, "+Inf" if bound == float("inf") else bound,
+                                                         count))
+    lines.append("%s_seconds_sum{%s} %r" % (prefix, labels, histogram.total))
+    lines.append("%s_seconds_count{%s} %d" % (prefix, labels, histogram.count))
+    errors.append("%s_errors_total{%s} %d" % (prefix, labels, histogram.errors))
+  lines.append("# HELP %s_errors_total WMI round trips that raised an exception." % prefix)
+  lines.append("# TYPE %s_errors_total counter" % prefix)
+  lines.extend(errors)
+  return "\n".join(lines) + "\n"
+
+
+class PrometheusTextSink(Sink):
+  """
+  Writes snapshot in Prometheus text format to given file path(atomically replaced, suitable for node_exporter
+  textfile collector) or file object.
+  """
+
+  def __init__(self, file: Union[str, IO], prefix="hvapi_wmi"):
+    self.file = file
+    self.prefix = prefix
+
+  def export(self, snapshot: Dict[Tuple[str, str, str], Histogram]):
+    text = prometheus_text(snapshot, self.prefix)
+    if isinstance(self.file, str):
+      temp_path = self.file + ".tmp"
+      with open(temp_path, "w") as f:
+        f.write(text)
+      os.replace(temp_path, self.file)
+    else:
+      self.file.write(text)
+      self.file.flush()
+
+
+class CallbackSink(Sink):
+  def __init__(self, callback: Callable[[Dict[Tuple[str, str, str], Histogram]], None]):
+    self.callback = callback
+
+  def export(self, snapshot: Dict[Tuple[str, str, str], Histogram]):
+    self.callback(snapshot)
+
+
+# control
+
+def enable(*sinks: Sink):
+  """
+  Enables instrumentation, given sinks receive metrics on every ``flush``. Sink that is already enabled is not added
+  again.
+  """
+  global _enabled
+  for sink in sinks:
+    if sink not in _sinks:
+      _sinks.append(sink)
+  _enabled = True
+
+
+def disable():
+  global _enabled
+  _enabled = False
+  del _sinks[:]
+
+
+def is_enabled() -> bool:
+  return _enabled
+
+
+def metrics() -> Metrics:
+  return _metrics
+
+
+def flush():
+  """
+  Exports current metrics to all sinks.
+  """
+  snapshot = _metrics.snapshot()
+  for sink in _sinks:
+    sink.export(snapshot)
+
+
+def current_api() -> str:
+  return _current_api.get()
+
+
+# hooks
+
+def observe(operation: str, detail: str, duration: float, error=False):
+  _metrics.observe(_current_api.get(), operation, detail, duration, error)
+
+
+class _Measure(object):
+  __slots__ = ("operation", "detail", "started")
+
+  def __init__(self, operation, detail):
+    self.operation = operation
+    self.detail = detail
+
+  def __enter__(self):
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    observe(self.operation, self.detail, time.perf_counter() - self.started, exc_type is not None)
+
+
+class _NoMeasure(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    pass
+
+
+_NO_MEASURE = _NoMeasure()
+
+
+def measure(operation: str, detail: str = None):
+  """
+  Context manager that records duration of enclosed round trip, does nothing while instrumentation is disabled.
+  """
+  if not _enabled:
+    return _NO_MEASURE
+  return _Measure(operation, detail)
+
+
+def instrumented(operation: str, detail: Callable = None):
+  """
+  Decorator that records duration of every call of function as given round trip operation.
+
+  :param operation: operation name
+  :param detail: optional function that gets call arguments and returns detail label
+  """
+
+  def _decorator(func):
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+      if not _enabled:
+        return func(*args, **kwargs)
+      started = time.perf_counter()
+      error = True
+      try:
+        result = func(*args, **kwargs)
+        error = False
+        return result
+      finally:
+        observe(operation, detail(*args, **kwargs) if detail else None, time.perf_counter() - started, error)
+
+    return _wrapper
+
+  return _decorator
+
+
+def api_call(func):
+  """
+  Decorator for public API functions. Round trips made inside of outermost decorated call are attributed to it by
+  qualified function name, call itself is recorded as ``api_call`` operation.
+  """
+  name = func.__qualname__
+
+  @functools.wraps(func)
+  def _wrapper(*args, **kwargs):
+    if not _enabled or _current_api.get() is not None:
+      return func(*args, **kwargs)
+    token = _current_api.set(name)
+    started = time.perf_counter()
+    error = True
+    try:
+      result = func(*args, **kwargs)
+      error = False
+      return result
+    finally:
+      observe(API_CALL, None, time.perf_counter() - started, error)
+      _current_api.reset(token)
+
+  return _wrapper
+
+
+class attribute_to(object):
+  """
+  Context manager that attributes round trips made inside of it to given name, for application level operations.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    self._token = None
+
+  def __enter__(self):
+    self._token = _current_api.set(self.name)
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    _current_api.reset(self._token)
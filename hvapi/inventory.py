@@ -0,0 +1,294 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import logging
+import time
+from enum import Enum
+from typing import Dict, Any, List, Iterable, Callable, Tuple
+
+from hvapi.clr.base import ScopeHolder, WmiEvent, WmiEventType, plain_properties, normalize_path
+
+INVENTORY_CLASSES = (
+  "Msvm_ComputerSystem",
+  "Msvm_VirtualEthernetSwitch",
+  "Msvm_VirtualSystemSettingData",
+  "Msvm_ProcessorSettingData",
+  "Msvm_MemorySettingData",
+  "Msvm_SyntheticEthernetPortSettingData",
+  "Msvm_EthernetPortAllocationSettingData",
+  "Msvm_StorageAllocationSettingData",
+  "Msvm_SerialPortSettingData"
+)
+DEFAULT_RESYNC_INTERVAL = 300
+
+
+class InventoryChangeType(int, Enum):
+  ADDED = 0
+  MODIFIED = 1
+  REMOVED = 2
+
+
+class InventoryChange(object):
+  """
+  Change of one inventory object. ``properties`` are new properties of object(``None`` for removed objects),
+  ``previous`` - properties known before change(``None`` for added objects).
+  """
+
+  def __init__(self, change_type: InventoryChangeType, class_name: str, path: str, properties: Dict[str, Any],
+               previous: Dict[str, Any] = None):
+    self.change_type = change_type
+    self.class_name = class_name
+    self.path = path
+    self.properties = properties
+    self.previous = previous
+
+  def __repr__(self):
+    return "InventoryChange(%s, %s, %s)" % (self.change_type.name, self.class_name, self.path)
+
+
+class InventoryOutOfSync(Exception):
+  pass
+
+
+class HostInventory(object):
+  """
+  In-memory inventory of host objects, keyed by normalized object path(see ``normalize_path``), so full and relative
+  paths of the same object from snapshots and events match. Contains only plain python values, so it is safe to read
+  it from any thread.
+  """
+
+  def __init__(self):
+    self.objects = {}  # type: Dict[str, Tuple[str, Dict[str, Any]]]
+
+  def __len__(self):
+    return len(self.objects)
+
+  def __contains__(self, path):
+    return normalize_path(path) in self.objects
+
+  def get(self, path) -> Dict[str, Any]:
+    item = self.objects.get(normalize_path(path))
+    if item:
+      return item[1]
+
+  def by_class(self, class_name) -> Dict[str, Dict[str, Any]]:
+    return {path: properties for path, (cls, properties) in self.objects.items() if cls == class_name}
+
+  def apply_event(self, event: WmiEvent, strict: bool = True) -> 'InventoryChange':
+    """
+    Applies given event to inventory. Raises ``InventoryOutOfSync`` if event can not be applied to current inventory
+    state, e.g. modification or deletion of unknown object, which means that some events were lost.
+
+    :param event: event to apply
+    :param strict: if ``False``, deletion of unknown object is ignored and modification of unknown object adds it,
+      used for events that may be already reflected in inventory
+    :return: resulting change or ``None`` if nothing changed
+    """
+    path = normalize_path(event.path)
+    known = self.objects.get(path)
+    if event.event_type == WmiEventType.DELETED:
+      if known is None:
+        if not strict:
+          return None
+        raise InventoryOutOfSync("Deletion of unknown object '%s'" % event.path)
+      del self.objects[path]
+      return InventoryChange(InventoryChangeType.REMOVED, known[0], path, None, known[1])
+    if event.event_type == WmiEventType.MODIFIED and known is None and strict:
+      raise InventoryOutOfSync("Modification of unknown object '%s'" % event.path)
+    return self._put(event.class_name, path, event.properties)
+
+  def replace(self, snapshot: Dict[str, Tuple[str, Dict[str, Any]]]) -> List['InventoryChange']:
+    """
+    Replaces inventory with given full snapshot.
+
+    :param snapshot: dict of object path to (class name, properties) tuples
+    :return: list of changes between previous inventory state and snapshot
+    """
+    snapshot = {normalize_path(path): item for path, item in snapshot.items()}
+    changes = []
+    for path in [path for path in self.objects if path not in snapshot]:
+      class_name, properties = self.objects.pop(path)
+      changes.append(InventoryChange(InventoryChangeType.REMOVED, class_name, path, None, properties))
+    for path, (class_name, properties) in snapshot.items():
+      change = self._put(class_name, path, properties)
+      if change:
+        changes.append(change)
+    return changes
+
+  def _put(self, class_name, path, properties) -> 'InventoryChange':
+    known = self.objects.get(path)
+    self.objects[path] = (class_name, properties)
+    if known is None:
+      return InventoryChange(InventoryChangeType.ADDED, class_name, path, properties)
+    if known[1] != properties:
+      return InventoryChange(InventoryChangeType.MODIFIED, class_name, path, properties, known[1])
+    return None
+
+
+class InventorySynchronizer(object):
+  """
+  Keeps ``HostInventory`` in sync with host by applying WMI instance events instead of rebuilding whole inventory.
+  Full resync is performed on start, every ``resync_interval`` seconds and every time when events were lost(event that
+  can not be applied to inventory or failed event source).
+
+  ``event_source`` is a callable that accepts timeout and returns next ``WmiEvent`` or ``None`` on timeout,
+  ``snapshot_source`` is a callable that returns full snapshot suitable for ``HostInventory.replace``. Both are built
+  from ``scope`` if omitted, passing fakes allows to drive synchronizer without host.
+  """
+  LOG = logging.getLogger('%s.%s' % (__module__, __qualname__))
+
+  def __init__(
+      self,
+      scope: ScopeHolder = None,
+      class_names: Iterable[str] = INVENTORY_CLASSES,
+      resync_interval: float = DEFAULT_RESYNC_INTERVAL,
+      event_source: Callable[[float], WmiEvent] = None,
+      snapshot_source: Callable[[], Dict[str, Tuple[str, Dict[str, Any]]]] = None,
+      clock: Callable[[], float] = time.monotonic
+  ):
+    self.scope = scope
+    self.class_names = tuple(class_names)
+    self.resync_interval = resync_interval
+    self.inventory = HostInventory()
+    self.clock = clock
+    self._watcher = None
+    self._event_source = event_source
+    self._snapshot_source = snapshot_source or self._query_snapshot
+    self._subscribers = []
+    self._last_resync = None
+    self._resync_required = True
+
+  def subscribe(self, callback: Callable[['InventoryChange'], None]):
+    self._subscribers.append(callback)
+
+  def unsubscribe(self, callback: Callable[['InventoryChange'], None]):
+    self._subscribers.remove(callback)
+
+  def request_resync(self):
+    self._resync_required = True
+
+  def resync(self) -> List['InventoryChange']:
+    # watcher is subscribed before snapshot is taken, changes made while snapshot is queried are queued by it
+    self._open_watcher()
+    changes = self.inventory.replace(self._snapshot_source())
+    self._last_resync = self.clock()
+    self._resync_required = False
+    self.LOG.debug("Full inventory resync, %s objects, %s changes", len(self.inventory), len(changes))
+    self._notify(changes)
+    changes.extend(self._apply_queued_events())
+    return changes
+
+  def process_event(self, event: WmiEvent) -> 'InventoryChange':
+    """
+    Applies event to inventory. Event source is expected to deliver only events of ``class_names`` and their
+    subclasses, like ISA query of watcher does, so class of event is not checked again.
+    """
+    try:
+      change = self.inventory.apply_event(event)
+    except InventoryOutOfSync as e:
+      self.LOG.debug("Inventory is out of sync: %s", e)
+      self.request_resync()
+      return None
+    if change:
+      self._notify((change,))
+    return change
+
+  def step(self, timeout: float = 1.0):
+    """
+    Performs one synchronization step: resync if required, then waits for one event for ``timeout`` seconds and
+    applies it.
+
+    :param timeout: seconds to wait for event
+    """
+    if self._resync_required or self.clock() - self._last_resync >= self.resync_interval:
+      self.resync()
+    try:
+      event = self._next_event(timeout)
+    except Exception:
+      self._watcher_failed()
+      return
+    if event is not None:
+      self.process_event(event)
+
+  def run(self, should_stop: Callable[[], bool] = lambda: False, timeout: float = 1.0):
+    try:
+      while not should_stop():
+        self.step(timeout)
+    finally:
+      self._close_watcher()
+
+  def _apply_queued_events(self):
+    """
+    Applies events queued while snapshot was taken. Some of them may be already reflected in snapshot, so they are
+    applied non-strictly, last event of every object still leaves it in its latest state.
+    """
+    changes = []
+    while True:
+      try:
+        event = self._next_event(0)
+      except Exception:
+        self._watcher_failed()
+        break
+      if event is None:
+        break
+      change = self.inventory.apply_event(event, strict=False)
+      if change:
+        self._notify((change,))
+        changes.append(change)
+    return changes
+
+  def _open_watcher(self):
+    if self._event_source is None and self._watcher is None:
+      self._watcher = self.scope.watch_instances(self.class_names)
+
+  def _next_event(self, timeout):
+    if self._event_source:
+      return self._event_source(timeout)
+    self._open_watcher()
+    return self._watcher.next_event(timeout)
+
+  def _watcher_failed(self):
+    self.LOG.exception("Failed to get event, switching to full resync")
+    self._close_watcher()
+    self.request_resync()
+
+  def _close_watcher(self):
+    if self._watcher is not None:
+      watcher, self._watcher = self._watcher, None
+      watcher.close()
+
+  def _query_snapshot(self):
+    result = {}
+    for class_name in self.class_names:
+      for moh in self.scope.query("SELECT * FROM %s" % class_name):
+        # ISA-like queries also return subclasses, so use real class name of object
+        result[moh.object_path] = (moh.class_name, plain_properties(moh.management_object))
+    return result
+
+  def _notify(self, changes):
+    for change in changes:
+      for subscriber in list(self._subscribers):
+        try:
+          subscriber(change)
+        except Exception:
+          self.LOG.exception("Inventory subscriber failed")
@@ -0,0 +1,473 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import array
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import operator
+import struct
+import sys
+import zlib
+from types import MappingProxyType
+from typing import Dict, Any, Tuple, Mapping, Iterable, List
+
+# Layout:
+#
+#   magic(4) version(1) kind(1) export_id(16) base_id(16) zlib compressed payload
+#   payload: metadata length(uint32), metadata(JSON), string pool length(uint32), string pool, column blobs
+#   string pool: utf-8 strings separated by NUL, or JSON list if some string contains NUL
+#
+# Records are stored by class in columns, so property names are stored once per class, and integer and string columns
+# are packed arrays of smallest fitting type, decoded by single C call. Strings are interned to pool in order of
+# records, so identifiers repeated by related objects(machine id in Name and InstanceID of its devices) stay close for
+# compression. Paths are not stored if all paths of class are built from one key column, e.g. '...Name="<Name>"'.
+MAGIC = b"HVIX"
+FORMAT_VERSION = 2
+EXPORT_CLASSES = (
+  "Msvm_ComputerSystem",
+  "Msvm_VirtualEthernetSwitch",
+  "Msvm_SyntheticEthernetPortSettingData",
+  "Msvm_EthernetPortAllocationSettingData"
+)
+_NULL_ID = b"\0" * 16
+_HEADER = struct.Struct("<4sBB16s16s")
+_LENGTH = struct.Struct("<I")
+
+_KIND_FULL = 0
+_KIND_DELTA = 1
+
+# column encodings
+_COLUMN_STRINGS = "s"  # pool indexes
+_COLUMN_STRING_TUPLES = "st"  # tuple lengths, then pool indexes of all items
+_COLUMN_INTEGERS = "i"  # followed by array type code
+_COLUMN_TUPLES = "t"  # tuples of plain values
+_COLUMN_JSON = "j"  # plain values
+_COLUMN_NESTED = "n"  # anything else, lists are loaded as tuples
+
+# signed array types by size
+_INTEGER_TYPES = tuple((typecode, -(1 << (8 * size - 1)), (1 << (8 * size - 1)) - 1)
+                       for typecode, size in (("b", 1), ("h", 2), ("i", 4), ("q", 8)))
+
+_ABSENT = object()
+_UNCHANGED = object()
+
+
+class InventoryExportException(Exception):
+  pass
+
+
+class InventoryRecord(collections.namedtuple("InventoryRecord", ("class_name", "path", "properties"))):
+  """
+  Read-only inventory record, ``properties`` is read-only mapping of plain python values.
+  """
+  __slots__ = ()
+
+
+# creates record without python level constructor call, loading builds thousands of them
+_new_record = functools.partial(tuple.__new__, InventoryRecord)
+
+
+class InventorySnapshot(object):
+  """
+  Result of loading inventory export. ``records`` maps object path to ``InventoryRecord``.
+  """
+
+  def __init__(self, export_id: bytes, records: Dict[str, InventoryRecord]):
+    self.export_id = export_id
+    self.records = records
+
+  def by_class(self, class_name) -> Iterable[InventoryRecord]:
+    return [record for record in self.records.values() if record.class_name == class_name]
+
+  def __len__(self):
+    return len(self.records)
+
+  @classmethod
+  def from_objects(cls, objects: Mapping[str, Tuple[str, Dict[str, Any]]], export_id: bytes) -> 'InventorySnapshot':
+    return cls(export_id, {
+      path: InventoryRecord(class_name, path, MappingProxyType(dict(properties)))
+      for path, (class_name, properties) in objects.items()
+    })
+
+
+def _pack_array(typecode, values) -> bytes:
+  packed = array.array(typecode, values)
+  if sys.byteorder == "big":
+    packed.byteswap()
+  return packed.tobytes()
+
+
+def _unpack_array(typecode, data) -> array.array:
+  unpacked = array.array(typecode)
+  unpacked.frombytes(data)
+  if sys.byteorder == "big":
+    unpacked.byteswap()
+  return unpacked
+
+
+def _tuples(value):
+  if type(value) is list:
+    return tuple(_tuples(item) for item in value)
+  return value
+
+
+class _Table(object):
+  """
+  Records of one class collected for encoding.
+  """
+
+  def __init__(self, class_name):
+    self.class_name = class_name
+    self.paths = []  # type: List[str]
+    self.rows = []  # type: List[Mapping[str, Any]]
+    self.base_rows = []  # type: List[Mapping[str, Any]]
+    # values of each column by row, ``_ABSENT`` where row has no such property
+    self.columns = collections.OrderedDict()
+    self.complete = set()
+    self.key = None
+
+  def collect(self):
+    for column in sorted(set().union(*self.rows)):
+      try:
+        self.columns[column] = list(map(operator.itemgetter(column), self.rows))
+        self.complete.add(column)
+      except KeyError:
+        self.columns[column] = [properties.get(column, _ABSENT) for properties in self.rows]
+    self.key = self._key_column()
+
+  def _key_column(self) -> Tuple[str, str]:
+    """
+    Finds column all paths are built from, returns (path prefix, column name) or ``None``.
+    """
+    path = self.paths[0]
+    for column, values in self.columns.items():
+      value = values[0]
+      if column not in self.complete or type(value) is not str or not path.endswith('="%s"' % value):
+        continue
+      prefix = path[:len(path) - len(value) - 1]
+      if set(map(type, values)) == {str} and \
+          list(map((prefix.replace("%", "%%") + '%s"').__mod__, values)) == self.paths:
+        return prefix, column
+    return None
+
+
+class _Encoder(object):
+  def __init__(self):
+    self.strings = {}  # type: Dict[str, int]
+    self.blobs = []  # type: List[bytes]
+    # type of string pool indexes, set once pool is complete
+    self.index = "I"
+
+  def blob(self, data: bytes) -> int:
+    self.blobs.append(data)
+    return len(data)
+
+  def column(self, values: List[Any]) -> Tuple[str, int]:
+    types = set(map(type, values))
+    if types == {str}:
+      return _COLUMN_STRINGS, self.blob(_pack_array(self.index, list(map(self.strings.__getitem__, values))))
+    if types == {int}:
+      low, high = min(values), max(values)
+      for typecode, type_min, type_max in _INTEGER_TYPES:
+        if type_min <= low and high <= type_max:
+          return _COLUMN_INTEGERS + typecode, self.blob(_pack_array(typecode, values))
+    if types == {tuple} and all(type(item) is str for value in values for item in value):
+      lengths = _pack_array("I", list(map(len, values)))
+      items = _pack_array(self.index, list(map(self.strings.__getitem__, itertools.chain.from_iterable(values))))
+      return _COLUMN_STRING_TUPLES, self.blob(_LENGTH.pack(len(lengths)) + lengths + items)
+    if types == {tuple} and not any(type(item) in (tuple, list) for value in values for item in value):
+      encoding = _COLUMN_TUPLES
+    elif tuple in types or list in types:
+      encoding = _COLUMN_NESTED
+    else:
+      encoding = _COLUMN_JSON
+    try:
+      data = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+    except TypeError:
+      value = next(value for value in values if not isinstance(value, (type(None), bool, int, float, str, tuple, list)))
+      raise InventoryExportException("Value '%r' of type '%s' can not be exported" % (value, type(value)))
+    return encoding, self.blob(data.encode("utf-8"))
+
+
+def dump_inventory(objects: Mapping[str, Tuple[str, Dict[str, Any]]], base: InventorySnapshot = None,
+                   class_names: Iterable[str] = EXPORT_CLASSES) -> bytes:
+  """
+  Serializes inventory objects(``HostInventory.objects`` or same-shaped dict) to compact binary form. If ``base`` is
+  given, result will contain only difference against it: added and changed records(unchanged properties are not
+  stored) and removed paths.
+
+  :param objects: dict of object path to (class name, properties) tuples
+  :param base: snapshot of previous export to encode delta against
+  :param class_names: classes to export, ``None`` to export everything
+  :return: serialized inventory
+  """
+  if class_names is not None:
+    class_names = set(class_names)
+  base_records = base.records if base is not None else {}
+  encoder = _Encoder()
+
+  tables = collections.OrderedDict()
+  exported_paths = set()
+  exported_rows = []
+  for path, (class_name, properties) in objects.items():
+    if class_names is not None and class_name not in class_names:
+      continue
+    exported_paths.add(path)
+    base_record = base_records.get(path)
+    base_properties = None
+    if base_record is not None and base_record.class_name == class_name:
+      if base_record.properties == properties:
+        continue
+      base_properties = base_record.properties
+    table = tables.get(class_name)
+    if table is None:
+      table = tables[class_name] = _Table(class_name)
+    table.paths.append(path)
+    table.rows.append(properties)
+    table.base_rows.append(base_properties)
+    exported_rows.append(properties)
+
+  # strings are pooled in order of records, so strings of one record are together
+  if all(type(properties) is dict for properties in exported_rows):
+    values = list(itertools.chain.from_iterable(map(dict.values, exported_rows)))
+  else:
+    values = list(itertools.chain.from_iterable(map(operator.methodcaller("values"), exported_rows)))
+  try:
+    values = dict.fromkeys(values)
+  except TypeError:
+    # unhashable values are left as they are
+    pass
+  strings = [value for value in values if type(value) is str]
+  if tuple in set(map(type, values)):
+    strings.extend(item for value in values if type(value) is tuple for item in value if type(item) is str)
+  encoder.strings = dict(zip(dict.fromkeys(strings), itertools.count()))
+
+  for table in tables.values():
+    table.collect()
+    if table.key is None:
+      for path in table.paths:
+        encoder.strings.setdefault(path, len(encoder.strings))
+  encoder.index = "H" if len(encoder.strings) <= 0x10000 else "I"
+
+  metadata = []
+  for table in tables.values():
+    key = table.key
+    path_size = encoder.column(table.paths)[1] if key is None else None
+    delta = table.base_rows.count(None) != len(table.base_rows)
+    encoded_columns = []
+    for column, values in table.columns.items():
+      unchanged = []
+      if delta:
+        stored = []
+        for row_index, (value, base_properties) in enumerate(zip(values, table.base_rows)):
+          if value is _ABSENT:
+            continue
+          # key column is always stored, paths are built from it
+          if base_properties is not None and (key is None or column != key[1]) and \
+              base_properties.get(column, _ABSENT) == value:
+            unchanged.append(row_index)
+          else:
+            stored.append(row_index)
+      elif column not in table.complete:
+        stored = [row_index for row_index, value in enumerate(values) if value is not _ABSENT]
+      else:
+        stored = None
+      if stored is not None:
+        values = [values[row_index] for row_index in stored]
+      encoding, size = encoder.column(values)
+      # row lists are omitted when every row stores value
+      stored_size = encoder.blob(_pack_array("I", stored)) if stored is not None else None
+      unchanged_size = encoder.blob(_pack_array("I", unchanged)) if unchanged else None
+      encoded_columns.append((column, encoding, size, stored_size, unchanged_size))
+    metadata.append((table.class_name, len(table.rows), key, path_size, encoded_columns))
+
+  removed = [path for path in base_records if path not in exported_paths] if base is not None else []
+  pool = "\0".join(encoder.strings)
+  pool_format = "text"
+  if pool.count("\0") != max(0, len(encoder.strings) - 1):
+    pool = json.dumps(list(encoder.strings), ensure_ascii=False)
+    pool_format = "json"
+  pool = pool.encode("utf-8")
+  metadata = json.dumps({"tables": metadata, "removed": removed, "index": encoder.index, "pool": pool_format,
+                         "strings": len(encoder.strings)},
+                        ensure_ascii=False).encode("utf-8")
+  payload = zlib.compress(b"".join([_LENGTH.pack(len(metadata)), metadata, _LENGTH.pack(len(pool)), pool] +
+                                   encoder.blobs), 1)
+
+  base_id = base.export_id if base is not None else _NULL_ID
+  export_id = hashlib.sha1(base_id + payload).digest()[:16]
+  kind = _KIND_DELTA if base is not None else _KIND_FULL
+  return _HEADER.pack(MAGIC, FORMAT_VERSION, kind, export_id, base_id) + payload
+
+
+class _Decoder(object):
+  def __init__(self, data: bytes):
+    self.data = memoryview(data)
+    self.offset = 0
+    self.strings = []  # type: List[str]
+    self.index = "I"
+
+  def chunk(self, size) -> memoryview:
+    result = self.data[self.offset:self.offset + size]
+    self.offset += size
+    return result
+
+  def sized(self) -> memoryview:
+    return self.chunk(_LENGTH.unpack(self.chunk(_LENGTH.size))[0])
+
+  def column(self, encoding, size) -> List[Any]:
+    data = self.chunk(size)
+    if encoding == _COLUMN_STRINGS:
+      return list(map(self.strings.__getitem__, _unpack_array(self.index, data)))
+    if encoding == _COLUMN_STRING_TUPLES:
+      lengths_size = _LENGTH.unpack_from(data)[0]
+      lengths = _unpack_array("I", data[_LENGTH.size:_LENGTH.size + lengths_size])
+      items = list(map(self.strings.__getitem__, _unpack_array(self.index, data[_LENGTH.size + lengths_size:])))
+      if lengths.count(1) == len(lengths):
+        return list(zip(items))
+      items = iter(items)
+      return [tuple(itertools.islice(items, length)) for length in lengths]
+    if encoding.startswith(_COLUMN_INTEGERS):
+      return _unpack_array(encoding[len(_COLUMN_INTEGERS):], data).tolist()
+    if encoding == _COLUMN_JSON:
+      return json.loads(str(data, "utf-8"))
+    if encoding == _COLUMN_TUPLES:
+      return list(map(tuple, json.loads(str(data, "utf-8"))))
+    if encoding == _COLUMN_NESTED:
+      return [_tuples(value) for value in json.loads(str(data, "utf-8"))]
+    raise InventoryExportException("Unknown column encoding '%s'" % encoding)
+
+  def rows(self, size) -> List[int]:
+    return _unpack_array("I", self.chunk(size)).tolist()
+
+
+def load_inventory(data: bytes, base: InventorySnapshot = None) -> InventorySnapshot:
+  """
+  Loads result of ``dump_inventory``. Delta exports require ``base`` snapshot they were encoded against.
+
+  :param data: serialized inventory
+  :param base: snapshot delta was encoded against
+  :return: loaded snapshot
+  """
+  if len(data) < _HEADER.size:
+    raise InventoryExportException("Unknown inventory export format")
+  magic, version, kind, export_id, base_id = _HEADER.unpack_from(data)
+  if magic != MAGIC or version != FORMAT_VERSION:
+    raise InventoryExportException("Unknown inventory export format")
+  if kind == _KIND_DELTA:
+    if base is None or base.export_id != base_id:
+      raise InventoryExportException("Delta export requires base export '%s'" % base_id.hex())
+    records = dict(base.records)
+  else:
+    records = {}
+
+  try:
+    decoder = _Decoder(zlib.decompress(data[_HEADER.size:]))
+  except zlib.error as e:
+    raise InventoryExportException("Inventory export is corrupted: %s" % e)
+  metadata = json.loads(str(decoder.sized(), "utf-8"))
+  pool = str(decoder.sized(), "utf-8")
+  if metadata["pool"] == "json":
+    decoder.strings = json.loads(pool)
+  else:
+    decoder.strings = pool.split("\0") if metadata["strings"] else []
+  decoder.index = metadata["index"]
+
+  for class_name, count, key, path_size, encoded_columns in metadata["tables"]:
+    paths = decoder.column(_COLUMN_STRINGS, path_size) if key is None else None
+    names = []
+    columns = []
+    masked = False
+    for column, encoding, size, stored_size, unchanged_size in encoded_columns:
+      values = decoder.column(encoding, size)
+      if stored_size is not None or unchanged_size is not None:
+        masked = True
+        full = [_ABSENT] * count
+        for row_index, value in zip(decoder.rows(stored_size) if stored_size is not None else range(count), values):
+          full[row_index] = value
+        if unchanged_size is not None:
+          for row_index in decoder.rows(unchanged_size):
+            full[row_index] = _UNCHANGED
+        values = full
+      names.append(column)
+      columns.append(values)
+    if key is not None:
+      prefix, key_column = key
+      paths = [prefix + value + '"' for value in columns[names.index(key_column)]]
+    rows = zip(*columns) if columns else [()] * count
+    if not masked:
+      properties = map(MappingProxyType, map(dict, map(zip, itertools.repeat(names), rows)))
+      records.update(zip(paths, map(_new_record, zip(itertools.repeat(class_name), paths, properties))))
+      continue
+    for path, row in zip(paths, rows):
+      base_record = records.get(path)
+      properties = {}
+      for column, value in zip(names, row):
+        if value is _ABSENT:
+          continue
+        if value is _UNCHANGED:
+          value = base_record.properties[column]
+        properties[column] = value
+      records[path] = InventoryRecord(class_name, path, MappingProxyType(properties))
+
+  for path in metadata["removed"]:
+    records.pop(path, None)
+  return InventorySnapshot(export_id, records)
+
+
+class InventoryExporter(object):
+  """
+  Host side of inventory shipping. First export is full, each next one is delta against previous export, until
+  ``reset`` is called(e.g. when controller lost its copy).
+  """
+
+  def __init__(self, class_names: Iterable[str] = EXPORT_CLASSES):
+    self.class_names = tuple(class_names) if class_names is not None else None
+    self.last_snapshot = None
+
+  def export(self, objects: Mapping[str, Tuple[str, Dict[str, Any]]]) -> bytes:
+    objects = getattr(objects, 'objects', objects)
+    if self.class_names is not None:
+      objects = {path: item for path, item in objects.items() if item[0] in self.class_names}
+    data = dump_inventory(objects, self.last_snapshot, self.class_names)
+    self.last_snapshot = InventorySnapshot.from_objects(objects, data[6:22])
+    return data
+
+  def reset(self):
+    self.last_snapshot = None
+
+
+class InventoryImporter(object):
+  """
+  Controller side of inventory shipping, keeps last loaded snapshot to apply deltas.
+  """
+
+  def __init__(self):
+    self.snapshot = None
+
+  def load(self, data: bytes) -> InventorySnapshot:
+    self.snapshot = load_inventory(data, self.snapshot)
+    return self.snapshot
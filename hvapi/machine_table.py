@@ -0,0 +1,283 @@
+"""
+The MIT License
+
+Copyright (c) 2017 Eugene Chekanskiy, echekanskiy@gmail.com
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import operator
+from array import array
+from typing import Dict, List, Sequence, Iterable, Any
+
+from hvapi.clr.base import ScopeHolder
+from hvapi.clr.types import ComputerSystem_EnabledState
+from hvapi.hyperv import VirtualMachine, machine_id_from_instance_id, switch_id_from_path
+from hvapi.types import VirtualMachineState
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+NUMERIC_COLUMNS = ("enabled_state", "state", "memory", "cpu_count")
+OBJECT_COLUMNS = ("id", "name", "path")
+
+
+class Mask(object):
+  """
+  Row selection produced by column comparison. Supports ``&``, ``|`` and ``~``.
+  """
+
+  def __init__(self, values):
+    self.values = values
+
+  def __and__(self, other: 'Mask') -> 'Mask':
+    if numpy is not None:
+      return Mask(self.values & other.values)
+    return Mask([a and b for a, b in zip(self.values, other.values)])
+
+  def __or__(self, other: 'Mask') -> 'Mask':
+    if numpy is not None:
+      return Mask(self.values | other.values)
+    return Mask([a or b for a, b in zip(self.values, other.values)])
+
+  def __invert__(self) -> 'Mask':
+    if numpy is not None:
+      return Mask(~self.values)
+    return Mask([not a for a in self.values])
+
+  def indices(self):
+    if numpy is not None:
+      return numpy.flatnonzero(self.values)
+    return [index for index, value in enumerate(self.values) if value]
+
+  def count(self) -> int:
+    if numpy is not None:
+      return int(numpy.count_nonzero(self.values))
+    return sum(1 for value in self.values if value)
+
+
+class Column(object):
+  """
+  One table column. Comparison operators are evaluated for whole column at once and return ``Mask``.
+  """
+
+  def __init__(self, name, values):
+    self.name = name
+    self.values = values
+
+  def __len__(self):
+    return len(self.values)
+
+  def __iter__(self):
+    return iter(self.values)
+
+  def __getitem__(self, item):
+    return self.values[item]
+
+  def _compare(self, other, op):
+    if isinstance(other, Column):
+      other = other.values
+    if numpy is not None:
+      return Mask(numpy.asarray(op(self.values, other), dtype=bool))
+    if isinstance(other, (list, array)):
+      return Mask([op(a, b) for a, b in zip(self.values, other)])
+    return Mask([op(a, other) for a in self.values])
+
+  def __eq__(self, other):
+    return self._compare(other, operator.eq)
+
+  def __ne__(self, other):
+    return self._compare(other, operator.ne)
+
+  def __lt__(self, other):
+    return self._compare(other, operator.lt)
+
+  def __le__(self, other):
+    return self._compare(other, operator.le)
+
+  def __gt__(self, other):
+    return self._compare(other, operator.gt)
+
+  def __ge__(self, other):
+    return self._compare(other, operator.ge)
+
+  __hash__ = None
+
+  def isin(self, values: Iterable[Any]) -> Mask:
+    values = set(values)
+    if numpy is not None and self.values.dtype != object:
+      return Mask(numpy.isin(self.values, list(values)))
+    return Mask(self._bool_array([value in values for value in self.values]))
+
+  @staticmethod
+  def _bool_array(values):
+    if numpy is not None:
+      return numpy.array(values, dtype=bool)
+    return values
+
+
+class VirtualMachineTable(object):
+  """
+  Column-oriented, read-only table of virtual machines. Built with few bulk queries, so filtering, sorting and grouping
+  thousands of machines does not touch WMI objects of every machine. ``VirtualMachine`` objects are created only for
+  rows that are requested by ``machines``.
+
+  Columns: ``id``, ``name``, ``path``, ``enabled_state``(raw Msvm_ComputerSystem.EnabledState), ``state``
+  (``VirtualMachineState`` value), ``memory``(MB), ``cpu_count`` and ``switches``(tuple of connected switch ids per
+  machine). Numeric columns are numpy arrays if numpy is available, ``array.array`` otherwise.
+  """
+
+  def __init__(self, scope: ScopeHolder, columns: Dict[str, Sequence], switches: Sequence[tuple]):
+    self.scope = scope
+    self.columns = columns
+    self.switches = switches
+
+  @classmethod
+  def from_host(cls, host) -> 'VirtualMachineTable':
+    return cls.from_scope(host.scope)
+
+  @classmethod
+  def from_scope(cls, scope: ScopeHolder) -> 'VirtualMachineTable':
+    rows = []
+    machine_rows = {}
+    # raw objects, table never touches holders of scope
+    for machine in scope.query_objects(
+        'SELECT CreationClassName, Name, ElementName, EnabledState FROM Msvm_ComputerSystem '
+        'WHERE Caption = "Virtual Machine"'):
+      machine_id = str(machine.get_property('Name')).upper()
+      row = {
+        "id": str(machine.get_property('Name')),
+        "name": str(machine.get_property('ElementName')),
+        "path": machine.path,
+        "enabled_state": int(machine.get_property('EnabledState')),
+        "memory": 0,
+        "cpu_count": 0,
+        "switches": []
+      }
+      machine_rows[machine_id] = row
+      rows.append(row)
+
+    for class_name, column in (("Msvm_MemorySettingData", "memory"), ("Msvm_ProcessorSettingData", "cpu_count")):
+      for setting in scope.query_objects('SELECT InstanceID, VirtualQuantity FROM %s' % class_name):
+        row = machine_rows.get(machine_id_from_instance_id(setting.get_property('InstanceID')))
+        if row is not None:
+          row[column] = int(setting.get_property('VirtualQuantity') or 0)
+
+    for port in scope.query_objects('SELECT InstanceID, HostResource FROM Msvm_EthernetPortAllocationSettingData'):
+      row = machine_rows.get(machine_id_from_instance_id(port.get_property('InstanceID')))
+      if row is not None:
+        for resource in port.get_property('HostResource') or ():
+          switch_id = switch_id_from_path(resource)
+          if switch_id:
+            row["switches"].append(switch_id)
+
+    for row in rows:
+      row["state"] = ComputerSystem_EnabledState.from_code(row["enabled_state"]).to_virtual_machine_state().value
+    return cls.from_rows(scope, rows)
+
+  @classmethod
+  def from_rows(cls, scope: ScopeHolder, rows: List[Dict[str, Any]]) -> 'VirtualMachineTable':
+    columns = {}
+    for name in NUMERIC_COLUMNS:
+      values = [row[name] for row in rows]
+      columns[name] = numpy.array(values, dtype=numpy.int64) if numpy is not None else array('q', values)
+    for name in OBJECT_COLUMNS:
+      values = [row[name] for row in rows]
+      if numpy is not None:
+        column = numpy.empty(len(values), dtype=object)
+        column[:] = values
+        values = column
+      columns[name] = values
+    return cls(scope, columns, [tuple(row["switches"]) for row in rows])
+
+  def __len__(self):
+    return len(self.columns["id"])
+
+  def __getitem__(self, item):
+    if isinstance(item, Mask):
+      return self.take(item.indices())
+    return self.column(item)
+
+  def column(self, name) -> Column:
+    if name == "switches":
+      return Column(name, self.switches)
+    return Column(name, self.columns[name])
+
+  def connected_to(self, switch_id) -> Mask:
+    """
+    Returns mask of machines that have adapter connected to switch with given id.
+    """
+    switch_id = switch_id.upper()
+    return Mask(Column._bool_array([any(_id.upper() == switch_id for _id in ids) for ids in self.switches]))
+
+  def in_state(self, *states: VirtualMachineState) -> Mask:
+    return self.column("state").isin(state.value for state in states)
+
+  def take(self, indices) -> 'VirtualMachineTable':
+    columns = {}
+    for name, values in self.columns.items():
+      if numpy is not None:
+        columns[name] = values[numpy.asarray(indices, dtype=numpy.intp)]
+      elif isinstance(values, array):
+        columns[name] = array(values.typecode, (values[index] for index in indices))
+      else:
+        columns[name] = [values[index] for index in indices]
+    return VirtualMachineTable(self.scope, columns, [self.switches[index] for index in indices])
+
+  def where(self, mask: Mask) -> 'VirtualMachineTable':
+    return self.take(mask.indices())
+
+  def sort(self, *names: str, reverse=False) -> 'VirtualMachineTable':
+    """
+    Sorts table by given columns, first column is primary sort key.
+    """
+    if numpy is not None:
+      # rows with equal keys keep their original order in both directions
+      order = numpy.arange(len(self))
+      if reverse:
+        order = order[::-1]
+      for name in reversed(names):
+        order = order[numpy.argsort(self.columns[name][order], kind="stable")]
+      if reverse:
+        order = order[::-1]
+      return self.take(order)
+    keys = [self.columns[name] for name in names]
+    return self.take(sorted(range(len(self)), key=lambda index: tuple(key[index] for key in keys), reverse=reverse))
+
+  def group_by(self, name) -> Dict[Any, 'VirtualMachineTable']:
+    """
+    Groups rows by values of given column. For ``switches`` column machine is included in group of every switch it is
+    connected to.
+    """
+    groups = {}
+    if name == "switches":
+      for index, ids in enumerate(self.switches):
+        for switch_id in set(ids):
+          groups.setdefault(switch_id, []).append(index)
+    else:
+      for index, value in enumerate(self.columns[name]):
+        groups.setdefault(value.item() if hasattr(value, "item") else value, []).append(index)
+    return {key: self.take(indices) for key, indices in groups.items()}
+
+  def machines(self) -> List[VirtualMachine]:
+    """
+    Returns ``VirtualMachine`` objects for rows of this table.
+    """
+    return [VirtualMachine.from_moh(self.scope.get(path)) for path in self.columns["path"]]
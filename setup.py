@@ -1,8 +1,8 @@
 from setuptools import setup, find_packages
 import sys
 
-if sys.version_info < (3, 5):
-  sys.exit('Python < 3.5 is not supported')
+if sys.version_info < (3, 7):
+  sys.exit('Python < 3.7 is not supported')
 
 setup(
   name='hvapi',
@@ -11,6 +11,10 @@ setup(
   author='Eugene Chekanskiy',
   author_email='echekanskiy@gmail.com',
   license='MIT',
-  packages=find_packages(),
-  include_package_data=True
+  packages=find_packages(exclude=('benchmarks', 'benchmarks.*')),
+  include_package_data=True,
+  python_requires='>=3.7',
+  extras_require={
+    'crc32c': ['crc32c']
+  }
 )
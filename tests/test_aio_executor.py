@@ -0,0 +1,39 @@
+import threading
+import unittest
+
+from hvapi.aio_executor import ScopeWorkerPool
+from hvapi.backend.simulator import HypervSimulator, SimulatorBackend
+from hvapi.clr.base import ScopeHolder
+
+
+class OwnedObject(object):
+  """
+  Backend object that may be used only by thread that owns it.
+  """
+
+  def __init__(self, management_object, owner: threading.Thread):
+    self.management_object = management_object
+    self.owner = owner
+
+  def __getattr__(self, item):
+    if threading.current_thread() is not self.owner:
+      raise AssertionError("Backend object used from other thread")
+    return getattr(self.management_object, item)
+
+
+class ScopeWorkerPoolTest(unittest.TestCase):
+  def setUp(self):
+    simulator = HypervSimulator()
+    simulator.add_machine("vm-1")
+    backend = SimulatorBackend(simulator)
+    self.pool = ScopeWorkerPool(2, scope_factory=lambda: ScopeHolder(backend=backend))
+
+  def tearDown(self):
+    self.pool.shutdown()
+
+  def test_rebind_does_not_touch_object_of_other_worker(self):
+    host = self.pool.create_host()
+    machine, = self.pool.submit_to(0, lambda: host.machines).result()
+    machine.management_object = OwnedObject(machine.management_object, self.pool.workers[0].thread)
+    name = self.pool.submit_to(1, lambda rebound: rebound.name, machine).result()
+    self.assertEqual("vm-1", name)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hvapi.disk.dedup import build_index
+from hvapi.disk.formats import open_image
+from hvapi.disk.vhdx_writer import create_vhdx, VHDXUpdater
+
+MB = 1024 * 1024
+VIRTUAL_SIZE = 8 * MB
+BLOCK_SIZE = 2 * MB
+
+
+class BlockIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    self.child_path = os.path.join(self.directory, "child.vhdx")
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(0, b"A" * MB + b"B" * MB)
+      updater.commit()
+    create_vhdx(self.child_path, parent_path=self.base_path)
+    with VHDXUpdater(self.child_path) as updater:
+      updater.write_partial_block(0, [(0, b"B" * MB)])
+      updater.commit()
+    # sectors that are not present in bitmap still hold stale data in file
+    with open_image(self.child_path) as image:
+      _, data_offset = image.block(0)
+    with open(self.child_path, "r+b") as f:
+      f.seek(data_offset + MB)
+      f.write(b"A" * MB)
+    self.index = build_index((self.base_path, self.child_path), os.path.join(self.directory, "index"), MB, 2)
+
+  def tearDown(self):
+    self.index.close()
+    shutil.rmtree(self.directory)
+
+  def test_images_sharing(self):
+    self.assertEqual([(self.child_path, 0)], self.index.images_sharing(self.base_path, MB))
+    self.assertEqual([(self.base_path, MB)], self.index.images_sharing(self.child_path, 0))
+
+  def test_images_sharing_chunk_not_present(self):
+    self.assertEqual([], self.index.images_sharing(self.child_path, MB))
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hvapi.disk.chain import ChainResolver
+from hvapi.disk.diff import vhd_diff, write_diff, DiffResult
+from hvapi.disk.vhdx_writer import create_vhdx, VHDXUpdater
+
+MB = 1024 * 1024
+VIRTUAL_SIZE = 8 * MB
+BLOCK_SIZE = 2 * MB
+
+
+def read_disk(path) -> bytes:
+  with ChainResolver().resolve(path) as chain:
+    buffer = bytearray(chain.virtual_size)
+    chain.readinto_at(0, buffer)
+  return bytes(buffer)
+
+
+class DiffTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    self.new_path = os.path.join(self.directory, "new.vhdx")
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(0, b"A" * BLOCK_SIZE)
+      updater.write_block(1, b"B" * BLOCK_SIZE)
+      updater.commit()
+    create_vhdx(self.new_path, parent_path=self.base_path)
+    with VHDXUpdater(self.new_path) as updater:
+      updater.write_partial_block(0, [(MB, b"C" * 4096)])
+      # rewritten with the same content, not a change
+      updater.write_block(1, b"B" * BLOCK_SIZE)
+      updater.write_block(3, bytes(BLOCK_SIZE))
+      updater.write_block(2, b"D" * BLOCK_SIZE)
+      updater.commit()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_diff_extents(self):
+    diff = vhd_diff(self.base_path, self.new_path, chunk_size=4096, workers=2)
+    self.assertEqual([(MB, 4096), (2 * BLOCK_SIZE, BLOCK_SIZE)], diff.extents)
+    path = os.path.join(self.directory, "diff")
+    diff.save(path)
+    self.assertEqual(diff.extents, DiffResult.load(path).extents)
+
+  def test_write_diff(self):
+    diff = vhd_diff(self.base_path, self.new_path, chunk_size=4096, workers=2)
+    dest = write_diff(diff, self.new_path, os.path.join(self.directory, "written.vhdx"), self.base_path, workers=2)
+    self.assertEqual(read_disk(self.new_path), read_disk(dest))
+    self.assertEqual([], vhd_diff(self.new_path, dest, workers=2).extents)
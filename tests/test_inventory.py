@@ -0,0 +1,148 @@
+import unittest
+
+from hvapi.backend.base import WmiEvent, WmiEventType
+from hvapi.inventory import InventorySynchronizer, InventoryChangeType
+
+FULL_PATH = r'\\HOST\root\virtualization\v2:Msvm_ComputerSystem.CreationClassName="Msvm_ComputerSystem",Name="VM1"'
+RELATIVE_PATH = 'Msvm_ComputerSystem.CreationClassName="Msvm_ComputerSystem",Name="VM1"'
+OTHER_SERVER_PATH = r'\\host\ROOT\virtualization\v2:Msvm_ComputerSystem.CreationClassName="Msvm_ComputerSystem",' \
+                    r'Name="VM1"'
+
+
+class FakeEvents(object):
+  def __init__(self):
+    self.events = []
+
+  def __call__(self, timeout):
+    if self.events:
+      return self.events.pop(0)
+    return None
+
+
+class InventorySynchronizerTest(unittest.TestCase):
+  def setUp(self):
+    self.now = 0.0
+    self.snapshots = 0
+    self.snapshot = {FULL_PATH: ("Msvm_ComputerSystem", {"Name": "VM1", "EnabledState": 3})}
+    self.events = FakeEvents()
+    self.changes = []
+    self.synchronizer = InventorySynchronizer(
+      class_names=("CIM_ComputerSystem",), resync_interval=60, event_source=self.events,
+      snapshot_source=self._snapshot, clock=lambda: self.now)
+    self.synchronizer.subscribe(self.changes.append)
+
+  def _snapshot(self):
+    self.snapshots += 1
+    return dict(self.snapshot)
+
+  def test_first_step_resyncs(self):
+    self.synchronizer.step(0)
+    self.assertEqual(1, self.snapshots)
+    self.assertEqual([InventoryChangeType.ADDED], [change.change_type for change in self.changes])
+    self.assertIn(FULL_PATH, self.synchronizer.inventory)
+
+  def test_event_paths_match_snapshot_paths(self):
+    self.synchronizer.step(0)
+    for number, path in enumerate((RELATIVE_PATH, OTHER_SERVER_PATH)):
+      self.events.events.append(WmiEvent(WmiEventType.MODIFIED, "Msvm_ComputerSystem", path,
+                                         {"Name": "VM1", "EnabledState": number}))
+      self.synchronizer.step(0)
+    self.assertEqual(1, self.snapshots)
+    self.assertEqual(1, len(self.synchronizer.inventory))
+    self.assertEqual(1, self.synchronizer.inventory.get(FULL_PATH)["EnabledState"])
+
+  def test_subclass_events_are_applied(self):
+    self.synchronizer.step(0)
+    path = RELATIVE_PATH.replace("VM1", "VM2")
+    self.events.events.append(WmiEvent(WmiEventType.CREATED, "Msvm_ComputerSystem", path,
+                                       {"Name": "VM2", "EnabledState": 2}))
+    self.synchronizer.step(0)
+    self.assertEqual(2, len(self.synchronizer.inventory))
+    self.assertEqual(InventoryChangeType.ADDED, self.changes[-1].change_type)
+
+  def test_lost_events_cause_resync(self):
+    self.synchronizer.step(0)
+    self.events.events.append(WmiEvent(WmiEventType.DELETED, "Msvm_ComputerSystem", "Msvm_ComputerSystem.Name=\"X\"",
+                                       {}))
+    self.synchronizer.step(0)
+    self.assertEqual(1, self.snapshots)
+    self.snapshot = {}
+    self.synchronizer.step(0)
+    self.assertEqual(2, self.snapshots)
+    self.assertEqual(0, len(self.synchronizer.inventory))
+    self.assertEqual(InventoryChangeType.REMOVED, self.changes[-1].change_type)
+
+  def test_periodic_resync(self):
+    self.synchronizer.step(0)
+    self.now = 30
+    self.synchronizer.step(0)
+    self.assertEqual(1, self.snapshots)
+    self.now = 60
+    self.synchronizer.step(0)
+    self.assertEqual(2, self.snapshots)
+    # unchanged snapshot produces no changes
+    self.assertEqual(1, len(self.changes))
+
+  def test_failed_event_source_causes_resync(self):
+    def failing(timeout):
+      raise RuntimeError("watcher failed")
+
+    self.synchronizer._event_source = failing
+    self.synchronizer.step(0)
+    self.synchronizer.step(0)
+    self.assertEqual(2, self.snapshots)
+
+  def test_events_during_resync_are_applied(self):
+    path = RELATIVE_PATH.replace("VM1", "VM2")
+
+    def snapshot():
+      # VM1 modification and VM3 deletion are already reflected in snapshot, VM2 is created after it is taken
+      self.events.events.extend((
+        WmiEvent(WmiEventType.MODIFIED, "Msvm_ComputerSystem", RELATIVE_PATH, {"Name": "VM1", "EnabledState": 3}),
+        WmiEvent(WmiEventType.DELETED, "Msvm_ComputerSystem", RELATIVE_PATH.replace("VM1", "VM3"), {}),
+        WmiEvent(WmiEventType.CREATED, "Msvm_ComputerSystem", path, {"Name": "VM2", "EnabledState": 2}),
+      ))
+      return self._snapshot()
+
+    self.synchronizer._snapshot_source = snapshot
+    self.synchronizer.step(0)
+    self.assertEqual(1, self.snapshots)
+    self.assertFalse(self.synchronizer._resync_required)
+    self.assertEqual(2, len(self.synchronizer.inventory))
+    self.assertEqual(2, self.synchronizer.inventory.get(path)["EnabledState"])
+    self.assertEqual([InventoryChangeType.ADDED, InventoryChangeType.ADDED],
+                     [change.change_type for change in self.changes])
+
+  def test_watcher_subscribed_before_snapshot(self):
+    calls = []
+
+    class FakeWatcher(object):
+      def next_event(self, timeout):
+        if timeout:
+          raise RuntimeError("watcher failed")
+        return None
+
+      def close(self):
+        calls.append("close")
+
+    class FakeScope(object):
+      def watch_instances(self, class_names):
+        calls.append("watch")
+        return FakeWatcher()
+
+    def snapshot():
+      calls.append("snapshot")
+      return self._snapshot()
+
+    synchronizer = InventorySynchronizer(FakeScope(), snapshot_source=snapshot, clock=lambda: self.now)
+    synchronizer.step(0)
+    synchronizer.request_resync()
+    synchronizer.step(0)
+    # failed watcher is replaced before next snapshot
+    synchronizer.step(1)
+    synchronizer.step(0)
+    self.assertEqual(["watch", "snapshot", "snapshot", "close", "watch", "snapshot"], calls)
+
+
+if __name__ == '__main__':
+  unittest.main()
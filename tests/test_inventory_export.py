@@ -0,0 +1,84 @@
+import unittest
+
+from hvapi.inventory_export import dump_inventory, load_inventory, InventorySnapshot, InventoryExporter, \
+  InventoryImporter, InventoryExportException
+
+HOST_PATH = r"\\HOST\root\virtualization\v2:"
+
+
+def machine(name, **properties):
+  properties.setdefault("Name", name)
+  return HOST_PATH + 'Msvm_ComputerSystem.CreationClassName="Msvm_ComputerSystem",Name="%s"' % name, \
+         ("Msvm_ComputerSystem", properties)
+
+
+def as_objects(snapshot: InventorySnapshot):
+  return {path: (record.class_name, dict(record.properties)) for path, record in snapshot.records.items()}
+
+
+class InventoryExportTest(unittest.TestCase):
+  def setUp(self):
+    self.objects = dict([
+      machine("VM1", ElementName="vm-1", EnabledState=2, OperationalStatus=(2, 32768), Heartbeat=None,
+              Uptime=1 << 40, Load=0.5, Enabled=True),
+      machine("VM2", ElementName="vm-2\0hidden", EnabledState=3, OperationalStatus=(), Heartbeat=None,
+              Uptime=-1, Load=1.5, Enabled=False, Notes="only here"),
+      (HOST_PATH + 'Msvm_EthernetPortAllocationSettingData.InstanceID="Microsoft:VM1\\\\A\\\\C"', (
+        "Msvm_EthernetPortAllocationSettingData", {
+          "InstanceID": "Microsoft:VM1\\A\\C", "EnabledState": 2, "Limits": (1 << 70, 0),
+          "HostResource": (HOST_PATH + 'Msvm_VirtualEthernetSwitch.Name="S1"',), "Nested": ((1, "a"), ("b",))
+        })),
+    ])
+
+  def test_full_round_trip(self):
+    data = dump_inventory(self.objects, class_names=None)
+    snapshot = load_inventory(data)
+    self.assertEqual(self.objects, as_objects(snapshot))
+    self.assertEqual(data[6:22], snapshot.export_id)
+    self.assertEqual([path for path in self.objects if "ComputerSystem" in path],
+                     [record.path for record in snapshot.by_class("Msvm_ComputerSystem")])
+
+  def test_delta_round_trip(self):
+    full = dump_inventory(self.objects, class_names=None)
+    base = load_inventory(full)
+    changed = dict(self.objects)
+    path, (class_name, properties) = machine("VM1", ElementName="vm-1", EnabledState=3, Heartbeat=(2,),
+                                             Uptime=1 << 40, Load=0.5, Enabled=True)
+    changed[path] = (class_name, properties)
+    removed, _ = machine("VM2")
+    del changed[removed]
+    added, item = machine("VM3", EnabledState=2)
+    changed[added] = item
+    delta = dump_inventory(changed, base, class_names=None)
+    self.assertLess(len(delta), len(full))
+    self.assertEqual(changed, as_objects(load_inventory(delta, base)))
+    with self.assertRaises(InventoryExportException):
+      load_inventory(delta)
+
+  def test_exporter_and_importer(self):
+    exporter = InventoryExporter(class_names=None)
+    importer = InventoryImporter()
+    importer.load(exporter.export(self.objects))
+    changed = dict(self.objects)
+    path, item = machine("VM1", EnabledState=6)
+    changed[path] = item
+    self.assertEqual(changed, as_objects(importer.load(exporter.export(changed))))
+
+  def test_class_filter(self):
+    snapshot = load_inventory(dump_inventory(self.objects))
+    self.assertEqual({"Msvm_ComputerSystem", "Msvm_EthernetPortAllocationSettingData"},
+                     {record.class_name for record in snapshot.records.values()})
+    snapshot = load_inventory(dump_inventory(self.objects, class_names=("Msvm_ComputerSystem",)))
+    self.assertEqual(2, len(snapshot))
+
+  def test_paths_not_built_from_key(self):
+    objects = {"path-%d" % index: ("Custom", {"Value": index}) for index in range(3)}
+    self.assertEqual(objects, as_objects(load_inventory(dump_inventory(objects, class_names=None))))
+
+  def test_unsupported_value(self):
+    with self.assertRaises(InventoryExportException):
+      dump_inventory(dict([machine("VM1", Value=object())]), class_names=None)
+
+  def test_unknown_format(self):
+    with self.assertRaises(InventoryExportException):
+      load_inventory(b"JSON" + bytes(40))
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from hvapi.disk import vhdx_writer
+from hvapi.disk.chain import ChainResolver, ParentCache
+from hvapi.disk.merge import merge_into_parent
+from hvapi.disk.types import VHDChainError
+from hvapi.disk.vhdx_writer import create_vhdx, VHDXUpdater
+
+MB = 1024 * 1024
+VIRTUAL_SIZE = 8 * MB
+BLOCK_SIZE = 2 * MB
+
+
+def read_disk(path) -> bytes:
+  with ChainResolver(ParentCache()).resolve(path) as chain:
+    buffer = bytearray(chain.virtual_size)
+    chain.readinto_at(0, buffer)
+  return bytes(buffer)
+
+
+class MergeTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    self.child_path = os.path.join(self.directory, "child.vhdx")
+    self.sibling_path = os.path.join(self.directory, "sibling.vhdx")
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(0, b"A" * BLOCK_SIZE)
+      updater.commit()
+    create_vhdx(self.child_path, parent_path=self.base_path)
+    with VHDXUpdater(self.child_path) as updater:
+      updater.write_partial_block(0, [(4096, b"C" * 4096)])
+      updater.write_block(2, b"D" * BLOCK_SIZE)
+      updater.commit()
+    create_vhdx(self.sibling_path, parent_path=self.base_path)
+    self.base_content = read_disk(self.base_path)
+    # sibling matches base before it is modified
+    self.assertEqual(self.base_content, read_disk(self.sibling_path))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _merge_child(self):
+    with ChainResolver(ParentCache()).resolve(self.child_path) as chain:
+      return merge_into_parent(chain, workers=2)
+
+  def _assert_sibling_rejected(self):
+    with self.assertRaises(VHDChainError):
+      ChainResolver(ParentCache()).resolve(self.sibling_path)
+
+  def test_merge_into_parent(self):
+    expected = read_disk(self.child_path)
+    result = self._merge_child()
+    self.assertEqual(self.base_path, result.target)
+    self.assertEqual(2, result.written_blocks)
+    self.assertEqual(expected, read_disk(self.base_path))
+    self._assert_sibling_rejected()
+
+  def test_failure_before_bat_update(self):
+    write_at = vhdx_writer.write_at
+
+    def failing_write_at(fd, data, offset):
+      # BAT entries are the only 8 byte writes
+      if len(data) == 8:
+        raise OSError("Simulated failure")
+      return write_at(fd, data, offset)
+
+    with mock.patch.object(vhdx_writer, "write_at", failing_write_at):
+      self.assertRaises(OSError, self._merge_child)
+    self.assertEqual(self.base_content, read_disk(self.base_path))
+    self._assert_sibling_rejected()
+
+  def test_failure_before_commit(self):
+    updater = VHDXUpdater(self.base_path)
+    updater.write_block(1, b"E" * BLOCK_SIZE)
+    updater.close()
+    self.assertEqual(self.base_content, read_disk(self.base_path))
+    self._assert_sibling_rejected()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hvapi.disk.verify import verify_image
+from hvapi.disk.vhdx_writer import create_vhdx, VHDXUpdater
+
+MB = 1024 * 1024
+VIRTUAL_SIZE = 8 * MB
+BLOCK_SIZE = 2 * MB
+
+
+class VerifyTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    self.child_path = os.path.join(self.directory, "child.vhdx")
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(0, b"A" * BLOCK_SIZE)
+      updater.commit()
+    create_vhdx(self.child_path, parent_path=self.base_path)
+    with VHDXUpdater(self.child_path) as updater:
+      updater.write_partial_block(1, [(0, b"B" * 4096)])
+      updater.commit()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_valid_chain(self):
+    for path in (self.base_path, self.child_path):
+      report = verify_image(path, workers=2, scan_payload=True)
+      self.assertTrue(report.ok, report.issues)
+      self.assertEqual(1, report.blocks)
+
+  def test_modified_parent(self):
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(2, b"C" * BLOCK_SIZE)
+      updater.commit()
+    report = verify_image(self.child_path, workers=2)
+    self.assertFalse(report.ok)
+    self.assertTrue(report.errors)
+
+  def test_truncated_file(self):
+    with open(self.base_path, "r+b") as f:
+      f.truncate(os.path.getsize(self.base_path) - MB)
+    self.assertFalse(verify_image(self.base_path, workers=2).ok)
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hvapi.disk.chain import ChainResolver, ParentCache
+from hvapi.disk.crc32c import crc32c, _python_crc32c
+from hvapi.disk.export import export_raw
+from hvapi.disk.types import ProviderSubtype, VirtualStorageType
+from hvapi.disk.vhd import VHDDisk
+from hvapi.disk.vhdx_writer import create_vhdx, VHDXUpdater
+
+MB = 1024 * 1024
+VIRTUAL_SIZE = 8 * MB
+BLOCK_SIZE = 2 * MB
+
+
+class Crc32cTest(unittest.TestCase):
+  def test_check_value(self):
+    self.assertEqual(0xE3069283, crc32c(b"123456789"))
+    self.assertEqual(0xE3069283, _python_crc32c(b"123456789"))
+
+  def test_trailing_zeros(self):
+    data = b"header" + bytes(4096)
+    self.assertEqual(crc32c(data), _python_crc32c(data))
+    self.assertEqual(_python_crc32c(data), _python_crc32c(data[6:], _python_crc32c(data[:6])))
+
+
+class NativeVhdxTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    self.child_path = os.path.join(self.directory, "child.vhdx")
+    self.expected = bytearray(VIRTUAL_SIZE)
+
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(0, b"A" * BLOCK_SIZE)
+      updater.write_block(2, b"B" * BLOCK_SIZE)
+      updater.commit()
+    self.expected[0:BLOCK_SIZE] = b"A" * BLOCK_SIZE
+    self.expected[2 * BLOCK_SIZE:3 * BLOCK_SIZE] = b"B" * BLOCK_SIZE
+
+    create_vhdx(self.child_path, parent_path=self.base_path)
+    with VHDXUpdater(self.child_path) as updater:
+      updater.write_partial_block(0, [(4096, b"C" * 8192)])
+      updater.write_block(1, b"D" * BLOCK_SIZE)
+      updater.commit()
+    self.expected[4096:4096 + 8192] = b"C" * 8192
+    self.expected[BLOCK_SIZE:2 * BLOCK_SIZE] = b"D" * BLOCK_SIZE
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_native_properties(self):
+    base = VHDDisk(self.base_path).native_properties
+    self.assertEqual(VIRTUAL_SIZE, base['Size']['VirtualSize'])
+    self.assertEqual(BLOCK_SIZE, base['Size']['BlockSize'])
+    self.assertEqual(VirtualStorageType.VHDX, base['VirtualStorageType'])
+    self.assertEqual(ProviderSubtype.DYNAMIC, base['ProviderSubtype'])
+
+    child = VHDDisk(self.child_path).native_properties
+    self.assertEqual(VIRTUAL_SIZE, child['Size']['VirtualSize'])
+    self.assertEqual(ProviderSubtype.DIFFERENCING, child['ProviderSubtype'])
+    self.assertTrue(child['ParentLocation']['ParentResolved'])
+    self.assertEqual(self.base_path, child['ParentLocation']['ParentLocationBuffer'])
+    self.assertNotIn('FragmentationPercentage', child)
+
+  def test_allocation_properties(self):
+    with VHDDisk(self.base_path).image() as image:
+      properties = image.properties()
+      self.assertEqual((True, 0), image.allocation_stats())
+    self.assertTrue(properties['Is4kAligned'])
+    self.assertEqual(0, properties['FragmentationPercentage'])
+
+  def test_open_reader(self):
+    with VHDDisk(self.child_path).open_reader() as reader:
+      self.assertEqual(bytes(self.expected), reader.read())
+      reader.seek(4096 - 16)
+      self.assertEqual(b"A" * 16 + b"C" * 16, reader.read(32))
+
+  def test_export_raw(self):
+    dest = os.path.join(self.directory, "child.raw")
+    VHDDisk(self.child_path).export_raw(dest)
+    with open(dest, "rb") as f:
+      self.assertEqual(bytes(self.expected), f.read())
+
+  def test_export_raw_chunk_not_dividing_blocks(self):
+    path = os.path.join(self.directory, "reversed.vhdx")
+    block_size = 4 * MB
+    create_vhdx(path, VIRTUAL_SIZE, block_size)
+    with VHDXUpdater(path) as updater:
+      # blocks are stored in file in reverse order, so pieces crossing blocks read wrong data
+      for index in reversed(range(VIRTUAL_SIZE // block_size)):
+        updater.write_block(index, bytes([index + 1]) * block_size)
+      updater.commit()
+    dest = os.path.join(self.directory, "reversed.raw")
+    with ChainResolver(ParentCache()).resolve(path) as chain:
+      export_raw(chain, dest, chunk_size=3 * MB)
+    with open(dest, "rb") as f:
+      self.assertEqual(b"".join(bytes([index + 1]) * block_size for index in range(VIRTUAL_SIZE // block_size)),
+                       f.read())
+
+
+class ParentCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = ParentCache(max_idle=1)
+    self.base_path = os.path.join(self.directory, "base.vhdx")
+    create_vhdx(self.base_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    self.child_paths = []
+    for name in ("child1.vhdx", "child2.vhdx"):
+      path = os.path.join(self.directory, name)
+      create_vhdx(path, parent_path=self.base_path, cache=self.cache)
+      self.child_paths.append(path)
+
+  def tearDown(self):
+    self.cache.clear()
+    shutil.rmtree(self.directory)
+
+  def test_parents_shared_and_released(self):
+    resolver = ChainResolver(self.cache)
+    first = resolver.resolve(self.child_paths[0])
+    second = resolver.resolve(self.child_paths[1])
+    self.assertIs(first.base, second.base)
+    first.close()
+    second.close()
+    self.assertEqual(1, len(self.cache))
+    self.assertIsNotNone(second.base._file)
+    self.cache.clear()
+    self.assertIsNone(second.base._file)
+
+  def test_replaced_parent_closed_on_release(self):
+    resolver = ChainResolver(self.cache)
+    chain = resolver.resolve(self.child_paths[0])
+    old_base = chain.base
+    with VHDXUpdater(self.base_path) as updater:
+      updater.write_block(1, b"M" * BLOCK_SIZE)
+      updater.commit()
+    new_base = self.cache.open(self.base_path)
+    self.assertIsNot(old_base, new_base)
+    # old image is still used by chain, so it stays open
+    self.assertIsNotNone(old_base._file)
+    chain.close()
+    self.assertIsNone(old_base._file)
+    self.cache.release(new_base)
+    self.assertIsNotNone(new_base._file)
+
+  def test_idle_images_bounded(self):
+    other_path = os.path.join(self.directory, "other.vhdx")
+    create_vhdx(other_path, VIRTUAL_SIZE, BLOCK_SIZE)
+    base = self.cache.open(self.base_path)
+    other = self.cache.open(other_path)
+    self.cache.release(base)
+    self.cache.release(other)
+    self.assertEqual(1, len(self.cache))
+    self.assertIsNone(base._file)
+    self.assertIsNotNone(other._file)